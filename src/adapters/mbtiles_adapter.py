@@ -1,6 +1,7 @@
 import sqlite3
 import os
-from typing import Dict, Any, List, Tuple, Optional
+import threading
+from typing import Dict, Any, List, Tuple, Optional, Iterator, Iterable
 from interfaces.tile_source import ITileSource, ITileExtractor
 from adapters.base_adapter import BaseAdapter
 from utils.mbtiles_utils import MBTilesUtils
@@ -8,7 +9,12 @@ from utils.mbtiles_utils import MBTilesUtils
 
 
 class MBTilesAdapter(BaseAdapter, ITileSource, ITileExtractor):
-    """Adapter for MBTiles sources"""
+    """Adapter for MBTiles sources.
+    
+    The table layout is detected once by initialize(). Reads go through one
+    read-only connection per thread (memory-mapped, with a large page cache),
+    and every query is built once, so each lookup reuses a prepared statement.
+    """
     
     def __init__(self, config: Dict[str, Any]):
         super().__init__(config)
@@ -16,7 +22,13 @@ class MBTilesAdapter(BaseAdapter, ITileSource, ITileExtractor):
         self.bounds = config.get('bounds', [])
         self.min_zoom = config.get('min_zoom', 0)
         self.max_zoom = config.get('max_zoom', 22)
-        self.connection = None
+        # Per-connection read tuning for large archives
+        self.mmap_mb = config.get('mmap_mb', 256)
+        self.cache_mb = config.get('cache_mb', 64)
+        self.schema: Optional[str] = None
+        self._queries: Optional[Dict[str, str]] = None
+        self._connections: Dict[int, sqlite3.Connection] = {}
+        self._connections_lock = threading.Lock()
         self._metadata = None
         self.is_tms = False
     
@@ -44,6 +56,12 @@ class MBTilesAdapter(BaseAdapter, ITileSource, ITileExtractor):
             # Check if this is TMS format
             self.is_tms = self._check_tms_format()
             
+            # Detect the table layout and build the queries once
+            self.schema = self._detect_schema()
+            if self.schema is None:
+                return False
+            self._prepare_queries()
+            
             return True
         except Exception as e:
             print(f"Failed to initialize MBTiles adapter: {e}")
@@ -86,117 +104,141 @@ class MBTilesAdapter(BaseAdapter, ITileSource, ITileExtractor):
         
         return True
     
+    def _detect_schema(self) -> Optional[str]:
+        """Tile table layout: 'tiles' (table or view), 'images_map' or 'omtm'; None if unsupported"""
+        conn = sqlite3.connect(f"file:{self.file_path}?mode=ro", uri=True)
+        try:
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+        finally:
+            conn.close()
+        if 'tiles' in tables:
+            return 'tiles'
+        if 'images' in tables and 'map' in tables:
+            return 'images_map'
+        if 'omtm' in tables:
+            return 'omtm'
+        print(f"Unsupported MBTiles format. Tables found: {sorted(tables)}")
+        return None
+    
+    def _prepare_queries(self) -> None:
+        """Build the SQL once; identical SQL text is reused from each connection's statement cache"""
+        if self.schema == 'images_map':
+            source = "images i JOIN map m ON i.tile_id = m.tile_id"
+            prefix = "m."
+            data = "i.tile_data"
+        else:
+            source = self.schema
+            prefix = ""
+            data = "tile_data"
+        where_range = (f"WHERE {prefix}zoom_level = ? AND {prefix}tile_column BETWEEN ? AND ? "
+                       f"AND {prefix}tile_row BETWEEN ? AND ?")
+        self._queries = {
+            'tile': f"SELECT {data} FROM {source} WHERE {prefix}zoom_level = ? "
+                    f"AND {prefix}tile_column = ? AND {prefix}tile_row = ?",
+            'range': f"SELECT {prefix}tile_column, {prefix}tile_row, {data} FROM {source} {where_range}",
+            'count': f"SELECT COUNT(*) FROM {source} {where_range}",
+        }
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Read-only connection of the calling thread, opened on first use"""
+        ident = threading.get_ident()
+        conn = self._connections.get(ident)
+        if conn is not None:
+            return conn
+        conn = sqlite3.connect(f"file:{self.file_path}?mode=ro", uri=True, check_same_thread=False,
+                               cached_statements=64)
+        # Large read-only archives: map the file instead of copying pages through read()
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_mb) * 1024 * 1024}")
+        conn.execute(f"PRAGMA cache_size = {-int(self.cache_mb) * 1024}")
+        conn.execute("PRAGMA query_only = 1")
+        with self._connections_lock:
+            # Drop the connections of threads that are gone (e.g. finished batch pools)
+            alive = {thread.ident for thread in threading.enumerate()}
+            for stale in [key for key in self._connections if key not in alive]:
+                self._connections.pop(stale).close()
+            self._connections[ident] = conn
+        return conn
+    
+    def close(self) -> None:
+        """Close the pooled connections of all threads"""
+        with self._connections_lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for conn in connections:
+            conn.close()
+    
+    def _require_schema(self) -> bool:
+        if self._queries is None and self.schema is None:
+            # Not initialized through initialize(): detect the layout now
+            self.schema = self._detect_schema()
+            if self.schema is not None:
+                self._prepare_queries()
+        return self._queries is not None
+    
     def get_tile(self, zoom: int, x: int, y: int) -> Optional[bytes]:
         """Get tile data for given coordinates"""
         try:
-            with sqlite3.connect(self.file_path) as conn:
-                cursor = conn.cursor()
-                
-                # Check table structure
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-                tables = [row[0] for row in cursor.fetchall()]
-                
-                if 'tiles' in tables:
-                    # Standard MBTiles format
-                    cursor.execute(
-                        "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
-                        (zoom, x, y)
-                    )
-                elif 'images' in tables and 'map' in tables:
-                    # TMS format
-                    cursor.execute(
-                        """SELECT i.tile_data 
-                           FROM images i 
-                           JOIN map m ON i.tile_id = m.tile_id 
-                           WHERE m.zoom_level = ? AND m.tile_column = ? AND m.tile_row = ?""",
-                        (zoom, x, y)
-                    )
-                elif 'omtm' in tables:
-                    # OMTM format
-                    cursor.execute(
-                        "SELECT tile_data FROM omtm WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
-                        (zoom, x, y)
-                    )
-                else:
-                    print(f"Unsupported MBTiles format")
-                    return None
-                
-                result = cursor.fetchone()
-                return result[0] if result else None
+            if not self._require_schema():
+                return None
+            row = self._connection().execute(self._queries['tile'], (zoom, x, y)).fetchone()
+            return row[0] if row else None
         except Exception as e:
             print(f"Failed to get tile {zoom}/{x}/{y}: {e}")
             return None
     
+    def get_tiles(self, coords: Iterable[Tuple[int, int, int]]) -> Dict[Tuple[int, int, int], bytes]:
+        """Tile data of many (zoom, x, y) coordinates (as stored, like get_tile); missing tiles are left out.
+        All lookups run on the calling thread's connection with one prepared statement. Read errors
+        propagate: a partial result would pass tiles that could not be read off as missing."""
+        tiles = {}
+        if not self._require_schema():
+            return tiles
+        conn = self._connection()
+        query = self._queries['tile']
+        for coord in coords:
+            row = conn.execute(query, coord).fetchone()
+            if row:
+                tiles[coord] = row[0]
+        return tiles
+    
     def extract_tiles(self, bbox: List[float], zoom: int) -> List[Tuple[int, int, bytes]]:
-        """Extract tiles for given bbox and zoom level"""
+        """Extract tiles for given bbox and zoom level (all in memory; see iter_tiles)"""
         tiles = []
+        try:
+            for batch in self.iter_tiles(bbox, zoom):
+                tiles.extend(batch)
+        except Exception as e:
+            print(f"Failed to extract tiles: {e}")
+        return tiles
+    
+    def _row_range(self, bbox: List[float], zoom: int) -> Tuple[int, int, int, int]:
+        """Column and stored row range of a bbox (rows flipped for TMS files)"""
+        min_x, max_x, min_y, max_y = MBTilesUtils.bbox_to_tile_range(bbox, zoom)
+        if self.is_tms:
+            min_y, max_y = self._convert_y_coordinate(max_y, zoom), self._convert_y_coordinate(min_y, zoom)
+        return min_x, max_x, min_y, max_y
+    
+    def iter_tiles(self, bbox: List[float], zoom: int, batch_size: int = 500) -> Iterator[List[Tuple[int, int, bytes]]]:
+        """Stream the tiles of a bbox and zoom level in batches of batch_size rows.
         
-        if not self.validate_bounds(bbox):
-            return tiles
+        Rows are read through the calling thread's pooled connection, so several
+        zooms can be streamed from one file by different threads at the same time.
+        """
+        if not self.validate_bounds(bbox) or not self._require_schema():
+            return
         
+        cursor = self._connection().execute(self._queries['range'], (zoom, *self._row_range(bbox, zoom)))
         try:
-            min_x, max_x, min_y, max_y = MBTilesUtils.bbox_to_tile_range(bbox, zoom)
-            
-            # Convert Y coordinates for TMS format
-            if self.is_tms:
-                original_min_y = min_y
-                min_y = self._convert_y_coordinate(max_y, zoom)
-                max_y = self._convert_y_coordinate(original_min_y, zoom)
-            
-            with sqlite3.connect(self.file_path) as conn:
-                cursor = conn.cursor()
-                
-                # Check table structure
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-                tables = [row[0] for row in cursor.fetchall()]
-                
-                if 'tiles' in tables:
-                    # Standard MBTiles format
-                    cursor.execute(
-                        """SELECT tile_column, tile_row, tile_data 
-                           FROM tiles 
-                           WHERE zoom_level = ? 
-                           AND tile_column BETWEEN ? AND ? 
-                           AND tile_row BETWEEN ? AND ?""",
-                        (zoom, min_x, max_x, min_y, max_y)
-                    )
-                elif 'images' in tables and 'map' in tables:
-                    # TMS format
-                    cursor.execute(
-                        """SELECT m.tile_column, m.tile_row, i.tile_data 
-                           FROM images i 
-                           JOIN map m ON i.tile_id = m.tile_id 
-                           WHERE m.zoom_level = ? 
-                           AND m.tile_column BETWEEN ? AND ? 
-                           AND m.tile_row BETWEEN ? AND ?""",
-                        (zoom, min_x, max_x, min_y, max_y)
-                    )
-                elif 'omtm' in tables and 'images' in tables and 'map' in tables:
-                    # OMTM format (omtm is metadata, tiles are in images/map)
-                    cursor.execute(
-                        """SELECT m.tile_column, m.tile_row, i.tile_data 
-                           FROM images i 
-                           JOIN map m ON i.tile_id = m.tile_id 
-                           WHERE m.zoom_level = ? 
-                           AND m.tile_column BETWEEN ? AND ? 
-                           AND m.tile_row BETWEEN ? AND ?""",
-                        (zoom, min_x, max_x, min_y, max_y)
-                    )
-                else:
-                    print(f"Unsupported MBTiles format. Tables found: {tables}")
-                    return tiles
-                
-                for row in cursor.fetchall():
-                    x, y, tile_data = row
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                if self.is_tms:
                     # Normalize to XYZ scheme for filesystem output
-                    if self.is_tms:
-                        y = self._convert_y_coordinate(y, zoom)
-                    tiles.append((x, y, tile_data))
-                
-                return tiles
-        except Exception as e:
-            print(f"Failed to extract tiles: {e}")
-            return tiles
+                    rows = [(x, self._convert_y_coordinate(y, zoom), tile_data) for x, y, tile_data in rows]
+                yield rows
+        finally:
+            cursor.close()
     
     def get_tile_count(self, bbox: List[float], zoom: int) -> int:
         """Get tile count for given bbox and zoom level"""
@@ -204,58 +246,10 @@ class MBTilesAdapter(BaseAdapter, ITileSource, ITileExtractor):
             return 0
         
         try:
-            min_x, max_x, min_y, max_y = MBTilesUtils.bbox_to_tile_range(bbox, zoom)
-            
-            # Convert Y coordinates for TMS format
-            if self.is_tms:
-                original_min_y = min_y
-                min_y = self._convert_y_coordinate(max_y, zoom)
-                max_y = self._convert_y_coordinate(original_min_y, zoom)
-            
-            with sqlite3.connect(self.file_path) as conn:
-                cursor = conn.cursor()
-                
-                # Check table structure
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-                tables = [row[0] for row in cursor.fetchall()]
-                
-                if 'tiles' in tables:
-                    # Standard MBTiles format
-                    cursor.execute(
-                        """SELECT COUNT(*) 
-                           FROM tiles 
-                           WHERE zoom_level = ? 
-                           AND tile_column BETWEEN ? AND ? 
-                           AND tile_row BETWEEN ? AND ?""",
-                        (zoom, min_x, max_x, min_y, max_y)
-                    )
-                elif 'images' in tables and 'map' in tables:
-                    # TMS format
-                    cursor.execute(
-                        """SELECT COUNT(*) 
-                           FROM images i 
-                           JOIN map m ON i.tile_id = m.tile_id 
-                           WHERE m.zoom_level = ? 
-                           AND m.tile_column BETWEEN ? AND ? 
-                           AND m.tile_row BETWEEN ? AND ?""",
-                        (zoom, min_x, max_x, min_y, max_y)
-                    )
-                elif 'omtm' in tables and 'images' in tables and 'map' in tables:
-                    # OMTM format (omtm is metadata, tiles are in images/map)
-                    cursor.execute(
-                        """SELECT COUNT(*) 
-                           FROM images i 
-                           JOIN map m ON i.tile_id = m.tile_id 
-                           WHERE m.zoom_level = ? 
-                           AND m.tile_column BETWEEN ? AND ? 
-                           AND m.tile_row BETWEEN ? AND ?""",
-                        (zoom, min_x, max_x, min_y, max_y)
-                    )
-                else:
-                    return 0
-                
-                result = cursor.fetchone()
-                return result[0] if result else 0
+            if not self._require_schema():
+                return 0
+            row = self._connection().execute(self._queries['count'], (zoom, *self._row_range(bbox, zoom))).fetchone()
+            return row[0] if row else 0
         except Exception as e:
             print(f"Failed to get tile count: {e}")
             return 0
@@ -1,32 +1,199 @@
 import argparse
-from typing import Dict, Any, List, Optional
+import json
+import os
+import signal
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Iterable, Iterator, Tuple
 from services.config_service import ConfigService
 from services.tile_download_service import TileDownloadService
+from services.async_tile_download_service import AsyncTileDownloadService
 from services.local_tile_service import LocalTileService
 from services.geocoordinate_service import GeoCoordinateService
 from services.source_factory import SourceFactory
+from services.download_journal import DownloadJournal
+from services.tile_validators import TileValidatorIndex, layer_key
+from services.download_metrics import MetricsReporter
+from services.job_estimator import JobEstimator
+from services.pyramid_builder import PyramidBuilder
+from services.vector_tile_migration import VectorTileGzipMigration
+from services.raster_recompressor import RasterRecompressor
+from services.shard_merge_service import ShardMergeService, MANIFEST_NAME, shard_root
+from services.mbtiles_merge_service import MBTilesMergeService, CONFLICT_POLICIES
 from utils.tile_calculator import TileCalculator
+from utils.tile_sharding import TileSharding
+from utils.tile_existence import TileExistenceIndex
 from utils.file_utils import FileUtils
+from utils.mbtiles_utils import MBTilesUtils
 from utils.metadata_manager import metadata_manager
+from utils.tile_encoding import (combine_encodings, sample_file_encoding, sample_file_format,
+                                 sample_mbtiles_encoding, sample_mbtiles_format)
 from exceptions.tile_downloader_exceptions import ConfigurationError, DownloadError
 from pathlib import Path
 
 
+_AGE_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def parse_age(value: str) -> float:
+    """Parse an age like 3600, 90m, 12h or 7d into seconds"""
+    text = value.strip().lower()
+    unit = _AGE_UNITS.get(text[-1:]) if text else None
+    try:
+        seconds = float(text[:-1]) * unit if unit else float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid age: {value} (e.g. 3600, 90m, 12h, 7d)")
+    if seconds < 0:
+        raise argparse.ArgumentTypeError(f"Invalid age: {value} (must not be negative)")
+    return seconds
+
+
 class TileDownloadManager:
     """Main manager class for tile downloading operations"""
     
     def __init__(self, config_path: str = "config.json"):
         self.config_service = ConfigService()
         self.config = self.config_service.load_config(config_path)
-        self.download_service = TileDownloadService(
-            max_workers=self.config['max_workers_per_server'],
-            retry_attempts=self.config['retry_attempts'],
-            timeout=self.config['timeout']
+        self.download_service = self._create_download_service()
+        local_extract = self.config.get('local_extract') or {}
+        self.local_tile_service = LocalTileService(
+            workers=local_extract.get('workers', 4),
+            writer_threads=local_extract.get('writers', 2),
+            batch_size=local_extract.get('batch_size', 500)
         )
-        self.local_tile_service = LocalTileService()
         self.geocoordinate_service = GeoCoordinateService()
+        self._journal = None
+        self._validators = None
+        # Set by --refresh: {'max_age': seconds|None, 'budget_bytes': int|None, 'budget_seconds': float|None}
+        self.refresh_options: Optional[Dict[str, Any]] = None
+        # Set by --shard-index/--shard-count: {'index': i, 'count': n} (+ 'partition_zoom' once a job fixed it)
+        self.shard: Optional[Dict[str, int]] = None
+        # Set by --estimate: jobs are forecast instead of downloaded
+        self.estimate_only = False
         self._initialize_local_sources()
     
+    def _create_download_service(self, engine: Optional[str] = None, output_format: Optional[str] = None,
+                                 dedup: Optional[bool] = None):
+        """Create the online download engine ('threads' or 'asyncio')"""
+        engine = (engine or self.config.get('download_engine', 'threads')).lower()
+        output_format = (output_format or self.config.get('output_format', 'files')).lower()
+        if output_format not in ('files', 'mbtiles'):
+            raise ConfigurationError(f"Unknown output format: {output_format} (expected 'files' or 'mbtiles')")
+        if dedup is None:
+            dedup = bool(self.config.get('dedup', False))
+        if engine == 'asyncio':
+            return AsyncTileDownloadService(
+                max_workers=self.config['max_workers_per_server'],
+                retry_attempts=self.config['retry_attempts'],
+                timeout=self.config['timeout'],
+                concurrency=self.config.get('async_concurrency', 1024),
+                per_server_limit=self.config.get('async_per_server_limit', 256),
+                drain_timeout=self.config.get('drain_timeout', 10.0),
+                output_format=output_format,
+                dedup=dedup,
+                circuit_breaker=self.config.get('circuit_breaker'),
+                health_ordering=self.config.get('health_ordering', False),
+                retry=self.config.get('retry')
+            )
+        if engine != 'threads':
+            raise ConfigurationError(f"Unknown download engine: {engine} (expected 'threads' or 'asyncio')")
+        return TileDownloadService(
+            max_workers=self.config['max_workers_per_server'],
+            retry_attempts=self.config['retry_attempts'],
+            timeout=self.config['timeout'],
+            max_concurrency_per_host=self.config.get('max_concurrency_per_host'),
+            rate_limits=self.config.get('rate_limits'),
+            drain_timeout=self.config.get('drain_timeout', 10.0),
+            output_format=output_format,
+            dedup=dedup,
+            circuit_breaker=self.config.get('circuit_breaker'),
+            health_ordering=self.config.get('health_ordering', False),
+            writer_queue_size=self.config.get('writer_queue_size', 1000),
+            fsync=self.config.get('fsync_tiles', False),
+            retry=self.config.get('retry')
+        )
+    
+    def get_journal(self) -> DownloadJournal:
+        """Open (once) the job journal stored next to the downloaded tiles"""
+        if self._journal is None:
+            journal_path = os.path.join(self.config['output_dir'], 'metadata', 'download_journal.sqlite')
+            self._journal = DownloadJournal(journal_path)
+        return self._journal
+    
+    def close(self) -> None:
+        """Release the download sessions, local sources and open metadata databases"""
+        self.download_service.close()
+        self.local_tile_service.close()
+        for index in (self._journal, self._validators):
+            if index is not None:
+                index.close()
+        self._journal = None
+        self._validators = None
+    
+    def get_validator_index(self) -> TileValidatorIndex:
+        """Open (once) the ETag/Last-Modified index used for refreshes"""
+        if self._validators is None:
+            index_path = os.path.join(self.config['output_dir'], 'metadata', 'tile_validators.sqlite')
+            self._validators = TileValidatorIndex(index_path)
+        return self._validators
+    
+    def set_shard(self, shard_index: int, shard_count: int) -> None:
+        """Run jobs as shard `shard_index` of `shard_count`: only that part of the tile space is
+        downloaded, into the shard's own output root (with its own journal and validator index)"""
+        if shard_count < 1 or not 0 <= shard_index < shard_count:
+            raise ConfigurationError(f"Invalid shard {shard_index} of {shard_count} (index must be 0..count-1)")
+        self.shard = {'index': shard_index, 'count': shard_count}
+        self.config['output_dir'] = shard_root(self.config['output_dir'], shard_index, shard_count)
+        self._journal = None
+        self._validators = None
+    
+    def list_jobs(self) -> None:
+        """List recorded download jobs"""
+        jobs = self.get_journal().list_jobs()
+        if not jobs:
+            print("No download jobs recorded.")
+            return
+        print("Download jobs:")
+        for job in jobs:
+            params = job['params']
+            counts = job['counts']
+            print(f"  {job['job_id']}  [{job['status']}]  {params.get('region_name')}  "
+                  f"z{params.get('min_zoom')}-{params.get('max_zoom')}  "
+                  f"done {counts['done']}, failed {counts['failed']}  (updated {job['updated_at']})")
+    
+    def resume_job(self, job_id: Optional[str] = None, retry_failed: bool = False) -> bool:
+        """Resume an interrupted job (unfinished tiles) or retry only its failed tiles"""
+        journal = self.get_journal()
+        job_id = job_id or journal.get_latest_job_id()
+        job = journal.get_job(job_id) if job_id else None
+        if job is None:
+            print(f"Unknown download job: {job_id}" if job_id else "No download jobs recorded.")
+            return False
+        
+        params = job['params']
+        online_names = params.get('online_sources', [])
+        local_names = params.get('local_sources', [])
+        sources = [s for s in self.config_service.get_enabled_sources(self.config) if s.get_name() in online_names]
+        if not retry_failed:
+            sources += [s for s in self.config_service.get_local_sources(self.config) if s.get_name() in local_names]
+        
+        if params.get('refresh') is not None:
+            self.refresh_options = params['refresh']
+        if params.get('shard') is not None:
+            self.shard = params['shard']
+        print(f"{'Retrying failed tiles of' if retry_failed else 'Resuming'} job {job_id}")
+        return self._download_area(
+            region_name=params['region_name'],
+            bbox=params['bbox'],
+            min_zoom=params['min_zoom'],
+            max_zoom=params['max_zoom'],
+            sources=sources,
+            job_id=job_id,
+            retry_failed=retry_failed,
+            polygon=params.get('polygon')
+        )
+    
     def _initialize_local_sources(self):
         """Initialize local sources from configuration"""
         local_sources = self.config_service.get_local_sources(self.config)
@@ -39,7 +206,9 @@ class TileDownloadManager:
                 'tile_type': source.tile_type,
                 'bounds': source.bounds,
                 'min_zoom': source.min_zoom,
-                'max_zoom': source.max_zoom
+                'max_zoom': source.max_zoom,
+                'mmap_mb': source.mmap_mb,
+                'cache_mb': source.cache_mb
             }
             success = self.local_tile_service.register_source(source_config)
             if not success:
@@ -153,8 +322,9 @@ class TileDownloadManager:
     def download_bbox(self, bbox: List[float], min_zoom: int, max_zoom: int,
                      server_filter: Optional[List[str]] = None,
                      source_filter: Optional[List[str]] = None,
-                     region_name: Optional[str] = None) -> bool:
-        """Download tiles for a custom bounding box"""
+                     region_name: Optional[str] = None,
+                     polygon: Optional[dict] = None) -> bool:
+        """Download tiles for a custom bounding box (only tiles intersecting `polygon` when given)"""
         try:
             # Get online sources
             enabled_sources = self.config_service.get_enabled_sources(self.config)
@@ -205,7 +375,8 @@ class TileDownloadManager:
                 bbox=bbox,
                 min_zoom=min_zoom,
                 max_zoom=max_zoom,
-                sources=all_sources
+                sources=all_sources,
+                polygon=polygon
             )
             
         except Exception as e:
@@ -214,10 +385,14 @@ class TileDownloadManager:
     
     def _download_area(self, region_name: str, bbox: List[float], 
                       min_zoom: int, max_zoom: int, 
-                      sources: List) -> bool:
-        """Download tiles for a specific area"""
+                      sources: List, job_id: Optional[str] = None,
+                      retry_failed: bool = False, polygon: Optional[dict] = None) -> bool:
+        """Download tiles for a specific area (job_id resumes a journaled job).
+        With a GeoJSON polygon only the tiles intersecting it are downloaded."""
         print(f"=== Downloading {region_name.upper()} ===")
         print(f"Bounding Box: {bbox}")
+        if polygon is not None:
+            print(f"Outline: {polygon['type']}, only tiles intersecting it are downloaded")
         print(f"Zoom Levels: {min_zoom} to {max_zoom}")
         print(f"Output Directory: {self.config['output_dir']}")
         print(f"Enabled Sources: {', '.join([s.get_name() for s in sources])}")
@@ -233,17 +408,70 @@ class TileDownloadManager:
             else:
                 online_sources.append(source)
         
+        # The partition zoom depends on the job, so every shard of it derives the same one
+        shard = self.shard
+        if shard is not None and shard.get('partition_zoom') is None:
+            shard = dict(shard, partition_zoom=TileSharding.choose_partition_zoom(bbox, min_zoom, max_zoom, shard['count']))
+        if shard is not None:
+            print(f"Shard: {shard['index']} of {shard['count']} (partitioned at zoom {shard['partition_zoom']})")
+            if local_sources and shard['index'] != 0:
+                print("Local sources are extracted by shard 0 only")
+                local_sources = []
+        
+        if self.estimate_only:
+            return self.estimate_area(region_name, bbox, min_zoom, max_zoom, online_sources + local_sources, shard,
+                                      polygon)
+        
+        journal = self.get_journal()
+        if job_id is None:
+            job_id = journal.create_job({
+                'region_name': region_name,
+                'bbox': list(bbox),
+                'min_zoom': min_zoom,
+                'max_zoom': max_zoom,
+                'online_sources': [s.get_name() for s in online_sources],
+                'local_sources': [s.get_name() for s in local_sources],
+                'refresh': self.refresh_options,
+                'shard': shard,
+                'polygon': polygon
+            })
+            print(f"Job ID: {job_id} (resume with --resume {job_id})")
+        else:
+            journal.set_job_status(job_id, 'running')
+        
         success = True
+        interrupted = False
         
         # Process online sources
         if online_sources:
             print("Processing online sources...")
-            success &= self._download_from_online_sources(region_name, bbox, min_zoom, max_zoom, online_sources)
+            online_success, interrupted = self._download_from_online_sources(
+                region_name, bbox, min_zoom, max_zoom, online_sources,
+                job_id=job_id, retry_failed=retry_failed, shard=shard, polygon=polygon
+            )
+            success &= online_success
+        
+        if interrupted:
+            journal.set_job_status(job_id, 'interrupted')
+            if shard is not None:
+                self._write_shard_manifest(region_name, bbox, min_zoom, max_zoom, sources, shard, job_id, 'interrupted',
+                                           polygon)
+            print(f"\nDownload interrupted. Resume with: --resume {job_id}")
+            return False
         
         # Process local sources
         if local_sources:
             print("Processing local sources...")
-            success &= self._download_from_local_sources(region_name, bbox, min_zoom, max_zoom, local_sources)
+            success &= self._download_from_local_sources(region_name, bbox, min_zoom, max_zoom, local_sources, polygon)
+        
+        journal.set_job_status(job_id, 'completed' if success else 'failed')
+        
+        if shard is not None:
+            # Region metadata describes the merged tree, so it is updated by --merge-shards
+            self._write_shard_manifest(region_name, bbox, min_zoom, max_zoom, sources, shard, job_id,
+                                       'completed' if success else 'failed', polygon)
+            print(f"\nShard done. Once every shard has finished, combine them with: --merge-shards {region_name}")
+            return success
         
         # Update metadata after download completes (automatic)
         if success:
@@ -254,55 +482,487 @@ class TileDownloadManager:
         
         return success
     
+    def estimate_area(self, region_name: str, bbox: List[float], min_zoom: int, max_zoom: int,
+                      sources: List, shard: Optional[Dict[str, int]] = None,
+                      polygon: Optional[dict] = None) -> bool:
+        """Print the tile, byte, disk and duration forecast of a job without downloading it"""
+        service = self.download_service
+        concurrency = getattr(service, 'per_server_limit', None) or service.max_workers
+        estimator = JobEstimator(
+            self.config['output_dir'],
+            output_format=service.output_format,
+            samples_per_zoom=self.config.get('estimate_samples', 5),
+            concurrency=concurrency,
+            timeout=self.config['timeout'],
+            local_tile_service=self.local_tile_service
+        )
+        print(f"Sampling {estimator.samples_per_zoom} tiles per zoom and source...")
+        estimate = estimator.estimate(region_name, bbox, min_zoom, max_zoom, sources, shard, polygon)
+        print()
+        for line in JobEstimator.format_report(estimate):
+            print(line)
+        return estimate['fits']
+    
+    def _write_shard_manifest(self, region_name: str, bbox: List[float], min_zoom: int, max_zoom: int,
+                              sources: List, shard: Dict[str, int], job_id: str, status: str,
+                              polygon: Optional[dict] = None) -> None:
+        """Describe this shard's job and progress for --merge-shards"""
+        online_names = [s.get_name() for s in sources
+                        if not (hasattr(s, 'get_source_type') and s.get_source_type() == 'local')]
+        counts = self.get_journal().get_counts(job_id)
+        manifest = {
+            'region_name': region_name,
+            'bbox': list(bbox),
+            'polygon_checksum': (zlib.crc32(json.dumps(polygon, sort_keys=True).encode())
+                                 if polygon is not None else None),
+            'min_zoom': min_zoom,
+            'max_zoom': max_zoom,
+            'shard_index': shard['index'],
+            'shard_count': shard['count'],
+            'partition_zoom': shard['partition_zoom'],
+            'online_sources': online_names,
+            'local_sources': [s.get_name() for s in sources if s.get_name() not in online_names],
+            'output_format': self.download_service.output_format,
+            'job_id': job_id,
+            'status': status,
+            'expected_tiles': self._job_tiles(bbox, min_zoom, max_zoom, shard, polygon)[0] if online_names else 0,
+            'done_tiles': counts['done'],
+            'failed_tiles': counts['failed']
+        }
+        manifest_path = os.path.join(self.config['output_dir'], region_name, MANIFEST_NAME)
+        FileUtils.ensure_directory_exists(os.path.dirname(manifest_path))
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+    
+    def merge_shards(self, region_name: str) -> bool:
+        """Verify the shards of a region and merge them into the main output tree"""
+        print(f"=== Merging shards of {region_name.upper()} ===")
+        result = ShardMergeService(self.config['output_dir']).merge(region_name)
+        if result['problems']:
+            print(f"Cannot merge ({result['shards']} shard(s) found):")
+            for problem in result['problems']:
+                print(f"  {problem}")
+            return False
+        
+        manifest = result['manifest']
+        print(f"Merged {result['shards']} shards: {result['files']} files linked, "
+              f"{result['mbtiles_tiles']} MBTiles tiles copied")
+        names = manifest['online_sources'] + manifest.get('local_sources', [])
+        sources = [s for s in self.config_service.get_enabled_sources(self.config) if s.get_name() in names]
+        sources += [s for s in self.config_service.get_local_sources(self.config)
+                    if s.get_name() in names and s not in sources]
+        print("\n=== Metadata Güncelleniyor ===")
+        self._update_metadata_after_download(region_name, manifest['bbox'], sources)
+        return True
+    
+    def build_pyramid(self, region_name: str, server_filter: Optional[List[str]] = None, min_zoom: int = 0,
+                      workers: Optional[int] = None, complete_only: bool = False) -> bool:
+        """Build the lower zooms of a region's raster layers from their deepest downloaded zoom"""
+        print(f"=== Building raster pyramid of {region_name.upper()} ===")
+        raster_dir = Path(self.config['output_dir']) / region_name / 'raster'
+        layers = sorted(entry.name for entry in raster_dir.iterdir() if entry.is_dir()) if raster_dir.is_dir() else []
+        for mbtiles_path in (raster_dir.glob('*.mbtiles') if raster_dir.is_dir() else []):
+            print(f"  {mbtiles_path.stem}: MBTiles layers are not supported, skipped")
+        if server_filter:
+            missing = [name for name in server_filter if name not in layers]
+            if missing:
+                print(f"No raster file layer for: {', '.join(missing)}")
+            layers = [name for name in layers if name in server_filter]
+        if not layers:
+            print(f"No raster file layers found under {raster_dir}")
+            return False
+        
+        success = True
+        for layer_name in layers:
+            builder = PyramidBuilder(str(raster_dir / layer_name), workers=workers, complete_only=complete_only)
+            source_zoom = builder.deepest_zoom()
+            print(f"\n{layer_name}: building zoom {min_zoom}-{source_zoom - 1 if source_zoom else '?'} "
+                  f"from zoom {source_zoom} ({builder.workers} workers)")
+            try:
+                stats = builder.build(min_zoom=min_zoom, source_zoom=source_zoom)
+            except DownloadError as e:
+                print(f"Error: {e}")
+                return False
+            print(f"{layer_name}: {stats['built']} tiles built, {stats['skipped']} skipped, "
+                  f"{stats['failed']} failed in {stats['seconds']:.1f}s")
+            success = success and stats['failed'] == 0
+        
+        print("\n=== Metadata Güncelleniyor ===")
+        try:
+            bbox = self.config.get('regions', {}).get(region_name, {}).get('bbox')
+            metadata_manager.update_region_metadata(region_name, bbox)
+            for layer_name in layers:
+                self._update_layer_metadata(region_name, layer_name, 'raster')
+        except Exception as e:
+            print(f"Metadata güncelleme hatası: {e}")
+        return success
+    
+    def recompress_raster_tiles(self, region_name: str, server_filter: Optional[List[str]] = None,
+                                zooms: Optional[Tuple[int, int]] = None,
+                                tiles: Optional[Iterable[Tuple[int, int, int]]] = None,
+                                update_metadata: bool = True) -> bool:
+        """Re-encode a region's raster file layers per config['recompress'] (format, quality, workers);
+        only the given (z, x, y) tiles when tiles is set"""
+        options = self.config.get('recompress') or {}
+        raster_dir = Path(self.config['output_dir']) / region_name / 'raster'
+        layers = sorted(entry.name for entry in raster_dir.iterdir() if entry.is_dir()) if raster_dir.is_dir() else []
+        if server_filter:
+            layers = [name for name in layers if name in server_filter]
+        if not layers:
+            print(f"No raster file layers found under {raster_dir}")
+            return False
+        
+        try:
+            recompressor = RasterRecompressor(self.config['output_dir'], target=options.get('format', 'png'),
+                                              quality=options.get('quality', 80), workers=options.get('workers'))
+            print(f"\n=== Recompressing raster tiles to {recompressor.target.upper()} "
+                  f"({', '.join(layers)}, {recompressor.workers} processes) ===")
+            result = recompressor.recompress_layers([str(raster_dir / name) for name in layers], zooms, tiles)
+        except DownloadError as e:
+            print(f"Error: {e}")
+            return False
+        saved = result['bytes_before'] - result['bytes_after']
+        print(f"{result['recompressed']} of {result['tiles']} tiles re-encoded, {result['unchanged']} kept, "
+              f"{result['failed']} failed, {saved / (1024 * 1024):.2f} MB saved in {result['seconds']:.1f}s")
+        
+        if update_metadata:
+            print("\n=== Metadata Güncelleniyor ===")
+            try:
+                for layer_name in layers:
+                    self._update_layer_metadata(region_name, layer_name, 'raster')
+            except Exception as e:
+                print(f"Metadata güncelleme hatası: {e}")
+        return result['failed'] == 0
+    
+    def gzip_vector_tiles(self, region_name: Optional[str] = None, workers: Optional[int] = None) -> bool:
+        """One-off migration: store the existing vector tiles of a region (None: all regions) as gzip"""
+        print(f"=== Converting vector tiles of {region_name.upper() if region_name else 'ALL REGIONS'} to gzip ===")
+        migration = VectorTileGzipMigration(self.config['output_dir'], workers=workers)
+        result = migration.migrate(region_name)
+        if not result['layers']:
+            print("No vector layers found")
+            return False
+        
+        converted = sum(layer['converted'] for layer in result['layers'])
+        failed = sum(layer['failed'] for layer in result['layers'])
+        before = sum(layer['bytes_before'] for layer in result['layers'])
+        after = sum(layer['bytes_after'] for layer in result['layers'])
+        print(f"{converted} tiles converted ({before / (1024 * 1024):.1f} MB -> {after / (1024 * 1024):.1f} MB), "
+              f"{failed} failed in {result['seconds']:.1f}s")
+        
+        print("\n=== Metadata Güncelleniyor ===")
+        try:
+            for layer in result['layers']:
+                self._update_layer_metadata(layer['region'], layer['layer'], 'vector')
+        except Exception as e:
+            print(f"Metadata güncelleme hatası: {e}")
+        return failed == 0
+    
+    def export_local_subset(self, source_name: str, output_path: str, bbox: List[float], min_zoom: int,
+                            max_zoom: int, polygon: Optional[dict] = None, overwrite: bool = False) -> bool:
+        """Clip a bbox (or polygon) and zoom range of a local MBTiles source into a new MBTiles file"""
+        print(f"=== Exporting {source_name} zoom {min_zoom}-{max_zoom} to {output_path} ===")
+        result = self.local_tile_service.export_subset(source_name, output_path, min_zoom, max_zoom,
+                                                       bbox=bbox, polygon=polygon, overwrite=overwrite)
+        if not result['success']:
+            print(f"Error: {', '.join(result['errors'])}")
+            return False
+        layout = f", {result['images']} distinct images (images/map layout)" if result['dedup'] else ""
+        print(f"{result['tiles']} tiles{layout}, {result['bytes'] / (1024 * 1024):.1f} MB "
+              f"in {result['seconds']:.1f}s")
+        return True
+    
+    def merge_mbtiles(self, inputs: List[str], output_path: str, conflict: str = 'first',
+                      workers: Optional[int] = None, overwrite: bool = False) -> bool:
+        """Merge local sources, MBTiles files and tile directories (earliest wins ties) into one MBTiles file"""
+        paths, tms = [], {}
+        for item in inputs:
+            source = self.local_tile_service.get_source(item)
+            if source is not None:
+                paths.append(source.file_path)
+                tms[source.file_path] = source.is_tms
+                continue
+            # A path, or a layer below output_dir such as istanbul/raster/CartoDB_Light(.mbtiles)
+            candidates = [item, os.path.join(self.config['output_dir'], item),
+                          os.path.join(self.config['output_dir'], item + '.mbtiles')]
+            path = next((candidate for candidate in candidates if os.path.exists(candidate)), None)
+            if path is None:
+                print(f"Unknown merge input: {item} (not a local source, file or layer under {self.config['output_dir']})")
+                return False
+            paths.append(path)
+        
+        print(f"=== Merging {len(paths)} inputs into {output_path} ({conflict} wins) ===")
+        try:
+            result = MBTilesMergeService(conflict, workers).merge(paths, output_path, overwrite, tms)
+        except DownloadError as e:
+            print(f"Error: {e}")
+            return False
+        for merged_input in result['inputs']:
+            print(f"  {merged_input['path']}: {merged_input['tiles']} of {merged_input['candidates']} tiles kept")
+        print(f"{result['tiles']} tiles ({result['conflicts']} duplicates resolved), {result['images']} distinct images, "
+              f"{result['bytes'] / (1024 * 1024):.1f} MB in {result['seconds']:.1f}s")
+        return True
+    
+    def _within_budget(self, tiles: Iterable[Tuple[int, int, int]], budget_bytes: Optional[int],
+                       budget_seconds: Optional[float]) -> Iterator[Tuple[int, int, int]]:
+        """Stop handing out tiles once the refresh has used its bandwidth or time budget.
+        The download service pulls tiles lazily, so the overshoot is bounded by its window."""
+        started = time.monotonic()
+        start_bytes = self.download_service.bytes_received
+        for tile in tiles:
+            if budget_seconds and time.monotonic() - started >= budget_seconds:
+                print("Refresh time budget reached; remaining tiles are left for the next run")
+                return
+            if budget_bytes and self.download_service.bytes_received - start_bytes >= budget_bytes:
+                print("Refresh bandwidth budget reached; remaining tiles are left for the next run")
+                return
+            yield tile
+    
     def _download_from_online_sources(self, region_name: str, bbox: List[float], 
                                     min_zoom: int, max_zoom: int, 
-                                    online_sources: List) -> bool:
-        """Download tiles from online sources"""
+                                    online_sources: List, job_id: Optional[str] = None,
+                                    retry_failed: bool = False,
+                                    shard: Optional[Dict[str, int]] = None,
+                                    polygon: Optional[dict] = None) -> tuple[bool, bool]:
+        """Download tiles from online sources; returns (success, interrupted)"""
+        journal = self.get_journal() if job_id else None
+        validators = self.get_validator_index()
+        refresh = self.refresh_options
         try:
-            # Calculate tiles
-            print("Calculating tiles...")
-            all_tiles = TileCalculator.get_tiles_for_bbox(bbox, min_zoom, max_zoom)
-            total_tiles = len(all_tiles)
+            # Tiles are streamed to the download service; only counts are computed up front
+            if journal and retry_failed:
+                total_tiles = journal.get_counts(job_id)['failed']
+                all_tiles = journal.iter_failed(job_id)
+            elif refresh and refresh.get('max_age') is not None:
+                # Age-based refresh: only recorded tiles older than max_age, oldest first
+                layers = [layer_key(region_name, 'vector' if s.get_tile_type() == 'vector' else 'raster', s.get_name())
+                          for s in online_sources]
+                older_than = time.time() - refresh['max_age']
+                total_tiles = validators.count_stale(layers, bbox, min_zoom, max_zoom, older_than)
+                all_tiles = validators.iter_stale(layers, bbox, min_zoom, max_zoom, older_than)
+                if journal:
+                    # Tiles refreshed before an interruption are no longer stale: count_stale is
+                    # already the remaining count; the journal only filters what it still yields
+                    all_tiles = journal.iter_unfinished(job_id, all_tiles)
+            else:
+                total_tiles, all_tiles = self._job_tiles(bbox, min_zoom, max_zoom, shard, polygon)
+                if journal:
+                    # Only tiles the journal has not recorded as done
+                    total_tiles -= journal.get_counts(job_id)['done']
+                    all_tiles = journal.iter_unfinished(job_id, all_tiles)
             
-            if total_tiles == 0:
+            if total_tiles <= 0:
                 print("No tiles to download.")
-                return True
+                return True, False
             
-            print(f"Total tiles to download: {total_tiles}")
+            print(f"Total tiles to {'refresh' if refresh else 'download'}: {total_tiles}")
+            if refresh and (refresh.get('budget_bytes') or refresh.get('budget_seconds')):
+                all_tiles = self._within_budget(all_tiles, refresh.get('budget_bytes'), refresh.get('budget_seconds'))
+            
+            tile_callback = None
+            if journal:
+                tile_callback = lambda tile, ok, error: journal.record_tile(job_id, tile, ok, error)
             
             # Download tiles using existing service
-            result = self.download_service.download_tiles_batch(
-                all_tiles, self.config['output_dir'], region_name, online_sources
-            )
+            reporter = self._start_metrics_reporter(total_tiles)
+            try:
+                with self._graceful_cancel():
+                    result = self.download_service.download_tiles_batch(
+                        all_tiles, self.config['output_dir'], region_name, online_sources,
+                        tile_callback=tile_callback,
+                        validators=validators,
+                        refresh=refresh is not None,
+                        max_age=refresh.get('max_age') if refresh else None
+                    )
+            finally:
+                if reporter is not None:
+                    reporter.stop()
+            self._print_pool_stats()
+            if result.get('skipped'):
+                print(f"Skipped {result['skipped']} tiles already on disk")
+            if refresh:
+                print(f"Refresh: {result['not_modified']} tiles unchanged (304), "
+                      f"{result['downloaded'] - result['not_modified']} downloaded or kept")
+            dedup = result.get('dedup')
+            if dedup and dedup['tiles']:
+                print(f"Dedup: {dedup['tiles']} tiles stored as {dedup['unique_payloads']} unique payloads "
+                      f"({dedup['logical_bytes'] / (1024 * 1024):.2f} MB -> {dedup['physical_bytes'] / (1024 * 1024):.2f} MB, "
+                      f"ratio {dedup['dedup_ratio']})")
             
+            if self.download_service.is_cancelled():
+                print(f"Cancelled: {result['downloaded']} downloaded, {result['failed']} failed, "
+                      f"{total_tiles - result['downloaded'] - result['failed']} not processed")
+                return False, True
             if result['downloaded'] > 0:
                 print(f"Successfully downloaded {result['downloaded']} tiles from online sources")
-                return True
+                if (self.config.get('recompress') or {}).get('format') and self.download_service.output_format != 'mbtiles':
+                    # Only the job's tiles; mtimes cannot tell them apart (dedup links keep the blob's mtime)
+                    raster_names = [s.get_name() for s in online_sources if s.get_tile_type() != 'vector']
+                    if raster_names:
+                        self.recompress_raster_tiles(region_name, raster_names,
+                                                     tiles=self._job_tiles(bbox, min_zoom, max_zoom, shard, polygon)[1],
+                                                     update_metadata=False)
+                return True, False
             else:
                 print("Failed to download tiles from online sources")
-                return False
+                return False, False
                 
+        except KeyboardInterrupt:
+            print("\nDownload aborted.")
+            return False, True
         except Exception as e:
             print(f"Error downloading from online sources: {e}")
-            return False
+            return False, False
+        finally:
+            validators.flush()
+            if journal:
+                journal.flush()
+    
+    @staticmethod
+    def _job_tiles(bbox: List[float], min_zoom: int, max_zoom: int, shard: Optional[Dict[str, int]] = None,
+                   polygon: Optional[dict] = None) -> Tuple[int, Iterator[Tuple[int, int, int]]]:
+        """Tile count and lazy tile iterator of a job: the bbox, or the quadtree cover of the polygon,
+        restricted to one shard's part of the tile space when sharded"""
+        if polygon is None:
+            if shard is None:
+                return (TileCalculator.calculate_tile_count(bbox, min_zoom, max_zoom),
+                        TileCalculator.iter_tiles_for_bbox(bbox, min_zoom, max_zoom))
+            # Only this shard's part of the tile space (the journal and validators are per shard already)
+            shard_args = (shard['partition_zoom'], shard['index'], shard['count'])
+            return (TileSharding.count_shard_tiles(bbox, min_zoom, max_zoom, *shard_args),
+                    TileSharding.iter_shard_tiles(bbox, min_zoom, max_zoom, *shard_args))
+        if shard is None:
+            return (sum(TileCalculator.calculate_polygon_tile_counts(polygon, min_zoom, max_zoom).values()),
+                    TileCalculator.iter_tiles_for_polygon(polygon, min_zoom, max_zoom))
+        
+        def owned() -> Iterator[Tuple[int, int, int]]:
+            for tile in TileCalculator.iter_tiles_for_polygon(polygon, min_zoom, max_zoom):
+                if TileSharding.shard_of(tile, shard['partition_zoom'], shard['count']) == shard['index']:
+                    yield tile
+        return sum(1 for _ in owned()), owned()
+    
+    def _start_metrics_reporter(self, total_tiles: int) -> Optional[MetricsReporter]:
+        """Reset the engine's metrics and start the periodic progress line / metric files"""
+        metrics = getattr(self.download_service, 'metrics', None)
+        if metrics is None:
+            return None
+        metrics.start(total_tiles)
+        reporter = MetricsReporter(
+            metrics,
+            interval=self.config.get('progress_interval', 10),
+            json_path=self.config.get('metrics_json'),
+            prometheus_path=self.config.get('metrics_prometheus')
+        )
+        reporter.start()
+        return reporter
     
+    @contextmanager
+    def _graceful_cancel(self):
+        """First SIGINT/SIGTERM drains in-flight tiles; a second one aborts immediately"""
+        signals_seen = []
+        
+        def handle_signal(signum, frame):
+            if signals_seen:
+                raise KeyboardInterrupt
+            signals_seen.append(signum)
+            print("\nStopping: finishing in-flight tiles (interrupt again to abort)...")
+            self.download_service.cancel()
+        
+        previous = {}
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                previous[sig] = signal.signal(sig, handle_signal)
+            except ValueError:
+                # Signal handlers can only be installed from the main thread
+                pass
+        try:
+            yield
+        finally:
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+    
+    def _print_pool_stats(self) -> None:
+        """Print per-host HTTP connection pool statistics"""
+        try:
+            pool_stats = self.download_service.get_pool_stats()
+        except Exception:
+            return
+        if not pool_stats:
+            return
+        print("Connection pools:")
+        for host, stats in pool_stats.items():
+            reuse = stats.get('reuse_ratio')
+            reuse_str = f"{reuse * 100:.1f}%" if reuse is not None else "n/a"
+            print(f"  {host}: {stats.get('requests', 0)} requests, "
+                  f"{stats.get('connections_created') or 0} connections, "
+                  f"{stats.get('open_connections') or 0} open, reuse {reuse_str}")
+        
+        get_limit_stats = getattr(self.download_service, 'get_rate_limit_stats', None)
+        limit_stats = get_limit_stats() if get_limit_stats else {}
+        if limit_stats:
+            print("Adaptive host limits:")
+            for host, stats in limit_stats.items():
+                print(f"  {host}: concurrency {stats['limit']}/{stats['max_concurrency']}, "
+                      f"{stats['throttled']} throttled, {stats['errors']} errors, "
+                      f"{stats['decreases']} back-offs")
+        
+        get_hedge_stats = getattr(self.download_service, 'get_hedge_stats', None)
+        hedge_stats = get_hedge_stats() if get_hedge_stats else {}
+        if hedge_stats:
+            print("Hedged requests:")
+            for name, stats in hedge_stats.items():
+                print(f"  {name}: {stats['hedged']} hedged, {stats['won']} answered first by the mirror")
+        
+        metrics = getattr(self.download_service, 'metrics', None)
+        servers = metrics.snapshot()['servers'] if metrics is not None else {}
+        if servers:
+            print("Server latency:")
+            for name, stats in servers.items():
+                latency = stats['latency']
+                if latency['p50'] is None:
+                    continue
+                print(f"  {name}: {stats['requests']} requests, p50 {latency['p50'] * 1000:.0f} ms, "
+                      f"p95 {latency['p95'] * 1000:.0f} ms, p99 {latency['p99'] * 1000:.0f} ms, "
+                      f"{stats['retries']} retries, {stats['fallbacks']} fallbacks")
+        
+        get_writer_stats = getattr(self.download_service, 'get_writer_stats', None)
+        writer_stats = get_writer_stats() if get_writer_stats else None
+        if writer_stats and writer_stats['files']:
+            throughput = writer_stats['throughput_mb_s']
+            print(f"Tile writer: {writer_stats['files']} files, {writer_stats['bytes'] / (1024 * 1024):.2f} MB "
+                  f"at {throughput if throughput is not None else 'n/a'} MB/s, "
+                  f"queue peak {writer_stats['max_queue_depth']}/{writer_stats['queue_size']}, "
+                  f"downloads waited {writer_stats['blocked_seconds']:.1f}s for the disk"
+                  + (" (disk-bound)" if writer_stats['blocked_seconds'] > 1.0 else ""))
+        
+        get_health_stats = getattr(self.download_service, 'get_health_stats', None)
+        health_stats = get_health_stats() if get_health_stats else {}
+        if any(stats['opened'] for stats in health_stats.values()):
+            print("Circuit breakers:")
+            for name, stats in health_stats.items():
+                print(f"  {name}: {stats['state']}, opened {stats['opened']}x, "
+                      f"{stats['rejected']} requests skipped, error rate {stats['error_rate'] * 100:.0f}%")
+
     def _download_from_local_sources(self, region_name: str, bbox: List[float], 
                                    min_zoom: int, max_zoom: int, 
-                                   local_sources: List) -> bool:
-        """Download tiles from local sources"""
+                                   local_sources: List, polygon: Optional[dict] = None) -> bool:
+        """Download tiles from local sources (only tiles intersecting `polygon` when given)"""
         try:
             success = True
+            source_names = [source.get_name() for source in local_sources]
+            zooms = list(range(min_zoom, max_zoom + 1))
             
-            for source in local_sources:
-                source_name = source.get_name()
+            # Every source and zoom level is extracted concurrently
+            results = self.local_tile_service.extract_zooms(
+                source_names, zooms, self.config['output_dir'], region_name,
+                bbox=None if polygon is not None else bbox, polygon=polygon
+            )
+            
+            for source_name in source_names:
                 print(f"Processing local source: {source_name}")
                 
-                # Extract tiles for each zoom level
-                for zoom in range(min_zoom, max_zoom + 1):
-                    result = self.local_tile_service.extract_tiles(
-                        source_name, bbox, zoom, self.config['output_dir'], region_name
-                    )
-                    
+                for zoom in zooms:
+                    result = results[(source_name, zoom)]
                     if result['success']:
                         print(f"  Zoom {zoom}: Extracted {result['tiles_extracted']} tiles")
                     else:
@@ -318,34 +978,13 @@ class TileDownloadManager:
     def _count_existing_tiles(self, tiles: List, region_name: str, 
                             servers: List) -> int:
         """Count existing tiles across all servers"""
-        existing_count = 0
-        
-        for zoom, x, y in tiles:
-            found = False
-            for server in servers:
-                if server.get_tile_type() == 'vector':
-                    extension = 'pbf'
-                    tile_type = 'vector'
-                    style_name = server.get_name()
-                else:
-                    extension = 'png'
-                    tile_type = 'raster'
-                    style_name = server.get_name()
-                
-                tile_path = FileUtils.get_tile_path(
-                    self.config['output_dir'], region_name, tile_type,
-                    style_name, zoom, x, y, extension
-                )
-                
-                if FileUtils.file_exists(tile_path):
-                    existing_count += 1
-                    found = True
-                    break
-            
-            if found:
-                continue
+        indexes = []
+        for server in servers:
+            tile_type = 'vector' if server.get_tile_type() == 'vector' else 'raster'
+            layer_dir = os.path.join(self.config['output_dir'], region_name, tile_type, server.get_name())
+            indexes.append(TileExistenceIndex(layer_dir, 'pbf' if tile_type == 'vector' else 'png'))
         
-        return existing_count
+        return sum(1 for zoom, x, y in tiles if any(index.contains(zoom, x, y) for index in indexes))
     
     def _update_metadata_after_download(self, region_name: str, bbox: List[float], sources: List):
         """Update metadata after download completes"""
@@ -357,57 +996,7 @@ class TileDownloadManager:
             
             # Update layer info for each source
             for source in sources:
-                layer_name = source.get_name()
-                layer_type = source.get_tile_type()
-                
-                print(f"  Layer taranıyor: {layer_name} ({layer_type})")
-                
-                # Scan layer directory - build correct path
-                layer_path = Path(self.config['output_dir']) / region_name / layer_type / layer_name
-                
-                if layer_path.exists():
-                    # Layer bilgilerini hesapla
-                    available_zooms = []
-                    tile_count = 0
-                    total_size = 0
-                    
-                    # Zoom seviyelerini bul
-                    for zoom_dir in layer_path.iterdir():
-                        if zoom_dir.is_dir() and zoom_dir.name.isdigit():
-                            zoom_level = int(zoom_dir.name)
-                            available_zooms.append(zoom_level)
-                            
-                            # Count tiles
-                            for x_dir in zoom_dir.iterdir():
-                                if x_dir.is_dir() and x_dir.name.isdigit():
-                                    for tile_file in x_dir.iterdir():
-                                        if tile_file.is_file():
-                                            tile_count += 1
-                                            total_size += tile_file.stat().st_size
-                    
-                    if available_zooms:
-                        min_zoom = min(available_zooms)
-                        max_zoom = max(available_zooms)
-                        
-                        # Layer bilgilerini metadata'ya ekle
-                        metadata_manager.add_layer_info(
-                            region_name=region_name,
-                            layer_name=layer_name,
-                            layer_type=layer_type,
-                            min_zoom=min_zoom,
-                            max_zoom=max_zoom,
-                            tile_count=tile_count,
-                            total_size=total_size,
-                            available_zooms=available_zooms
-                        )
-                        
-                        print(f"  {layer_name} ({layer_type}): {tile_count} tiles, zoom {min_zoom}-{max_zoom}")
-                    else:
-                        # No tiles found for this layer
-                        print(f"  {layer_name} ({layer_type}): Hiç tile bulunamadı")
-                else:
-                    # Layer directory not found
-                    print(f"  {layer_name} ({layer_type}): Layer dizini bulunamadı")
+                self._update_layer_metadata(region_name, source.get_name(), source.get_tile_type())
             
             # Metadata update finished
             print("Metadata güncelleme tamamlandı!")
@@ -418,6 +1007,82 @@ class TileDownloadManager:
             import traceback
             traceback.print_exc()
 
+    def _update_layer_metadata(self, region_name: str, layer_name: str, layer_type: str) -> None:
+        """Rescan one layer (files or MBTiles) and store its zooms, tile count and size"""
+        print(f"  Layer taranıyor: {layer_name} ({layer_type})")
+        
+        # Scan layer directory - build correct path
+        layer_path = Path(self.config['output_dir']) / region_name / layer_type / layer_name
+        mbtiles_path = layer_path.parent / f"{layer_name}.mbtiles"
+        
+        if layer_path.exists() or mbtiles_path.exists():
+            # Layer bilgilerini hesapla
+            available_zooms = []
+            tile_count = 0
+            total_size = 0
+            # Encoding (vector) or image format (raster) of the layer: one sampled tile per zoom
+            encodings = []
+            samples = []
+            
+            # MBTiles output mode: read counts from the database instead of walking files
+            if mbtiles_path.exists():
+                stats = MBTilesUtils.get_mbtiles_tile_stats(str(mbtiles_path))
+                available_zooms = stats['available_zooms']
+                tile_count = stats['tile_count']
+                total_size = stats['total_size']
+                encodings.append(sample_mbtiles_encoding(str(mbtiles_path)) if layer_type == 'vector'
+                                 else sample_mbtiles_format(str(mbtiles_path)))
+            
+            # Zoom seviyelerini bul
+            for zoom_dir in (layer_path.iterdir() if layer_path.exists() else []):
+                if zoom_dir.is_dir() and zoom_dir.name.isdigit():
+                    zoom_level = int(zoom_dir.name)
+                    available_zooms.append(zoom_level)
+                    zoom_sampled = False
+                    
+                    # Count tiles
+                    for x_dir in zoom_dir.iterdir():
+                        if x_dir.is_dir() and x_dir.name.isdigit():
+                            for tile_file in x_dir.iterdir():
+                                if tile_file.is_file():
+                                    tile_count += 1
+                                    total_size += tile_file.stat().st_size
+                                    if not zoom_sampled:
+                                        samples.append(str(tile_file))
+                                        zoom_sampled = True
+            
+            if samples:
+                encodings.append(sample_file_encoding(samples) if layer_type == 'vector' else sample_file_format(samples))
+            encoding = combine_encodings(encoding for encoding in encodings if encoding)
+            
+            available_zooms = sorted(set(available_zooms))
+            if available_zooms:
+                min_zoom = min(available_zooms)
+                max_zoom = max(available_zooms)
+                
+                # Layer bilgilerini metadata'ya ekle
+                metadata_manager.add_layer_info(
+                    region_name=region_name,
+                    layer_name=layer_name,
+                    layer_type=layer_type,
+                    min_zoom=min_zoom,
+                    max_zoom=max_zoom,
+                    tile_count=tile_count,
+                    total_size=total_size,
+                    available_zooms=available_zooms,
+                    encoding=encoding if layer_type == 'vector' else None,
+                    format=encoding if layer_type != 'vector' else None
+                )
+                
+                encoding_note = f", {encoding}" if encoding else ""
+                print(f"  {layer_name} ({layer_type}): {tile_count} tiles, zoom {min_zoom}-{max_zoom}{encoding_note}")
+            else:
+                # No tiles found for this layer
+                print(f"  {layer_name} ({layer_type}): Hiç tile bulunamadı")
+        else:
+            # Layer directory not found
+            print(f"  {layer_name} ({layer_type}): Layer dizini bulunamadı")
+    
     # =========================
     # Interactive Download Wizard
     # =========================
@@ -560,6 +1225,7 @@ class TileDownloadManager:
         mode: Optional[str] = None  # 'region' | 'place' | 'bbox'
         selected_region: Optional[str] = None
         selected_place: Optional[str] = None
+        selected_polygon: Optional[dict] = None
         selected_bbox: Optional[List[float]] = None
         server_filter: Optional[List[str]] = None
         source_filter: Optional[List[str]] = None
@@ -638,6 +1304,7 @@ class TileDownloadManager:
                             continue
                     selected_place = raw
                     selected_bbox = bbox
+                    selected_polygon = self.geocoordinate_service.get_polygon_for_place(raw)
                     print(f"BBOX: {selected_bbox}")
                     # Default zoom levels
                     min_zoom_val, max_zoom_val = 10, 15
@@ -799,7 +1466,9 @@ class TileDownloadManager:
                 if mode == 'region' and selected_region:
                     ok = self.download_region(selected_region, min_zoom_val, max_zoom_val, server_filter, source_filter)
                 else:
-                    ok = self.download_bbox(selected_bbox, min_zoom_val, max_zoom_val, server_filter, source_filter, region_name=(selected_place or None))
+                    ok = self.download_bbox(selected_bbox, min_zoom_val, max_zoom_val, server_filter, source_filter,
+                                            region_name=(selected_place or None),
+                                            polygon=selected_polygon if mode == 'place' else None)
                 print("\nDone." if ok else "\nFailed.")
                 return
     
@@ -826,9 +1495,28 @@ class TileDownloadManager:
                 '6) List configured regions and sources:\n'
                 '   python src/tile_downloader.py --list-regions\n'
                 '   python src/tile_downloader.py --list-sources\n\n'
+                '7) Large seed on a single event loop (asyncio engine, requires aiohttp):\n'
+                '   python src/tile_downloader.py --region turkiye --servers "CartoDB_Light" --engine asyncio\n\n'
+                '8) Split a job over several machines/processes, then merge the shards:\n'
+                '   python src/tile_downloader.py --region turkiye --servers "CartoDB_Light" --shard-index 0 --shard-count 4\n'
+                '   python src/tile_downloader.py --merge-shards turkiye\n\n'
+                '9) Forecast tiles, disk usage and duration before starting a seed:\n'
+                '   python src/tile_downloader.py --region turkiye --servers "CartoDB_Light" --min-zoom 5 --max-zoom 14 --estimate\n\n'
+                '10) Seed only the deepest raster zoom, then build the lower zooms locally:\n'
+                '   python src/tile_downloader.py --region istanbul --servers "CartoDB_Light" --min-zoom 14 --max-zoom 14\n'
+                '   python src/tile_downloader.py --build-pyramid istanbul --servers "CartoDB_Light" --pyramid-min-zoom 8\n\n'
+                '11) Convert vector tiles downloaded by older versions to gzip (once, for all regions):\n'
+                '   python src/tile_downloader.py --gzip-vector-tiles all\n\n'
+                '12) Store raster tiles as WebP, after a download or for existing layers:\n'
+                '   python src/tile_downloader.py --region istanbul --servers "CartoDB_Light" --recompress webp --recompress-quality 80\n'
+                '   python src/tile_downloader.py --recompress-layers istanbul --recompress png\n\n'
+                '13) Clip a local MBTiles source into a region bundle (copied inside SQLite, no tile files):\n'
+                '   python src/tile_downloader.py --place istanbul --sources "Local_OSM_Turkey" --min-zoom 0 --max-zoom 14 --export-mbtiles bundles/istanbul.mbtiles\n\n'
+                '14) Combine local sources and downloaded layers into one MBTiles file:\n'
+                '   python src/tile_downloader.py --merge-mbtiles bundles/osm.mbtiles --merge-inputs "Local_OSM_Turkey,Local_OSM_Africa,istanbul/raster/CartoDB_Light" --conflict newest\n\n'
                 'Notes:\n'
                 '- For LOCAL MBTiles, your BBOX must fall within the source bounds (see --list-sources).\n'
-                '- Vector tiles are saved as .pbf, raster tiles as .png/.jpg.\n'
+                '- Vector tiles are saved as gzip-compressed .pbf, raster tiles as .png/.jpg.\n'
                 "- Output directory layout: map_tiles/<region>/<raster|vector>/<source_name>/<z>/<x>/<y>.<ext>"
             )
         )
@@ -844,9 +1532,158 @@ class TileDownloadManager:
         parser.add_argument('--max-zoom', type=int, default=12, help='Maximum zoom level (default: 12)')
         # polygon-mode/mask-raster removed; arguments no longer supported
         parser.add_argument('--interactive', action='store_true', help='Start interactive download wizard (step-by-step)')
+        parser.add_argument('--resume', metavar='JOB_ID', help='Resume an interrupted job; only tiles not yet done are downloaded (see --list-jobs)')
+        parser.add_argument('--retry-failed', action='store_true', help='Re-download only the failed tiles of --resume JOB_ID (default: latest job)')
+        parser.add_argument('--list-jobs', action='store_true', help='List recorded download jobs with their status and tile counts')
+        parser.add_argument('--engine', choices=['threads', 'asyncio'],
+                           help='Online download engine (default: config.json -> download_engine, else threads). asyncio requires aiohttp.')
+        parser.add_argument('--output-format', choices=['files', 'mbtiles'],
+                           help='Online tile output: z/x/y files or one MBTiles file per region and layer (default: config.json -> output_format, else files)')
+        parser.add_argument('--dedup', action='store_true',
+                           help='Store identical tiles once (hardlinked files, or an images/map MBTiles layout); default: config.json -> dedup')
+        parser.add_argument('--refresh', action='store_true',
+                           help='Revalidate existing tiles with If-None-Match/If-Modified-Since; unchanged tiles (304) are not rewritten')
+        parser.add_argument('--max-age', type=parse_age, metavar='AGE',
+                           help='With --refresh: only tiles last fetched longer ago than AGE (e.g. 3600, 12h, 7d), oldest first')
+        parser.add_argument('--refresh-budget-mb', type=float, metavar='MB',
+                           help='With --refresh: stop starting new tiles after about MB megabytes were received')
+        parser.add_argument('--refresh-budget-minutes', type=float, metavar='MIN',
+                           help='With --refresh: stop starting new tiles after MIN minutes')
+        parser.add_argument('--estimate', action='store_true',
+                           help='Dry run: print tiles per zoom, sampled tile sizes, download/disk size and ETA, then exit')
+        parser.add_argument('--estimate-samples', type=int, metavar='N',
+                           help='With --estimate: tiles sampled per zoom and source (default: config.json -> estimate_samples, else 5)')
+        parser.add_argument('--progress-interval', type=float, metavar='SECONDS',
+                           help='Print a progress line (rate, ETA, queue depths) every SECONDS; 0 disables (default: config.json -> progress_interval, else 10)')
+        parser.add_argument('--metrics-json', metavar='PATH',
+                           help='Write a JSON metrics snapshot (per-server requests, status codes, latency percentiles) to PATH at every progress tick')
+        parser.add_argument('--metrics-prom', metavar='PATH',
+                           help='Write the metrics in Prometheus text format to PATH (e.g. for the node_exporter textfile collector)')
+        parser.add_argument('--shard-index', type=int, metavar='I',
+                           help='With --shard-count: download only shard I (0-based) of the job into output_dir/shards/shard-I-of-N')
+        parser.add_argument('--shard-count', type=int, metavar='N',
+                           help='Number of shards the job is split into (deterministic, by quadkey of a partition zoom)')
+        parser.add_argument('--merge-shards', metavar='REGION',
+                           help='Check that all shards of REGION finished without gaps and merge them into output_dir/REGION')
+        parser.add_argument('--build-pyramid', metavar='REGION',
+                           help='Build the lower zooms of REGION\'s raster file layers (or --servers) from their deepest zoom on disk')
+        parser.add_argument('--pyramid-min-zoom', type=int, default=0, metavar='Z',
+                           help='Lowest zoom built by --build-pyramid (default: 0)')
+        parser.add_argument('--pyramid-workers', type=int, metavar='N',
+                           help='Processes rendering parent tiles for --build-pyramid (default: CPU count)')
+        parser.add_argument('--complete-only', action='store_true',
+                           help='With --build-pyramid: only build parents whose four children all exist')
+        parser.add_argument('--gzip-vector-tiles', metavar='REGION',
+                           help='Rewrite the existing vector tiles of REGION ("all" for every region) gzip-compressed, '
+                                'so the viewer serves them without recompressing')
+        parser.add_argument('--gzip-workers', type=int, metavar='N',
+                           help='Threads compressing tiles for --gzip-vector-tiles (default: CPU count)')
+        parser.add_argument('--recompress', choices=['png', 'webp', 'jpeg'],
+                           help='Re-encode downloaded raster tiles after the download: lossless PNG optimisation, '
+                                'or WebP/JPEG at --recompress-quality (default: config.json -> recompress)')
+        parser.add_argument('--recompress-quality', type=int, metavar='Q',
+                           help='WebP/JPEG quality for --recompress (1-100, default: 80)')
+        parser.add_argument('--recompress-workers', type=int, metavar='N',
+                           help='Processes re-encoding tiles (default: CPU count)')
+        parser.add_argument('--export-mbtiles', metavar='PATH',
+                           help='Write the --region/--bbox/--place area and zoom range of one local MBTiles source '
+                                '(--sources) to a new MBTiles file at PATH, copied inside SQLite')
+        parser.add_argument('--overwrite', action='store_true',
+                           help='With --export-mbtiles or --merge-mbtiles: replace PATH if it exists')
+        parser.add_argument('--merge-mbtiles', metavar='PATH',
+                           help='Merge --merge-inputs into one deduplicated MBTiles file at PATH')
+        parser.add_argument('--merge-inputs', metavar='INPUTS',
+                           help='Comma-separated local source names, .mbtiles files or tile directories '
+                                '(paths may be relative to output_dir, e.g. istanbul/raster/CartoDB_Light)')
+        parser.add_argument('--conflict', choices=list(CONFLICT_POLICIES), default='first',
+                           help='Tile kept when --merge-inputs overlap: from the first input listed, the newest, '
+                                'or the largest (default: first)')
+        parser.add_argument('--merge-workers', type=int, metavar='N',
+                           help='Threads scanning inputs for --merge-mbtiles (default: CPU count)')
+        parser.add_argument('--recompress-layers', metavar='REGION',
+                           help='Re-encode the existing raster file layers of REGION (or --servers) with --recompress (default: png)')
         
         args = parser.parse_args()
         
+        if args.engine or args.output_format or args.dedup:
+            self.download_service = self._create_download_service(args.engine, args.output_format,
+                                                                  True if args.dedup else None)
+        
+        if args.refresh:
+            self.refresh_options = {
+                'max_age': args.max_age,
+                'budget_bytes': int(args.refresh_budget_mb * 1024 * 1024) if args.refresh_budget_mb else None,
+                'budget_seconds': args.refresh_budget_minutes * 60 if args.refresh_budget_minutes else None
+            }
+        elif args.max_age is not None or args.refresh_budget_mb or args.refresh_budget_minutes:
+            print("--max-age and --refresh-budget-* require --refresh")
+            return
+        
+        self.estimate_only = args.estimate
+        if args.estimate_samples is not None:
+            self.config['estimate_samples'] = args.estimate_samples
+        
+        if args.progress_interval is not None:
+            self.config['progress_interval'] = args.progress_interval
+        if args.metrics_json:
+            self.config['metrics_json'] = args.metrics_json
+        if args.metrics_prom:
+            self.config['metrics_prometheus'] = args.metrics_prom
+        
+        if (args.shard_index is None) != (args.shard_count is None):
+            print("--shard-index and --shard-count must be used together")
+            return
+        
+        if args.merge_shards:
+            success = self.merge_shards(args.merge_shards)
+            print("\nShards merged successfully!" if success else "\nShard merge failed!")
+            return
+        
+        if args.build_pyramid:
+            server_filter = [s.strip() for s in args.servers.split(',')] if args.servers else None
+            success = self.build_pyramid(args.build_pyramid, server_filter, args.pyramid_min_zoom,
+                                         args.pyramid_workers, args.complete_only)
+            print("\nPyramid built successfully!" if success else "\nPyramid build failed or incomplete!")
+            return
+        
+        if args.recompress or args.recompress_quality is not None or args.recompress_workers:
+            options = dict(self.config.get('recompress') or {})
+            if args.recompress:
+                options['format'] = args.recompress
+            if args.recompress_quality is not None:
+                options['quality'] = args.recompress_quality
+            if args.recompress_workers:
+                options['workers'] = args.recompress_workers
+            self.config['recompress'] = options
+        
+        if args.recompress_layers:
+            server_filter = [s.strip() for s in args.servers.split(',')] if args.servers else None
+            success = self.recompress_raster_tiles(args.recompress_layers, server_filter)
+            print("\nRaster tiles recompressed successfully!" if success else "\nRaster recompression failed or incomplete!")
+            return
+        
+        if args.gzip_vector_tiles:
+            region = None if args.gzip_vector_tiles == 'all' else args.gzip_vector_tiles
+            success = self.gzip_vector_tiles(region, args.gzip_workers)
+            print("\nVector tiles converted successfully!" if success else "\nVector tile conversion failed or incomplete!")
+            return
+        
+        if args.merge_mbtiles:
+            if not args.merge_inputs:
+                print("--merge-mbtiles needs --merge-inputs")
+                return
+            inputs = [item.strip() for item in args.merge_inputs.split(',') if item.strip()]
+            success = self.merge_mbtiles(inputs, args.merge_mbtiles, args.conflict, args.merge_workers, args.overwrite)
+            print("\nMBTiles merged successfully!" if success else "\nMBTiles merge failed!")
+            return
+        
+        if args.shard_count is not None:
+            try:
+                self.set_shard(args.shard_index, args.shard_count)
+            except ConfigurationError as e:
+                print(e)
+                return
+        
         # List regions if requested
         if args.list_regions:
             self.list_regions()
@@ -857,6 +1694,16 @@ class TileDownloadManager:
             self.list_sources()
             return
         
+        if args.list_jobs:
+            self.list_jobs()
+            return
+        
+        # Resume a journaled job
+        if args.resume or args.retry_failed:
+            success = self.resume_job(args.resume, retry_failed=args.retry_failed)
+            print("\nDownload completed successfully!" if success else "\nDownload failed!")
+            return
+        
         # Parse server and source filters
         server_filter = None
         source_filter = None
@@ -883,7 +1730,29 @@ class TileDownloadManager:
             print("Auto place lookup: --place 'name'  or interactive: --interactive")
             return
         
-        # Handle --place parameter (polygon mode removed)
+        if args.export_mbtiles:
+            if not source_filter or len(source_filter) != 1:
+                print("--export-mbtiles needs exactly one local source in --sources")
+                return
+            bbox, polygon = args.bbox, None
+            if args.place:
+                bbox = self.geocoordinate_service.get_bbox_from_place(args.place)
+                if bbox is None:
+                    print(f"Could not find coordinates for place: {args.place}")
+                    return
+                polygon = self.geocoordinate_service.get_polygon_for_place(args.place)
+            elif args.region:
+                try:
+                    bbox = self.config_service.get_region(self.config, args.region).bbox
+                except ConfigurationError as e:
+                    print(e)
+                    return
+            success = self.export_local_subset(source_filter[0], args.export_mbtiles, bbox,
+                                               args.min_zoom, args.max_zoom, polygon, args.overwrite)
+            print("\nSubset exported successfully!" if success else "\nSubset export failed!")
+            return
+        
+        # Handle --place parameter: tiles follow the place's outline, inside its bbox
         if args.place:
             if args.region or args.bbox:
                 print("Error: --place cannot be used with --region or --bbox")
@@ -903,8 +1772,13 @@ class TileDownloadManager:
                         print(f"  - {suggestion['name']} ({suggestion['type']})")
                 return
             
+            polygon = self.geocoordinate_service.get_polygon_for_place(args.place)
+            if polygon is None:
+                print("No outline found for this place; downloading its whole bounding box")
+            
             # Use the found bbox for download with place name as region name
-            success = self.download_bbox(bbox, args.min_zoom, args.max_zoom, server_filter, source_filter, region_name=args.place)
+            success = self.download_bbox(bbox, args.min_zoom, args.max_zoom, server_filter, source_filter,
+                                         region_name=args.place, polygon=polygon)
         else:
             # Download based on region or bbox
             success = False
@@ -913,6 +1787,10 @@ class TileDownloadManager:
             elif args.bbox:
                 success = self.download_bbox(args.bbox, args.min_zoom, args.max_zoom, server_filter, source_filter)
         
+        if self.estimate_only:
+            print("\nThe job fits on the output volume." if success else "\nEstimate failed or the job does not fit!")
+            return
+        
         if success:
             print("\nDownload completed successfully!")
         else:
@@ -1,3 +1,6 @@
+from typing import Optional
+
+
 class TileDownloaderException(Exception):
     """Base exception for tile downloader"""
     pass
@@ -13,6 +16,16 @@ class DownloadError(TileDownloaderException):
     pass
 
 
+class TileRequestError(DownloadError):
+    """A tile request answered with an HTTP error status"""
+
+    def __init__(self, message: str, status: int, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        # Seconds from the server's Retry-After header, if it sent one
+        self.retry_after = retry_after
+
+
 class ServerError(TileDownloaderException):
     """Server related errors"""
     pass
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List, Tuple, Optional, Union
+from typing import Dict, Any, List, Tuple, Optional, Union, Iterator, Iterable
 import os
 
 
@@ -26,6 +26,15 @@ class ITileSource(ABC):
         """Get tile data for given coordinates"""
         pass
     
+    def get_tiles(self, coords: Iterable[Tuple[int, int, int]]) -> Dict[Tuple[int, int, int], bytes]:
+        """Tile data of many (zoom, x, y) coordinates; missing tiles are left out"""
+        tiles = {}
+        for coord in coords:
+            data = self.get_tile(*coord)
+            if data:
+                tiles[coord] = data
+        return tiles
+    
     @abstractmethod
     def validate_bounds(self, bbox: List[float]) -> bool:
         """Validate if bbox is within source bounds"""
@@ -55,6 +64,12 @@ class ITileExtractor(ABC):
         """Extract tiles for given bbox and zoom level"""
         pass
     
+    def iter_tiles(self, bbox: List[float], zoom: int, batch_size: int = 500) -> Iterator[List[Tuple[int, int, bytes]]]:
+        """Yield the tiles of a bbox and zoom level in batches (default: one batch from extract_tiles)"""
+        tiles = self.extract_tiles(bbox, zoom)
+        if tiles:
+            yield tiles
+    
     @abstractmethod
     def get_tile_count(self, bbox: List[float], zoom: int) -> int:
         """Get tile count for given bbox and zoom level"""
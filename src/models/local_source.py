@@ -14,6 +14,9 @@ class LocalSource:
     min_zoom: int
     max_zoom: int
     description: str = ""
+    # SQLite read tuning per connection: memory-mapped bytes and page cache (MB)
+    mmap_mb: int = 256
+    cache_mb: int = 64
     
     def get_name(self) -> str:
         """Get source name"""
@@ -1,18 +1,90 @@
-from dataclasses import dataclass
-from typing import Dict, Optional
+import itertools
+import zlib
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Union
+
+
+DEFAULT_SUBDOMAINS = ['a', 'b', 'c']
+
+
+def tile_quadkey(zoom: int, x: int, y: int) -> str:
+    """Bing-style quadkey of an XYZ tile"""
+    digits = []
+    for i in range(zoom, 0, -1):
+        mask = 1 << (i - 1)
+        digits.append(str((1 if x & mask else 0) + (2 if y & mask else 0)))
+    return ''.join(digits)
 
 
 @dataclass
 class TileServer:
-    """Data model for tile server configuration"""
+    """Data model for tile server configuration.
+
+    Besides `url`, a server may list `mirrors` (alternative URL templates) and use
+    an `{s}` placeholder expanded with `subdomains`. Requests are spread over the
+    resulting templates by quadkey hash (stable per tile, cache friendly) or
+    round-robin. `hedge_after` (seconds, or a percentile such as "p95" of observed
+    latency) lets the downloader send a duplicate request to the next mirror when
+    the first one is slow. `retry` overrides the download's retry policy for
+    this server.
+    """
     name: str
     url: str
     headers: Dict[str, str]
     tile_type: str  # 'raster' or 'vector'
+    mirrors: List[str] = field(default_factory=list)
+    subdomains: List[str] = field(default_factory=list)
+    mirror_strategy: str = 'quadkey'  # 'quadkey' or 'round_robin'
+    hedge_after: Optional[Union[float, str]] = None
+    # Per-server overrides of the retry policy (attempts, base_delay, max_delay, jitter, ...)
+    retry: Dict[str, Any] = field(default_factory=dict)
+    
+    def __post_init__(self):
+        if self.mirror_strategy not in ('quadkey', 'round_robin'):
+            raise ValueError(f"{self.name}: mirror_strategy must be 'quadkey' or 'round_robin'")
+        if isinstance(self.hedge_after, str) and self.get_hedge_percentile() is None:
+            raise ValueError(f"{self.name}: hedge_after must be seconds or a percentile like 'p95'")
+        templates = []
+        for template in [self.url] + list(self.mirrors):
+            if '{s}' in template:
+                templates.extend(template.replace('{s}', s) for s in (self.subdomains or DEFAULT_SUBDOMAINS))
+            else:
+                templates.append(template)
+        self._templates = templates
+        self._round_robin = itertools.count()
+    
+    def get_url_templates(self) -> List[str]:
+        """All concrete URL templates (mirrors and expanded subdomains)"""
+        return list(self._templates)
+    
+    def _template_index(self, zoom: int, x: int, y: int) -> int:
+        if len(self._templates) == 1:
+            return 0
+        if self.mirror_strategy == 'round_robin':
+            return next(self._round_robin) % len(self._templates)
+        return zlib.crc32(f"{zoom}/{tile_quadkey(zoom, x, y)}".encode()) % len(self._templates)
     
     def get_tile_url(self, zoom: int, x: int, y: int) -> str:
         """Generate tile URL for given coordinates"""
-        return self.url.format(z=zoom, x=x, y=y)
+        return self._templates[self._template_index(zoom, x, y)].format(z=zoom, x=x, y=y)
+    
+    def get_tile_urls(self, zoom: int, x: int, y: int) -> List[str]:
+        """Tile URL on every mirror, starting with the one get_tile_url would pick"""
+        start = self._template_index(zoom, x, y)
+        ordered = self._templates[start:] + self._templates[:start]
+        return [template.format(z=zoom, x=x, y=y) for template in ordered]
+    
+    def get_hedge_percentile(self) -> Optional[float]:
+        """Latency percentile of a hedge_after like 'p95', else None"""
+        value = self.hedge_after
+        if isinstance(value, str) and value.lower().startswith('p'):
+            try:
+                percentile = float(value[1:])
+            except ValueError:
+                return None
+            if 0 < percentile < 100:
+                return percentile
+        return None
     
     def get_headers(self) -> Dict[str, str]:
         """Get request headers"""
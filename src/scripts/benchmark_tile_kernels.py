@@ -0,0 +1,90 @@
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+# Ensure 'src' directory is on sys.path when running this script directly
+_current_file = Path(__file__).resolve()
+_src_dir = _current_file.parents[1]
+if str(_src_dir) not in [str(p) for p in sys.path]:
+    sys.path.insert(0, str(_src_dir))
+
+import numpy as np
+from shapely.geometry import Point, box, mapping, shape
+from shapely.prepared import prep
+
+from models.tile_server import tile_quadkey
+from utils.tile_calculator import TileCalculator
+from utils.tile_sharding import TileSharding
+
+
+def best_of(func: Callable[[], object], repeat: int) -> float:
+    """Fastest of `repeat` runs in seconds"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def polygon_cover_per_tile(polygon: dict, min_zoom: int, max_zoom: int) -> List[Tuple[int, int, int]]:
+    """The former cover: one shapely box and intersects test per bbox tile"""
+    geometry = shape(polygon)
+    prepared = prep(geometry)
+    tiles = []
+    for z, x, y in TileCalculator.iter_tiles_for_bbox(list(geometry.bounds), min_zoom, max_zoom):
+        if prepared.intersects(box(*TileCalculator.tile_bounds(z, x, y))):
+            tiles.append((z, x, y))
+    return tiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the scalar and NumPy tile coordinate kernels')
+    parser.add_argument('--count', type=int, default=100000, help='Coordinates per kernel (default: 100000)')
+    parser.add_argument('--zoom', type=int, default=14, help='Zoom level of the converted tiles (default: 14)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement; the fastest is shown (default: 3)')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    lats = [rng.uniform(-85.0, 85.0) for _ in range(args.count)]
+    lons = [rng.uniform(-180.0, 179.999) for _ in range(args.count)]
+    zoom = args.zoom
+    xs, ys = TileCalculator.deg2num_array(lats, lons, zoom)
+    tiles = list(zip(xs.tolist(), ys.tolist()))
+    lat_array, lon_array = np.array(lats), np.array(lons)
+
+    circle = mapping(Point(32.8, 39.9).buffer(1.5, quad_segs=64))
+    cover_zoom = min(zoom, 12)
+
+    cases = [
+        ('lat/lon -> tile',
+         lambda: [TileCalculator.deg2num(lat, lon, zoom) for lat, lon in zip(lats, lons)],
+         lambda: TileCalculator.deg2num_array(lat_array, lon_array, zoom)),
+        ('tile -> bounds',
+         lambda: [TileCalculator.tile_bounds(zoom, x, y) for x, y in tiles],
+         lambda: TileCalculator.tile_bounds_array(zoom, xs, ys)),
+        ('quadkey encode',
+         lambda: [tile_quadkey(zoom, x, y) for x, y in tiles],
+         lambda: TileCalculator.quadkeys_array(zoom, xs, ys)),
+        ('shard of tile',
+         lambda: [TileSharding.shard_of((zoom, x, y), zoom, 8) for x, y in tiles],
+         lambda: TileSharding.shard_of_array(zoom, xs, ys, zoom, 8)),
+        (f'polygon cover z{cover_zoom}',
+         lambda: polygon_cover_per_tile(circle, cover_zoom, cover_zoom),
+         lambda: sum(1 for _ in TileCalculator.iter_tiles_for_polygon(circle, cover_zoom, cover_zoom))),
+    ]
+
+    print(f"{args.count} coordinates at zoom {zoom}, best of {args.repeat} runs")
+    print(f"{'Kernel':<22} {'Scalar':>10} {'NumPy':>10} {'Speed-up':>9}")
+    for name, scalar, vectorised in cases:
+        scalar_seconds = best_of(scalar, args.repeat)
+        vector_seconds = best_of(vectorised, args.repeat)
+        print(f"{name:<22} {scalar_seconds * 1000:>8.1f}ms {vector_seconds * 1000:>8.1f}ms "
+              f"{scalar_seconds / vector_seconds:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,572 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Tuple, Optional, Iterable, Callable
+
+try:
+    import aiohttp
+except ImportError:
+    # Optional dependency: only required when the asyncio engine is selected
+    aiohttp = None
+
+from interfaces.tile_server import ITileDownloader
+from models.tile_server import TileServer
+from services.mbtiles_writer import MBTilesWriter
+from services.tile_store import ContentAddressedTileStore, merge_dedup_stats
+from services.tile_validators import TileValidatorIndex, layer_key, is_stale, conditional_headers
+from services.hedging import HedgeTracker
+from services.circuit_breaker import ServerHealthRegistry
+from services.rate_limiter import parse_retry_after
+from services.retry_policy import RetryPolicyRegistry
+from services.download_metrics import DownloadMetrics
+from utils.file_utils import FileUtils
+from utils.tile_existence import TileExistenceIndex
+from utils.tile_encoding import to_gzip
+from exceptions.tile_downloader_exceptions import DownloadError, ServerError, TileRequestError
+
+
+# Failed tiles are counted; only this many error messages are kept in batch results
+MAX_ERROR_SAMPLES = 100
+
+
+class AsyncTileDownloadService(ITileDownloader):
+    """asyncio-based tile downloader.
+
+    Keeps many requests in flight on a single event loop. Each server is capped by
+    its own semaphore, file I/O is offloaded to a small thread pool, and the
+    vector-then-raster fallback matches TileDownloadService.
+    """
+
+    def __init__(self, max_workers: int = 15, retry_attempts: int = 3, timeout: int = 30,
+                 concurrency: int = 1024, per_server_limit: int = 256, write_workers: int = 4,
+                 drain_timeout: float = 10.0, output_format: str = 'files', dedup: bool = False,
+                 circuit_breaker: Optional[Dict[str, Any]] = None, health_ordering: bool = False,
+                 retry: Optional[Dict[str, Any]] = None):
+        self.max_workers = max_workers
+        self.retry_attempts = retry_attempts
+        self.timeout = timeout
+        self.concurrency = max(1, concurrency)
+        self.per_server_limit = max(1, per_server_limit)
+        self.write_workers = max(1, write_workers)
+        self.drain_timeout = drain_timeout
+        # 'files' writes z/x/y files, 'mbtiles' writes one MBTiles file per region and layer
+        self.output_format = output_format
+        # Store each distinct payload once (hardlinked files, or images/map MBTiles)
+        self.dedup = dedup
+        # threading.Event so cancel() is safe from signal handlers and other threads
+        self._cancel_event = threading.Event()
+        # Payload bytes received since the service was created (read by refresh budgets)
+        self.bytes_received = 0
+        # Latency history per server for hedged requests across mirrors
+        self.hedge_tracker = HedgeTracker()
+        # Per-server circuit breakers; failing servers are skipped instead of retried per tile
+        self.server_health = ServerHealthRegistry(circuit_breaker, health_ordering)
+        # Backoff per server; a coroutine waiting for its retry holds no thread
+        self.retry_policies = RetryPolicyRegistry(retry, retry_attempts)
+        # Live request/tile counters read by the progress reporter
+        self.metrics = DownloadMetrics()
+
+    @staticmethod
+    def _require_aiohttp() -> None:
+        if aiohttp is None:
+            raise DownloadError("The asyncio download engine requires aiohttp (pip install aiohttp)")
+
+    def _create_session(self) -> 'aiohttp.ClientSession':
+        """Create the shared client session for one batch"""
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=0, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    def get_pool_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Connection reuse is managed by the aiohttp connector; no per-host stats are tracked"""
+        return {}
+
+    def get_hedge_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-server hedged request statistics"""
+        return self.hedge_tracker.get_stats()
+
+    def get_health_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-server circuit breaker state and health"""
+        return self.server_health.get_stats()
+
+    def close(self) -> None:
+        """Sessions and executors are scoped to each batch; nothing to release"""
+        pass
+
+    def cancel(self) -> None:
+        """Stop the running batch: no new tiles are started, in-flight tiles drain"""
+        self._cancel_event.set()
+
+    def is_cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def download_tile(self, zoom: int, x: int, y: int, output_path: str,
+                     server: TileServer) -> bool:
+        """Download a single tile (runs a short-lived event loop)"""
+        self._require_aiohttp()
+
+        # Skip only if file exists and is non-empty
+        if FileUtils.file_exists(output_path) and FileUtils.get_file_size(output_path) > 0:
+            return True
+
+        async def run() -> bool:
+            async with self._create_session() as session:
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    content = await self._fetch_with_retries(session, asyncio.Semaphore(1), server, zoom, x, y)
+                    # output_path is not part of a layer index: write it as given
+                    await self._run_io(executor, self._write_single_tile, output_path, content, zoom, x, y, server)
+                    return True
+
+        return asyncio.run(run())
+
+    def download_tiles_batch(self, tiles: Iterable[Tuple[int, int, int]],
+                           output_dir: str, region_name: str,
+                           servers: List[TileServer],
+                           tile_postprocess=None,
+                           tile_callback: Optional[Callable[[Tuple[int, int, int], bool, Optional[str]], None]] = None,
+                           validators: Optional[TileValidatorIndex] = None,
+                           refresh: bool = False,
+                           max_age: Optional[float] = None) -> Dict[str, Any]:
+        """Download multiple tiles using multiple servers on one event loop.
+        tile_postprocess: optional callable (bytes, z, x, y, server)->bytes for per-tile post-processing.
+        tile_callback: optional callable (tile, ok, error) invoked for every finished (not cancelled) tile.
+        validators/refresh/max_age: conditional revalidation of existing tiles, as in TileDownloadService.
+        """
+        self._require_aiohttp()
+        self._cancel_event.clear()
+        return asyncio.run(self._download_tiles_batch_async(
+            tiles, output_dir, region_name, servers, tile_postprocess, tile_callback,
+            validators, refresh, max_age
+        ))
+
+    async def _download_tiles_batch_async(self, tiles: Iterable[Tuple[int, int, int]],
+                                          output_dir: str, region_name: str,
+                                          servers: List[TileServer],
+                                          tile_postprocess=None,
+                                          tile_callback=None,
+                                          validators: Optional[TileValidatorIndex] = None,
+                                          refresh: bool = False,
+                                          max_age: Optional[float] = None) -> Dict[str, Any]:
+        results = {
+            'total': 0,
+            'downloaded': 0,
+            'failed': 0,
+            'cancelled': 0,
+            'not_modified': 0,
+            'skipped': 0,
+            'errors': []
+        }
+
+        # Separate vector and raster servers
+        vector_servers = [s for s in servers if s.get_tile_type() == 'vector']
+        raster_servers = [s for s in servers if s.get_tile_type() != 'vector']
+        semaphores = {s.get_name(): asyncio.Semaphore(self.per_server_limit) for s in servers}
+        stores: Dict[Tuple[str, str], MBTilesWriter] = {}
+        # MBTiles output: the writer each queued tile went to, so it is journaled once committed
+        queued_in: Dict[Tuple[int, int, int], MBTilesWriter] = {}
+
+        def report_written(store: MBTilesWriter, tile: Tuple[int, int, int]) -> None:
+            error = store.pop_error(tile)
+            tile_callback(tile, error is None, error)
+
+        def get_store(tile_type: str, server: TileServer) -> MBTilesWriter:
+            key = (tile_type, server.get_name())
+            if key not in stores:
+                store_path = FileUtils.get_mbtiles_path(output_dir, region_name, tile_type, server.get_name())
+                stores[key] = MBTilesWriter(store_path, name=server.get_name(), tile_type=tile_type,
+                                            dedup=self.dedup)
+            return stores[key]
+
+        # File output with dedup: payloads kept once under <output_dir>/.tile_store
+        tile_store = None
+        if self.dedup and self.output_format != 'mbtiles':
+            tile_store = ContentAddressedTileStore(os.path.join(output_dir, '.tile_store'))
+        # File output: existing tiles per layer, read with one directory scan per zoom level
+        existence: Dict[Tuple[str, str], TileExistenceIndex] = {}
+
+        def get_existence(tile_type: str, server: TileServer) -> TileExistenceIndex:
+            key = (tile_type, server.get_name())
+            if key not in existence:
+                layer_dir = os.path.join(output_dir, region_name, tile_type, server.get_name())
+                existence[key] = TileExistenceIndex(layer_dir, 'pbf' if tile_type == 'vector' else 'png')
+            return existence[key]
+
+        async def already_present(executor, tile: Tuple[int, int, int]) -> bool:
+            """Pre-flight check: the first server in line already has the tile on disk"""
+            if refresh or self.output_format == 'mbtiles' or not servers:
+                return False
+            tile_type, candidates = ('vector', vector_servers) if vector_servers else ('raster', raster_servers)
+            index = get_existence(tile_type, self.server_health.order(candidates)[0])
+            if not index.is_scanned(tile[0]):
+                # The directory scan is blocking: run it on the I/O executor, once per zoom
+                await self._run_io(executor, index.scan_zoom, tile[0])
+            return index.contains(*tile)
+
+        def revalidator(session, executor, tile_type: str, server: TileServer):
+            """Fetch callback (exists)->content|None recording validators, or None without an index"""
+            if validators is None:
+                return None
+            layer = layer_key(region_name, tile_type, server.get_name())
+
+            async def fetch(zoom: int, x: int, y: int, exists: bool) -> Optional[bytes]:
+                entry = None
+                if exists:
+                    entry = await self._run_io(executor, validators.get, layer, zoom, x, y)
+                    if not is_stale(entry, refresh, max_age):
+                        return None
+                content, received = await self._fetch_validated(
+                    session, semaphores[server.get_name()], server, zoom, x, y, entry
+                )
+                await self._run_io(executor, validators.record, layer, zoom, x, y,
+                                   received['etag'], received['last_modified'])
+                if content is None:
+                    results['not_modified'] += 1
+                return content
+
+            return fetch
+
+        # Bounded queue keeps memory flat; workers pull tiles as they free up
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        self.metrics.set_gauge('queue_depth', queue.qsize)
+
+        async def download_single_tile(session, executor, tile_info: Tuple[int, int, int]) -> bool:
+            zoom, x, y = tile_info
+
+            # Try vector servers first
+            for server in self.server_health.order(vector_servers):
+                try:
+                    if self.output_format == 'mbtiles':
+                        if await self._download_to_store(session, executor, semaphores[server.get_name()],
+                                                         get_store('vector', server), server, zoom, x, y, None,
+                                                         revalidator(session, executor, 'vector', server),
+                                                         queued_in):
+                            return True
+                        continue
+                    if await self._download_to_path(session, executor, semaphores[server.get_name()],
+                                                    server, zoom, x, y, get_existence('vector', server),
+                                                    None, tile_store,
+                                                    revalidator(session, executor, 'vector', server)):
+                        return True
+                except Exception:
+                    self.metrics.record_fallback(server.get_name())
+                    continue
+
+            # Try raster servers as fallback
+            for server in self.server_health.order(raster_servers):
+                try:
+                    if self.output_format == 'mbtiles':
+                        if await self._download_to_store(session, executor, semaphores[server.get_name()],
+                                                         get_store('raster', server), server, zoom, x, y,
+                                                         tile_postprocess,
+                                                         revalidator(session, executor, 'raster', server),
+                                                         queued_in):
+                            return True
+                        continue
+                    if await self._download_to_path(session, executor, semaphores[server.get_name()],
+                                                    server, zoom, x, y, get_existence('raster', server),
+                                                    tile_postprocess, tile_store,
+                                                    revalidator(session, executor, 'raster', server)):
+                        return True
+                except Exception:
+                    self.metrics.record_fallback(server.get_name())
+                    continue
+
+            return False
+
+        async def report(tile: Tuple[int, int, int], ok: bool, error: Optional[str]) -> None:
+            # The callback may block (journal writes to SQLite): keep it off the event loop,
+            # on one thread so tiles are reported in order
+            await self._run_io(callback_executor, tile_callback, tile, ok, error)
+
+        async def worker(session, executor):
+            while True:
+                tile = await queue.get()
+                try:
+                    if tile is None:
+                        return
+                    if self.is_cancelled():
+                        results['cancelled'] += 1
+                        continue
+                    error = None
+                    try:
+                        ok = await download_single_tile(session, executor, tile)
+                        if not ok:
+                            error = f"Failed: {tile[0]}/{tile[1]}/{tile[2]}"
+                    except Exception as e:
+                        ok, error = False, str(e)
+                    self.metrics.record_tile('downloaded' if ok else 'failed')
+                    if ok:
+                        results['downloaded'] += 1
+                    else:
+                        results['failed'] += 1
+                        if len(results['errors']) < MAX_ERROR_SAMPLES:
+                            results['errors'].append(error)
+                    store = queued_in.pop(tile, None)
+                    if tile_callback is not None:
+                        if ok and store is not None:
+                            # Journal the tile only once its batch is committed
+                            store.call_after_writes(report_written, store, tile)
+                        else:
+                            await report(tile, ok, error)
+                finally:
+                    queue.task_done()
+
+        callback_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tile-callback')
+        with callback_executor, ThreadPoolExecutor(max_workers=self.write_workers) as executor:
+            async with self._create_session() as session:
+                workers = [asyncio.create_task(worker(session, executor)) for _ in range(self.concurrency)]
+                try:
+                    for tile in tiles:
+                        if self.is_cancelled():
+                            break
+                        results['total'] += 1
+                        if await already_present(executor, tile):
+                            # Present tiles never reach the worker queue
+                            results['downloaded'] += 1
+                            results['skipped'] += 1
+                            self.metrics.record_tile('skipped')
+                            if tile_callback is not None:
+                                await report(tile, True, None)
+                            continue
+                        await queue.put(tile)
+                    for _ in workers:
+                        await queue.put(None)
+
+                    # Wait for workers; once cancelled, in-flight tiles get drain_timeout to finish
+                    drain_deadline = None
+                    running = set(workers)
+                    while running:
+                        _, running = await asyncio.wait(running, timeout=0.5)
+                        if self.is_cancelled():
+                            drain_deadline = drain_deadline or time.monotonic() + self.drain_timeout
+                            if time.monotonic() >= drain_deadline:
+                                break
+                finally:
+                    for task in workers:
+                        task.cancel()
+                    # Flush queued tiles and write MBTiles metadata
+                    for store in stores.values():
+                        try:
+                            await self._run_io(executor, store.close)
+                        except DownloadError as e:
+                            print(e)
+                    if validators is not None:
+                        await self._run_io(executor, validators.flush)
+
+        write_errors = sum(store.write_errors for store in stores.values())
+        if write_errors:
+            # Tiles that were downloaded but could not be written count as failed
+            results['downloaded'] -= write_errors
+            results['failed'] += write_errors
+            if len(results['errors']) < MAX_ERROR_SAMPLES:
+                results['errors'].append(f"{write_errors} tiles could not be written")
+
+        if self.dedup:
+            parts = [tile_store.get_stats()] if tile_store is not None else [s.get_stats() for s in stores.values()]
+            results['dedup'] = merge_dedup_stats(parts)
+        return results
+
+    @staticmethod
+    async def _run_io(executor, func, *args):
+        """Run a blocking filesystem call on the I/O executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, func, *args)
+
+    @staticmethod
+    def _postprocess(content: bytes, zoom: int, x: int, y: int,
+                     server: TileServer, tile_postprocess=None) -> bytes:
+        if tile_postprocess is not None:
+            try:
+                content = tile_postprocess(content, zoom, x, y, server)
+            except Exception:
+                # If postprocess fails, keep original
+                pass
+        if not content:
+            raise DownloadError(f"Empty content received for tile {zoom}/{x}/{y} from {server.get_name()}")
+        # Vector tiles are stored gzip-compressed, so the viewer serves them without recompressing
+        return to_gzip(content) if server.get_tile_type() == 'vector' else content
+
+    @staticmethod
+    def _write_tile(path: str, content: bytes, zoom: int, x: int, y: int,
+                    server: TileServer, tile_postprocess=None,
+                    tile_store: Optional[ContentAddressedTileStore] = None) -> None:
+        content = AsyncTileDownloadService._postprocess(content, zoom, x, y, server, tile_postprocess)
+        # The tile's directory was created by TileExistenceIndex.tile_path()
+        if tile_store is not None:
+            tile_store.write_tile(path, content, make_dirs=False)
+            return
+        # Temp file + rename: a crash never leaves a truncated tile
+        FileUtils.write_file_atomic(path, content)
+
+    @staticmethod
+    def _write_single_tile(path: str, content: bytes, zoom: int, x: int, y: int, server: TileServer) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        AsyncTileDownloadService._write_tile(path, content, zoom, x, y, server)
+
+    @staticmethod
+    def _store_tile(store: MBTilesWriter, content: bytes, zoom: int, x: int, y: int,
+                    server: TileServer, tile_postprocess=None) -> None:
+        content = AsyncTileDownloadService._postprocess(content, zoom, x, y, server, tile_postprocess)
+        store.put(zoom, x, y, content)
+
+    async def _download_to_path(self, session, executor, semaphore: asyncio.Semaphore,
+                                server: TileServer, zoom: int, x: int, y: int,
+                                existence: TileExistenceIndex, tile_postprocess=None,
+                                tile_store: Optional[ContentAddressedTileStore] = None,
+                                revalidate=None) -> bool:
+        """Download one tile from one server with retries and write it via the executor.
+        existence: the layer's index of tiles on disk (also creates the tile's directory).
+        revalidate: optional coroutine (z, x, y, exists)->content|None replacing the plain fetch."""
+        output_path = await self._run_io(executor, existence.tile_path, zoom, x, y)
+        exists = existence.contains(zoom, x, y)
+        if revalidate is not None:
+            content = await revalidate(zoom, x, y, exists)
+        else:
+            # Skip only if file exists and is non-empty
+            content = None if exists else await self._fetch_with_retries(session, semaphore, server, zoom, x, y)
+        if content is None:
+            return True
+
+        await self._run_io(executor, self._write_tile, output_path, content,
+                           zoom, x, y, server, tile_postprocess, tile_store)
+        existence.add(zoom, x, y)
+        return True
+
+    async def _download_to_store(self, session, executor, semaphore: asyncio.Semaphore,
+                                 store: MBTilesWriter, server: TileServer, zoom: int, x: int, y: int,
+                                 tile_postprocess=None, revalidate=None,
+                                 queued_in: Optional[Dict[Tuple[int, int, int], MBTilesWriter]] = None) -> bool:
+        """Download one tile from one server with retries and queue it on the layer's MBTiles writer.
+        queued_in: optional map recording the writer each queued tile went to."""
+        exists = await self._run_io(executor, store.has_tile, zoom, x, y)
+        if revalidate is not None:
+            content = await revalidate(zoom, x, y, exists)
+        else:
+            content = None if exists else await self._fetch_with_retries(session, semaphore, server, zoom, x, y)
+        if content is None:
+            return True
+
+        # put() may block while the writer thread catches up, so keep it off the event loop
+        await self._run_io(executor, self._store_tile, store, content, zoom, x, y, server, tile_postprocess)
+        if queued_in is not None:
+            queued_in[(zoom, x, y)] = store
+        return True
+
+    async def _fetch_with_retries(self, session, semaphore: asyncio.Semaphore,
+                                  server: TileServer, zoom: int, x: int, y: int) -> bytes:
+        """Fetch non-empty tile content, retrying throttling and server errors"""
+        content, _ = await self._fetch_validated(session, semaphore, server, zoom, x, y)
+        return content
+
+    async def _fetch_validated(self, session, semaphore: asyncio.Semaphore,
+                               server: TileServer, zoom: int, x: int, y: int,
+                               validators: Optional[Dict[str, Any]] = None) -> Tuple[Optional[bytes], Dict[str, Any]]:
+        """Fetch a tile, conditionally when stored validators are given.
+        Returns (content, validators); content is None when the server answered 304."""
+        conditional = conditional_headers(validators)
+        request_headers = {**server.get_headers(), **conditional} if conditional else server.get_headers()
+
+        breaker = self.server_health.get_breaker(server.get_name())
+        policy = self.retry_policies.get(server)
+        failures = 0
+        while True:
+            if not breaker.allow_request():
+                # Fail fast while the server's circuit breaker is open
+                raise ServerError(f"Circuit open for {server.get_name()}; skipped")
+            try:
+                urls = server.get_tile_urls(zoom, x, y)
+                tile_url = urls[0]
+                delay = self.hedge_tracker.get_delay(server)
+                if delay is None:
+                    status, content, received = await self._request(session, semaphore, server, tile_url,
+                                                                    request_headers)
+                else:
+                    status, content, received = await self._hedged_request(session, semaphore, server,
+                                                                           urls[0], urls[1],
+                                                                           request_headers, delay)
+
+                if status == 304 and conditional:
+                    return None, received
+                if status >= 400:
+                    raise TileRequestError(f"HTTP {status} for {tile_url}", status=status,
+                                           retry_after=received['retry_after'])
+
+                # Reject empty content to avoid creating zero-byte tiles
+                if not content:
+                    raise DownloadError(f"Empty content received for tile {zoom}/{x}/{y} from {tile_url}")
+
+                return content, received
+            except Exception as e:
+                failures += 1
+                delay = policy.retry_delay(failures, e)
+                if delay is None or self.is_cancelled():
+                    raise DownloadError(f"Failed to download tile {zoom}/{x}/{y}: {e}")
+            self.metrics.record_retry(server.get_name())
+            await asyncio.sleep(delay)
+
+    async def _request(self, session, semaphore: asyncio.Semaphore, server: TileServer,
+                       tile_url: str, request_headers: Dict[str, str]) -> Tuple[int, bytes, Dict[str, Any]]:
+        """One GET; returns (status, content, validators)"""
+        breaker = self.server_health.get_breaker(server.get_name())
+        try:
+            async with semaphore:
+                started = time.monotonic()
+                try:
+                    async with session.get(tile_url, headers=request_headers) as response:
+                        status = response.status
+                        content = await response.read() if status < 400 else b''
+                        received = {'etag': response.headers.get('ETag'),
+                                    'last_modified': response.headers.get('Last-Modified'),
+                                    'retry_after': parse_retry_after(response.headers.get('Retry-After'))}
+                except Exception:
+                    breaker.record(None, time.monotonic() - started)
+                    self.metrics.record_request(server.get_name(), None, time.monotonic() - started)
+                    raise
+        except asyncio.CancelledError:
+            # Cancelled waiting for the semaphore or mid-request (e.g. a lost hedge): no outcome
+            breaker.release_probe()
+            raise
+        latency = time.monotonic() - started
+        breaker.record(status, latency)
+        self.metrics.record_request(server.get_name(), status, latency, len(content))
+        if status < 400:
+            self.hedge_tracker.record_latency(server.get_name(), latency)
+        self.bytes_received += len(content)
+        return status, content, received
+
+    async def _hedged_request(self, session, semaphore: asyncio.Semaphore, server: TileServer,
+                              primary_url: str, hedge_url: str, request_headers: Dict[str, str],
+                              delay: float) -> Tuple[int, bytes, Dict[str, Any]]:
+        """Send the request; if it is still pending after delay, race a copy on the next mirror"""
+        primary = asyncio.ensure_future(self._request(session, semaphore, server, primary_url, request_headers))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        hedge = asyncio.ensure_future(self._request(session, semaphore, server, hedge_url, request_headers))
+        pending = {primary, hedge}
+        fallback = None
+        last_error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        continue
+                    if task.result()[0] < 500:
+                        self.hedge_tracker.record_hedge(server.get_name(), won=task is hedge)
+                        return task.result()
+                    fallback = task.result()
+        finally:
+            # Unlike threads, the losing request can be cancelled outright
+            for task in pending:
+                task.cancel()
+        self.hedge_tracker.record_hedge(server.get_name(), won=False)
+        if fallback is not None:
+            return fallback
+        raise last_error
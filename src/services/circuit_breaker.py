@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional
+
+from models.tile_server import TileServer
+
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker over a rolling window of request outcomes.
+
+    The breaker opens when the failure rate of the last `window_size` requests
+    (5xx, 429, transport errors and, if configured, calls slower than
+    `slow_call_seconds`) reaches `error_threshold`. While open, requests are
+    refused without touching the network. After `open_seconds` one probe is let
+    through (half-open): success closes the breaker, failure opens it again for
+    twice as long (up to `max_open_seconds`).
+    """
+
+    def __init__(self, name: str, error_threshold: float = 0.5, window_size: int = 20,
+                 min_requests: int = 10, open_seconds: float = 30.0, max_open_seconds: float = 300.0,
+                 slow_call_seconds: Optional[float] = None):
+        self.name = name
+        self.error_threshold = error_threshold
+        self.min_requests = max(1, min_requests)
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max(open_seconds, max_open_seconds)
+        self.slow_call_seconds = slow_call_seconds
+
+        self.state = STATE_CLOSED
+        self._outcomes = deque(maxlen=max(self.min_requests, window_size))
+        self._latency_ewma: Optional[float] = None
+        self._open_until = 0.0
+        self._current_open_seconds = open_seconds
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+        # Counters
+        self.opened = 0
+        self.rejected = 0
+
+    def allow_request(self) -> bool:
+        """Whether a request may be sent now (half-open lets a single probe through)"""
+        with self._lock:
+            if self.state == STATE_OPEN:
+                if time.monotonic() < self._open_until:
+                    self.rejected += 1
+                    return False
+                self.state = STATE_HALF_OPEN
+            if self.state == STATE_HALF_OPEN:
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def release_probe(self) -> None:
+        """Give back the half-open probe slot of a request that ended without an outcome
+        (never sent, or cancelled on the way), so a later request can probe instead"""
+        with self._lock:
+            if self.state == STATE_HALF_OPEN:
+                self._probe_in_flight = False
+
+    def record(self, status: Optional[int], latency: float) -> None:
+        """Feed one request outcome (status None = transport error)"""
+        failed = status is None or status >= 500 or status == 429
+        if not failed and self.slow_call_seconds is not None and latency > self.slow_call_seconds:
+            failed = True
+        with self._lock:
+            if not failed:
+                self._latency_ewma = latency if self._latency_ewma is None else 0.8 * self._latency_ewma + 0.2 * latency
+            if self.state == STATE_HALF_OPEN:
+                self._probe_in_flight = False
+                if failed:
+                    self._current_open_seconds = min(self.max_open_seconds, self._current_open_seconds * 2)
+                    self._open_locked()
+                else:
+                    self.state = STATE_CLOSED
+                    self._current_open_seconds = self.open_seconds
+                    self._outcomes.clear()
+                return
+            self._outcomes.append(not failed)
+            if self.state == STATE_CLOSED and len(self._outcomes) >= self.min_requests \
+                    and self._error_rate() >= self.error_threshold:
+                self._open_locked()
+
+    def _open_locked(self) -> None:
+        self.state = STATE_OPEN
+        self.opened += 1
+        self._open_until = time.monotonic() + self._current_open_seconds
+
+    def _error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return 1.0 - sum(self._outcomes) / len(self._outcomes)
+
+    def health_score(self) -> float:
+        """Lower is healthier: smoothed latency inflated by the recent error rate.
+        Servers without samples score 0 so they get measured."""
+        with self._lock:
+            if self._latency_ewma is None:
+                return 0.0
+            return self._latency_ewma / max(0.05, 1.0 - self._error_rate())
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'state': self.state,
+                'error_rate': round(self._error_rate(), 3),
+                'latency_ewma': round(self._latency_ewma, 4) if self._latency_ewma is not None else None,
+                'opened': self.opened,
+                'rejected': self.rejected
+            }
+
+
+class ServerHealthRegistry:
+    """Circuit breaker per configured server, plus health-based fallback ordering"""
+
+    def __init__(self, settings: Optional[Dict[str, Any]] = None, health_ordering: bool = False):
+        self.settings = settings or {}
+        self.health_ordering = health_ordering
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get_breaker(self, server_name: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(server_name)
+            if breaker is None:
+                breaker = self._breakers[server_name] = CircuitBreaker(server_name, **self.settings)
+            return breaker
+
+    def order(self, servers: List[TileServer]) -> List[TileServer]:
+        """Servers to try for one tile: open breakers last, then (optionally) healthiest first.
+        The sort is stable, so config order breaks ties."""
+        def key(server: TileServer):
+            breaker = self.get_breaker(server.get_name())
+            is_open = breaker.state == STATE_OPEN
+            return (is_open, breaker.health_score() if self.health_ordering else 0.0)
+        return sorted(servers, key=key)
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {name: breaker.get_stats() for name, breaker in breakers.items()}
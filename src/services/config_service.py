@@ -4,6 +4,7 @@ from typing import Dict, Any, List, Optional
 from interfaces.tile_server import IConfigLoader
 from models.tile_server import TileServer, Region, DownloadConfig
 from models.local_source import LocalSource
+from services.retry_policy import RetryPolicy
 from exceptions.tile_downloader_exceptions import ConfigurationError, ValidationError
 
 
@@ -62,8 +63,15 @@ class ConfigService(IConfigLoader):
                         name=server_data['name'],
                         url=server_data['url'],
                         headers=server_data.get('headers', {}),
-                        tile_type=server_data.get('tile_type', 'raster')
+                        tile_type=server_data.get('tile_type', 'raster'),
+                        mirrors=server_data.get('mirrors', []),
+                        subdomains=server_data.get('subdomains', []),
+                        mirror_strategy=server_data.get('mirror_strategy', 'quadkey'),
+                        hedge_after=server_data.get('hedge_after'),
+                        retry=server_data.get('retry') or {}
                     )
+                    # Fail on unknown retry settings now rather than mid-download
+                    RetryPolicy.from_config({**(config.get('retry') or {}), **server.retry})
                     server_defs[server_data['name']] = server
                 elif server_type == 'local':
                     # Local source
@@ -75,7 +83,9 @@ class ConfigService(IConfigLoader):
                         bounds=server_data.get('bounds', []),
                         min_zoom=server_data.get('min_zoom', 0),
                         max_zoom=server_data.get('max_zoom', 22),
-                        description=server_data.get('description', '')
+                        description=server_data.get('description', ''),
+                        mmap_mb=server_data.get('mmap_mb', 256),
+                        cache_mb=server_data.get('cache_mb', 64)
                     )
                     local_sources[server_data['name']] = local_source
         
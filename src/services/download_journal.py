@@ -0,0 +1,224 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Any, List, Tuple, Optional, Iterable, Iterator, Set
+
+
+STATE_DONE = 'done'
+STATE_FAILED = 'failed'
+
+
+class DownloadJournal:
+    """Crash-safe SQLite journal of download jobs and per-tile state.
+
+    Tile outcomes are buffered and written in batched transactions (checkpoints).
+    Tiles of a job that have no row yet are pending. WAL mode keeps a crash from
+    corrupting the database; at worst the last unflushed checkpoint is replayed.
+    """
+
+    def __init__(self, db_path: str, checkpoint_size: int = 1000, checkpoint_interval: float = 5.0):
+        self.db_path = db_path
+        self.checkpoint_size = checkpoint_size
+        self.checkpoint_interval = checkpoint_interval
+        self._buffer: List[Tuple[str, int, int, int, str, Optional[str]]] = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+
+    def _create_schema(self) -> None:
+        with self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                       job_id TEXT PRIMARY KEY,
+                       params TEXT NOT NULL,
+                       status TEXT NOT NULL,
+                       created_at TEXT NOT NULL,
+                       updated_at TEXT NOT NULL
+                   )"""
+            )
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS tiles (
+                       job_id TEXT NOT NULL,
+                       zoom_level INTEGER NOT NULL,
+                       tile_column INTEGER NOT NULL,
+                       tile_row INTEGER NOT NULL,
+                       state TEXT NOT NULL,
+                       attempts INTEGER NOT NULL DEFAULT 1,
+                       last_error TEXT,
+                       PRIMARY KEY (job_id, zoom_level, tile_column, tile_row)
+                   ) WITHOUT ROWID"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS tiles_state ON tiles (job_id, state)"
+            )
+
+    # ---- jobs ----
+
+    def create_job(self, params: Dict[str, Any]) -> str:
+        """Record a new job with its parameters and return its id"""
+        job_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        now = datetime.now().isoformat()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, params, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, json.dumps(params, ensure_ascii=False), 'running', now, now)
+            )
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get job parameters and status"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id, params, status, created_at, updated_at FROM jobs WHERE job_id = ?",
+                (job_id,)
+            ).fetchone()
+        if not row:
+            return None
+        return {
+            'job_id': row[0],
+            'params': json.loads(row[1]),
+            'status': row[2],
+            'created_at': row[3],
+            'updated_at': row[4]
+        }
+
+    def get_latest_job_id(self) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id FROM jobs ORDER BY created_at DESC LIMIT 1"
+            ).fetchone()
+        return row[0] if row else None
+
+    def list_jobs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """List recent jobs with per-state tile counts"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        jobs = []
+        for (job_id,) in rows:
+            job = self.get_job(job_id)
+            job['counts'] = self.get_counts(job_id)
+            jobs.append(job)
+        return jobs
+
+    def set_job_status(self, job_id: str, status: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?",
+                (status, datetime.now().isoformat(), job_id)
+            )
+
+    # ---- tiles ----
+
+    def record_tile(self, job_id: str, tile: Tuple[int, int, int], ok: bool,
+                    error: Optional[str] = None) -> None:
+        """Buffer a tile outcome; flushes when a checkpoint is due"""
+        zoom, x, y = tile
+        with self._lock:
+            self._buffer.append((job_id, zoom, x, y, STATE_DONE if ok else STATE_FAILED, error))
+            due = (len(self._buffer) >= self.checkpoint_size or
+                   time.monotonic() - self._last_flush >= self.checkpoint_interval)
+            if due:
+                self._flush_locked()
+
+    def flush(self) -> None:
+        """Write buffered tile outcomes in one transaction"""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        rows, self._buffer = self._buffer, []
+        with self._conn:
+            self._conn.executemany(
+                """INSERT INTO tiles (job_id, zoom_level, tile_column, tile_row, state, attempts, last_error)
+                   VALUES (?, ?, ?, ?, ?, 1, ?)
+                   ON CONFLICT (job_id, zoom_level, tile_column, tile_row) DO UPDATE SET
+                       state = excluded.state,
+                       attempts = tiles.attempts + 1,
+                       last_error = excluded.last_error""",
+                rows
+            )
+            self._conn.execute(
+                "UPDATE jobs SET updated_at = ? WHERE job_id = ?",
+                (datetime.now().isoformat(), rows[-1][0])
+            )
+
+    def get_counts(self, job_id: str) -> Dict[str, int]:
+        """Tile counts per recorded state"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) FROM tiles WHERE job_id = ? GROUP BY state", (job_id,)
+            ).fetchall()
+        counts = {STATE_DONE: 0, STATE_FAILED: 0}
+        counts.update({state: count for state, count in rows})
+        return counts
+
+    def _get_tiles_in_state(self, job_id: str, tiles: List[Tuple[int, int, int]],
+                            state: str) -> Set[Tuple[int, int, int]]:
+        """The given tiles that are recorded in state (one primary key lookup each)"""
+        rows = ', '.join(['(?, ?, ?)'] * len(tiles))
+        params = [value for tile in tiles for value in tile]
+        with self._lock:
+            # CROSS JOIN keeps the tile list as the outer loop, so each tile is a key lookup
+            found = self._conn.execute(
+                f"""SELECT t.zoom_level, t.tile_column, t.tile_row
+                    FROM (VALUES {rows}) v CROSS JOIN tiles t
+                    ON t.job_id = ? AND t.zoom_level = v.column1 AND t.tile_column = v.column2
+                    AND t.tile_row = v.column3
+                    WHERE t.state = ?""",
+                (*params, job_id, state)
+            ).fetchall()
+        return set(found)
+
+    def iter_unfinished(self, job_id: str, tiles: Iterable[Tuple[int, int, int]],
+                        chunk_size: int = 300) -> Iterator[Tuple[int, int, int]]:
+        """Yield tiles of the job that are not done (pending or failed).
+        Tiles are looked up a chunk at a time, so they may come in any order (e.g.
+        oldest first from a refresh) and only one chunk is held in memory."""
+        tiles = iter(tiles)
+        while True:
+            chunk = [tuple(tile) for tile in islice(tiles, chunk_size)]
+            if not chunk:
+                return
+            done = self._get_tiles_in_state(job_id, chunk, STATE_DONE)
+            for tile in chunk:
+                if tile not in done:
+                    yield tile
+
+    def iter_failed(self, job_id: str, page_size: int = 10000) -> Iterator[Tuple[int, int, int]]:
+        """Yield tiles recorded as failed, one keyset page at a time"""
+        last = (-1, -1, -1)
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    """SELECT zoom_level, tile_column, tile_row FROM tiles
+                       WHERE job_id = ? AND state = ? AND (zoom_level, tile_column, tile_row) > (?, ?, ?)
+                       ORDER BY zoom_level, tile_column, tile_row LIMIT ?""",
+                    (job_id, STATE_FAILED, *last, page_size)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield tuple(row)
+            last = rows[-1]
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,273 @@
+import json
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Callable, List, Optional
+
+from utils.file_utils import FileUtils
+
+
+# Request latency histogram bucket bounds in seconds (Prometheus `le` labels)
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TILE_RESULTS = ('downloaded', 'skipped', 'failed')
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    """Format seconds as H:MM:SS (or 'n/a')"""
+    if seconds is None:
+        return 'n/a'
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class _ServerMetrics:
+    __slots__ = ('requests', 'statuses', 'bytes', 'buckets', 'latency_sum', 'recent', 'retries', 'fallbacks')
+
+    def __init__(self):
+        self.requests = 0
+        self.statuses: Dict[str, int] = {}
+        self.bytes = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        # Recent latencies for percentiles; the buckets keep the full distribution
+        self.recent = deque(maxlen=1000)
+        self.retries = 0
+        self.fallbacks = 0
+
+
+class DownloadMetrics:
+    """Live counters for a download job, shared by the engines and the progress reporter.
+
+    Tracks per-server requests, status codes, bytes, a latency histogram
+    (p50/p95/p99 from recent samples), retries and fallback hops, plus finished
+    tiles. Gauges such as queue or writer depth are read from callables
+    registered with set_gauge(). snapshot() returns everything as a dict, with
+    throughput over the last few snapshots and an ETA when the total is known.
+    """
+
+    def __init__(self, rate_window: int = 6):
+        self._lock = threading.Lock()
+        self._rate_samples = deque(maxlen=max(2, rate_window))
+        self._gauges: Dict[str, Callable[[], Any]] = {}
+        self.start()
+
+    def start(self, expected_tiles: Optional[int] = None) -> None:
+        """Reset the counters for a new job"""
+        with self._lock:
+            self.expected_tiles = expected_tiles
+            self.started_at = time.monotonic()
+            self._servers: Dict[str, _ServerMetrics] = {}
+            self._tiles = {result: 0 for result in TILE_RESULTS}
+            self._bytes = 0
+            self._rate_samples.clear()
+            self._rate_samples.append((self.started_at, 0, 0))
+
+    def _server(self, name: str) -> _ServerMetrics:
+        metrics = self._servers.get(name)
+        if metrics is None:
+            metrics = self._servers[name] = _ServerMetrics()
+        return metrics
+
+    def record_request(self, server_name: str, status: Optional[int], latency: float, size: int = 0) -> None:
+        """One HTTP request (status None = transport error)"""
+        bucket = len(LATENCY_BUCKETS)
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                bucket = index
+                break
+        with self._lock:
+            metrics = self._server(server_name)
+            metrics.requests += 1
+            key = str(status) if status is not None else 'error'
+            metrics.statuses[key] = metrics.statuses.get(key, 0) + 1
+            metrics.bytes += size
+            metrics.buckets[bucket] += 1
+            metrics.latency_sum += latency
+            metrics.recent.append(latency)
+            self._bytes += size
+
+    def record_retry(self, server_name: str) -> None:
+        with self._lock:
+            self._server(server_name).retries += 1
+
+    def record_fallback(self, server_name: str) -> None:
+        """A tile moved on from this server to the next one in its fallback chain"""
+        with self._lock:
+            self._server(server_name).fallbacks += 1
+
+    def record_tile(self, result: str) -> None:
+        """A finished tile: 'downloaded', 'skipped' (already present) or 'failed'"""
+        with self._lock:
+            self._tiles[result] += 1
+
+    def set_gauge(self, name: str, source: Callable[[], Any]) -> None:
+        """Register a callable read at every snapshot (e.g. queue depth)"""
+        with self._lock:
+            self._gauges[name] = source
+
+    @staticmethod
+    def _percentile(samples: List[float], percentile: float) -> Optional[float]:
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile / 100.0))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """All metrics as a JSON-serialisable dict"""
+        with self._lock:
+            now = time.monotonic()
+            processed = sum(self._tiles.values())
+            self._rate_samples.append((now, processed, self._bytes))
+            first_time, first_tiles, first_bytes = self._rate_samples[0]
+            window = now - first_time
+            tiles_per_second = (processed - first_tiles) / window if window > 0 else 0.0
+            bytes_per_second = (self._bytes - first_bytes) / window if window > 0 else 0.0
+            eta = None
+            if self.expected_tiles is not None and tiles_per_second > 0:
+                eta = max(0, self.expected_tiles - processed) / tiles_per_second
+
+            servers = {}
+            for name, metrics in self._servers.items():
+                recent = sorted(metrics.recent)
+                servers[name] = {
+                    'requests': metrics.requests,
+                    'status_codes': dict(metrics.statuses),
+                    'bytes': metrics.bytes,
+                    'retries': metrics.retries,
+                    'fallbacks': metrics.fallbacks,
+                    'latency': {
+                        'p50': self._percentile(recent, 50),
+                        'p95': self._percentile(recent, 95),
+                        'p99': self._percentile(recent, 99),
+                        'sum': round(metrics.latency_sum, 6),
+                        'buckets': list(metrics.buckets)
+                    }
+                }
+            gauges = dict(self._gauges)
+            tiles = dict(self._tiles, processed=processed)
+            total_bytes = self._bytes
+            elapsed = now - self.started_at
+            expected = self.expected_tiles
+
+        gauge_values = {}
+        for name, source in gauges.items():
+            try:
+                gauge_values[name] = source()
+            except Exception:
+                gauge_values[name] = None
+        return {
+            'elapsed_seconds': round(elapsed, 3),
+            'expected_tiles': expected,
+            'tiles': tiles,
+            'bytes': total_bytes,
+            'tiles_per_second': round(tiles_per_second, 2),
+            'bytes_per_second': round(bytes_per_second, 1),
+            'eta_seconds': round(eta, 1) if eta is not None else None,
+            'gauges': gauge_values,
+            'servers': servers
+        }
+
+    @staticmethod
+    def to_prometheus(snapshot: Dict[str, Any]) -> str:
+        """Prometheus text exposition of a snapshot"""
+        def label(value: str) -> str:
+            return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+        lines = [
+            '# TYPE tile_downloader_tiles_total counter',
+            *(f'tile_downloader_tiles_total{{result="{result}"}} {snapshot["tiles"][result]}'
+              for result in TILE_RESULTS),
+            '# TYPE tile_downloader_tiles_expected gauge',
+            f'tile_downloader_tiles_expected {snapshot["expected_tiles"] if snapshot["expected_tiles"] is not None else "NaN"}',
+            '# TYPE tile_downloader_tiles_per_second gauge',
+            f'tile_downloader_tiles_per_second {snapshot["tiles_per_second"]}',
+            '# TYPE tile_downloader_bytes_per_second gauge',
+            f'tile_downloader_bytes_per_second {snapshot["bytes_per_second"]}',
+            '# TYPE tile_downloader_eta_seconds gauge',
+            f'tile_downloader_eta_seconds {snapshot["eta_seconds"] if snapshot["eta_seconds"] is not None else "NaN"}',
+        ]
+        for name, value in snapshot['gauges'].items():
+            if isinstance(value, (int, float)):
+                lines.append(f'# TYPE tile_downloader_{name} gauge')
+                lines.append(f'tile_downloader_{name} {value}')
+
+        servers = snapshot['servers']
+        lines.append('# TYPE tile_downloader_requests_total counter')
+        for name, metrics in servers.items():
+            for status, count in sorted(metrics['status_codes'].items()):
+                lines.append(f'tile_downloader_requests_total{{server="{label(name)}",status="{status}"}} {count}')
+        for metric, key in (('response_bytes_total', 'bytes'), ('retries_total', 'retries'),
+                            ('fallbacks_total', 'fallbacks')):
+            lines.append(f'# TYPE tile_downloader_{metric} counter')
+            for name, metrics in servers.items():
+                lines.append(f'tile_downloader_{metric}{{server="{label(name)}"}} {metrics[key]}')
+        lines.append('# TYPE tile_downloader_request_duration_seconds histogram')
+        for name, metrics in servers.items():
+            cumulative = 0
+            bounds = [str(bound) for bound in LATENCY_BUCKETS] + ['+Inf']
+            for bound, count in zip(bounds, metrics['latency']['buckets']):
+                cumulative += count
+                lines.append(f'tile_downloader_request_duration_seconds_bucket{{server="{label(name)}",le="{bound}"}} {cumulative}')
+            lines.append(f'tile_downloader_request_duration_seconds_sum{{server="{label(name)}"}} {metrics["latency"]["sum"]}')
+            lines.append(f'tile_downloader_request_duration_seconds_count{{server="{label(name)}"}} {metrics["requests"]}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def format_progress(snapshot: Dict[str, Any]) -> str:
+        """One-line progress summary"""
+        tiles = snapshot['tiles']
+        expected = snapshot['expected_tiles']
+        done = f"{tiles['processed']}/{expected}" if expected else str(tiles['processed'])
+        percent = f" ({tiles['processed'] * 100.0 / expected:.1f}%)" if expected else ""
+        line = (f"Progress: {done} tiles{percent}, {tiles['failed']} failed, "
+                f"{snapshot['tiles_per_second']:.1f} tiles/s, {snapshot['bytes_per_second'] / (1024 * 1024):.2f} MB/s, "
+                f"ETA {format_duration(snapshot['eta_seconds'])}")
+        gauges = ', '.join(f"{name.replace('_', ' ')} {value}" for name, value in snapshot['gauges'].items()
+                           if value is not None)
+        return f"{line}, {gauges}" if gauges else line
+
+
+class MetricsReporter:
+    """Background thread printing a progress line and writing metric snapshots every interval.
+
+    json_path gets the snapshot as JSON, prometheus_path the Prometheus text
+    format (e.g. for node_exporter's textfile collector). Both are replaced
+    atomically, and written once more by stop().
+    """
+
+    def __init__(self, metrics: DownloadMetrics, interval: float = 10.0,
+                 json_path: Optional[str] = None, prometheus_path: Optional[str] = None):
+        self.metrics = metrics
+        self.interval = interval
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self.interval and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="metrics-reporter", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            snapshot = self.metrics.snapshot()
+            print(DownloadMetrics.format_progress(snapshot))
+            self._write(snapshot)
+
+    def _write(self, snapshot: Dict[str, Any]) -> None:
+        try:
+            if self.json_path:
+                FileUtils.write_file_atomic(self.json_path, json.dumps(snapshot, indent=2).encode('utf-8'))
+            if self.prometheus_path:
+                FileUtils.write_file_atomic(self.prometheus_path, DownloadMetrics.to_prometheus(snapshot).encode('utf-8'))
+        except OSError as e:
+            print(f"Could not write metrics: {e}")
+
+    def stop(self) -> Dict[str, Any]:
+        """Stop reporting and write the final snapshot; returns it"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        snapshot = self.metrics.snapshot()
+        self._write(snapshot)
+        return snapshot
@@ -114,8 +114,9 @@ class GeoCoordinateService:
             return None
         try:
             result = self._api.find_coordinates(place_name, region_type)
-            if result.get('success') and result.get('coordinates', {}).get('polygon'):
-                return result['coordinates']['polygon']
+            polygon = result.get('coordinates', {}).get('polygon') if result.get('success') else None
+            if polygon and polygon.get('type') in ('Polygon', 'MultiPolygon') and polygon.get('coordinates'):
+                return polygon
             return None
         except Exception as e:
             print(f"Error getting polygon for '{place_name}': {e}")
@@ -0,0 +1,57 @@
+import threading
+from collections import deque
+from typing import Dict, Any, Optional
+
+from models.tile_server import TileServer
+
+
+class HedgeTracker:
+    """Recent latencies per server and the delay after which a request is hedged.
+
+    A hedge is a duplicate request to the server's next mirror, sent when the
+    first one has not answered within `hedge_after` seconds (or the configured
+    latency percentile, once enough samples exist). Whichever answers first wins.
+    """
+
+    def __init__(self, window_size: int = 200, min_samples: int = 20):
+        self.window_size = window_size
+        self.min_samples = min_samples
+        self._latencies: Dict[str, deque] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record_latency(self, server_name: str, latency: float) -> None:
+        with self._lock:
+            window = self._latencies.get(server_name)
+            if window is None:
+                window = self._latencies[server_name] = deque(maxlen=self.window_size)
+            window.append(latency)
+
+    def get_percentile(self, server_name: str, percentile: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._latencies.get(server_name, ()))
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * percentile / 100.0))
+        return samples[index]
+
+    def get_delay(self, server: TileServer) -> Optional[float]:
+        """Seconds to wait before hedging, or None when this server is not hedged (yet)"""
+        if server.hedge_after is None or len(server.get_url_templates()) < 2:
+            return None
+        percentile = server.get_hedge_percentile()
+        if percentile is not None:
+            return self.get_percentile(server.get_name(), percentile)
+        return float(server.hedge_after)
+
+    def record_hedge(self, server_name: str, won: bool) -> None:
+        with self._lock:
+            counters = self._counters.setdefault(server_name, {'hedged': 0, 'won': 0})
+            counters['hedged'] += 1
+            if won:
+                counters['won'] += 1
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Hedged requests per server and how many of them answered first"""
+        with self._lock:
+            return {name: dict(counters) for name, counters in self._counters.items()}
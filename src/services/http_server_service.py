@@ -8,8 +8,6 @@ import sys
 import urllib.parse
 import math
 import sqlite3
-import gzip
-import zlib
 from typing import Dict, Any, List
 from functools import lru_cache
 from pathlib import Path
@@ -25,6 +23,11 @@ except ImportError:
         print("[WARNING] Could not import metadata synchronization system")
         sync_metadata_on_startup = None
 
+try:
+    from src.utils.tile_encoding import detect_encoding, detect_image_format, to_gzip
+except ImportError:
+    from utils.tile_encoding import detect_encoding, detect_image_format, to_gzip
+
 
 class HTTPServerService:
     """Optimized HTTP server service for TileMapDownloader"""
@@ -625,6 +628,9 @@ class HTTPServerService:
                     # Serve file if exists
                     if os.path.exists(file_path) and os.path.isfile(file_path):
                         self._serve_file(file_path)
+                    elif self._serve_layer_mbtiles_tile(rel_path):
+                        # Layer downloaded in mbtiles output mode (map_tiles/REGION/TYPE/LAYER.mbtiles)
+                        return
                     else:
                         # Fallback: If request matches map tile XYZ pattern, try TMS-inverted Y
                         try:
@@ -714,28 +720,26 @@ class HTTPServerService:
                     with open(file_path, 'rb') as f:
                         content = f.read()
                     
+                    # Raster tiles keep their .png name whatever their format (e.g. after --recompress webp)
+                    if content_type in ('image/png', 'image/jpeg'):
+                        image_format = detect_image_format(content)
+                        if image_format:
+                            content_type = {'png': 'image/png', 'jpg': 'image/jpeg', 'webp': 'image/webp'}[image_format]
+                    
                     # For vector tiles served as static files, normalize transport encoding to GZIP and set header
                     is_vector_tile_path = file_path.lower().endswith('.pbf') or file_path.lower().endswith('.mvt')
                     if is_vector_tile_path:
-                        try:
-                            # Detect original encoding and ensure we serve gzip
-                            detected = 'raw'
-                            if len(content) >= 2 and content[0:2] == b'\x1f\x8b':
-                                detected = 'gzip'
-                                # already gzip
+                        # Tiles are stored gzip-compressed and sent as they are; only trees written
+                        # before that (see --gzip-vector-tiles) are compressed per request
+                        detected = detect_encoding(content)
+                        if detected != 'gzip':
+                            try:
+                                content = to_gzip(content)
+                            except Exception:
+                                # If normalization fails, fall back to original bytes
                                 pass
-                            elif len(content) >= 2 and content[0] == 0x78 and content[1] in (0x01, 0x9C, 0xDA):
-                                detected = 'zlib'
-                                raw = zlib.decompress(content)
-                                content = gzip.compress(raw)
-                            else:
-                                # assume raw pbf -> gzip it
-                                content = gzip.compress(content)
-                            # Stash detected format for headers
-                            self._last_detected_vector_format = detected
-                        except Exception:
-                            # If normalization fails, fall back to original bytes
-                            pass
+                        # Stash detected format for headers
+                        self._last_detected_vector_format = detected
 
                     # Pre-compute caching fingerprint for conditional requests
                     etag_value = None
@@ -822,6 +826,7 @@ class HTTPServerService:
                     '.png': 'image/png',
                     '.jpg': 'image/jpeg',
                     '.jpeg': 'image/jpeg',
+                    '.webp': 'image/webp',
                     '.gif': 'image/gif',
                     '.svg': 'image/svg+xml',
                     '.ico': 'image/x-icon',
@@ -830,6 +835,90 @@ class HTTPServerService:
                 }
                 return content_types.get(ext, 'application/octet-stream')
             
+            def _serve_layer_mbtiles_tile(self, rel_path: str) -> bool:
+                """Serve map_tiles/REGION/TYPE/LAYER/z/x/y.ext from map_tiles/REGION/TYPE/LAYER.mbtiles if present"""
+                parts = rel_path.split('/')
+                if len(parts) != 7 or parts[0] != 'map_tiles' or parts[2] not in ('raster', 'vector'):
+                    return False
+                y_str, _, ext = parts[6].partition('.')
+                if not (parts[4].isdigit() and parts[5].isdigit() and y_str.isdigit()):
+                    return False
+                mbtiles_path = os.path.join(os.getcwd(), parts[0], parts[1], parts[2], f"{parts[3]}.mbtiles")
+                if not (self._is_safe_path(mbtiles_path) and os.path.isfile(mbtiles_path)):
+                    return False
+                
+                tile_data = server_service._extract_tile_from_mbtiles(mbtiles_path, int(parts[4]), int(parts[5]), int(y_str))
+                if tile_data is None:
+                    self.send_error(404, f'Tile {parts[4]}/{parts[5]}/{y_str} not found in {parts[3]}.mbtiles')
+                    return True
+                self._send_tile_data(tile_data, parts[2] == 'vector', ext or 'png')
+                return True
+
+            def _send_tile_data(self, tile_data: bytes, is_vector: bool, ext: str):
+                """Send tile bytes read from an MBTiles file (vector tiles normalized to gzip)"""
+                # Normalize vector tile transport encoding to GZIP and set header
+                if is_vector and ext.lower() in ['pbf', 'mvt']:
+                    detected = detect_encoding(tile_data)
+                    if detected != 'gzip':
+                        try:
+                            tile_data = to_gzip(tile_data)
+                        except Exception:
+                            # Keep original if normalization fails
+                            pass
+                    self._last_detected_vector_format = detected
+
+                # Determine content type based on server tile_type and extension
+                if is_vector:
+                    content_type = 'application/vnd.mapbox-vector-tile'
+                else:
+                    # Raster tile
+                    if ext.lower() in ['jpg', 'jpeg']:
+                        content_type = 'image/jpeg'
+                    elif ext.lower() == 'png':
+                        content_type = 'image/png'
+                    else:
+                        content_type = 'image/png'  # default
+                
+                # MBTiles: compute ETag and handle conditional GET BEFORE writing headers
+                try:
+                    import hashlib
+                    etag_value = hashlib.md5(tile_data).hexdigest()
+                except Exception:
+                    etag_value = None
+
+                if etag_value:
+                    incoming_etag = self.headers.get('If-None-Match')
+                    if incoming_etag:
+                        incoming_etag = incoming_etag.strip()
+                        if incoming_etag in (f'W/"{etag_value}"', f'"{etag_value}"', etag_value):
+                            self.send_response(304)
+                            self.send_header('Cache-Control', 'public, max-age=86400')
+                            self.send_header('Vary', 'Accept-Encoding')
+                            self.send_header('ETag', f'W/"{etag_value}"')
+                            self.end_headers()
+                            return
+
+                # Send tile response
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(tile_data)))
+
+                if is_vector:
+                    # Strong caching and defensive headers for tiles
+                    self.send_header('Cache-Control', 'public, max-age=86400')
+                    self.send_header('Vary', 'Accept-Encoding')
+                    self.send_header('X-Content-Type-Options', 'nosniff')
+                    if etag_value:
+                        self.send_header('ETag', f'W/"{etag_value}"')
+                    # Always set gzip since we normalized above
+                    self.send_header('Content-Encoding', 'gzip')
+                    detected = getattr(self, '_last_detected_vector_format', None)
+                    if detected:
+                        self.send_header('X-Tile-Detected-Format', detected)
+
+                self.end_headers()
+                self.wfile.write(tile_data)
+
             def _handle_mbtiles_tile(self):
                 """Handle mbtiles tile requests - extract tiles from .mbtiles files"""
                 try:
@@ -893,79 +982,7 @@ class HTTPServerService:
                         self.send_error(404, f'Tile {z}/{x}/{y} not found in {server_name}')
                         return
                     
-                    # Normalize vector tile transport encoding to GZIP and set header
-                    if server_config.get('tile_type') == 'vector' and ext.lower() in ['pbf', 'mvt']:
-                        try:
-                            detected = 'raw'
-                            if len(tile_data) >= 2 and tile_data[0:2] == b'\x1f\x8b':
-                                detected = 'gzip'
-                                # keep as-is
-                                pass
-                            elif len(tile_data) >= 2 and tile_data[0] == 0x78 and tile_data[1] in (0x01, 0x9C, 0xDA):
-                                detected = 'zlib'
-                                raw = zlib.decompress(tile_data)
-                                tile_data = gzip.compress(raw)
-                            else:
-                                # assume raw pbf
-                                tile_data = gzip.compress(tile_data)
-                            self._last_detected_vector_format = detected
-                        except Exception:
-                            # Keep original if normalization fails
-                            pass
-
-                    # Determine content type based on server tile_type and extension
-                    if server_config.get('tile_type') == 'vector':
-                        content_type = 'application/vnd.mapbox-vector-tile'
-                    else:
-                        # Raster tile
-                        if ext.lower() in ['jpg', 'jpeg']:
-                            content_type = 'image/jpeg'
-                        elif ext.lower() == 'png':
-                            content_type = 'image/png'
-                        else:
-                            content_type = 'image/png'  # default
-                    
-                    # MBTiles: compute ETag and handle conditional GET BEFORE writing headers
-                    try:
-                        import hashlib
-                        etag_value = hashlib.md5(tile_data).hexdigest()
-                    except Exception:
-                        etag_value = None
-
-                    if etag_value:
-                        incoming_etag = self.headers.get('If-None-Match')
-                        if incoming_etag:
-                            incoming_etag = incoming_etag.strip()
-                            if incoming_etag in (f'W/"{etag_value}"', f'"{etag_value}"', etag_value):
-                                self.send_response(304)
-                                self.send_header('Cache-Control', 'public, max-age=86400')
-                                self.send_header('Vary', 'Accept-Encoding')
-                                self.send_header('ETag', f'W/"{etag_value}"')
-                                self.end_headers()
-                                return
-
-                    # Send tile response
-                    self.send_response(200)
-                    self.send_header('Content-Type', content_type)
-                    self.send_header('Content-Length', str(len(tile_data)))
-
-                    # Vector tile specific headers
-                    is_vector = server_config.get('tile_type') == 'vector'
-                    if is_vector:
-                        # Strong caching and defensive headers for tiles
-                        self.send_header('Cache-Control', 'public, max-age=86400')
-                        self.send_header('Vary', 'Accept-Encoding')
-                        self.send_header('X-Content-Type-Options', 'nosniff')
-                        if etag_value:
-                            self.send_header('ETag', f'W/"{etag_value}"')
-                        # Always set gzip since we normalized above
-                        self.send_header('Content-Encoding', 'gzip')
-                        detected = getattr(self, '_last_detected_vector_format', None)
-                        if detected:
-                            self.send_header('X-Tile-Detected-Format', detected)
-
-                    self.end_headers()
-                    self.wfile.write(tile_data)
+                    self._send_tile_data(tile_data, server_config.get('tile_type') == 'vector', ext)
                     
                     print(f"[SUCCESS] Served mbtiles tile: {z}/{x}/{y} ({len(tile_data)} bytes)")
                     
@@ -1116,6 +1133,11 @@ class HTTPServerService:
                 if result:
                     return result[0]
                 
+                # Plain tiles table (e.g. mbtiles output mode): a miss is just a missing tile
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='map'")
+                if cursor.fetchone() is None:
+                    return None
+                
                 # Try TMS format (images + map tables)
                 cursor.execute(
                     "SELECT tile_id FROM map WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
@@ -1200,7 +1222,8 @@ class HTTPServerService:
     def _has_filesystem_tiles(self, region_name: str, layer_type: str, layer_name: str) -> bool:
         try:
             base_path = os.path.join(os.getcwd(), 'map_tiles', self._resolve_region_directory_name(region_name), layer_type, layer_name)
-            return os.path.exists(base_path) and os.path.isdir(base_path)
+            # A layer is either a z/x/y directory or a single MBTiles file (mbtiles output mode)
+            return (os.path.exists(base_path) and os.path.isdir(base_path)) or os.path.isfile(base_path + '.mbtiles')
         except Exception:
             return False
 
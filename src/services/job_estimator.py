@@ -0,0 +1,287 @@
+import math
+import os
+import shutil
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+import requests
+
+from models.tile_server import TileServer
+from services.download_metrics import format_duration
+from utils.tile_calculator import TileCalculator
+from utils.tile_sharding import TileSharding
+
+
+class JobEstimator:
+    """Dry-run forecast of a download job: tiles, bytes, disk usage and duration.
+
+    Tile counts per zoom are computed arithmetically. For every zoom and source a
+    few tiles spread evenly over the bbox (one per cell of a grid laid over the
+    tile range) are sized: from the job's existing output or the local MBTiles
+    source when they are there, otherwise with a GET to the server. Sampled
+    tiles found on disk also estimate how much of the job is already done.
+    The duration comes from the measured request latency and the engine's
+    concurrency per server.
+    """
+
+    def __init__(self, output_dir: str, output_format: str = 'files', samples_per_zoom: int = 5,
+                 concurrency: int = 15, timeout: int = 30, sample_workers: int = 8,
+                 local_tile_service=None):
+        self.output_dir = output_dir
+        self.output_format = output_format
+        self.samples_per_zoom = max(1, samples_per_zoom)
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.sample_workers = max(1, sample_workers)
+        self.local_tile_service = local_tile_service
+
+    def create_session(self) -> requests.Session:
+        return requests.Session()
+
+    @staticmethod
+    def zoom_counts(bbox: List[float], min_zoom: int, max_zoom: int,
+                    shard: Optional[Dict[str, int]] = None, polygon: Optional[dict] = None) -> Dict[int, int]:
+        """Tiles per zoom level of the job (inside the polygon, of one shard when given)"""
+        if polygon is not None:
+            if shard is None:
+                return TileCalculator.calculate_polygon_tile_counts(polygon, min_zoom, max_zoom)
+            counts = {zoom: 0 for zoom in range(min_zoom, max_zoom + 1)}
+            for tile in TileCalculator.iter_tiles_for_polygon(polygon, min_zoom, max_zoom):
+                if TileSharding.shard_of(tile, shard['partition_zoom'], shard['count']) == shard['index']:
+                    counts[tile[0]] += 1
+            return counts
+        if shard is None:
+            return TileCalculator.calculate_tile_counts(bbox, min_zoom, max_zoom)
+        return {zoom: TileSharding.count_shard_tiles(bbox, zoom, zoom, shard['partition_zoom'],
+                                                     shard['index'], shard['count'])
+                for zoom in range(min_zoom, max_zoom + 1)}
+
+    @staticmethod
+    def sample_tiles(bbox: List[float], zoom: int, count: int) -> List[Tuple[int, int, int]]:
+        """Up to `count` tiles of the bbox at `zoom`: the centre tiles of an even grid of strata"""
+        min_x, min_y, max_x, max_y = TileCalculator.get_tile_range(bbox, zoom)
+        width, height = max_x - min_x + 1, max_y - min_y + 1
+        if width <= 0 or height <= 0:
+            return []
+        if width * height <= count:
+            return [(zoom, x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+        columns = max(1, min(width, round(math.sqrt(count * width / height))))
+        rows = max(1, min(height, math.ceil(count / columns)))
+        cells = [(column, row) for row in range(rows) for column in range(columns)]
+        step = len(cells) / count
+        tiles = []
+        for i in range(min(count, len(cells))):
+            column, row = cells[int(i * step)]
+            x = min_x + int((column + 0.5) * width / columns)
+            y = min_y + int((row + 0.5) * height / rows)
+            tiles.append((zoom, x, y))
+        return tiles
+
+    def _existing_size(self, region_name: str, tile_type: str, name: str,
+                       tile: Tuple[int, int, int]) -> Optional[int]:
+        """Size of a tile already in the job's output (None if not there)"""
+        zoom, x, y = tile
+        layer_dir = os.path.join(self.output_dir, region_name, tile_type)
+        if self.output_format == 'mbtiles':
+            path = os.path.join(layer_dir, f"{name}.mbtiles")
+            if not os.path.isfile(path):
+                return None
+            conn = sqlite3.connect(path)
+            try:
+                row = conn.execute(
+                    "SELECT length(tile_data) FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+                    (zoom, x, (1 << zoom) - 1 - y)
+                ).fetchone()
+            except sqlite3.Error:
+                return None
+            finally:
+                conn.close()
+            return row[0] if row and row[0] else None
+        extension = 'pbf' if tile_type == 'vector' else 'png'
+        try:
+            size = os.path.getsize(os.path.join(layer_dir, name, str(zoom), str(x), f"{y}.{extension}"))
+        except OSError:
+            return None
+        return size or None
+
+    def _fetch_size(self, session: requests.Session, server: TileServer,
+                    tile: Tuple[int, int, int]) -> Tuple[Optional[int], Optional[float]]:
+        """(size, latency) of one upstream GET; size is None if the tile could not be fetched"""
+        started = time.monotonic()
+        try:
+            response = session.get(server.get_tile_url(*tile), headers=server.get_headers(), timeout=self.timeout)
+            response.raise_for_status()
+            content = response.content
+        except Exception:
+            return None, None
+        return (len(content) if content else None), time.monotonic() - started
+
+    def _sample_source(self, session: requests.Session, executor: ThreadPoolExecutor, region_name: str,
+                       source, samples: List[Tuple[int, int, int]]) -> Dict[str, Any]:
+        """Sizes of the sample tiles for one source"""
+        tile_type = 'vector' if source.get_tile_type() == 'vector' else 'raster'
+        name = source.get_name()
+        is_local = hasattr(source, 'get_source_type') and source.get_source_type() == 'local'
+        result = {'sizes': [], 'present': 0, 'fetched': 0, 'missing': 0, 'latencies': []}
+        to_fetch = []
+        for tile in samples:
+            size = self._existing_size(region_name, tile_type, name, tile)
+            if size is not None:
+                result['present'] += 1
+                result['sizes'].append(size)
+                continue
+            to_fetch.append(tile)
+
+        if is_local:
+            # One batched lookup on the local source instead of a request per tile
+            extractor = self.local_tile_service.get_source(name) if self.local_tile_service else None
+            try:
+                found = extractor.get_tiles(to_fetch) if extractor else {}
+            except sqlite3.Error as e:
+                # Like a failed upstream GET: the samples count as missing
+                print(f"Could not read samples from {name}: {e}")
+                found = {}
+            for tile in to_fetch:
+                data = found.get(tile)
+                if data:
+                    result['fetched'] += 1
+                    result['sizes'].append(len(data))
+                else:
+                    result['missing'] += 1
+            return result
+
+        for size, latency in executor.map(lambda tile: self._fetch_size(session, source, tile), to_fetch):
+            if size is None:
+                result['missing'] += 1
+                continue
+            result['fetched'] += 1
+            result['sizes'].append(size)
+            result['latencies'].append(latency)
+        return result
+
+    def estimate(self, region_name: str, bbox: List[float], min_zoom: int, max_zoom: int,
+                 sources: List, shard: Optional[Dict[str, int]] = None,
+                 polygon: Optional[dict] = None) -> Dict[str, Any]:
+        """Forecast the job; see format_report() for the printed form"""
+        counts = self.zoom_counts(bbox, min_zoom, max_zoom, shard, polygon)
+        block_size = self._block_size()
+        zooms = []
+        totals = {'tiles': 0, 'remaining_tiles': 0, 'bytes': 0, 'disk_bytes': 0, 'seconds': 0.0}
+        latencies: Dict[str, List[float]] = {}
+        session = self.create_session()
+        try:
+            with ThreadPoolExecutor(max_workers=self.sample_workers) as executor:
+                for zoom, tiles in counts.items():
+                    samples = self.sample_tiles(bbox, zoom, self.samples_per_zoom)
+                    per_source = {}
+                    for source in sources:
+                        sampled = self._sample_source(session, executor, region_name, source, samples)
+                        latencies.setdefault(source.get_name(), []).extend(sampled['latencies'])
+                        sizes = sampled['sizes']
+                        average = sum(sizes) / len(sizes) if sizes else 0.0
+                        # Tiles the upstream has no data for are not written
+                        found = len(sizes) / len(samples) if samples else 0.0
+                        present = sampled['present'] / len(samples) if samples else 0.0
+                        remaining = round(tiles * max(0.0, found - present))
+                        allocated = (sum(math.ceil(size / block_size) * block_size for size in sizes) / len(sizes)
+                                     if sizes and self.output_format != 'mbtiles' else average)
+                        per_source[source.get_name()] = {
+                            'samples': len(samples),
+                            'present': sampled['present'],
+                            'fetched': sampled['fetched'],
+                            'missing': sampled['missing'],
+                            'avg_bytes': round(average),
+                            'remaining_tiles': remaining,
+                            'bytes': round(remaining * average),
+                            'disk_bytes': round(remaining * allocated)
+                        }
+                        totals['tiles'] += tiles
+                        totals['remaining_tiles'] += remaining
+                        totals['bytes'] += per_source[source.get_name()]['bytes']
+                        totals['disk_bytes'] += per_source[source.get_name()]['disk_bytes']
+                    zooms.append({'zoom': zoom, 'tiles': tiles, 'sources': per_source})
+        finally:
+            session.close()
+
+        # Servers are downloaded in parallel, each with its own concurrency
+        servers = {}
+        for source in sources:
+            name = source.get_name()
+            samples = latencies.get(name) or []
+            if hasattr(source, 'get_source_type') and source.get_source_type() == 'local':
+                continue
+            remaining = sum(zoom['sources'][name]['remaining_tiles'] for zoom in zooms)
+            mean_latency = sum(samples) / len(samples) if samples else None
+            rate = self.concurrency / mean_latency if mean_latency else None
+            seconds = remaining / rate if rate else None
+            servers[name] = {
+                'remaining_tiles': remaining,
+                'mean_latency': round(mean_latency, 4) if mean_latency is not None else None,
+                'tiles_per_second': round(rate, 1) if rate else None,
+                'seconds': round(seconds, 1) if seconds is not None else None
+            }
+            if seconds:
+                totals['seconds'] = max(totals['seconds'], seconds)
+
+        free_bytes = self._free_bytes()
+        return {
+            'region_name': region_name,
+            'zooms': zooms,
+            'servers': servers,
+            'totals': totals,
+            'block_size': block_size,
+            'free_bytes': free_bytes,
+            'fits': free_bytes is None or totals['disk_bytes'] <= free_bytes
+        }
+
+    def _existing_parent(self) -> str:
+        path = os.path.abspath(self.output_dir)
+        while not os.path.exists(path) and os.path.dirname(path) != path:
+            path = os.path.dirname(path)
+        return path
+
+    def _block_size(self) -> int:
+        """Allocation unit of the output filesystem (small tiles still take a whole block)"""
+        try:
+            return os.statvfs(self._existing_parent()).f_frsize or 4096
+        except (AttributeError, OSError):
+            return 4096
+
+    def _free_bytes(self) -> Optional[int]:
+        try:
+            return shutil.disk_usage(self._existing_parent()).free
+        except OSError:
+            return None
+
+    @staticmethod
+    def format_report(estimate: Dict[str, Any]) -> List[str]:
+        """Printable lines: per-zoom table, per-server throughput and totals"""
+        def mb(value: float) -> str:
+            return f"{value / (1024 * 1024):.1f} MB"
+
+        lines = [f"{'Zoom':>4}  {'Tiles':>12}  {'Source':<24} {'Sampled':>7} {'Avg size':>10} {'To fetch':>12} {'Download':>12} {'On disk':>12}"]
+        for zoom in estimate['zooms']:
+            for name, source in zoom['sources'].items():
+                sampled = f"{source['present'] + source['fetched']}/{source['samples']}"
+                lines.append(f"{zoom['zoom']:>4}  {zoom['tiles']:>12}  {name:<24} {sampled:>7} "
+                             f"{source['avg_bytes'] / 1024:>7.1f} KB {source['remaining_tiles']:>12} "
+                             f"{mb(source['bytes']):>12} {mb(source['disk_bytes']):>12}")
+        for name, server in estimate['servers'].items():
+            if not server['remaining_tiles']:
+                lines.append(f"{name}: nothing left to fetch")
+            elif server['tiles_per_second']:
+                lines.append(f"{name}: {server['mean_latency'] * 1000:.0f} ms per request, "
+                             f"~{server['tiles_per_second']} tiles/s, ETA {format_duration(server['seconds'])}")
+            else:
+                lines.append(f"{name}: no sample could be fetched, duration unknown")
+        totals = estimate['totals']
+        lines.append(f"Total: {totals['tiles']} tiles over all layers, {totals['remaining_tiles']} to fetch, "
+                     f"{mb(totals['bytes'])} download, {mb(totals['disk_bytes'])} on disk "
+                     f"({estimate['block_size']} byte blocks), ETA {format_duration(totals['seconds'] or None)}")
+        if estimate['free_bytes'] is not None:
+            lines.append(f"Free space: {mb(estimate['free_bytes'])}")
+            if not estimate['fits']:
+                lines.append("WARNING: the job does not fit on the output volume")
+        return lines
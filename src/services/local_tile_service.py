@@ -1,18 +1,34 @@
 import os
-from typing import Dict, Any, List, Tuple, Optional
-from shapely.geometry import shape, box
-from shapely.prepared import prep
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Any, List, Tuple, Optional
+from shapely.geometry import shape
 from interfaces.tile_source import ITileSource, ITileExtractor
 from adapters.mbtiles_adapter import MBTilesAdapter
+from services.tile_file_writer import TileFileWriter
+from services.mbtiles_subset_export import MBTilesSubsetExporter
+from exceptions.tile_downloader_exceptions import DownloadError
+from utils.tile_calculator import TileCalculator
+from utils.tile_encoding import to_gzip
 
 
 
 class LocalTileService:
     """Service for handling local tile sources (MBTiles, etc.)"""
     
-    def __init__(self):
+    def __init__(self, workers: int = 4, writer_threads: int = 2, batch_size: int = 500):
         self.sources: Dict[str, ITileSource] = {}
         self.extractors: Dict[str, ITileExtractor] = {}
+        # Extraction: (source, zoom) pairs read concurrently, rows streamed in batches,
+        # files written by a pool of writer threads
+        self.workers = max(1, workers)
+        self.writer_threads = max(1, writer_threads)
+        self.batch_size = max(1, batch_size)
+        # Writer pool shared by all extractions, started on first use and stopped by close()
+        self._writers: List[TileFileWriter] = []
+        self._writers_lock = threading.Lock()
     
     def register_source(self, source_config: Dict[str, Any]) -> bool:
         """Register a local source"""
@@ -57,72 +73,95 @@ class LocalTileService:
     def extract_tiles(self, source_name: str, bbox: List[float], 
                      zoom: int, output_dir: str, region_name: str) -> Dict[str, Any]:
         """Extract tiles from local source"""
-        result = {
-            'success': False,
-            'tiles_extracted': 0,
-            'errors': [],
-            'output_path': ''
-        }
-        
-        try:
-            extractor = self.get_extractor(source_name)
-            if not extractor:
-                result['errors'].append(f"Source not found: {source_name}")
-                return result
-            
-            if not extractor.validate_source():
-                result['errors'].append(f"Source not available: {source_name}")
-                return result
-            
-            if not extractor.validate_bounds(bbox):
-                source_bounds = extractor.get_bounds()
-                result['errors'].append(f"Bbox {bbox} is outside source bounds {source_bounds}. Use --list-sources to see valid coordinate ranges for {source_name}.")
-                return result
-            
-            # Extract tiles
-            tiles = extractor.extract_tiles(bbox, zoom)
-            if not tiles:
-                result['errors'].append("No tiles found for given bbox and zoom")
-                return result
-            
-            # Get tile type from source to determine file extension and path
-            source = self.get_source(source_name)
-            tile_type = source.get_tile_type() if source else 'raster'
-            extension = 'pbf' if tile_type == 'vector' else 'png'
-            
-            # Create output directory with tile type classification (like online sources)
-            output_path = os.path.join(output_dir, region_name, tile_type, source_name, str(zoom))
-            os.makedirs(output_path, exist_ok=True)
-            
-            # Write tiles
-            tiles_written = 0
-            for x, y, tile_data in tiles:
-                tile_path = os.path.join(output_path, str(x), f"{y}.{extension}")
-                os.makedirs(os.path.dirname(tile_path), exist_ok=True)
-                
-                with open(tile_path, 'wb') as f:
-                    f.write(tile_data)
-                tiles_written += 1
-            
-            result['success'] = True
-            result['tiles_extracted'] = tiles_written
-            result['output_path'] = output_path
-            
-        except Exception as e:
-            result['errors'].append(f"Extraction failed: {e}")
-        
-        return result
+        return self.extract_zooms([source_name], [zoom], output_dir, region_name, bbox=bbox)[(source_name, zoom)]
 
-    # extract_tiles_for_polygon removed from usage; keep for compatibility if referenced elsewhere (not used)
     def extract_tiles_for_polygon(self, source_name: str, polygon_geojson: dict,
                                   zoom: int, output_dir: str, region_name: str) -> Dict[str, Any]:
         """Extract tiles for a polygon from local source (MBTiles)."""
+        return self.extract_zooms([source_name], [zoom], output_dir, region_name,
+                                  polygon=polygon_geojson)[(source_name, zoom)]
+
+    def extract_zooms(self, source_names: List[str], zooms: List[int], output_dir: str, region_name: str,
+                      bbox: Optional[List[float]] = None, polygon: Optional[dict] = None) -> Dict[Tuple[str, int], Dict[str, Any]]:
+        """Extract every (source, zoom) pair concurrently; returns a result per pair.
+
+        Each pair is streamed from its own read-only connection in batches of
+        batch_size rows, and the tiles go through a pool of writer threads with
+        bounded queues, so memory stays flat however large a zoom level is.
+        With a polygon only tiles of its quadtree cover are written.
+        """
+        jobs = [(source_name, zoom) for source_name in source_names for zoom in zooms]
+        writers = self._get_writers()
+        # Tiles of each job that reached the disk (counted on the writer threads)
+        written = dict.fromkeys(jobs, 0)
+        written_lock = threading.Lock()
+
+        def record_written(job: Tuple[str, int]) -> None:
+            with written_lock:
+                written[job] += 1
+
+        results = {}
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(jobs)))) as executor:
+                futures = {executor.submit(self._extract_zoom, source_name, zoom, output_dir, region_name,
+                                           writers, bbox, polygon, partial(record_written, (source_name, zoom))):
+                           (source_name, zoom)
+                           for source_name, zoom in jobs}
+                for future, job in futures.items():
+                    results[job] = future.result()
+        finally:
+            self._wait_for_writers(writers)
+        for job, result in results.items():
+            lost = result['tiles_extracted'] - written[job]
+            if lost > 0:
+                # Only the jobs whose tiles could not be written are incomplete
+                result['success'] = False
+                result['tiles_extracted'] = written[job]
+                result['errors'].append(f"{lost} tiles could not be written")
+        return results
+
+    def _get_writers(self) -> List[TileFileWriter]:
+        with self._writers_lock:
+            if not self._writers:
+                # Tiles of one x column always go to the same writer, which creates the directory once
+                self._writers = [TileFileWriter(queue_size=self.batch_size * 2, batch_size=self.batch_size)
+                                 for _ in range(self.writer_threads)]
+            return self._writers
+
+    @staticmethod
+    def _wait_for_writers(writers: List[TileFileWriter]) -> None:
+        """Block until every tile queued so far is on disk"""
+        flushed = []
+        for writer in writers:
+            event = threading.Event()
+            writer.call_after_writes(event.set)
+            flushed.append(event)
+        for event in flushed:
+            event.wait()
+
+    def close(self) -> None:
+        """Stop the writer threads and close the sources' connections (both reopen on next use)"""
+        with self._writers_lock:
+            writers, self._writers = self._writers, []
+        for writer in writers:
+            writer.close()
+        for source in self.sources.values():
+            if isinstance(source, MBTilesAdapter):
+                source.close()
+
+    def _extract_zoom(self, source_name: str, zoom: int, output_dir: str, region_name: str,
+                      writers: List[TileFileWriter], bbox: Optional[List[float]] = None,
+                      polygon: Optional[dict] = None,
+                      on_written: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+        """Stream one zoom level of a source into the writer pool (runs in a worker thread)"""
         result = {
             'success': False,
             'tiles_extracted': 0,
             'errors': [],
             'output_path': ''
         }
+        area = 'polygon' if polygon is not None else 'bbox'
+        area_label = 'Polygon bbox' if polygon is not None else 'Bbox'
 
         try:
             extractor = self.get_extractor(source_name)
@@ -134,47 +173,43 @@ class LocalTileService:
                 result['errors'].append(f"Source not available: {source_name}")
                 return result
 
-            # Bounds hint from polygon
-            poly = shape(polygon_geojson)
-            poly = poly.buffer(0) if not poly.is_valid else poly
-            min_lon, min_lat, max_lon, max_lat = poly.bounds
-            bbox_hint = [min_lon, min_lat, max_lon, max_lat]
+            covered = None
+            if polygon is not None:
+                # Bounds hint from polygon; rows are post-filtered by its quadtree cover
+                poly = shape(polygon)
+                poly = poly.buffer(0) if not poly.is_valid else poly
+                bbox = list(poly.bounds)
+                covered = {(x, y) for _, x, y in TileCalculator.iter_tiles_for_polygon(polygon, zoom, zoom)}
 
-            if not extractor.validate_bounds(bbox_hint):
+            if not extractor.validate_bounds(bbox):
                 source_bounds = extractor.get_bounds()
-                result['errors'].append(
-                    f"Polygon bbox {bbox_hint} is outside source bounds {source_bounds}. Use --list-sources to check bounds."
-                )
-                return result
-
-            # Reuse extractor's bbox path then filter by polygon
-            tiles = extractor.extract_tiles(bbox_hint, zoom)
-            if not tiles:
-                result['errors'].append("No tiles found for given polygon and zoom")
+                result['errors'].append(f"{area_label} {bbox} is outside source bounds {source_bounds}. Use --list-sources to see valid coordinate ranges for {source_name}.")
                 return result
 
-            prepared = prep(poly)
-
-            # Get tile type and output path
+            # Get tile type from source to determine file extension and path
             source = self.get_source(source_name)
             tile_type = source.get_tile_type() if source else 'raster'
             extension = 'pbf' if tile_type == 'vector' else 'png'
+            # Output directory with tile type classification (like online sources)
             output_path = os.path.join(output_dir, region_name, tile_type, source_name, str(zoom))
-            os.makedirs(output_path, exist_ok=True)
 
-            # Write only tiles intersecting polygon (post-filter)
+            rows = 0
             tiles_written = 0
-            for x, y, tile_data in tiles:
-                from utils.tile_calculator import TileCalculator
-                tb = TileCalculator.tile_bounds(zoom, x, y)
-                tile_poly = box(tb[0], tb[1], tb[2], tb[3])
-                if not prepared.intersects(tile_poly):
-                    continue
-                tile_path = os.path.join(output_path, str(x), f"{y}.{extension}")
-                os.makedirs(os.path.dirname(tile_path), exist_ok=True)
-                with open(tile_path, 'wb') as f:
-                    f.write(tile_data)
-                tiles_written += 1
+            for batch in extractor.iter_tiles(bbox, zoom, self.batch_size):
+                rows += len(batch)
+                for x, y, tile_data in batch:
+                    if covered is not None and (x, y) not in covered:
+                        continue
+                    # Vector tiles are stored gzip-compressed, like downloaded ones
+                    if tile_type == 'vector':
+                        tile_data = to_gzip(tile_data)
+                    writers[x % len(writers)].put(os.path.join(output_path, str(x), f"{y}.{extension}"), tile_data,
+                                                  on_written=on_written)
+                    tiles_written += 1
+
+            if not rows:
+                result['errors'].append(f"No tiles found for given {area} and zoom")
+                return result
 
             result['success'] = True
             result['tiles_extracted'] = tiles_written
@@ -185,6 +220,39 @@ class LocalTileService:
 
         return result
     
+    def export_subset(self, source_name: str, output_path: str, min_zoom: int, max_zoom: int,
+                      bbox: Optional[List[float]] = None, polygon: Optional[dict] = None,
+                      overwrite: bool = False) -> Dict[str, Any]:
+        """Write a bbox (or polygon cover) and zoom range of an MBTiles source to a new MBTiles file.
+        The copy runs inside SQLite (see MBTilesSubsetExporter); no tile files are written."""
+        result = {
+            'success': False,
+            'tiles_exported': 0,
+            'errors': [],
+            'output_path': output_path
+        }
+        source = self.get_source(source_name)
+        if not isinstance(source, MBTilesAdapter):
+            result['errors'].append(f"Source not found: {source_name}" if source is None
+                                    else f"Not an MBTiles source: {source_name}")
+            return result
+        try:
+            stats = MBTilesSubsetExporter(source.file_path, tms=source.is_tms).export(
+                output_path, min_zoom, max_zoom, bbox=bbox, polygon=polygon, overwrite=overwrite
+            )
+        except (DownloadError, sqlite3.Error, OSError) as e:
+            result['errors'].append(f"Export failed: {e}")
+            return result
+        result.update(stats)
+        result['tiles_exported'] = stats['tiles']
+        if not stats['tiles']:
+            # The area misses the source (or its zoom range): do not leave an empty archive behind
+            os.remove(output_path)
+            result['errors'].append("No tiles found for given area and zoom range")
+            return result
+        result['success'] = True
+        return result
+    
     def get_tile_count(self, source_name: str, bbox: List[float], zoom: int) -> int:
         """Get tile count for given source, bbox and zoom"""
         extractor = self.get_extractor(source_name)
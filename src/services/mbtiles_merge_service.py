@@ -0,0 +1,355 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from services.mbtiles_writer import create_mbtiles_schema
+from services.tile_store import tile_digest
+from utils.tile_calculator import TileCalculator
+from utils.tile_encoding import detect_image_format, to_gzip
+from exceptions.tile_downloader_exceptions import DownloadError
+
+
+CONFLICT_POLICIES = ('first', 'newest', 'largest')
+
+_EXTENSION_FORMATS = {'pbf': 'pbf', 'mvt': 'pbf', 'png': 'png', 'jpg': 'jpg', 'jpeg': 'jpg', 'webp': 'webp'}
+
+# (zoom, column, TMS row, digest, data, score)
+Candidate = Tuple[int, int, int, str, bytes, float]
+
+
+class MBTilesMergeService:
+    """Combine MBTiles files and z/x/y tile directories into one MBTiles file.
+
+    Inputs are scanned in parallel: each zoom of an MBTiles input (read-only
+    connection) and each `x` directory of a tile tree is one unit of work,
+    and the units stream batches to the single writer connection. When
+    several inputs have the same tile, the conflict policy picks it: the
+    earliest input ('first'), the most recently written one ('newest'; file
+    mtime of a tile file, or of the whole MBTiles input) or the biggest
+    payload ('largest'); ties go to the earlier input. The output uses the
+    images/map layout, so identical payloads are stored once. Bounds are the
+    union of the inputs' bounds, and the zoom range comes from the merged
+    tiles. The file is built under a temp name and renamed when complete.
+    """
+
+    def __init__(self, conflict: str = 'first', workers: Optional[int] = None, batch_size: int = 500):
+        if conflict not in CONFLICT_POLICIES:
+            raise DownloadError(f"Unknown conflict policy: {conflict} (use {', '.join(CONFLICT_POLICIES)})")
+        self.conflict = conflict
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.batch_size = max(1, batch_size)
+
+    @staticmethod
+    def _mbtiles_input(path: str, tms: Optional[bool]) -> Dict[str, Any]:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+            if 'tiles' in tables:
+                query = "SELECT tile_column, tile_row, tile_data FROM tiles WHERE zoom_level = ?"
+                zoom_query = "SELECT 1 FROM tiles WHERE zoom_level = ? LIMIT 1"
+            elif 'images' in tables and 'map' in tables:
+                query = ("SELECT m.tile_column, m.tile_row, i.tile_data FROM map m "
+                         "JOIN images i ON i.tile_id = m.tile_id WHERE m.zoom_level = ?")
+                zoom_query = "SELECT 1 FROM map WHERE zoom_level = ? LIMIT 1"
+            else:
+                raise DownloadError(f"{path}: unsupported MBTiles format. Tables found: {sorted(tables)}")
+            metadata = dict(conn.execute("SELECT name, value FROM metadata").fetchall()) if 'metadata' in tables else {}
+            # Zoom levels through the index: one lookup per level instead of a full scan
+            zooms = [zoom for zoom in range(31) if conn.execute(zoom_query, (zoom,)).fetchone()]
+            sample = conn.execute(query + " LIMIT 1", (zooms[0],)).fetchone() if zooms else None
+        except sqlite3.Error as e:
+            raise DownloadError(f"{path}: {e}")
+        finally:
+            conn.close()
+
+        image_format = (metadata.get('format') or '').lower()
+        if not image_format and sample and sample[2]:
+            image_format = detect_image_format(bytes(sample[2][:12])) or 'pbf'
+        if tms is None:
+            # Same rule as MBTilesAdapter: rows are TMS only when the metadata says so
+            tms = metadata.get('scheme', '').lower() == 'tms'
+        return {'path': path, 'kind': 'mbtiles', 'query': query, 'zooms': zooms, 'metadata': metadata, 'tms': tms,
+                'format': 'jpg' if image_format == 'jpeg' else image_format, 'mtime': os.path.getmtime(path)}
+
+    @staticmethod
+    def _directory_input(path: str) -> Dict[str, Any]:
+        columns = []
+        image_format = None
+        for zoom in sorted(os.scandir(path), key=lambda entry: entry.name):
+            if not (zoom.name.isdigit() and zoom.is_dir()):
+                continue
+            for column in os.scandir(zoom.path):
+                if column.name.isdigit() and column.is_dir():
+                    columns.append((int(zoom.name), int(column.name), column.path))
+                    if image_format is None:
+                        with os.scandir(column.path) as files:
+                            for entry in files:
+                                extension = entry.name.rsplit('.', 1)[-1].lower()
+                                if extension in _EXTENSION_FORMATS:
+                                    image_format = _EXTENSION_FORMATS[extension]
+                                    break
+        return {'path': path, 'kind': 'directory', 'columns': columns, 'metadata': {}, 'tms': False,
+                'format': image_format}
+
+    def _candidate(self, zoom: int, x: int, row: int, data: bytes, mtime: float, vector: bool) -> Candidate:
+        if vector:
+            # MBTiles vector tiles are gzip; compressing here also lets raw and gzip copies deduplicate
+            data = to_gzip(data)
+        score = {'first': 0.0, 'newest': mtime, 'largest': float(len(data))}[self.conflict]
+        return zoom, x, row, tile_digest(data), data, score
+
+    def _scan_mbtiles(self, source: Dict[str, Any], zoom: int, vector: bool) -> Iterator[List[Candidate]]:
+        conn = sqlite3.connect(f"file:{source['path']}?mode=ro", uri=True)
+        try:
+            cursor = conn.execute(source['query'], (zoom,))
+            while True:
+                rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                yield [self._candidate(zoom, x, row if source['tms'] else (1 << zoom) - 1 - row, bytes(data),
+                                       source['mtime'], vector) for x, row, data in rows if data]
+        finally:
+            conn.close()
+
+    def _scan_column(self, zoom: int, x: int, column_dir: str, vector: bool) -> Iterator[List[Candidate]]:
+        batch = []
+        with os.scandir(column_dir) as entries:
+            files = [entry for entry in entries if entry.is_file() and not entry.name.endswith('.tmp')]
+        for entry in files:
+            y = entry.name.split('.', 1)[0]
+            if not y.isdigit():
+                continue
+            with open(entry.path, 'rb') as f:
+                data = f.read()
+            if not data:
+                continue
+            mtime = entry.stat().st_mtime if self.conflict == 'newest' else 0.0
+            # Files are XYZ; rows are stored TMS
+            batch.append(self._candidate(zoom, x, (1 << zoom) - 1 - int(y), data, mtime, vector))
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @staticmethod
+    def _input_bounds(source: Dict[str, Any], extent: Dict[int, List[int]]) -> Optional[List[float]]:
+        """Declared bounds of an MBTiles input, else the tile extent at its deepest zoom"""
+        try:
+            bounds = [float(value) for value in source['metadata'].get('bounds', '').split(',')]
+            if len(bounds) == 4:
+                return bounds
+        except ValueError:
+            pass
+        if not extent:
+            return None
+        zoom = max(extent)
+        min_x, max_x, min_row, max_row = extent[zoom]
+        west = TileCalculator.tile_bounds(zoom, min_x, (1 << zoom) - 1 - min_row)
+        east = TileCalculator.tile_bounds(zoom, max_x, (1 << zoom) - 1 - max_row)
+        return [west[0], west[1], east[2], east[3]]
+
+    @staticmethod
+    def _merged_vector_layers(sources: List[Dict[str, Any]]) -> Optional[str]:
+        """`json` metadata with the vector_layers of all inputs (first definition of each id wins)"""
+        merged, layers = None, {}
+        for source in sources:
+            try:
+                document = json.loads(source['metadata'].get('json') or 'null')
+            except ValueError:
+                continue
+            if not isinstance(document, dict):
+                continue
+            if merged is None:
+                merged = document
+            for layer in document.get('vector_layers') or []:
+                layers.setdefault(layer.get('id'), layer)
+        if merged is None:
+            return None
+        merged['vector_layers'] = list(layers.values())
+        return json.dumps(merged)
+
+    def merge(self, inputs: List[str], output_path: str, overwrite: bool = False,
+              tms: Optional[Dict[str, bool]] = None) -> Dict[str, Any]:
+        """Merge inputs (.mbtiles files or z/x/y directories, earliest first) into output_path; returns stats.
+
+        tms maps an MBTiles input path to whether its rows are TMS, overriding its metadata `scheme`.
+        """
+        if not inputs:
+            raise DownloadError("Nothing to merge")
+        if os.path.exists(output_path) and not overwrite:
+            raise DownloadError(f"{output_path} already exists")
+        sources = []
+        for path in inputs:
+            if os.path.abspath(path) == os.path.abspath(output_path):
+                raise DownloadError("The merged file cannot be one of its inputs")
+            if os.path.isdir(path):
+                sources.append(self._directory_input(path))
+            elif os.path.isfile(path):
+                sources.append(self._mbtiles_input(path, (tms or {}).get(path)))
+            else:
+                raise DownloadError(f"Input not found: {path}")
+        formats = [source['format'] for source in sources if source['format']]
+        if 'pbf' in formats and any(image_format != 'pbf' for image_format in formats):
+            raise DownloadError(f"Cannot merge vector and raster inputs (formats: {', '.join(sorted(set(formats)))})")
+        vector = 'pbf' in formats
+
+        started = time.monotonic()
+        directory = os.path.dirname(output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = output_path + '.tmp'
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+        units = []
+        for index, source in enumerate(sources):
+            if source['kind'] == 'mbtiles':
+                units.extend((index, zoom, lambda s=source, z=zoom: self._scan_mbtiles(s, z, vector))
+                             for zoom in source['zooms'])
+            else:
+                units.extend((index, zoom, lambda z=zoom, x=x, p=path: self._scan_column(z, x, p, vector))
+                             for zoom, x, path in source['columns'])
+
+        batches: queue.Queue = queue.Queue(maxsize=self.workers * 2)
+        stop = threading.Event()
+
+        def send(message) -> bool:
+            # Gives up once the merge is aborted, so no worker stays blocked on a full queue
+            while not stop.is_set():
+                try:
+                    batches.put(message, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def scan(unit) -> None:
+            index, zoom, scanner = unit
+            error = None
+            try:
+                for batch in scanner():
+                    if not send((index, zoom, batch, None)):
+                        return
+            except Exception as e:
+                error = f"{sources[index]['path']} (zoom {zoom}): {e}"
+            # A batch of None marks the end of the unit
+            send((index, zoom, None, error))
+
+        conn = sqlite3.connect(temp_path)
+        try:
+            # Must precede the first table: lets superseded payloads be released without a full VACUUM
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # A fresh file that only becomes visible once complete needs no journal
+            conn.execute("PRAGMA journal_mode=OFF")
+            conn.execute("PRAGMA synchronous=OFF")
+            create_mbtiles_schema(conn, dedup=True)
+            # Best candidate per tile so far; `rank` is minus the input index, so earlier inputs win ties
+            conn.execute("CREATE TEMP TABLE choice (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, "
+                         "tile_id TEXT, score REAL, rank INTEGER, "
+                         "PRIMARY KEY (zoom_level, tile_column, tile_row)) WITHOUT ROWID")
+
+            candidates = [0] * len(sources)
+            errors = []
+            extents: List[Dict[int, List[int]]] = [{} for _ in sources]
+            remaining = len(units)
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for unit in units:
+                    executor.submit(scan, unit)
+                try:
+                    while remaining and not errors:
+                        index, zoom, batch, error = batches.get()
+                        if batch is None:
+                            remaining -= 1
+                            if error:
+                                errors.append(error)
+                            continue
+                        candidates[index] += len(batch)
+                        if not batch:
+                            continue
+                        columns = [candidate[1] for candidate in batch]
+                        rows = [candidate[2] for candidate in batch]
+                        extent = extents[index].setdefault(zoom, [min(columns), max(columns), min(rows), max(rows)])
+                        extent[:] = [min(extent[0], min(columns)), max(extent[1], max(columns)),
+                                     min(extent[2], min(rows)), max(extent[3], max(rows))]
+                        with conn:
+                            for zoom_level, x, row, digest, data, score in batch:
+                                won = conn.execute(
+                                    """INSERT INTO temp.choice VALUES (?, ?, ?, ?, ?, ?)
+                                       ON CONFLICT (zoom_level, tile_column, tile_row) DO UPDATE
+                                       SET tile_id = excluded.tile_id, score = excluded.score, rank = excluded.rank
+                                       WHERE (excluded.score, excluded.rank) > (choice.score, choice.rank)""",
+                                    (zoom_level, x, row, digest, score, -index)
+                                ).rowcount
+                                if won:
+                                    # Only payloads of the current winners are stored, identical ones once
+                                    conn.execute("INSERT OR IGNORE INTO images (tile_data, tile_id) VALUES (?, ?)",
+                                                 (data, digest))
+                finally:
+                    # Also on errors: lets the workers still running give up before the pool shuts down
+                    stop.set()
+            if errors:
+                raise DownloadError(f"Failed to read {len(errors)} input part(s): {'; '.join(errors[:3])}")
+
+            with conn:
+                # The WITHOUT ROWID table is read in key order, so map rows go in index order too
+                conn.execute("INSERT INTO main.map SELECT zoom_level, tile_column, tile_row, tile_id FROM temp.choice")
+                # Payloads of tiles a better candidate replaced later
+                conn.execute("DELETE FROM images WHERE tile_id NOT IN (SELECT tile_id FROM map)")
+                per_input = dict(conn.execute("SELECT -rank, COUNT(*) FROM temp.choice GROUP BY rank").fetchall())
+                tiles, zoom_low, zoom_high = conn.execute(
+                    "SELECT COUNT(*), MIN(zoom_level), MAX(zoom_level) FROM map").fetchone()
+                images = conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+                input_bounds = [self._input_bounds(source, extents[index]) for index, source in enumerate(sources)]
+                input_bounds = [bounds for bounds in input_bounds if bounds]
+                metadata = {key: value for key, value in sources[0]['metadata'].items()
+                            if key in ('type', 'version', 'description')}
+                attributions = []
+                for source in sources:
+                    attribution = source['metadata'].get('attribution')
+                    if attribution and attribution not in attributions:
+                        attributions.append(attribution)
+                if attributions:
+                    metadata['attribution'] = ' | '.join(attributions)
+                vector_layers = self._merged_vector_layers(sources)
+                if vector_layers:
+                    metadata['json'] = vector_layers
+                metadata.update(name=os.path.splitext(os.path.basename(output_path))[0], scheme='tms',
+                                format=formats[0] if formats else 'png')
+                if tiles:
+                    metadata['minzoom'] = str(zoom_low)
+                    metadata['maxzoom'] = str(zoom_high)
+                if input_bounds:
+                    bounds = [min(b[0] for b in input_bounds), min(b[1] for b in input_bounds),
+                              max(b[2] for b in input_bounds), max(b[3] for b in input_bounds)]
+                    metadata['bounds'] = ','.join(f"{value:.6f}" for value in bounds)
+                    if tiles:
+                        metadata['center'] = (f"{(bounds[0] + bounds[2]) / 2:.6f},"
+                                              f"{(bounds[1] + bounds[3]) / 2:.6f},{zoom_low}")
+                conn.executemany("INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)", list(metadata.items()))
+            conn.execute("PRAGMA incremental_vacuum")
+        except BaseException:
+            stop.set()
+            conn.close()
+            os.remove(temp_path)
+            raise
+        conn.close()
+        os.replace(temp_path, output_path)
+
+        return {
+            'inputs': [{'path': source['path'], 'candidates': candidates[index], 'tiles': per_input.get(index, 0)}
+                       for index, source in enumerate(sources)],
+            'candidates': sum(candidates),
+            'tiles': tiles,
+            'conflicts': sum(candidates) - tiles,
+            'images': images,
+            'zooms': (zoom_low, zoom_high) if tiles else None,
+            'bytes': os.path.getsize(output_path),
+            'seconds': round(time.monotonic() - started, 3)
+        }
@@ -0,0 +1,154 @@
+import os
+import sqlite3
+import time
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from shapely.geometry import shape
+
+from services.mbtiles_writer import create_mbtiles_schema
+from utils.mbtiles_utils import MBTilesUtils
+from utils.tile_calculator import TileCalculator
+from exceptions.tile_downloader_exceptions import DownloadError
+
+
+class MBTilesSubsetExporter:
+    """Copy an area and zoom range of an MBTiles file into a new MBTiles file.
+
+    Source and target are ATTACHed to one connection, and the tiles are copied
+    with set-based INSERT ... SELECT statements, so no tile passes through
+    Python. The area is a bbox or the quadtree cover of a polygon. Either way
+    it becomes a small temp table of tile rectangles, which drives index range
+    scans on the source. A source in the deduplicated images/map layout keeps
+    that layout, and only the images still referenced are copied. The source
+    metadata is copied, with bounds, zoom range and center adjusted (dropped
+    when the subset has no area or no tiles). The file is built under a temp
+    name and renamed into place when it is complete.
+    """
+
+    def __init__(self, source_path: str, tms: bool = True):
+        self.source_path = source_path
+        # Whether tile_row is stored TMS (flipped) or XYZ
+        self.tms = tms
+
+    def _cover(self, min_zoom: int, max_zoom: int, bbox: Optional[List[float]],
+               polygon: Optional[dict]) -> Iterator[Tuple[int, int, int, int, int]]:
+        """(zoom, min_x, max_x, min_row, max_row) rectangles in stored rows"""
+        if polygon is not None:
+            ranges = TileCalculator.iter_polygon_cover_ranges(polygon, min_zoom, max_zoom, bbox)
+        else:
+            ranges = ((zoom, *MBTilesUtils.bbox_to_tile_range(bbox, zoom)) for zoom in range(min_zoom, max_zoom + 1))
+        for zoom, min_x, max_x, min_y, max_y in ranges:
+            if self.tms:
+                min_y, max_y = (1 << zoom) - 1 - max_y, (1 << zoom) - 1 - min_y
+            yield zoom, min_x, max_x, min_y, max_y
+
+    @staticmethod
+    def _area_bounds(bbox: Optional[List[float]], polygon: Optional[dict],
+                     source_bounds: Optional[List[float]]) -> Optional[List[float]]:
+        """Bounds of the exported area, clipped to the source bounds"""
+        area = list(shape(polygon).bounds) if polygon is not None else list(bbox)
+        if polygon is not None and bbox is not None:
+            area = [max(area[0], bbox[0]), max(area[1], bbox[1]), min(area[2], bbox[2]), min(area[3], bbox[3])]
+        if source_bounds and len(source_bounds) == 4:
+            area = [max(area[0], source_bounds[0]), max(area[1], source_bounds[1]),
+                    min(area[2], source_bounds[2]), min(area[3], source_bounds[3])]
+        if area[0] > area[2] or area[1] > area[3]:
+            return None
+        return area
+
+    def export(self, output_path: str, min_zoom: int, max_zoom: int, bbox: Optional[List[float]] = None,
+               polygon: Optional[dict] = None, overwrite: bool = False) -> Dict[str, Any]:
+        """Write the tiles of bbox (or polygon) at min_zoom..max_zoom to output_path; returns stats"""
+        if bbox is None and polygon is None:
+            raise DownloadError("A bbox or a polygon is required to export a subset")
+        if os.path.exists(output_path) and not overwrite:
+            raise DownloadError(f"{output_path} already exists")
+        if os.path.abspath(output_path) == os.path.abspath(self.source_path):
+            raise DownloadError("The subset cannot be written over its source")
+        started = time.monotonic()
+        directory = os.path.dirname(output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = output_path + '.tmp'
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+        # URI mode so the source can be attached read-only
+        conn = sqlite3.connect(f"file:{temp_path}", uri=True)
+        try:
+            # A fresh file that only becomes visible once complete needs no journal
+            conn.execute("PRAGMA journal_mode=OFF")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("ATTACH DATABASE ? AS src", (f"file:{self.source_path}?mode=ro",))
+            tables = {row[0] for row in conn.execute(
+                "SELECT name FROM src.sqlite_master WHERE type IN ('table', 'view')")}
+            dedup = 'images' in tables and 'map' in tables
+            if not dedup and 'tiles' not in tables:
+                raise DownloadError(f"Unsupported MBTiles format. Tables found: {sorted(tables)}")
+            create_mbtiles_schema(conn, dedup)
+
+            conn.execute("CREATE TEMP TABLE cover (zoom_level INTEGER, min_x INTEGER, max_x INTEGER, "
+                         "min_row INTEGER, max_row INTEGER)")
+            conn.executemany("INSERT INTO temp.cover VALUES (?, ?, ?, ?, ?)",
+                             self._cover(min_zoom, max_zoom, bbox, polygon))
+
+            with conn:
+                # CROSS JOIN keeps the cover as the outer loop: one index range scan per rectangle
+                layout = ("map (zoom_level, tile_column, tile_row, tile_id)", "t.tile_id", "src.map")
+                if not dedup:
+                    layout = ("tiles (zoom_level, tile_column, tile_row, tile_data)", "t.tile_data", "src.tiles")
+                conn.execute(
+                    f"""INSERT OR IGNORE INTO main.{layout[0]}
+                        SELECT t.zoom_level, t.tile_column, t.tile_row, {layout[1]}
+                        FROM temp.cover c CROSS JOIN {layout[2]} t
+                        ON t.zoom_level = c.zoom_level
+                        AND t.tile_column BETWEEN c.min_x AND c.max_x
+                        AND t.tile_row BETWEEN c.min_row AND c.max_row"""
+                )
+                if dedup:
+                    # Only the payloads the subset still references
+                    conn.execute(
+                        """INSERT OR IGNORE INTO main.images (tile_data, tile_id)
+                           SELECT i.tile_data, i.tile_id
+                           FROM (SELECT DISTINCT tile_id FROM main.map) d CROSS JOIN src.images i
+                           ON i.tile_id = d.tile_id"""
+                    )
+                if 'metadata' in tables:
+                    conn.execute("INSERT OR REPLACE INTO main.metadata (name, value) SELECT name, value FROM src.metadata")
+
+                table = 'map' if dedup else 'tiles'
+                tiles, zoom_low, zoom_high = conn.execute(
+                    f"SELECT COUNT(*), MIN(zoom_level), MAX(zoom_level) FROM main.{table}").fetchone()
+                images = conn.execute("SELECT COUNT(*) FROM main.images").fetchone()[0] if dedup else None
+                source_bounds = MBTilesUtils.get_mbtiles_bounds(self.source_path)
+                bounds = self._area_bounds(bbox, polygon, source_bounds)
+                updates = {}
+                if bounds is not None:
+                    updates['bounds'] = ','.join(f"{value:.6f}" for value in bounds)
+                if tiles:
+                    updates['minzoom'] = str(zoom_low)
+                    updates['maxzoom'] = str(zoom_high)
+                    if bounds is not None:
+                        updates['center'] = (f"{(bounds[0] + bounds[2]) / 2:.6f},"
+                                             f"{(bounds[1] + bounds[3]) / 2:.6f},{zoom_low}")
+                conn.executemany("INSERT OR REPLACE INTO main.metadata (name, value) VALUES (?, ?)",
+                                 list(updates.items()))
+                # The source's values would describe tiles the subset does not have
+                stale = [(name,) for name in ('bounds', 'minzoom', 'maxzoom', 'center') if name not in updates]
+                conn.executemany("DELETE FROM main.metadata WHERE name = ?", stale)
+            conn.execute("DETACH DATABASE src")
+        except BaseException:
+            conn.close()
+            os.remove(temp_path)
+            raise
+        conn.close()
+        os.replace(temp_path, output_path)
+
+        return {
+            'tiles': tiles,
+            'images': images,
+            'dedup': dedup,
+            'zooms': (zoom_low, zoom_high) if tiles else None,
+            'bytes': os.path.getsize(output_path),
+            'seconds': round(time.monotonic() - started, 3)
+        }
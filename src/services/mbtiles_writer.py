@@ -0,0 +1,283 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from services.tile_store import tile_digest
+from utils.tile_calculator import TileCalculator
+from utils.tile_encoding import detect_image_format
+from exceptions.tile_downloader_exceptions import DownloadError
+
+
+_CLOSE = object()
+_CALL = object()
+
+
+def create_mbtiles_schema(conn: sqlite3.Connection, dedup: bool = False) -> None:
+    """Create the MBTiles tables (if missing): a plain `tiles` table, or the
+    content-addressed images/map layout with a `tiles` view when dedup is set"""
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)")
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS metadata_name ON metadata (name)")
+        if dedup:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS map (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_id TEXT)"
+            )
+            conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS map_index ON map (zoom_level, tile_column, tile_row)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS images (tile_data BLOB, tile_id TEXT)")
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS images_id ON images (tile_id)")
+            conn.execute(
+                """CREATE VIEW IF NOT EXISTS tiles AS
+                   SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column,
+                          map.tile_row AS tile_row, images.tile_data AS tile_data
+                   FROM map JOIN images ON images.tile_id = map.tile_id"""
+            )
+        else:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)"
+            )
+            conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)"
+            )
+
+
+class MBTilesWriter:
+    """Write tiles into a single MBTiles file from a dedicated writer thread.
+
+    Any thread may call put(); the writer thread drains the queue into large WAL
+    transactions, each batch sorted by (zoom, column, row) so inserts stay local
+    in the tiles index. Rows use the MBTiles TMS scheme. Metadata (bounds,
+    min/max zoom, format) is written by close().
+
+    With dedup=True the file uses the content-addressed images/map layout (plus a
+    `tiles` view): each distinct payload is stored once, keyed by its digest.
+
+    A batch that fails to commit is lost as a whole: its tiles are reported by
+    pop_error(), put() refuses new tiles and close() raises. call_after_writes()
+    queues a callback that runs once every tile queued before it is committed.
+    """
+
+    def __init__(self, path: str, name: Optional[str] = None, tile_type: str = 'raster',
+                 batch_size: int = 2000, queue_size: int = 10000, flush_interval: float = 2.0,
+                 dedup: bool = False):
+        self.path = path
+        self.name = name or os.path.splitext(os.path.basename(path))[0]
+        self.tile_type = tile_type
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.dedup = dedup
+        self.tiles_written = 0
+        self.payloads_written = 0
+        self.logical_bytes = 0
+        self.physical_bytes = 0
+        self.write_errors = 0
+        self._error: Optional[Exception] = None
+        self._errors: Dict[Tuple[int, int, int], str] = {}
+        self._errors_lock = threading.Lock()
+        self._closed = False
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+
+        # Separate connection for existence checks; WAL lets it read while the writer commits
+        self._reader = sqlite3.connect(path, check_same_thread=False)
+        self._reader_lock = threading.Lock()
+
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name=f"mbtiles-writer-{self.name}", daemon=True)
+        self._thread.start()
+
+    def _create_schema(self) -> None:
+        # An existing file keeps its layout regardless of the requested mode
+        existing = dict(self._conn.execute(
+            "SELECT name, type FROM sqlite_master WHERE name IN ('tiles', 'map')"
+        ).fetchall())
+        if existing:
+            self.dedup = 'map' in existing
+        create_mbtiles_schema(self._conn, self.dedup)
+
+    @staticmethod
+    def _to_tms(zoom: int, y: int) -> int:
+        return (1 << zoom) - 1 - y
+
+    def has_tile(self, zoom: int, x: int, y: int) -> bool:
+        """Check if a (XYZ) tile has already been written (queued tiles are not visible yet)"""
+        query = ("SELECT 1 FROM map WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?" if self.dedup else
+                 "SELECT 1 FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ? AND length(tile_data) > 0")
+        with self._reader_lock:
+            row = self._reader.execute(query, (zoom, x, self._to_tms(zoom, y))).fetchone()
+        return row is not None
+
+    def put(self, zoom: int, x: int, y: int, data: bytes) -> None:
+        """Queue a (XYZ) tile for writing; blocks while the writer is behind"""
+        if self._error is not None:
+            raise DownloadError(f"MBTiles writer for {self.path} failed: {self._error}")
+        if self._closed:
+            raise DownloadError(f"MBTiles writer for {self.path} is closed")
+        # Hash in the calling (download) thread so the writer thread only does I/O
+        digest = tile_digest(data) if self.dedup else None
+        self._queue.put((zoom, x, self._to_tms(zoom, y), data, digest))
+
+    def call_after_writes(self, func, *args) -> None:
+        """Run func(*args) on the writer thread after all previously queued tiles are committed"""
+        if self._closed:
+            raise DownloadError(f"MBTiles writer for {self.path} is closed")
+        self._queue.put((_CALL, func, args))
+
+    def pop_error(self, tile: Tuple[int, int, int]) -> Optional[str]:
+        """Write error of a (XYZ) tile (once), or None if it was committed"""
+        with self._errors_lock:
+            return self._errors.pop(tile, None)
+
+    def _run(self) -> None:
+        batch: List[tuple] = []
+        last_write = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+            if item is _CLOSE:
+                break
+            if item is not None:
+                batch.append(item)
+            if len(batch) >= self.batch_size or (batch and time.monotonic() - last_write >= self.flush_interval):
+                self._write_batch(batch)
+                batch = []
+                last_write = time.monotonic()
+        self._write_batch(batch)
+
+    def _write_batch(self, items: List[tuple]) -> None:
+        batch = [item for item in items if item[0] is not _CALL]
+        if batch:
+            self._write_rows(batch)
+        for item in items:
+            if item[0] is _CALL:
+                try:
+                    item[1](*item[2])
+                except Exception as e:
+                    print(f"MBTiles writer callback failed: {e}")
+
+    def _write_rows(self, batch: List[Tuple[int, int, int, bytes, Optional[str]]]) -> None:
+        # Insert in index order: neighbouring tiles land on neighbouring pages
+        batch.sort(key=lambda row: (row[0], row[1], row[2]))
+        try:
+            with self._conn:
+                if self.dedup:
+                    new_payloads = self._write_dedup_rows(batch)
+                else:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+                        [row[:4] for row in batch]
+                    )
+                    new_payloads = [row[3] for row in batch]
+            self.tiles_written += len(batch)
+            self.payloads_written += len(new_payloads)
+            self.logical_bytes += sum(len(row[3]) for row in batch)
+            self.physical_bytes += sum(len(data) for data in new_payloads)
+        except Exception as e:
+            print(f"Failed to write {len(batch)} tiles to {self.path}: {e}")
+            self._error = e
+            with self._errors_lock:
+                self.write_errors += len(batch)
+                for zoom, x, row, _, _ in batch:
+                    self._errors[(zoom, x, self._to_tms(zoom, row))] = f"Write to {self.path} failed: {e}"
+
+    def _write_dedup_rows(self, batch: List[Tuple[int, int, int, bytes, Optional[str]]]) -> List[bytes]:
+        """Insert map rows and any payloads not stored yet; returns the new payloads"""
+        payloads = {row[4]: row[3] for row in batch}
+        digests = list(payloads)
+        known = set()
+        for start in range(0, len(digests), 500):
+            chunk = digests[start:start + 500]
+            rows = self._conn.execute(
+                f"SELECT tile_id FROM images WHERE tile_id IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            known.update(row[0] for row in rows)
+        new_payloads = [(data, digest) for digest, data in payloads.items() if digest not in known]
+
+        self._conn.executemany("INSERT INTO images (tile_data, tile_id) VALUES (?, ?)", new_payloads)
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO map (zoom_level, tile_column, tile_row, tile_id) VALUES (?, ?, ?, ?)",
+            [(z, x, row, digest) for z, x, row, _, digest in batch]
+        )
+        return [data for data, _ in new_payloads]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Tiles and payload bytes written by this writer, with the resulting dedup ratio"""
+        ratio = self.logical_bytes / self.physical_bytes if self.physical_bytes else None
+        return {
+            'tiles': self.tiles_written,
+            'unique_payloads': self.payloads_written,
+            'logical_bytes': self.logical_bytes,
+            'physical_bytes': self.physical_bytes,
+            'dedup_ratio': round(ratio, 2) if ratio is not None else None
+        }
+
+    def _detect_format(self) -> str:
+        row = self._conn.execute("SELECT tile_data FROM tiles LIMIT 1").fetchone()
+        image_format = detect_image_format(bytes(row[0][:12])) if row and row[0] else None
+        if image_format:
+            return image_format
+        return 'pbf' if self.tile_type == 'vector' else 'png'
+
+    def _build_metadata(self) -> Dict[str, str]:
+        metadata = {
+            'name': self.name,
+            'type': 'baselayer',
+            'version': '1.1',
+            'scheme': 'tms',
+            'format': self._detect_format()
+        }
+        # The extent only needs coordinates: read the map table directly rather than the joined view
+        index_table = 'map' if self.dedup else 'tiles'
+        min_zoom, max_zoom = self._conn.execute(f"SELECT MIN(zoom_level), MAX(zoom_level) FROM {index_table}").fetchone()
+        if max_zoom is None:
+            return metadata
+        metadata['minzoom'] = str(min_zoom)
+        metadata['maxzoom'] = str(max_zoom)
+
+        # Bounds from the tile extent at the deepest zoom (rows are TMS)
+        min_x, max_x, min_row, max_row = self._conn.execute(
+            f"SELECT MIN(tile_column), MAX(tile_column), MIN(tile_row), MAX(tile_row) FROM {index_table} WHERE zoom_level = ?",
+            (max_zoom,)
+        ).fetchone()
+        top_y, bottom_y = self._to_tms(max_zoom, max_row), self._to_tms(max_zoom, min_row)
+        west = TileCalculator.tile_bounds(max_zoom, min_x, bottom_y)
+        east = TileCalculator.tile_bounds(max_zoom, max_x, top_y)
+        bounds = [west[0], west[1], east[2], east[3]]
+        metadata['bounds'] = ','.join(f"{v:.6f}" for v in bounds)
+        metadata['center'] = f"{(bounds[0] + bounds[2]) / 2:.6f},{(bounds[1] + bounds[3]) / 2:.6f},{min_zoom}"
+        return metadata
+
+    def close(self) -> None:
+        """Flush queued tiles, write metadata and checkpoint the WAL into the main file.
+        Raises DownloadError if any batch failed to commit."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_CLOSE)
+        self._thread.join()
+        try:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)",
+                    list(self._build_metadata().items())
+                )
+            # Fold the WAL back so the .mbtiles file can be copied on its own
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            with self._reader_lock:
+                self._reader.close()
+            self._conn.close()
+        if self._error is not None:
+            raise DownloadError(f"MBTiles writer for {self.path} lost {self.write_errors} tiles: {self._error}")
@@ -0,0 +1,163 @@
+import io
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby, islice
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+try:
+    from PIL import Image
+except ImportError:
+    # Optional dependency: only required when building pyramids
+    Image = None
+
+from utils.file_utils import FileUtils
+from utils.tile_existence import TileExistenceIndex
+from exceptions.tile_downloader_exceptions import DownloadError
+
+
+# Child offsets in the 2x2 mosaic of a parent tile: (dx, dy)
+_QUADRANTS = ((0, 0), (1, 0), (0, 1), (1, 1))
+
+
+def _build_parent(parent_path: str, child_paths: List[Optional[str]]) -> Optional[str]:
+    """Downsample the 2x2 children into one parent tile (runs in a pool process); returns an error or None"""
+    try:
+        children = []
+        for (dx, dy), path in zip(_QUADRANTS, child_paths):
+            if path is None:
+                continue
+            with open(path, 'rb') as f:
+                image = Image.open(io.BytesIO(f.read()))
+                image.load()
+            children.append((dx, dy, image))
+        if not children:
+            return "no child tiles"
+
+        size = children[0][2].width
+        image_format = children[0][2].format or 'PNG'
+        # JPEG has no alpha: missing children become black instead of transparent
+        mode = 'RGB' if image_format == 'JPEG' else 'RGBA'
+        mosaic = Image.new(mode, (size * 2, size * 2))
+        for dx, dy, image in children:
+            if image.size != (size, size):
+                image = image.resize((size, size), Image.LANCZOS)
+            mosaic.paste(image.convert(mode), (dx * size, dy * size))
+
+        buffer = io.BytesIO()
+        options = {'quality': 90} if image_format in ('JPEG', 'WEBP') else {}
+        mosaic.resize((size, size), Image.LANCZOS).save(buffer, format=image_format, **options)
+        os.makedirs(os.path.dirname(parent_path), exist_ok=True)
+        FileUtils.write_file_atomic(parent_path, buffer.getvalue())
+        return None
+    except Exception as e:
+        return str(e)
+
+
+def _build_parents(jobs: List[Tuple[str, List[Optional[str]]]]) -> List[Optional[str]]:
+    """Build a chunk of parent tiles (one pool task); returns their errors in order"""
+    return [_build_parent(parent_path, child_paths) for parent_path, child_paths in jobs]
+
+
+class PyramidBuilder:
+    """Build the lower zoom levels of a raster file layer from its deepest zoom.
+
+    Every parent tile at zoom z is the 2x2 mosaic of its children at z+1,
+    downsampled to one tile in the children's image format. Levels are built
+    from the deepest one upwards, so each level feeds the next; the mosaics are
+    rendered in a process pool. Parents already on disk are skipped, as are
+    parents with fewer than four children when complete_only is set (their
+    tiles would be partly empty). Jobs are planned lazily, one parent column
+    at a time, and only a few chunks per worker are in flight.
+    """
+
+    def __init__(self, layer_dir: str, workers: Optional[int] = None, complete_only: bool = False,
+                 extension: str = 'png', chunk_size: int = 32):
+        self.layer_dir = layer_dir
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.complete_only = complete_only
+        self.chunk_size = max(1, chunk_size)
+        self.index = TileExistenceIndex(layer_dir, extension)
+
+    @staticmethod
+    def _require_pillow() -> None:
+        if Image is None:
+            raise DownloadError("Building raster pyramids requires Pillow (pip install Pillow)")
+
+    def deepest_zoom(self) -> Optional[int]:
+        """Highest zoom directory of the layer (None if it has none)"""
+        try:
+            zooms = [int(entry.name) for entry in os.scandir(self.layer_dir)
+                     if entry.name.isdigit() and entry.is_dir()]
+        except FileNotFoundError:
+            return None
+        return max(zooms) if zooms else None
+
+    def _iter_jobs(self, zoom: int, level: Dict[str, int]) -> Iterator[Tuple[int, int, str, List[Optional[str]]]]:
+        """A job per missing parent of one level with the paths of its children; counts skips in level"""
+        # Children come column by column, so the two child columns of a parent column are adjacent
+        for x, children in groupby(self.index.iter_tiles(zoom + 1), key=lambda tile: tile[0] >> 1):
+            for y in sorted({child_y >> 1 for _, child_y in children}):
+                if self.index.contains(zoom, x, y):
+                    level['skipped'] += 1
+                    continue
+                child_paths = []
+                for dx, dy in _QUADRANTS:
+                    child = (zoom + 1, 2 * x + dx, 2 * y + dy)
+                    child_paths.append(self.index.tile_path(*child, create_dir=False)
+                                       if self.index.contains(*child) else None)
+                if self.complete_only and None in child_paths:
+                    level['skipped'] += 1
+                    continue
+                yield x, y, self.index.tile_path(zoom, x, y, create_dir=False), child_paths
+
+    def _finish_chunk(self, zoom: int, chunk: List[Tuple[int, int, str, List[Optional[str]]]],
+                      errors: List[Optional[str]], level: Dict[str, int]) -> None:
+        for (x, y, _, _), error in zip(chunk, errors):
+            if error is None:
+                self.index.add(zoom, x, y)
+                level['built'] += 1
+            else:
+                print(f"Failed to build tile {zoom}/{x}/{y}: {error}")
+                level['failed'] += 1
+
+    def build(self, min_zoom: int = 0, source_zoom: Optional[int] = None) -> Dict[str, Any]:
+        """Build every level from source_zoom - 1 (default: the deepest zoom on disk) down to min_zoom"""
+        self._require_pillow()
+        if source_zoom is None:
+            source_zoom = self.deepest_zoom()
+        stats = {'source_zoom': source_zoom, 'built': 0, 'skipped': 0, 'failed': 0, 'zooms': {}, 'seconds': 0.0}
+        if source_zoom is None or source_zoom <= min_zoom:
+            return stats
+
+        started = time.monotonic()
+        executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        try:
+            for zoom in range(source_zoom - 1, min_zoom - 1, -1):
+                level = {'built': 0, 'skipped': 0, 'failed': 0}
+                jobs = self._iter_jobs(zoom, level)
+                pending = deque()
+                for chunk in iter(lambda: list(islice(jobs, self.chunk_size)), []):
+                    if executor is None:
+                        self._finish_chunk(zoom, chunk, _build_parents([job[2:] for job in chunk]), level)
+                        continue
+                    pending.append((chunk, executor.submit(_build_parents, [job[2:] for job in chunk])))
+                    # Bound the chunks in flight instead of queueing the whole level
+                    if len(pending) >= self.workers * 2:
+                        chunk, future = pending.popleft()
+                        self._finish_chunk(zoom, chunk, future.result(), level)
+                while pending:
+                    chunk, future = pending.popleft()
+                    self._finish_chunk(zoom, chunk, future.result(), level)
+
+                stats['zooms'][zoom] = level
+                for key in ('built', 'skipped', 'failed'):
+                    stats[key] += level[key]
+                print(f"  Zoom {zoom}: {level['built']} built, {level['skipped']} already present or skipped, "
+                      f"{level['failed']} failed")
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        stats['seconds'] = round(time.monotonic() - started, 3)
+        return stats
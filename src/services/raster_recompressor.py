@@ -0,0 +1,188 @@
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    from PIL import Image
+except ImportError:
+    # Optional dependency: only required when recompressing raster tiles
+    Image = None
+
+from services.tile_store import ContentAddressedTileStore
+from utils.file_utils import FileUtils
+from utils.tile_encoding import detect_image_format
+from exceptions.tile_downloader_exceptions import DownloadError
+
+
+TARGET_FORMATS = ('png', 'webp', 'jpeg')
+_PIL_FORMATS = {'png': 'PNG', 'webp': 'WEBP', 'jpeg': 'JPEG'}
+_STAT_KEYS = ('tiles', 'recompressed', 'unchanged', 'failed', 'bytes_before', 'bytes_after')
+
+# Dedup store of the pool process, created on first use (the store itself is not picklable)
+_tile_stores: Dict[str, ContentAddressedTileStore] = {}
+
+
+def _encode_tile(data: bytes, target: str, quality: int) -> Optional[bytes]:
+    """New tile bytes in the target format, or None when the tile is kept as it is"""
+    source_format = detect_image_format(data)
+    if source_format is None:
+        return None
+    if target == 'png':
+        # Lossless optimisation of PNG tiles only: other formats would only grow
+        if source_format != 'png':
+            return None
+    elif source_format == ('jpg' if target == 'jpeg' else target):
+        # Never re-encode a lossy tile into its own format again
+        return None
+
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    buffer = io.BytesIO()
+    if target == 'png':
+        image.save(buffer, format='PNG', optimize=True)
+    elif target == 'webp':
+        image.save(buffer, format='WEBP', quality=quality, method=4)
+    else:
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            image = image.convert('RGBA')
+            # JPEG has no alpha: tiles with transparent pixels stay as they are
+            if image.getchannel('A').getextrema()[0] < 255:
+                return None
+        image.convert('RGB').save(buffer, format='JPEG', quality=quality, optimize=True)
+    content = buffer.getvalue()
+    if target == 'png' and len(content) >= len(data):
+        return None
+    return content
+
+
+def _recompress_files(paths: List[str], target: str, quality: int, store_root: Optional[str]) -> Dict[str, int]:
+    """Re-encode the given tile files; missing ones are skipped (runs in a pool process)"""
+    stats = dict.fromkeys(_STAT_KEYS, 0)
+    store = None
+    if store_root is not None:
+        store = _tile_stores.get(store_root)
+        if store is None:
+            store = _tile_stores[store_root] = ContentAddressedTileStore(store_root)
+    for path in paths:
+        try:
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            stats['tiles'] += 1
+            content = _encode_tile(data, target, quality)
+            if content is None:
+                stats['unchanged'] += 1
+                continue
+            if store is not None and os.stat(path).st_nlink > 1:
+                store.write_tile(path, content, make_dirs=False)
+            else:
+                FileUtils.write_file_atomic(path, content)
+            stats['recompressed'] += 1
+            stats['bytes_before'] += len(data)
+            stats['bytes_after'] += len(content)
+        except Exception as e:
+            print(f"Failed to recompress {path}: {e}")
+            stats['failed'] += 1
+    return stats
+
+
+def _recompress_column(column_dir: str, target: str, quality: int, store_root: Optional[str]) -> Dict[str, int]:
+    """Re-encode the tiles of one `x` directory (runs in a pool process)"""
+    with os.scandir(column_dir) as entries:
+        paths = [entry.path for entry in entries if entry.is_file() and not entry.name.endswith('.tmp')]
+    return _recompress_files(paths, target, quality, store_root)
+
+
+class RasterRecompressor:
+    """Re-encode the raster tiles of file layers in a process pool.
+
+    target 'png' optimises PNG tiles losslessly and keeps a result only when
+    it is smaller; 'webp' and 'jpeg' convert tiles at the given quality (tiles
+    already in that format are not re-encoded, and tiles with transparency are
+    not turned into JPEG). Tiles keep their `<y>.png` path, so indexes, resume
+    and the viewer URLs are unaffected; the actual format is recorded in the
+    layer metadata. Each `x` directory (or, for a given tile set, each chunk of
+    tiles) is one unit of work; a bounded number of units is in flight at once.
+    """
+
+    def __init__(self, output_dir: str, target: str = 'png', quality: int = 80, workers: Optional[int] = None):
+        if target not in TARGET_FORMATS:
+            raise DownloadError(f"Unknown raster format '{target}' (choose from {', '.join(TARGET_FORMATS)})")
+        self.output_dir = output_dir
+        self.target = target
+        self.quality = max(1, min(100, quality))
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        store_root = os.path.join(output_dir, '.tile_store')
+        self.store_root = store_root if os.path.isdir(store_root) else None
+
+    @staticmethod
+    def _require_pillow() -> None:
+        if Image is None:
+            raise DownloadError("Recompressing raster tiles requires Pillow (pip install Pillow)")
+
+    @staticmethod
+    def _columns(layer_dir: str, zooms: Optional[Tuple[int, int]] = None) -> List[str]:
+        columns = []
+        try:
+            zoom_entries = list(os.scandir(layer_dir))
+        except FileNotFoundError:
+            return columns
+        for zoom in zoom_entries:
+            if not zoom.name.isdigit() or not zoom.is_dir():
+                continue
+            if zooms is not None and not zooms[0] <= int(zoom.name) <= zooms[1]:
+                continue
+            columns.extend(column.path for column in os.scandir(zoom.path)
+                           if column.name.isdigit() and column.is_dir())
+        return columns
+
+    @staticmethod
+    def _tile_chunks(layer_dirs: List[str], tiles: Iterable[Tuple[int, int, int]],
+                     chunk_size: int) -> Iterator[Tuple[str, List[str]]]:
+        """(layer, tile paths) units covering the tiles in every layer, read lazily from tiles"""
+        tile_iter = iter(tiles)
+        while True:
+            chunk = list(islice(tile_iter, chunk_size))
+            if not chunk:
+                return
+            for layer_dir in layer_dirs:
+                yield layer_dir, [os.path.join(layer_dir, str(z), str(x), f"{y}.png") for z, x, y in chunk]
+
+    def recompress_layers(self, layer_dirs: List[str], zooms: Optional[Tuple[int, int]] = None,
+                          tiles: Optional[Iterable[Tuple[int, int, int]]] = None,
+                          chunk_size: int = 256) -> Dict[str, Any]:
+        """Re-encode the tiles of the given layer directories: all of them (optionally only zooms
+        min..max), or only the given (z, x, y) tiles; returns totals and per-layer stats"""
+        self._require_pillow()
+        started = time.monotonic()
+        if tiles is not None:
+            units = ((layer_dir, _recompress_files, (paths,))
+                     for layer_dir, paths in self._tile_chunks(layer_dirs, tiles, max(1, chunk_size)))
+        else:
+            units = ((layer_dir, _recompress_column, (column,))
+                     for layer_dir in layer_dirs for column in self._columns(layer_dir, zooms))
+        layers = {layer_dir: dict.fromkeys(_STAT_KEYS, 0) for layer_dir in layer_dirs}
+
+        def collect(futures) -> None:
+            for future in futures:
+                layer_stats = layers[in_flight.pop(future)]
+                for key, value in future.result().items():
+                    layer_stats[key] += value
+
+        in_flight = {}
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for layer_dir, func, args in units:
+                in_flight[executor.submit(func, *args, self.target, self.quality, self.store_root)] = layer_dir
+                if len(in_flight) >= self.workers * 4:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+            collect(list(in_flight))
+        totals = {key: sum(stats[key] for stats in layers.values()) for key in _STAT_KEYS}
+        totals['layers'] = layers
+        totals['seconds'] = round(time.monotonic() - started, 3)
+        return totals
@@ -0,0 +1,243 @@
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Any, Optional
+from urllib.parse import urlsplit
+
+
+THROTTLE_STATUS_CODES = (429, 503)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (delta-seconds or HTTP-date) into seconds"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except Exception:
+        return None
+
+
+class TokenBucket:
+    """Thread-safe token bucket; rate can be adjusted while in use"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(1.0, float(rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self) -> None:
+        """Block until one token is available"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def set_rate(self, rate: float) -> None:
+        with self._lock:
+            self._refill()
+            self.rate = max(0.1, min(self.max_rate, rate))
+
+
+class AdaptiveHostLimiter:
+    """Per-host concurrency limit driven by additive-increase/multiplicative-decrease.
+
+    The limit grows by roughly one slot per round of healthy (2xx/3xx)
+    responses and is halved on 429/503, on a sustained error rate, or when
+    latency degrades. A Retry-After on a 429/503 pauses the whole host; other
+    4xx answers (e.g. 404 for tiles outside coverage) leave the limit alone.
+    """
+
+    def __init__(self, host: str, initial_concurrency: int, max_concurrency: int,
+                 min_concurrency: int = 1, requests_per_second: Optional[float] = None,
+                 burst: Optional[float] = None, latency_target: Optional[float] = None,
+                 window_size: int = 50, error_threshold: float = 0.2):
+        self.host = host
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.limit = float(min(max(initial_concurrency, self.min_concurrency), self.max_concurrency))
+        self.latency_target = latency_target
+        self.error_threshold = error_threshold
+        self.bucket = TokenBucket(requests_per_second, burst) if requests_per_second else None
+
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._outcomes = deque(maxlen=window_size)
+        self._latency_ewma: Optional[float] = None
+        self._latency_floor: Optional[float] = None
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+        # Counters
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self.decreases = 0
+
+    def acquire(self, abort: Optional[Callable[[], bool]] = None) -> bool:
+        """Block until a concurrency slot (and a token, if rate-limited) is available.
+        Returns False without a slot once abort() is true (checked at least every 0.5s)."""
+        with self._cond:
+            while True:
+                if abort is not None and abort():
+                    return False
+                now = time.monotonic()
+                if now < self.paused_until:
+                    self._cond.wait(min(self.paused_until - now, 0.5) if abort is not None
+                                    else self.paused_until - now)
+                    continue
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    break
+                self._cond.wait(0.5)
+        if self.bucket is not None:
+            self.bucket.acquire()
+        return True
+
+    def release(self, status: Optional[int], latency: float, retry_after: Optional[float] = None) -> None:
+        """Release a slot and feed the outcome (status None = transport error) into AIMD"""
+        now = time.monotonic()
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            self.requests += 1
+
+            throttled = status in THROTTLE_STATUS_CODES
+            failed = status is None or status >= 500
+            if not (throttled or failed) and status >= 400:
+                # A client error says nothing about the host's capacity
+                self._cond.notify_all()
+                return
+            self._outcomes.append(not (throttled or failed))
+
+            if throttled:
+                self.throttled += 1
+                if retry_after:
+                    self.paused_until = max(self.paused_until, now + retry_after)
+                self._decrease(now)
+            elif failed:
+                self.errors += 1
+                if self._error_rate() > self.error_threshold:
+                    self._decrease(now)
+            else:
+                self._record_latency(latency)
+                if self._is_latency_healthy(latency) and self._error_rate() <= self.error_threshold / 4:
+                    self._increase()
+                elif not self._is_latency_healthy(latency):
+                    self._decrease(now)
+
+            self._cond.notify_all()
+
+    def _error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return 1.0 - sum(self._outcomes) / len(self._outcomes)
+
+    def _record_latency(self, latency: float) -> None:
+        if self._latency_ewma is None:
+            self._latency_ewma = latency
+        else:
+            self._latency_ewma = 0.8 * self._latency_ewma + 0.2 * latency
+        if self._latency_floor is None or self._latency_ewma < self._latency_floor:
+            self._latency_floor = self._latency_ewma
+
+    def _is_latency_healthy(self, latency: float) -> bool:
+        if self.latency_target is not None:
+            return latency <= self.latency_target
+        if self._latency_floor is None:
+            return True
+        # Tolerate some jitter above the best observed latency before backing off
+        return self._latency_ewma <= max(3.0 * self._latency_floor, 0.25)
+
+    def _increase(self) -> None:
+        self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+        if self.bucket is not None:
+            self.bucket.set_rate(self.bucket.rate + self.bucket.max_rate * 0.01)
+
+    def _decrease(self, now: float) -> None:
+        # At most one multiplicative decrease per round-trip; in-flight responses to
+        # the same congestion event must not collapse the limit to the floor
+        cooldown = max(self._latency_ewma or 0.0, 1.0)
+        if now - self._last_decrease < cooldown:
+            return
+        self._last_decrease = now
+        self.decreases += 1
+        self.limit = max(float(self.min_concurrency), self.limit / 2.0)
+        if self.bucket is not None:
+            self.bucket.set_rate(self.bucket.rate / 2.0)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'limit': round(self.limit, 2),
+                'max_concurrency': self.max_concurrency,
+                'in_flight': self.in_flight,
+                'requests': self.requests,
+                'throttled': self.throttled,
+                'errors': self.errors,
+                'decreases': self.decreases,
+                'latency_ewma': round(self._latency_ewma, 4) if self._latency_ewma is not None else None,
+                'rate': round(self.bucket.rate, 2) if self.bucket is not None else None
+            }
+
+
+class HostRateLimiter:
+    """Registry of adaptive limiters keyed by hostname.
+
+    Several configured servers that resolve to the same hostname (e.g.
+    CartoDB_Light and CartoDB_Dark) share one limiter and therefore one cap.
+    """
+
+    def __init__(self, initial_concurrency: int = 15, max_concurrency: Optional[int] = None,
+                 host_limits: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.initial_concurrency = max(1, initial_concurrency)
+        self.max_concurrency = max_concurrency or self.initial_concurrency * 4
+        self.host_limits = host_limits or {}
+        self._limiters: Dict[str, AdaptiveHostLimiter] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_host(url: str) -> str:
+        return (urlsplit(url).hostname or '').lower()
+
+    def get_limiter(self, url: str) -> AdaptiveHostLimiter:
+        host = self.get_host(url)
+        with self._lock:
+            limiter = self._limiters.get(host)
+            if limiter is None:
+                overrides = self.host_limits.get(host, {})
+                limiter = AdaptiveHostLimiter(
+                    host,
+                    initial_concurrency=overrides.get('initial_concurrency', self.initial_concurrency),
+                    max_concurrency=overrides.get('max_concurrency', self.max_concurrency),
+                    min_concurrency=overrides.get('min_concurrency', 1),
+                    requests_per_second=overrides.get('requests_per_second'),
+                    burst=overrides.get('burst'),
+                    latency_target=overrides.get('latency_target')
+                )
+                self._limiters[host] = limiter
+            return limiter
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {host: limiter.get_stats() for host, limiter in limiters.items()}
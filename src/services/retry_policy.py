@@ -0,0 +1,137 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from typing import Dict, Any, List, Optional, Set
+
+from models.tile_server import TileServer
+from exceptions.tile_downloader_exceptions import ConfigurationError, ServerError
+
+
+DEFAULT_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class RetryPolicy:
+    """When (and whether) to retry a failed tile request.
+
+    A tile gets `attempts` tries per server. The wait before retry n is
+    `base_delay * 2 ** (n - 1)`, capped at `max_delay`, with up to `jitter`
+    (a fraction) taken off at random so retries of many tiles do not arrive
+    in lockstep. A Retry-After header from the server raises the wait to the
+    requested pause (still capped at `max_delay`). HTTP errors are retried only
+    for `statuses`; transport errors and empty bodies are always retried, an
+    open circuit breaker never is.
+    """
+
+    def __init__(self, attempts: int = 3, base_delay: float = 0.5, max_delay: float = 30.0,
+                 jitter: float = 0.5, statuses: Optional[List[int]] = None, respect_retry_after: bool = True):
+        self.attempts = max(1, int(attempts))
+        self.base_delay = max(0.0, float(base_delay))
+        self.max_delay = max(self.base_delay, float(max_delay))
+        self.jitter = min(1.0, max(0.0, float(jitter)))
+        self.statuses = frozenset(DEFAULT_RETRY_STATUSES if statuses is None else statuses)
+        self.respect_retry_after = respect_retry_after
+
+    @classmethod
+    def from_config(cls, settings: Optional[Dict[str, Any]], attempts: int = 3) -> 'RetryPolicy':
+        """Policy from a `retry` config section; `attempts` is the default when the section has none"""
+        settings = dict(settings or {})
+        settings.setdefault('attempts', attempts)
+        try:
+            return cls(**settings)
+        except (TypeError, ValueError) as e:
+            raise ConfigurationError(f"Invalid retry settings {settings}: {e}")
+
+    def is_retryable(self, error: BaseException) -> bool:
+        if isinstance(error, ServerError):
+            return False
+        status = getattr(error, 'status', None)
+        return status is None or status in self.statuses
+
+    def retry_delay(self, failures: int, error: BaseException) -> Optional[float]:
+        """Seconds to wait before the next try after `failures` failed tries, or None to give up"""
+        if failures >= self.attempts or not self.is_retryable(error):
+            return None
+        delay = min(self.max_delay, self.base_delay * 2 ** (failures - 1))
+        delay -= delay * self.jitter * random.random()
+        retry_after = getattr(error, 'retry_after', None)
+        if self.respect_retry_after and retry_after is not None:
+            delay = max(delay, min(self.max_delay, retry_after))
+        return delay
+
+
+class RetryPolicyRegistry:
+    """Retry policy per server: the service defaults overridden by the server's own `retry` settings"""
+
+    def __init__(self, settings: Optional[Dict[str, Any]] = None, attempts: int = 3):
+        self.settings = settings or {}
+        self.attempts = attempts
+        self._policies: Dict[str, RetryPolicy] = {}
+        self._lock = threading.Lock()
+
+    def get(self, server: TileServer) -> RetryPolicy:
+        with self._lock:
+            policy = self._policies.get(server.get_name())
+            if policy is None:
+                policy = self._policies[server.get_name()] = RetryPolicy.from_config(
+                    {**self.settings, **(server.retry or {})}, self.attempts
+                )
+            return policy
+
+
+class RetryLater(Exception):
+    """Raised by a worker to hand its tile back to the scheduler for a delayed retry"""
+
+    def __init__(self, delay: float, error: BaseException):
+        super().__init__(str(error))
+        self.delay = delay
+        self.error = error
+
+
+class TileRetryState:
+    """Failed tries per server of one tile, kept while the tile waits for its next try"""
+
+    __slots__ = ('failures', 'exhausted')
+
+    def __init__(self):
+        self.failures: Dict[str, int] = {}
+        self.exhausted: Set[str] = set()
+
+    def record_failure(self, server_name: str) -> int:
+        self.failures[server_name] = self.failures.get(server_name, 0) + 1
+        return self.failures[server_name]
+
+
+class DelayedQueue:
+    """Items waiting until a point in time, released in due order (not thread-safe)"""
+
+    def __init__(self):
+        self._heap: List[Any] = []
+        self._sequence = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, item: Any, delay: float) -> None:
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._sequence), item))
+
+    def pop_ready(self) -> List[Any]:
+        """Items whose delay has passed, earliest first"""
+        now = time.monotonic()
+        ready = []
+        while self._heap and self._heap[0][0] <= now:
+            ready.append(heapq.heappop(self._heap)[2])
+        return ready
+
+    def next_ready_in(self) -> Optional[float]:
+        """Seconds until the next item is due (None when empty)"""
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - time.monotonic())
+
+    def clear(self) -> int:
+        """Drop every waiting item; returns how many there were"""
+        count = len(self._heap)
+        self._heap = []
+        return count
@@ -0,0 +1,101 @@
+import threading
+from typing import Dict, Any, Callable, Optional
+from urllib.parse import urlsplit
+import requests
+
+
+class SessionPool:
+    """Long-lived, thread-safe pool of HTTP sessions keyed by upstream host.
+
+    One session (and therefore one urllib3 connection pool) is kept per host so
+    that keep-alive connections survive across tiles and TLS handshakes are paid
+    once per connection instead of once per request.
+    """
+
+    def __init__(self, session_factory: Callable[[], requests.Session]):
+        self._session_factory = session_factory
+        self._sessions: Dict[str, requests.Session] = {}
+        self._request_counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_host_key(url: str) -> str:
+        """Return the pool key (scheme://host[:port]) for a URL"""
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}".lower()
+
+    def get_session(self, url: str) -> requests.Session:
+        """Get (or lazily create) the shared session for the URL's host"""
+        host = self.get_host_key(url)
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = self._session_factory()
+                self._sessions[host] = session
+                self._request_counts[host] = 0
+            self._request_counts[host] += 1
+        return session
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-host pool statistics (requests, new connections, reuse ratio, open connections)"""
+        with self._lock:
+            sessions = dict(self._sessions)
+            request_counts = dict(self._request_counts)
+
+        stats = {}
+        for host, session in sessions.items():
+            host_stats = {
+                'requests': request_counts.get(host, 0),
+                'connections_created': None,
+                'open_connections': None,
+                'reuse_ratio': None
+            }
+            pool_stats = self._get_urllib3_stats(session, host)
+            if pool_stats:
+                host_stats.update(pool_stats)
+            stats[host] = host_stats
+        return stats
+
+    def _get_urllib3_stats(self, session: requests.Session, host: str) -> Optional[Dict[str, Any]]:
+        """Read connection counters from the urllib3 pools behind a session"""
+        try:
+            adapter = session.get_adapter(host + '/')
+            pools = [adapter.poolmanager.pools[key] for key in adapter.poolmanager.pools.keys()]
+        except Exception:
+            # Sessions without an HTTPAdapter (e.g. test doubles) expose no pool counters
+            return None
+
+        connections_created = 0
+        pool_requests = 0
+        open_connections = 0
+        for pool in pools:
+            connections_created += getattr(pool, 'num_connections', 0)
+            pool_requests += getattr(pool, 'num_requests', 0)
+            queue = getattr(pool, 'pool', None)
+            if queue is None:
+                continue
+            idle = sum(1 for conn in list(queue.queue) if conn is not None)
+            in_use = max(0, pool.maxsize - queue.qsize()) if hasattr(pool, 'maxsize') else 0
+            open_connections += idle + in_use
+
+        reuse_ratio = 0.0
+        if pool_requests > 0:
+            reuse_ratio = max(0.0, 1.0 - connections_created / pool_requests)
+
+        return {
+            'connections_created': connections_created,
+            'open_connections': open_connections,
+            'reuse_ratio': round(reuse_ratio, 4)
+        }
+
+    def close(self) -> None:
+        """Close all pooled sessions and their connections"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+            self._request_counts.clear()
+        for session in sessions:
+            try:
+                session.close()
+            except Exception:
+                pass
@@ -0,0 +1,158 @@
+import glob
+import json
+import os
+import shutil
+import sqlite3
+from typing import Dict, Any, List, Tuple
+
+from services.mbtiles_writer import MBTilesWriter
+from services.tile_validators import TileValidatorIndex
+
+
+MANIFEST_NAME = 'shard_manifest.json'
+
+# Parameters every shard of one job must agree on
+_JOB_KEYS = ('bbox', 'polygon_checksum', 'min_zoom', 'max_zoom', 'shard_count', 'partition_zoom', 'online_sources',
+             'output_format')
+
+
+def shard_root(output_dir: str, shard_index: int, shard_count: int) -> str:
+    """Output root of one shard: its tiles, journal and validator index live below it"""
+    return os.path.join(output_dir, 'shards', f"shard-{shard_index}-of-{shard_count}")
+
+
+class ShardMergeService:
+    """Combine the outputs of sharded download jobs into one region tree.
+
+    Each shard writes `<output_dir>/shards/shard-<i>-of-<n>/<region>/` plus a
+    shard_manifest.json describing the job and its journal counts. Merging
+    first checks that every shard is present, that all shards ran the same job
+    and that none of them left tiles undone; only then files are hardlinked
+    (or copied) into `<output_dir>/<region>/`, MBTiles files are merged row by
+    row and the validator indexes are combined.
+    """
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+
+    def find_manifests(self, region_name: str) -> List[Tuple[str, Dict[str, Any]]]:
+        """(shard region directory, manifest) of every shard found for the region"""
+        pattern = os.path.join(self.output_dir, 'shards', 'shard-*-of-*', region_name, MANIFEST_NAME)
+        found = []
+        for manifest_path in sorted(glob.glob(pattern)):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                found.append((os.path.dirname(manifest_path), json.load(f)))
+        return found
+
+    def verify(self, manifests: List[Dict[str, Any]]) -> List[str]:
+        """Problems that prevent a complete merge (empty list when the shards are complete)"""
+        if not manifests:
+            return ["No shard manifests found"]
+        problems = []
+        reference = manifests[0]
+        shard_count = reference['shard_count']
+        for manifest in manifests[1:]:
+            for key in _JOB_KEYS:
+                if manifest.get(key) != reference.get(key):
+                    problems.append(f"Shard {manifest['shard_index']} was run with a different {key} "
+                                    f"({manifest.get(key)} != {reference.get(key)})")
+
+        seen = {m['shard_index'] for m in manifests}
+        for index in range(shard_count):
+            if index not in seen:
+                problems.append(f"Shard {index} of {shard_count} is missing")
+
+        for manifest in sorted(manifests, key=lambda m: m['shard_index']):
+            missing = manifest['expected_tiles'] - manifest['done_tiles']
+            if missing > 0:
+                problems.append(
+                    f"Shard {manifest['shard_index']} left {missing} of {manifest['expected_tiles']} tiles undone "
+                    f"({manifest['failed_tiles']} failed, status {manifest['status']}); rerun it with "
+                    f"--resume {manifest['job_id']}{' --retry-failed' if manifest['failed_tiles'] else ''} "
+                    f"--shard-index {manifest['shard_index']} --shard-count {shard_count}"
+                )
+        return problems
+
+    def merge(self, region_name: str) -> Dict[str, Any]:
+        """Verify and merge the shards of a region; result has 'problems' when nothing was merged"""
+        found = self.find_manifests(region_name)
+        manifests = [manifest for _, manifest in found]
+        result = {'shards': len(found), 'files': 0, 'mbtiles_tiles': 0, 'problems': self.verify(manifests)}
+        if result['problems']:
+            return result
+
+        target_dir = os.path.join(self.output_dir, region_name)
+        mbtiles_sources: Dict[str, List[str]] = {}
+        for shard_dir, _ in found:
+            for dirpath, _, filenames in os.walk(shard_dir):
+                relative_dir = os.path.relpath(dirpath, shard_dir)
+                for filename in filenames:
+                    if filename == MANIFEST_NAME:
+                        continue
+                    relative = os.path.normpath(os.path.join(relative_dir, filename))
+                    if filename.endswith('.mbtiles'):
+                        mbtiles_sources.setdefault(relative, []).append(os.path.join(dirpath, filename))
+                    elif not filename.endswith(('-wal', '-shm', '-journal')):
+                        self._link_file(os.path.join(dirpath, filename), os.path.join(target_dir, relative))
+                        result['files'] += 1
+
+        for relative, sources in mbtiles_sources.items():
+            result['mbtiles_tiles'] += self._merge_mbtiles(sources, os.path.join(target_dir, relative))
+
+        self._merge_validators([os.path.dirname(shard_dir) for shard_dir, _ in found])
+        result['manifest'] = manifests[0]
+        return result
+
+    @staticmethod
+    def _link_file(source: str, target: str) -> None:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            os.remove(target)
+        try:
+            os.link(source, target)
+        except OSError:
+            # Different file system (or no hardlink support): copy instead
+            shutil.copyfile(source, target)
+
+    @staticmethod
+    def _merge_mbtiles(sources: List[str], target: str) -> int:
+        """Stream the rows of the shard MBTiles files into one (keeps the dedup layout if the shards used it)"""
+        def is_dedup(path: str) -> bool:
+            conn = sqlite3.connect(path)
+            try:
+                return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'map'").fetchone() is not None
+            finally:
+                conn.close()
+
+        name, _ = os.path.splitext(os.path.basename(target))
+        tile_type = os.path.basename(os.path.dirname(target))
+        writer = MBTilesWriter(target, name=name, tile_type=tile_type, dedup=is_dedup(sources[0]))
+        written = 0
+        try:
+            for source in sources:
+                conn = sqlite3.connect(source)
+                try:
+                    for zoom, x, row, data in conn.execute(
+                        "SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles"
+                    ):
+                        # Rows are TMS; the writer takes XYZ
+                        writer.put(zoom, x, (1 << zoom) - 1 - row, bytes(data))
+                        written += 1
+                finally:
+                    conn.close()
+        finally:
+            writer.close()
+        return written
+
+    def _merge_validators(self, shard_roots: List[str]) -> None:
+        """Fold the shards' ETag/Last-Modified indexes into the main one, so refreshes cover the merged region"""
+        paths = [os.path.join(root, 'metadata', 'tile_validators.sqlite') for root in shard_roots]
+        paths = [path for path in paths if os.path.exists(path)]
+        if not paths:
+            return
+        index = TileValidatorIndex(os.path.join(self.output_dir, 'metadata', 'tile_validators.sqlite'))
+        try:
+            for path in paths:
+                index.merge_from(path)
+        finally:
+            index.close()
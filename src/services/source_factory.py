@@ -3,6 +3,7 @@ from interfaces.tile_source import ITileSource
 from adapters.mbtiles_adapter import MBTilesAdapter
 from models.tile_server import TileServer
 from models.local_source import LocalSource
+from services.retry_policy import RetryPolicy
 
 
 class SourceFactory:
@@ -30,12 +31,20 @@ class SourceFactory:
     def _create_http_source(config: Dict[str, Any]) -> Optional[TileServer]:
         """Create HTTP tile server"""
         try:
-            return TileServer(
+            server = TileServer(
                 name=config['name'],
                 url=config['url'],
                 headers=config.get('headers', {}),
-                tile_type=config.get('tile_type', 'raster')
+                tile_type=config.get('tile_type', 'raster'),
+                mirrors=config.get('mirrors', []),
+                subdomains=config.get('subdomains', []),
+                mirror_strategy=config.get('mirror_strategy', 'quadkey'),
+                hedge_after=config.get('hedge_after'),
+                retry=config.get('retry') or {}
             )
+            # Fail on unknown retry settings now rather than mid-download
+            RetryPolicy.from_config(server.retry)
+            return server
         except Exception as e:
             print(f"Failed to create HTTP source: {e}")
             return None
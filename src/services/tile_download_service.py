@@ -1,40 +1,91 @@
 import time
 import os
-from typing import Dict, Any, List, Tuple
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+from typing import Dict, Any, List, Tuple, Optional, Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
 import requests
 from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 
 from interfaces.tile_server import ITileDownloader
 from models.tile_server import TileServer
+from services.session_pool import SessionPool
+from services.rate_limiter import HostRateLimiter, parse_retry_after
+from services.hedging import HedgeTracker
+from services.circuit_breaker import ServerHealthRegistry
+from services.retry_policy import RetryPolicyRegistry, RetryLater, TileRetryState, DelayedQueue
+from services.mbtiles_writer import MBTilesWriter
+from services.tile_store import ContentAddressedTileStore, merge_dedup_stats
+from services.tile_validators import TileValidatorIndex, layer_key, is_stale, conditional_headers
+from services.tile_file_writer import TileFileWriter
+from services.download_metrics import DownloadMetrics
 from utils.file_utils import FileUtils
-from exceptions.tile_downloader_exceptions import DownloadError, ServerError
+from utils.tile_existence import TileExistenceIndex
+from utils.tile_encoding import to_gzip
+from exceptions.tile_downloader_exceptions import DownloadError, ServerError, TileRequestError
+
+
+# Failed tiles are counted; only this many error messages are kept in batch results
+MAX_ERROR_SAMPLES = 100
 
 
 class TileDownloadService(ITileDownloader):
     """Service for downloading map tiles"""
     
-    def __init__(self, max_workers: int = 15, retry_attempts: int = 3, timeout: int = 30):
+    def __init__(self, max_workers: int = 15, retry_attempts: int = 3, timeout: int = 30,
+                 max_concurrency_per_host: Optional[int] = None,
+                 rate_limits: Optional[Dict[str, Dict[str, Any]]] = None,
+                 drain_timeout: float = 10.0, output_format: str = 'files', dedup: bool = False,
+                 circuit_breaker: Optional[Dict[str, Any]] = None, health_ordering: bool = False,
+                 writer_queue_size: int = 1000, fsync: bool = False,
+                 retry: Optional[Dict[str, Any]] = None):
         self.max_workers = max_workers
         self.retry_attempts = retry_attempts
         self.timeout = timeout
+        # 'files' writes z/x/y files, 'mbtiles' writes one MBTiles file per region and layer
+        self.output_format = output_format
+        # Store each distinct payload once (hardlinked files, or images/map MBTiles)
+        self.dedup = dedup
+        # Seconds in-flight tiles get to finish after cancel() before the batch returns
+        self.drain_timeout = drain_timeout
+        self._cancel_event = threading.Event()
+        # Monotonic time the running batch stops waiting for in-flight tiles (set by cancel())
+        self._drain_deadline: Optional[float] = None
+        # Payload bytes received since the service was created (read by refresh budgets)
+        self.bytes_received = 0
+        self._bytes_lock = threading.Lock()
+        # Long-lived per-host sessions; resolved lazily so create_session can be overridden
+        self.session_pool = SessionPool(lambda: self.create_session())
+        # Adaptive (AIMD) concurrency + optional token bucket per upstream hostname
+        self.rate_limiter = HostRateLimiter(
+            initial_concurrency=max_workers,
+            max_concurrency=max_concurrency_per_host,
+            host_limits=rate_limits
+        )
+        # Latency history for hedged requests; the executor only exists during a batch
+        self.hedge_tracker = HedgeTracker()
+        self._hedge_executor: Optional[ThreadPoolExecutor] = None
+        # Per-server circuit breakers; failing servers are skipped instead of retried per tile
+        self.server_health = ServerHealthRegistry(circuit_breaker, health_ordering)
+        # Backoff per server; in a batch, tiles wait for their retry in a delay queue, not in a worker
+        self.retry_policies = RetryPolicyRegistry(retry, retry_attempts)
+        # File output goes through a writer thread; fsync makes each written batch durable
+        self.writer_queue_size = writer_queue_size
+        self.fsync = fsync
+        self._file_writer: Optional[TileFileWriter] = None
+        self._writer_stats: Optional[Dict[str, Any]] = None
+        # Live request/tile counters read by the progress reporter
+        self.metrics = DownloadMetrics()
     
     def create_session(self) -> requests.Session:
-        """Create optimized session for downloads"""
+        """Create optimized session for downloads (pool sized to the worker count)"""
         session = requests.Session()
         
-        retry_strategy = Retry(
-            total=3,
-            backoff_factor=1.0,
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["GET"]
-        )
-        
+        # No transport-level retries: every status reaches the adaptive limiter and
+        # the circuit breaker, and retries are scheduled by the retry policy
+        pool_size = max(self.max_workers, self.rate_limiter.max_concurrency)
         adapter = HTTPAdapter(
-            max_retries=retry_strategy,
-            pool_connections=20,
-            pool_maxsize=20
+            pool_connections=pool_size,
+            pool_maxsize=pool_size
         )
         
         session.mount("http://", adapter)
@@ -42,132 +93,514 @@ class TileDownloadService(ITileDownloader):
         
         return session
     
+    def get_session(self, url: str) -> requests.Session:
+        """Get the pooled session for the URL's host"""
+        return self.session_pool.get_session(url)
+    
+    def get_pool_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-host connection pool statistics"""
+        return self.session_pool.get_stats()
+    
+    def get_rate_limit_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-host adaptive concurrency statistics"""
+        return self.rate_limiter.get_stats()
+    
+    def get_hedge_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-server hedged request statistics"""
+        return self.hedge_tracker.get_stats()
+    
+    def get_health_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-server circuit breaker state and health"""
+        return self.server_health.get_stats()
+    
+    def get_writer_stats(self) -> Optional[Dict[str, Any]]:
+        """Tile writer queue depth and disk throughput (running batch, else the last one)"""
+        writer = self._file_writer
+        return writer.get_stats() if writer is not None else self._writer_stats
+    
+    def close(self) -> None:
+        """Close pooled sessions"""
+        self.session_pool.close()
+    
+    def cancel(self) -> None:
+        """Stop the running batch: queued tiles are dropped, in-flight tiles drain"""
+        if self._drain_deadline is None:
+            self._drain_deadline = time.monotonic() + self.drain_timeout
+        self._cancel_event.set()
+    
+    def is_cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+    
+    def _drain_expired(self) -> bool:
+        deadline = self._drain_deadline
+        return deadline is not None and time.monotonic() >= deadline
+    
+    def _request_timeout(self) -> float:
+        """Socket timeout of a new request: the configured one, cut to what is left of a drain"""
+        deadline = self._drain_deadline
+        if deadline is None:
+            return self.timeout
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DownloadError("Drain deadline passed; request not sent")
+        return min(self.timeout, remaining)
+    
+    def _fetch_tile(self, zoom: int, x: int, y: int, server: TileServer) -> bytes:
+        """Perform one GET for a tile through the host's adaptive limiter"""
+        response = self._get_tile_response(zoom, x, y, server)
+        self._raise_for_status(response, zoom, x, y, server)
+        return response.content
+    
+    @staticmethod
+    def _raise_for_status(response, zoom: int, x: int, y: int, server: TileServer) -> None:
+        """Raise TileRequestError (with any Retry-After) for an HTTP error status"""
+        if response.status_code >= 400:
+            headers = getattr(response, 'headers', None) or {}
+            raise TileRequestError(f"HTTP {response.status_code} for tile {zoom}/{x}/{y} from {server.get_name()}",
+                                   status=response.status_code,
+                                   retry_after=parse_retry_after(headers.get('Retry-After')))
+    
+    def _get_tile_response(self, zoom: int, x: int, y: int, server: TileServer,
+                           extra_headers: Optional[Dict[str, str]] = None):
+        """GET a tile from one of the server's mirrors; the status is not checked"""
+        request_headers = server.get_headers()
+        if extra_headers:
+            request_headers = {**request_headers, **extra_headers}
+        
+        urls = server.get_tile_urls(zoom, x, y)
+        executor = self._hedge_executor
+        delay = self.hedge_tracker.get_delay(server) if executor is not None else None
+        if delay is None:
+            return self._request_tile(urls[0], server, request_headers)
+        return self._hedged_request(executor, urls[0], urls[1], server, request_headers, delay)
+    
+    def _hedged_request(self, executor: ThreadPoolExecutor, primary_url: str, hedge_url: str,
+                        server: TileServer, request_headers: Dict[str, str], delay: float):
+        """Send the request; if it is still pending after delay, race a copy on the next mirror"""
+        primary = executor.submit(self._request_tile, primary_url, server, request_headers)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        
+        hedge = executor.submit(self._request_tile, hedge_url, server, request_headers)
+        last_error: Optional[BaseException] = None
+        fallback = None
+        for future in as_completed([primary, hedge]):
+            error = future.exception()
+            if error is not None:
+                last_error = error
+                continue
+            response = future.result()
+            if response.status_code < 500:
+                # The slower request finishes in the background and frees its limiter slot
+                self.hedge_tracker.record_hedge(server.get_name(), won=future is hedge)
+                return response
+            fallback = response
+        self.hedge_tracker.record_hedge(server.get_name(), won=False)
+        if fallback is not None:
+            return fallback
+        raise last_error
+    
+    def _request_tile(self, tile_url: str, server: TileServer, request_headers: Dict[str, str]):
+        """One GET through the host's adaptive limiter"""
+        limiter = self.rate_limiter.get_limiter(tile_url)
+        session = self.get_session(tile_url)
+        
+        # Workers waiting for a slot give up once a cancelled batch stops draining
+        if not limiter.acquire(abort=self._drain_expired):
+            self.server_health.get_breaker(server.get_name()).release_probe()
+            raise DownloadError("Drain deadline passed; request not sent")
+        started = time.monotonic()
+        status = None
+        retry_after = None
+        size = 0
+        try:
+            response = session.get(tile_url, headers=request_headers, 
+                                 timeout=self._request_timeout())
+            status = getattr(response, 'status_code', None)
+            headers = getattr(response, 'headers', None) or {}
+            retry_after = parse_retry_after(headers.get('Retry-After'))
+            size = len(response.content or b'')
+        finally:
+            latency = time.monotonic() - started
+            limiter.release(status, latency, retry_after)
+            self.server_health.get_breaker(server.get_name()).record(status, latency)
+            self.metrics.record_request(server.get_name(), status, latency, size)
+        
+        if status is not None and status < 400:
+            self.hedge_tracker.record_latency(server.get_name(), latency)
+        with self._bytes_lock:
+            self.bytes_received += size
+        return response
+    
+    def _check_circuit(self, server: TileServer) -> None:
+        """Fail fast while the server's circuit breaker is open"""
+        if not self.server_health.get_breaker(server.get_name()).allow_request():
+            raise ServerError(f"Circuit open for {server.get_name()}; skipped")
+    
+    def _fetch_tile_validated(self, zoom: int, x: int, y: int, server: TileServer,
+                              validators: Optional[Dict[str, Any]] = None) -> Tuple[Optional[bytes], Dict[str, Any]]:
+        """One try at a tile, conditional when stored validators are given.
+        Returns (content, validators); content is None when the server answered 304."""
+        conditional = conditional_headers(validators)
+        self._check_circuit(server)
+        response = self._get_tile_response(zoom, x, y, server, conditional)
+        headers = getattr(response, 'headers', None) or {}
+        received = {'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified')}
+        if response.status_code == 304 and conditional:
+            return None, received
+        self._raise_for_status(response, zoom, x, y, server)
+        # Reject empty content to avoid creating zero-byte tiles
+        if not response.content:
+            raise DownloadError(f"Empty content received for tile {zoom}/{x}/{y} from {server.get_name()}")
+        return response.content, received
+    
+    def _fetch_tile_once(self, zoom: int, x: int, y: int, server: TileServer) -> bytes:
+        """One try at non-empty tile content"""
+        self._check_circuit(server)
+        content = self._fetch_tile(zoom, x, y, server)
+        # Reject empty content to avoid creating zero-byte tiles
+        if not content:
+            raise DownloadError(f"Empty content received for tile {zoom}/{x}/{y} from {server.get_name()}")
+        return content
+    
     def download_tile(self, zoom: int, x: int, y: int, output_path: str, 
-                     server: TileServer) -> bool:
+                     server: TileServer,
+                     tile_store: Optional[ContentAddressedTileStore] = None) -> bool:
         """Download a single tile"""
-        tile_url = server.get_tile_url(zoom, x, y)
-        
         # Skip only if file exists and is non-empty
         if FileUtils.file_exists(output_path) and FileUtils.get_file_size(output_path) > 0:
             return True
         
-        for attempt in range(self.retry_attempts):
+        content = self._fetch_tile_with_retries(zoom, x, y, server)
+        if server.get_tile_type() == 'vector':
+            content = to_gzip(content)
+        self._write_tile_file(output_path, content, tile_store)
+        return True
+    
+    @staticmethod
+    def _write_tile_file(output_path: str, content: bytes,
+                         tile_store: Optional[ContentAddressedTileStore] = None,
+                         make_dirs: bool = True) -> None:
+        """Write a tile file, through the dedup store when one is given"""
+        if tile_store is not None:
+            tile_store.write_tile(output_path, content, make_dirs)
+            return
+        if make_dirs:
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, 'wb') as f:
+            f.write(content)
+    
+    def _fetch_tile_with_retries(self, zoom: int, x: int, y: int, server: TileServer) -> bytes:
+        """Fetch non-empty tile content, retrying as the server's policy allows.
+        Used for single tiles; batches hand retries to their delay queue instead."""
+        policy = self.retry_policies.get(server)
+        failures = 0
+        while True:
             try:
-                if attempt > 0:
-                    time.sleep(0.5 * attempt)
-                
-                session = self.create_session()
-                response = session.get(tile_url, headers=server.get_headers(), 
-                                     timeout=self.timeout)
-                response.raise_for_status()
-                
-                content = response.content
-                # Reject empty content to avoid creating zero-byte tiles
-                if not content or len(content) == 0:
-                    raise DownloadError(f"Empty content received for tile {zoom}/{x}/{y} from {tile_url}")
-
-                with open(output_path, 'wb') as f:
-                    f.write(content)
-                
-                return True
-                
+                return self._fetch_tile_once(zoom, x, y, server)
             except Exception as e:
-                if attempt == self.retry_attempts - 1:
+                failures += 1
+                delay = policy.retry_delay(failures, e)
+                if delay is None or self.is_cancelled():
                     raise DownloadError(f"Failed to download tile {zoom}/{x}/{y}: {e}")
-                time.sleep(1.0)
-        
-        return False
+                self.metrics.record_retry(server.get_name())
+                time.sleep(delay)
     
-    def download_tiles_batch(self, tiles: List[Tuple[int, int, int]], 
+    def download_tiles_batch(self, tiles: Iterable[Tuple[int, int, int]], 
                            output_dir: str, region_name: str, 
                            servers: List[TileServer],
-                           tile_postprocess=None) -> Dict[str, Any]:
+                           tile_postprocess=None,
+                           tile_callback: Optional[Callable[[Tuple[int, int, int], bool, Optional[str]], None]] = None,
+                           validators: Optional[TileValidatorIndex] = None,
+                           refresh: bool = False,
+                           max_age: Optional[float] = None) -> Dict[str, Any]:
         """Download multiple tiles using multiple servers.
+        tiles may be any iterable (e.g. a generator); it is consumed lazily through a bounded window.
         tile_postprocess: optional callable (bytes, z, x, y, server)->bytes for per-tile post-processing (e.g., raster mask).
+        tile_callback: optional callable (tile, ok, error) invoked for every finished (not cancelled) tile.
+        validators: optional index recording ETag/Last-Modified per fetched tile.
+        refresh: revalidate existing tiles with conditional requests (needs validators);
+        max_age limits that to tiles last fetched more than max_age seconds ago.
         """
         results = {
-            'total': len(tiles),
+            'total': 0,
             'downloaded': 0,
             'failed': 0,
+            'cancelled': 0,
+            'not_modified': 0,
+            'skipped': 0,
             'errors': []
         }
+        results_lock = threading.Lock()
+        self._cancel_event.clear()
+        self._drain_deadline = None
         
         # Separate vector and raster servers
         vector_servers = [s for s in servers if s.get_tile_type() == 'vector']
         raster_servers = [s for s in servers if s.get_tile_type() != 'vector']
         
-        def download_single_tile(tile_info: Tuple[int, int, int]) -> str:
+        # MBTiles output: one writer (and writer thread) per layer, opened on first use
+        stores: Dict[Tuple[str, str], MBTilesWriter] = {}
+        stores_lock = threading.Lock()
+        # MBTiles output: the writer each queued tile went to, so it is journaled once committed
+        queued_in: Dict[Tuple[int, int, int], MBTilesWriter] = {}
+        # File output with dedup: payloads kept once under <output_dir>/.tile_store
+        tile_store = None
+        if self.dedup and self.output_format != 'mbtiles':
+            tile_store = ContentAddressedTileStore(os.path.join(output_dir, '.tile_store'), fsync=self.fsync)
+        # File output: existing tiles per layer, read with one directory scan per zoom level
+        existence: Dict[Tuple[str, str], TileExistenceIndex] = {}
+        # File output: workers hand tiles to the writer thread instead of writing them
+        file_writer = None
+        if self.output_format != 'mbtiles':
+            file_writer = self._file_writer = TileFileWriter(queue_size=self.writer_queue_size, fsync=self.fsync,
+                                                             tile_store=tile_store)
+        
+        def report_written(writer, tile: Tuple[int, int, int]) -> None:
+            error = writer.pop_error(tile)
+            tile_callback(tile, error is None, error)
+        
+        def get_existence(tile_type: str, server: TileServer) -> TileExistenceIndex:
+            key = (tile_type, server.get_name())
+            with stores_lock:
+                index = existence.get(key)
+                if index is None:
+                    layer_dir = os.path.join(output_dir, region_name, tile_type, server.get_name())
+                    index = existence[key] = TileExistenceIndex(layer_dir, 'pbf' if tile_type == 'vector' else 'png')
+                return index
+        
+        def already_present(tile: Tuple[int, int, int]) -> bool:
+            """Pre-flight check: the first server in line already has the tile on disk"""
+            if refresh or self.output_format == 'mbtiles' or not servers:
+                return False
+            tile_type, candidates = ('vector', vector_servers) if vector_servers else ('raster', raster_servers)
+            return get_existence(tile_type, self.server_health.order(candidates)[0]).contains(*tile)
+        
+        def fetch_content(zoom: int, x: int, y: int, tile_type: str, server: TileServer,
+                          exists: bool) -> Optional[bytes]:
+            """New tile content, or None when the stored tile is kept (present, fresh or 304)"""
+            if validators is None:
+                return None if exists else self._fetch_tile_once(zoom, x, y, server)
+            layer = layer_key(region_name, tile_type, server.get_name())
+            entry = None
+            if exists:
+                entry = validators.get(layer, zoom, x, y)
+                if not is_stale(entry, refresh, max_age):
+                    return None
+            content, received = self._fetch_tile_validated(zoom, x, y, server, entry)
+            validators.record(layer, zoom, x, y, received['etag'], received['last_modified'])
+            if content is None:
+                with results_lock:
+                    results['not_modified'] += 1
+            return content
+        
+        def apply_postprocess(content: bytes, zoom: int, x: int, y: int, server: TileServer,
+                              postprocess=None) -> bytes:
+            if postprocess is not None:
+                try:
+                    content = postprocess(content, zoom, x, y, server)
+                except Exception:
+                    # If postprocess fails, keep original
+                    pass
+                # Reject empty content
+                if not content:
+                    raise DownloadError(f"Empty content received for tile {zoom}/{x}/{y} from {server.get_name()}")
+            # Vector tiles are stored gzip-compressed, so the viewer serves them without recompressing
+            return to_gzip(content) if server.get_tile_type() == 'vector' else content
+        
+        def download_to_store(zoom: int, x: int, y: int, tile_type: str, server: TileServer,
+                              postprocess=None) -> bool:
+            key = (tile_type, server.get_name())
+            with stores_lock:
+                store = stores.get(key)
+                if store is None:
+                    store_path = FileUtils.get_mbtiles_path(output_dir, region_name, tile_type, server.get_name())
+                    store = stores[key] = MBTilesWriter(store_path, name=server.get_name(), tile_type=tile_type,
+                                                        dedup=self.dedup)
+            content = fetch_content(zoom, x, y, tile_type, server, store.has_tile(zoom, x, y))
+            if content is not None:
+                store.put(zoom, x, y, apply_postprocess(content, zoom, x, y, server, postprocess))
+                with stores_lock:
+                    queued_in[(zoom, x, y)] = store
+            return True
+        
+        def download_to_file(zoom: int, x: int, y: int, tile_type: str, server: TileServer,
+                             postprocess=None) -> bool:
+            index = get_existence(tile_type, server)
+            # Existing non-empty tiles are kept unless a refresh revalidates them
+            content = fetch_content(zoom, x, y, tile_type, server, index.contains(zoom, x, y))
+            if content is not None:
+                # The index only learns about the tile once it is on disk
+                file_writer.put(index.tile_path(zoom, x, y, create_dir=False),
+                                apply_postprocess(content, zoom, x, y, server, postprocess), (zoom, x, y),
+                                on_written=lambda: index.add(zoom, x, y))
+            return True
+        
+        def download_single_tile(tile_info: Tuple[int, int, int], state: TileRetryState) -> bool:
+            """True if downloaded, False if skipped due to cancellation; raises on failure.
+            Raises RetryLater when a server should be tried again after a delay."""
             zoom, x, y = tile_info
+            if self.is_cancelled():
+                return False
+            last_error: Optional[Exception] = None
             
-            # Try vector servers first
-            if vector_servers:
-                for server in vector_servers:
-                    try:
-                        extension = 'pbf'
-                        tile_path = FileUtils.get_tile_path(
-                            output_dir, region_name, 'vector', server.get_name(),
-                            zoom, x, y, extension
-                        )
-                        
-                        if self.download_tile(zoom, x, y, tile_path, server):
-                            return f"Downloaded: vector/{server.get_name()}/{zoom}/{x}/{y}.{extension}"
-                    except Exception as e:
+            # Try vector servers first, raster servers as fallback
+            for tile_type, candidates, postprocess in (('vector', vector_servers, None),
+                                                       ('raster', raster_servers, tile_postprocess)):
+                for server in self.server_health.order(candidates):
+                    if server.get_name() in state.exhausted:
                         continue
-            
-            # Try raster servers as fallback
-            if raster_servers:
-                for server in raster_servers:
                     try:
-                        extension = 'png'
-                        # Use actual server name instead of hardcoded CartoDB_Light
-                        tile_path = FileUtils.get_tile_path(
-                            output_dir, region_name, 'raster', server.get_name(),
-                            zoom, x, y, extension
-                        )
-                        
-                        if FileUtils.file_exists(tile_path) and FileUtils.get_file_size(tile_path) > 0:
-                            return f"Downloaded: raster/{server.get_name()}/{zoom}/{x}/{y}.{extension}"
+                        if self.output_format == 'mbtiles':
+                            if download_to_store(zoom, x, y, tile_type, server, postprocess):
+                                return True
+                            continue
                         
-                        # Download to memory if postprocess is needed
-                        if tile_postprocess is not None:
-                            session = self.create_session()
-                            response = session.get(server.get_tile_url(zoom, x, y), headers=server.get_headers(), timeout=self.timeout)
-                            response.raise_for_status()
-                            content = response.content
-                            try:
-                                content = tile_postprocess(content, zoom, x, y, server)
-                            except Exception:
-                                # If postprocess fails, keep original
-                                pass
-                            # Reject empty content
-                            if not content or len(content) == 0:
-                                raise DownloadError(f"Empty content received for tile {zoom}/{x}/{y} from {server.get_name()}")
-                            os.makedirs(os.path.dirname(tile_path), exist_ok=True)
-                            with open(tile_path, 'wb') as f:
-                                f.write(content)
-                            return f"Downloaded: raster/{server.get_name()}/{zoom}/{x}/{y}.{extension}"
-                        else:
-                            if self.download_tile(zoom, x, y, tile_path, server):
-                                return f"Downloaded: raster/{server.get_name()}/{zoom}/{x}/{y}.{extension}"
+                        if download_to_file(zoom, x, y, tile_type, server, postprocess):
+                            return True
                     except Exception as e:
+                        last_error = e
+                        delay = self.retry_policies.get(server).retry_delay(
+                            state.record_failure(server.get_name()), e)
+                        if delay is not None and not self.is_cancelled():
+                            self.metrics.record_retry(server.get_name())
+                            raise RetryLater(delay, e)
+                        state.exhausted.add(server.get_name())
+                        self.metrics.record_fallback(server.get_name())
                         continue
             
-            return f"Failed: {zoom}/{x}/{y}"
+            raise DownloadError(f"Failed: {zoom}/{x}/{y}" + (f" ({last_error})" if last_error else ""))
         
-        # Download tiles using thread pool
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            futures = [executor.submit(download_single_tile, tile) for tile in tiles]
-            
-            for future in as_completed(futures):
-                try:
-                    result = future.result()
-                    if "Downloaded:" in result:
+        # Enough threads to fill every distinct host up to its adaptive ceiling;
+        # the per-host limiters decide how many of them actually hit the network
+        host_limiters = {}
+        for server in servers:
+            for template in server.get_url_templates():
+                limiter = self.rate_limiter.get_limiter(template.format(z=0, x=0, y=0))
+                host_limiters[limiter.host] = limiter
+        pool_size = max(self.max_workers, sum(l.max_concurrency for l in host_limiters.values()))
+        if any(s.hedge_after is not None for s in servers):
+            # Requests of hedged servers run here so the worker can stop waiting for a slow one
+            self._hedge_executor = ThreadPoolExecutor(max_workers=pool_size * 2, thread_name_prefix='hedge')
+        
+        # Bounded window of submitted tiles: memory stays flat however large the job
+        # is, and the first requests go out before the producer is exhausted.
+        # Tiles waiting for a retry stay in the window without holding a worker.
+        max_pending = pool_size * 2
+        tile_iter = iter(tiles)
+        producer_done = False
+        
+        executor = ThreadPoolExecutor(max_workers=pool_size)
+        pending = {}
+        delayed = DelayedQueue()
+        self.metrics.set_gauge('queue_depth', lambda: len(pending))
+        self.metrics.set_gauge('retry_queue_depth', lambda: len(delayed))
+        if file_writer is not None:
+            self.metrics.set_gauge('writer_queue_depth', lambda: file_writer.get_stats()['queue_depth'])
+        drain_deadline = None
+        try:
+            while True:
+                for tile, state in delayed.pop_ready():
+                    pending[executor.submit(download_single_tile, tile, state)] = (tile, state)
+                while not producer_done and not self.is_cancelled() and len(pending) + len(delayed) < max_pending:
+                    tile = next(tile_iter, None)
+                    if tile is None:
+                        producer_done = True
+                        break
+                    results['total'] += 1
+                    if already_present(tile):
+                        # Present tiles never reach the worker queue
+                        results['downloaded'] += 1
+                        results['skipped'] += 1
+                        self.metrics.record_tile('skipped')
+                        if tile_callback is not None:
+                            tile_callback(tile, True, None)
+                        continue
+                    state = TileRetryState()
+                    pending[executor.submit(download_single_tile, tile, state)] = (tile, state)
+                if not pending and not delayed:
+                    break
+                
+                if self.is_cancelled() and drain_deadline is None:
+                    # Drop queued and waiting tiles; only requests already on the wire may finish
+                    for future in pending:
+                        future.cancel()
+                    results['cancelled'] += delayed.clear()
+                    drain_deadline = self._drain_deadline or time.monotonic() + self.drain_timeout
+                if drain_deadline is not None and time.monotonic() >= drain_deadline:
+                    break
+                
+                # Wake up for the next due retry, even when no request is running
+                next_retry = delayed.next_ready_in()
+                timeout = 0.5 if next_retry is None else min(0.5, next_retry)
+                if not pending:
+                    # Only tiles waiting for a retry are left
+                    time.sleep(timeout)
+                    continue
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tile, state = pending.pop(future)
+                    if future.cancelled():
+                        results['cancelled'] += 1
+                        continue
+                    error = future.exception()
+                    if isinstance(error, RetryLater):
+                        delayed.push((tile, state), error.delay)
+                        continue
+                    if error is None and not future.result():
+                        results['cancelled'] += 1
+                        continue
+                    ok = error is None
+                    self.metrics.record_tile('downloaded' if ok else 'failed')
+                    if ok:
                         results['downloaded'] += 1
                     else:
                         results['failed'] += 1
-                        results['errors'].append(result)
-                except Exception as e:
-                    results['failed'] += 1
-                    results['errors'].append(str(e))
+                        if len(results['errors']) < MAX_ERROR_SAMPLES:
+                            results['errors'].append(str(error))
+                    with stores_lock:
+                        writer = file_writer or queued_in.pop(tile, None)
+                    if tile_callback is not None:
+                        if ok and writer is not None:
+                            # Journal the tile only once it is on disk
+                            writer.call_after_writes(report_written, writer, tile)
+                        else:
+                            tile_callback(tile, ok, None if ok else str(error))
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        else:
+            # Tiles still running past the drain deadline are abandoned, not waited on
+            results['cancelled'] += len(pending) + delayed.clear()
+            executor.shutdown(wait=drain_deadline is None, cancel_futures=True)
+        finally:
+            if self._hedge_executor is not None:
+                self._hedge_executor.shutdown(wait=False)
+                self._hedge_executor = None
+            if file_writer is not None:
+                file_writer.close()
+                self._writer_stats = file_writer.get_stats()
+                self._file_writer = None
+            # Flush queued tiles and write MBTiles metadata
+            for store in stores.values():
+                try:
+                    store.close()
+                except DownloadError as e:
+                    print(e)
+            if validators is not None:
+                validators.flush()
         
+        write_errors = sum(store.write_errors for store in stores.values())
+        if file_writer is not None:
+            write_errors += file_writer.write_errors
+        if write_errors:
+            # Tiles that were downloaded but could not be written count as failed
+            results['downloaded'] -= write_errors
+            results['failed'] += write_errors
+            if len(results['errors']) < MAX_ERROR_SAMPLES:
+                results['errors'].append(f"{write_errors} tiles could not be written")
+        if self.dedup:
+            parts = [tile_store.get_stats()] if tile_store is not None else [s.get_stats() for s in stores.values()]
+            results['dedup'] = merge_dedup_stats(parts)
         return results 
\ No newline at end of file
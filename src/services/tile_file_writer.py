@@ -0,0 +1,177 @@
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+from services.tile_store import ContentAddressedTileStore
+from utils.file_utils import FileUtils
+from exceptions.tile_downloader_exceptions import DownloadError
+
+
+_CLOSE = object()
+
+
+class TileFileWriter:
+    """Write tile files from a dedicated writer thread fed by a bounded queue.
+
+    Download threads hand over (path, content) and go straight back to the
+    network. The writer thread takes batches off the queue, sorts each batch by
+    path so every directory is created and visited once, and writes each tile to
+    a temp file that is renamed into place: a crash never leaves a truncated
+    tile. With fsync=True every batch is a checkpoint: files are fsynced before
+    their rename, and each directory touched by the batch is fsynced once after.
+
+    call_after_writes() queues a callback that runs once every tile queued before
+    it is on disk (used to journal tiles only after they were written); put()
+    takes an on_written callback that runs only if that tile was written.
+    """
+
+    def __init__(self, queue_size: int = 1000, batch_size: int = 256, flush_interval: float = 0.5,
+                 fsync: bool = False, tile_store: Optional[ContentAddressedTileStore] = None):
+        self.queue_size = max(1, queue_size)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.tile_store = tile_store
+        self._queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        self._known_dirs = set()
+        self._errors: Dict[Tuple[int, int, int], str] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+        # Counters
+        self.files_written = 0
+        self.bytes_written = 0
+        self.write_errors = 0
+        self.batches = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.max_queue_depth = 0
+
+        self._thread = threading.Thread(target=self._run, name="tile-file-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, path: str, content: bytes, tile: Optional[Tuple[int, int, int]] = None,
+            on_written: Optional[Callable[[], None]] = None) -> None:
+        """Queue a tile file; blocks while the disk is behind (the wait is counted as blocked time).
+        on_written runs on the writer thread once the file is on disk (not if the write fails)."""
+        self._enqueue(('write', path, content, tile, on_written))
+
+    def call_after_writes(self, func, *args) -> None:
+        """Run func(*args) on the writer thread after all previously queued tiles are written"""
+        self._enqueue(('call', func, args))
+
+    def _enqueue(self, item) -> None:
+        if self._closed:
+            raise DownloadError("Tile writer is closed")
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            started = time.monotonic()
+            self._queue.put(item)
+            with self._lock:
+                self.blocked_seconds += time.monotonic() - started
+        depth = self._queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def pop_error(self, tile: Tuple[int, int, int]) -> Optional[str]:
+        """Write error of a tile (once), or None if it was written"""
+        with self._lock:
+            return self._errors.pop(tile, None)
+
+    def _run(self) -> None:
+        batch = []
+        last_write = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+            if item is _CLOSE:
+                break
+            if item is not None:
+                batch.append(item)
+            if len(batch) >= self.batch_size or (batch and time.monotonic() - last_write >= self.flush_interval):
+                self._write_batch(batch)
+                batch = []
+                last_write = time.monotonic()
+        self._write_batch(batch)
+
+    def _write_batch(self, batch: List[tuple]) -> None:
+        if not batch:
+            return
+        started = time.monotonic()
+        writes = sorted((item for item in batch if item[0] == 'write'), key=lambda item: item[1])
+        touched_dirs = []
+        written_bytes = 0
+        written = 0
+        on_written = []
+        for _, path, content, tile, callback in writes:
+            directory = os.path.dirname(path)
+            try:
+                if directory not in self._known_dirs:
+                    os.makedirs(directory, exist_ok=True)
+                    self._known_dirs.add(directory)
+                if self.tile_store is not None:
+                    self.tile_store.write_tile(path, content, make_dirs=False)
+                else:
+                    FileUtils.write_file_atomic(path, content, fsync=self.fsync)
+                written += 1
+                written_bytes += len(content)
+                if callback is not None:
+                    on_written.append(callback)
+                if not touched_dirs or touched_dirs[-1] != directory:
+                    touched_dirs.append(directory)
+            except Exception as e:
+                print(f"Failed to write tile {path}: {e}")
+                with self._lock:
+                    self.write_errors += 1
+                    if tile is not None:
+                        self._errors[tile] = f"Write failed for {path}: {e}"
+        if self.fsync:
+            for directory in touched_dirs:
+                FileUtils.fsync_directory(directory)
+        for callback in on_written:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Tile writer callback failed: {e}")
+        with self._lock:
+            self.files_written += written
+            self.bytes_written += written_bytes
+            self.batches += 1
+            self.busy_seconds += time.monotonic() - started
+
+        for item in batch:
+            if item[0] == 'call':
+                try:
+                    item[1](*item[2])
+                except Exception as e:
+                    print(f"Tile writer callback failed: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Queue depth and disk throughput: a full queue with high blocked time means disk-bound"""
+        with self._lock:
+            throughput = self.bytes_written / self.busy_seconds if self.busy_seconds else None
+            return {
+                'files': self.files_written,
+                'bytes': self.bytes_written,
+                'errors': self.write_errors,
+                'batches': self.batches,
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self.max_queue_depth,
+                'queue_size': self.queue_size,
+                'busy_seconds': round(self.busy_seconds, 3),
+                'blocked_seconds': round(self.blocked_seconds, 3),
+                'throughput_mb_s': round(throughput / (1024 * 1024), 2) if throughput is not None else None
+            }
+
+    def close(self) -> None:
+        """Write everything still queued and stop the writer thread"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_CLOSE)
+        self._thread.join()
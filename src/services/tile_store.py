@@ -0,0 +1,127 @@
+import errno
+import hashlib
+import os
+import threading
+import uuid
+from typing import Dict, Any, Iterable
+
+from utils.file_utils import FileUtils
+
+
+def tile_digest(content: bytes) -> str:
+    """Content address of a tile payload"""
+    return hashlib.blake2b(content, digest_size=20).hexdigest()
+
+
+def merge_dedup_stats(parts: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Sum get_stats() results of several stores and recompute the ratio"""
+    parts = list(parts)
+    stats = {key: sum(p[key] for p in parts)
+             for key in ('tiles', 'unique_payloads', 'logical_bytes', 'physical_bytes')}
+    ratio = stats['logical_bytes'] / stats['physical_bytes'] if stats['physical_bytes'] else None
+    stats['dedup_ratio'] = round(ratio, 2) if ratio is not None else None
+    return stats
+
+
+class ContentAddressedTileStore:
+    """Filesystem tile store that keeps one copy of each distinct payload.
+
+    Payloads live under <root>/<aa>/<digest>; every z/x/y tile path is a hardlink
+    to its payload, so the normal directory layout (and the viewer) keep working
+    while identical tiles (open sea, empty land) share one inode. Filesystems
+    without hardlink support fall back to plain copies. With fsync=True new
+    payloads (and copies) are fsynced, and so is the payload's directory.
+    """
+
+    def __init__(self, root: str, fsync: bool = False):
+        self.root = root
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self.tiles = 0
+        self.unique_payloads = 0
+        self.logical_bytes = 0
+        self.physical_bytes = 0
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _write_atomic(self, path: str, content: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        FileUtils.write_file_atomic(path, content, fsync=self.fsync)
+        if self.fsync:
+            FileUtils.fsync_directory(os.path.dirname(path))
+
+    def _create_payload(self, blob_path: str, content: bytes) -> bool:
+        """Write the payload unless it exists; True only for the one writer that created it"""
+        if os.path.exists(blob_path):
+            return False
+        directory = os.path.dirname(blob_path)
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{blob_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            try:
+                # link() refuses an existing name, so concurrent writers of one payload cannot both win
+                os.link(tmp_path, blob_path)
+            except FileExistsError:
+                return False
+            except OSError:
+                # No hardlinks on this filesystem: decide under the lock instead
+                with self._lock:
+                    if os.path.exists(blob_path):
+                        return False
+                    os.replace(tmp_path, blob_path)
+        finally:
+            if os.path.lexists(tmp_path):
+                os.remove(tmp_path)
+        if self.fsync:
+            FileUtils.fsync_directory(directory)
+        return True
+
+    def write_tile(self, path: str, content: bytes, make_dirs: bool = True) -> str:
+        """Store content once and link path to it; returns the digest"""
+        digest = tile_digest(content)
+        blob_path = self._blob_path(digest)
+
+        new_payload = self._create_payload(blob_path, content)
+
+        if make_dirs:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.lexists(path):
+            os.remove(path)
+        copied = False
+        try:
+            os.link(blob_path, path)
+        except OSError as e:
+            if e.errno == errno.EMLINK:
+                # Payload inode hit the filesystem's link limit: start a fresh inode for new links
+                self._write_atomic(blob_path, content)
+                os.link(blob_path, path)
+            else:
+                FileUtils.write_file_atomic(path, content, fsync=self.fsync)
+                copied = True
+
+        with self._lock:
+            self.tiles += 1
+            self.logical_bytes += len(content)
+            if new_payload:
+                self.unique_payloads += 1
+                self.physical_bytes += len(content)
+            if copied:
+                self.physical_bytes += len(content)
+        return digest
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            ratio = self.logical_bytes / self.physical_bytes if self.physical_bytes else None
+            return {
+                'tiles': self.tiles,
+                'unique_payloads': self.unique_payloads,
+                'logical_bytes': self.logical_bytes,
+                'physical_bytes': self.physical_bytes,
+                'dedup_ratio': round(ratio, 2) if ratio is not None else None
+            }
@@ -0,0 +1,168 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, List, Tuple, Optional, Iterator
+
+from utils.tile_calculator import TileCalculator
+
+
+def layer_key(region_name: str, tile_type: str, server_name: str) -> str:
+    """Validator index key of one downloaded layer"""
+    return f"{region_name}/{tile_type}/{server_name}"
+
+
+def is_stale(entry: Optional[Dict[str, Any]], refresh: bool, max_age: Optional[float]) -> bool:
+    """Whether an existing tile with these stored validators should be revalidated"""
+    if not refresh:
+        return False
+    if max_age is None or entry is None:
+        return True
+    return entry['fetched_at'] < time.time() - max_age
+
+
+def conditional_headers(entry: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    """If-None-Match / If-Modified-Since request headers from stored validators"""
+    headers = {}
+    if entry:
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+
+class TileValidatorIndex:
+    """Sidecar SQLite index of HTTP validators per downloaded tile.
+
+    Keeps the ETag, Last-Modified and fetch time of every tile fetched from an
+    online server, so a refresh can send conditional requests and pick the
+    oldest tiles first. Writes are buffered like the download journal.
+    """
+
+    def __init__(self, db_path: str, checkpoint_size: int = 1000, checkpoint_interval: float = 5.0):
+        self.db_path = db_path
+        self.checkpoint_size = checkpoint_size
+        self.checkpoint_interval = checkpoint_interval
+        self._buffer: List[Tuple[str, int, int, int, Optional[str], Optional[str], int]] = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS validators (
+                       layer TEXT NOT NULL,
+                       zoom_level INTEGER NOT NULL,
+                       tile_column INTEGER NOT NULL,
+                       tile_row INTEGER NOT NULL,
+                       etag TEXT,
+                       last_modified TEXT,
+                       fetched_at INTEGER NOT NULL,
+                       PRIMARY KEY (layer, zoom_level, tile_column, tile_row)
+                   ) WITHOUT ROWID"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS validators_age ON validators (layer, fetched_at)"
+            )
+
+    def get(self, layer: str, zoom: int, x: int, y: int) -> Optional[Dict[str, Any]]:
+        """Stored validators of a (XYZ) tile, or None if it was never recorded"""
+        with self._lock:
+            row = self._conn.execute(
+                """SELECT etag, last_modified, fetched_at FROM validators
+                   WHERE layer = ? AND zoom_level = ? AND tile_column = ? AND tile_row = ?""",
+                (layer, zoom, x, y)
+            ).fetchone()
+        if not row:
+            return None
+        return {'etag': row[0], 'last_modified': row[1], 'fetched_at': row[2]}
+
+    def record(self, layer: str, zoom: int, x: int, y: int,
+               etag: Optional[str], last_modified: Optional[str]) -> None:
+        """Buffer the validators of a tile fetched (or revalidated) now"""
+        with self._lock:
+            self._buffer.append((layer, zoom, x, y, etag, last_modified, int(time.time())))
+            due = (len(self._buffer) >= self.checkpoint_size or
+                   time.monotonic() - self._last_flush >= self.checkpoint_interval)
+            if due:
+                self._flush_locked()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        rows, self._buffer = self._buffer, []
+        with self._conn:
+            # A 304 may omit validators; keep the stored ones in that case
+            self._conn.executemany(
+                """INSERT INTO validators (layer, zoom_level, tile_column, tile_row, etag, last_modified, fetched_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (layer, zoom_level, tile_column, tile_row) DO UPDATE SET
+                       etag = COALESCE(excluded.etag, validators.etag),
+                       last_modified = COALESCE(excluded.last_modified, validators.last_modified),
+                       fetched_at = excluded.fetched_at""",
+                rows
+            )
+
+    def _stale_query(self, layers: List[str], bbox: List[float], min_zoom: int, max_zoom: int,
+                     older_than: float) -> Tuple[str, List[Any]]:
+        zoom_clauses = []
+        params: List[Any] = list(layers)
+        for zoom in range(min_zoom, max_zoom + 1):
+            min_x, min_y, max_x, max_y = TileCalculator.get_tile_range(bbox, zoom)
+            zoom_clauses.append("(zoom_level = ? AND tile_column BETWEEN ? AND ? AND tile_row BETWEEN ? AND ?)")
+            params.extend([zoom, min_x, max_x, min_y, max_y])
+        params.append(older_than)
+        # A tile counts once, by its oldest copy across the fallback layers
+        query = f"""SELECT zoom_level, tile_column, tile_row, MIN(fetched_at) AS oldest FROM validators
+                    WHERE layer IN ({','.join('?' * len(layers))}) AND ({' OR '.join(zoom_clauses)})
+                    GROUP BY zoom_level, tile_column, tile_row
+                    HAVING oldest < ?"""
+        return query, params
+
+    def count_stale(self, layers: List[str], bbox: List[float], min_zoom: int, max_zoom: int,
+                    older_than: float) -> int:
+        """Number of recorded tiles in the area last fetched before older_than (epoch seconds)"""
+        self.flush()
+        query, params = self._stale_query(layers, bbox, min_zoom, max_zoom, older_than)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM ({query})", params).fetchone()[0]
+
+    def iter_stale(self, layers: List[str], bbox: List[float], min_zoom: int, max_zoom: int,
+                   older_than: float) -> Iterator[Tuple[int, int, int]]:
+        """Yield recorded tiles in the area last fetched before older_than, oldest first"""
+        self.flush()
+        query, params = self._stale_query(layers, bbox, min_zoom, max_zoom, older_than)
+        # Own read connection: the refresh records new fetch times while this cursor is open
+        reader = sqlite3.connect(self.db_path)
+        try:
+            for zoom, x, y, _ in reader.execute(query + " ORDER BY oldest", params):
+                yield (zoom, x, y)
+        finally:
+            reader.close()
+
+    def merge_from(self, db_path: str) -> None:
+        """Copy every entry of another validator index (e.g. a shard's) into this one"""
+        with self._lock:
+            self._flush_locked()
+            self._conn.execute("ATTACH DATABASE ? AS other", (db_path,))
+            try:
+                with self._conn:
+                    self._conn.execute("INSERT OR REPLACE INTO validators SELECT * FROM other.validators")
+            finally:
+                self._conn.execute("DETACH DATABASE other")
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            self._conn.close()
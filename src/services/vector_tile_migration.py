@@ -0,0 +1,140 @@
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+from services.tile_store import ContentAddressedTileStore
+from utils.file_utils import FileUtils
+from utils.tile_encoding import GZIP_MAGIC, to_gzip
+
+
+class VectorTileGzipMigration:
+    """Convert the vector tiles of existing output trees to gzip in place.
+
+    Tiles written before downloads stored vector tiles pre-gzipped may be raw
+    or zlib PBF, which the viewer has to compress on every request. Each tile
+    is rewritten once: files through a temp file and rename (through the dedup
+    store when they are hardlinked into it), MBTiles rows in batches. zlib
+    releases the GIL, so the compression runs in a thread pool. Tiles that are
+    already gzip are left untouched, so the migration can be rerun safely.
+    MBTiles files must not be written to (or merged) while they are migrated.
+    """
+
+    def __init__(self, output_dir: str, workers: Optional[int] = None, batch_size: int = 500):
+        self.output_dir = output_dir
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.batch_size = max(1, batch_size)
+        store_root = os.path.join(output_dir, '.tile_store')
+        self.tile_store = ContentAddressedTileStore(store_root) if os.path.isdir(store_root) else None
+
+    def find_layers(self, region_name: Optional[str] = None) -> List[Tuple[str, str, str]]:
+        """(region, layer, path) of the vector layers: directories and .mbtiles files"""
+        if region_name:
+            regions = [region_name]
+        else:
+            try:
+                regions = sorted(entry.name for entry in os.scandir(self.output_dir)
+                                 if entry.is_dir() and entry.name not in ('metadata', 'shards', '.tile_store'))
+            except FileNotFoundError:
+                regions = []
+        layers = []
+        for region in regions:
+            vector_dir = os.path.join(self.output_dir, region, 'vector')
+            if not os.path.isdir(vector_dir):
+                continue
+            for entry in sorted(os.scandir(vector_dir), key=lambda entry: entry.name):
+                if entry.is_dir():
+                    layers.append((region, entry.name, entry.path))
+                elif entry.name.endswith('.mbtiles'):
+                    layers.append((region, entry.name[:-len('.mbtiles')], entry.path))
+        return layers
+
+    def _convert_file(self, path: str) -> Tuple[str, int, int]:
+        """('converted' | 'gzip' | 'failed', bytes before, bytes after) for one tile file"""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            if not data or data[:2] == GZIP_MAGIC:
+                return 'gzip', len(data), len(data)
+            content = to_gzip(data)
+            if self.tile_store is not None and os.stat(path).st_nlink > 1:
+                self.tile_store.write_tile(path, content, make_dirs=False)
+            else:
+                FileUtils.write_file_atomic(path, content)
+            return 'converted', len(data), len(content)
+        except Exception as e:
+            print(f"Failed to convert {path}: {e}")
+            return 'failed', 0, 0
+
+    def _convert_column(self, column_dir: str) -> Dict[str, int]:
+        """Convert the tiles of one `x` directory (the unit of work of the pool)"""
+        stats = {'tiles': 0, 'converted': 0, 'failed': 0, 'bytes_before': 0, 'bytes_after': 0}
+        with os.scandir(column_dir) as entries:
+            paths = [entry.path for entry in entries if entry.is_file() and not entry.name.endswith('.tmp')]
+        for path in paths:
+            result, before, after = self._convert_file(path)
+            stats['tiles'] += 1
+            if result == 'failed':
+                stats['failed'] += 1
+            elif result == 'converted':
+                stats['converted'] += 1
+                stats['bytes_before'] += before
+                stats['bytes_after'] += after
+        return stats
+
+    def migrate_directory(self, layer_dir: str) -> Dict[str, int]:
+        columns = []
+        for zoom in os.scandir(layer_dir):
+            if zoom.name.isdigit() and zoom.is_dir():
+                columns.extend(column.path for column in os.scandir(zoom.path)
+                               if column.name.isdigit() and column.is_dir())
+        stats = {'tiles': 0, 'converted': 0, 'failed': 0, 'bytes_before': 0, 'bytes_after': 0}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for column_stats in executor.map(self._convert_column, columns):
+                for key, value in column_stats.items():
+                    stats[key] += value
+        return stats
+
+    def migrate_mbtiles(self, path: str) -> Dict[str, int]:
+        stats = {'tiles': 0, 'converted': 0, 'failed': 0, 'bytes_before': 0, 'bytes_after': 0}
+        conn = sqlite3.connect(path)
+        try:
+            row = conn.execute("SELECT type FROM sqlite_master WHERE name = 'tiles'").fetchone()
+            # Deduplicated files keep the payloads in `images` behind a `tiles` view
+            table = 'images' if row and row[0] == 'view' else 'tiles'
+            last_rowid = -1
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                while True:
+                    rows = conn.execute(f"SELECT rowid, tile_data FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                                        (last_rowid, self.batch_size)).fetchall()
+                    if not rows:
+                        break
+                    last_rowid = rows[-1][0]
+                    stats['tiles'] += len(rows)
+                    pending = [(rowid, bytes(data)) for rowid, data in rows if data and bytes(data[:2]) != GZIP_MAGIC]
+                    converted = list(executor.map(lambda item: to_gzip(item[1]), pending))
+                    conn.executemany(f"UPDATE {table} SET tile_data = ? WHERE rowid = ?",
+                                     [(content, rowid) for (rowid, _), content in zip(pending, converted)])
+                    conn.commit()
+                    stats['converted'] += len(pending)
+                    stats['bytes_before'] += sum(len(data) for _, data in pending)
+                    stats['bytes_after'] += sum(len(content) for content in converted)
+        except sqlite3.Error as e:
+            print(f"Failed to convert {path}: {e}")
+            stats['failed'] += 1
+        finally:
+            conn.close()
+        return stats
+
+    def migrate(self, region_name: Optional[str] = None) -> Dict[str, Any]:
+        """Convert every vector layer of a region (or of all regions); returns per-layer stats"""
+        started = time.monotonic()
+        layers = []
+        for region, layer, path in self.find_layers(region_name):
+            stats = self.migrate_mbtiles(path) if path.endswith('.mbtiles') else self.migrate_directory(path)
+            stats.update(region=region, layer=layer, path=path)
+            layers.append(stats)
+            print(f"  {region}/{layer}: {stats['converted']} of {stats['tiles']} tiles converted, "
+                  f"{stats['failed']} failed")
+        return {'layers': layers, 'seconds': round(time.monotonic() - started, 3)}
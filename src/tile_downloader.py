@@ -28,7 +28,10 @@ def main():
         
         # Create and run the download manager
         manager = TileDownloadManager()
-        manager.run_from_command_line()
+        try:
+            manager.run_from_command_line()
+        finally:
+            manager.close()
         
     except KeyboardInterrupt:
         print("\nDownload interrupted by user.")
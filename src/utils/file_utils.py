@@ -1,6 +1,9 @@
 import os
+import uuid
 from typing import List, Tuple
 
+from utils.tile_existence import TileExistenceIndex
+
 
 class FileUtils:
     """Utility class for file operations"""
@@ -18,6 +21,45 @@ class FileUtils:
         FileUtils.ensure_directory_exists(tile_dir)
         return os.path.join(tile_dir, f"{y}.{extension}")
     
+    @staticmethod
+    def get_mbtiles_path(output_dir: str, region_name: str, tile_type: str, style_name: str) -> str:
+        """Generate the MBTiles file path used for a layer in mbtiles output mode"""
+        layer_dir = os.path.join(output_dir, region_name, tile_type)
+        FileUtils.ensure_directory_exists(layer_dir)
+        return os.path.join(layer_dir, f"{style_name}.mbtiles")
+    
+    @staticmethod
+    def write_file_atomic(file_path: str, content: bytes, fsync: bool = False) -> None:
+        """Write to a temp file next to file_path and rename it into place, so the file is never partial"""
+        tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+                if fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+    
+    @staticmethod
+    def fsync_directory(directory_path: str) -> None:
+        """Persist renames in a directory (no-op where directories cannot be opened, e.g. Windows)"""
+        try:
+            fd = os.open(directory_path, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+    
     @staticmethod
     def file_exists(file_path: str) -> bool:
         """Check if file exists"""
@@ -32,11 +74,6 @@ class FileUtils:
     def count_existing_tiles(tiles: List[Tuple[int, int, int]], output_dir: str, 
                            region_name: str, tile_type: str, style_name: str, 
                            extension: str) -> int:
-        """Count existing tiles"""
-        existing_count = 0
-        for zoom, x, y in tiles:
-            tile_path = FileUtils.get_tile_path(output_dir, region_name, tile_type, 
-                                              style_name, zoom, x, y, extension)
-            if FileUtils.file_exists(tile_path):
-                existing_count += 1
-        return existing_count 
\ No newline at end of file
+        """Count existing non-empty tiles (one directory scan per zoom level)"""
+        index = TileExistenceIndex(os.path.join(output_dir, region_name, tile_type, style_name), extension)
+        return sum(1 for zoom, x, y in tiles if index.contains(zoom, x, y)) 
\ No newline at end of file
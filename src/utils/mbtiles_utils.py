@@ -1,9 +1,10 @@
 import sqlite3
-import math
 import os
 from typing import List, Tuple, Optional, Dict, Any
 from pathlib import Path
 
+from utils.tile_calculator import TileCalculator
+
 
 class MBTilesUtils:
     """Utility class for MBTiles operations"""
@@ -11,11 +12,7 @@ class MBTilesUtils:
     @staticmethod
     def lat_lon_to_tile(lat: float, lon: float, zoom: int) -> Tuple[int, int]:
         """Convert lat/lon to tile coordinates"""
-        lat_rad = math.radians(lat)
-        n = 2.0 ** zoom
-        xtile = int((lon + 180.0) / 360.0 * n)
-        ytile = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
-        return xtile, ytile
+        return TileCalculator.deg2num(lat, lon, zoom)
     
     @staticmethod
     def bbox_to_tile_range(bbox: List[float], zoom: int) -> Tuple[int, int, int, int]:
@@ -23,8 +20,7 @@ class MBTilesUtils:
         min_lon, min_lat, max_lon, max_lat = bbox
         
         # Get tile coordinates for corners
-        min_x, max_y = MBTilesUtils.lat_lon_to_tile(min_lat, min_lon, zoom)
-        max_x, min_y = MBTilesUtils.lat_lon_to_tile(max_lat, max_lon, zoom)
+        min_x, min_y, max_x, max_y = TileCalculator.get_tile_range(bbox, zoom)
         
         return min_x, max_x, min_y, max_y
     
@@ -106,3 +102,21 @@ class MBTilesUtils:
             return None
         except Exception:
             return None
+    
+    @staticmethod
+    def get_mbtiles_tile_stats(file_path: str) -> Dict[str, Any]:
+        """Get available zooms, tile count and total tile bytes of a standard MBTiles file"""
+        stats = {'available_zooms': [], 'tile_count': 0, 'total_size': 0}
+        try:
+            with sqlite3.connect(file_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT zoom_level, COUNT(*), SUM(LENGTH(tile_data)) FROM tiles GROUP BY zoom_level ORDER BY zoom_level"
+                )
+                for zoom, count, size in cursor.fetchall():
+                    stats['available_zooms'].append(int(zoom))
+                    stats['tile_count'] += count
+                    stats['total_size'] += size or 0
+            return stats
+        except Exception:
+            return stats
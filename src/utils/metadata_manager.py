@@ -8,6 +8,8 @@ from datetime import datetime
 import re
 import sys
 
+from utils.tile_encoding import sample_file_encoding, sample_file_format
+
 # Geocoordinate API import
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 try:
@@ -29,6 +31,8 @@ class TileLayerInfo:
     total_size: int
     last_updated: str
     available_zooms: List[int]
+    encoding: Optional[str] = None  # vector tiles: 'gzip', 'raw', 'zlib' or 'mixed'
+    format: Optional[str] = None  # raster tiles: 'png', 'jpg', 'webp' or 'mixed'
 
 
 @dataclass
@@ -239,7 +243,8 @@ class MetadataManager:
     
     def add_layer_info(self, region_name: str, layer_name: str, layer_type: str, 
                       min_zoom: int, max_zoom: int, tile_count: int, 
-                      total_size: int, available_zooms: List[int]):
+                      total_size: int, available_zooms: List[int], encoding: Optional[str] = None,
+                      format: Optional[str] = None):
         """Add or update layer info"""
         region_info = self.update_region_metadata(region_name)
         
@@ -252,7 +257,9 @@ class MetadataManager:
             tile_count=tile_count,
             total_size=total_size,
             last_updated=datetime.now().isoformat(),
-            available_zooms=sorted(available_zooms)
+            available_zooms=sorted(available_zooms),
+            encoding=encoding,
+            format=format
         )
         
         # Add/update layer
@@ -355,11 +362,14 @@ class MetadataManager:
         available_zooms = []
         tile_count = 0
         total_size = 0
+        # First tile of each zoom, to record the encoding (vector) or image format (raster) of the layer
+        samples = []
         
         for zoom_dir in layer_path.iterdir():
             if zoom_dir.is_dir() and zoom_dir.name.isdigit():
                 zoom_level = int(zoom_dir.name)
                 available_zooms.append(zoom_level)
+                zoom_sampled = False
                 
                 # Count tiles
                 for x_dir in zoom_dir.iterdir():
@@ -368,6 +378,9 @@ class MetadataManager:
                             if tile_file.is_file():
                                 tile_count += 1
                                 total_size += tile_file.stat().st_size
+                                if not zoom_sampled:
+                                    samples.append(str(tile_file))
+                                    zoom_sampled = True
         
         if available_zooms:
             min_zoom = min(available_zooms)
@@ -382,7 +395,9 @@ class MetadataManager:
                 max_zoom=max_zoom,
                 tile_count=tile_count,
                 total_size=total_size,
-                available_zooms=available_zooms
+                available_zooms=available_zooms,
+                encoding=sample_file_encoding(samples) if layer_type == 'vector' else None,
+                format=sample_file_format(samples) if layer_type != 'vector' else None
             )
     
     def get_metadata_summary(self) -> Dict[str, Any]:
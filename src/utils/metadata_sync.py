@@ -1,5 +1,6 @@
 import os
 import json
+import sqlite3
 import time
 from pathlib import Path
 from typing import Dict, List, Optional, Any, Set, Tuple
@@ -238,6 +239,11 @@ class MetadataSynchronizer:
                         layer_info = self._scan_layer_directory(layer_dir, tile_type)
                         if layer_info:
                             layers[tile_type][layer_dir.name] = layer_info
+                    elif layer_dir.suffix == '.mbtiles' and layer_dir.stem not in layers[tile_type]:
+                        # Layer downloaded in mbtiles output mode: region/raster|vector/layer_name.mbtiles
+                        layer_info = self._scan_layer_mbtiles(layer_dir, tile_type)
+                        if layer_info:
+                            layers[tile_type][layer_dir.stem] = layer_info
         
         return layers
     
@@ -318,6 +324,32 @@ class MetadataSynchronizer:
             'last_updated': datetime.now().isoformat()
         }
     
+    def _scan_layer_mbtiles(self, mbtiles_path: Path, tile_type: str) -> Optional[Dict[str, Any]]:
+        """Scan a layer stored as a single MBTiles file and return layer information"""
+        try:
+            with sqlite3.connect(str(mbtiles_path)) as conn:
+                rows = conn.execute(
+                    "SELECT zoom_level, COUNT(*), SUM(LENGTH(tile_data)) FROM tiles GROUP BY zoom_level"
+                ).fetchall()
+        except Exception as e:
+            self.logger.warning(f"Error reading MBTiles layer {mbtiles_path}: {e}")
+            return None
+        
+        if not rows:
+            return None
+        
+        available_zooms = [int(row[0]) for row in rows]
+        return {
+            'name': mbtiles_path.stem,
+            'type': tile_type,
+            'min_zoom': min(available_zooms),
+            'max_zoom': max(available_zooms),
+            'tile_count': sum(row[1] for row in rows),
+            'total_size': sum(row[2] or 0 for row in rows),
+            'available_zooms': sorted(available_zooms),
+            'last_updated': datetime.now().isoformat()
+        }
+    
     def _count_tiles_in_zoom(self, zoom_dir: Path) -> Tuple[int, int]:
         """Count tiles and calculate total size for a zoom directory"""
         tile_count = 0
@@ -8,8 +8,9 @@ class TileAnalyzer:
     @staticmethod
     def analyze_region_tiles(bbox: List[float], zoom: int) -> Dict[str, Any]:
         """Analyze tile requirements for a region at specific zoom level"""
-        min_x, max_y = TileCalculator.deg2num(bbox[1], bbox[0], zoom)
-        max_x, min_y = TileCalculator.deg2num(bbox[3], bbox[2], zoom)
+        xs, ys = TileCalculator.deg2num_array([bbox[1], bbox[3]], [bbox[0], bbox[2]], zoom)
+        min_x, max_x = int(xs[0]), int(xs[1])
+        min_y, max_y = int(ys[1]), int(ys[0])
         
         x_range = list(range(min_x, max_x + 1))
         y_range = list(range(min_y, max_y + 1))
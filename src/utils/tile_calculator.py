@@ -1,11 +1,19 @@
 import math
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional, Iterator, Sequence, Union
+import numpy as np
+import shapely
 from shapely.geometry import box, shape
-from shapely.prepared import prep
+
+
+ArrayLike = Union[Sequence[float], np.ndarray]
 
 
 class TileCalculator:
-    """Utility class for tile coordinate calculations"""
+    """Utility class for tile coordinate calculations.
+
+    The `*_array` variants are NumPy kernels converting whole arrays of
+    coordinates per call; they return the same values as the scalar functions.
+    """
     
     @staticmethod
     def deg2num(lat_deg: float, lon_deg: float, zoom: int) -> Tuple[int, int]:
@@ -17,20 +25,84 @@ class TileCalculator:
         return xtile, ytile
     
     @staticmethod
-    def get_tiles_for_bbox(bbox: List[float], min_zoom: int, max_zoom: int) -> List[Tuple[int, int, int]]:
-        """Get all tile coordinates for given bbox and zoom range"""
-        tiles = []
+    def deg2num_array(lats: ArrayLike, lons: ArrayLike, zoom: Union[int, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """Convert arrays of lat/lon to tile x and y arrays (int64)"""
+        lat_rad = np.radians(np.asarray(lats, dtype=np.float64))
+        n = np.exp2(zoom)
+        xtiles = ((np.asarray(lons, dtype=np.float64) + 180.0) / 360.0 * n).astype(np.int64)
+        ytiles = ((1.0 - np.arcsinh(np.tan(lat_rad)) / np.pi) / 2.0 * n).astype(np.int64)
+        return xtiles, ytiles
+    
+    @staticmethod
+    def num2deg_array(zoom: Union[int, np.ndarray], xs: ArrayLike, ys: ArrayLike) -> Tuple[np.ndarray, np.ndarray]:
+        """Lat and lon arrays of the north-west corners of tiles"""
+        n = np.exp2(zoom)
+        lons = np.asarray(xs, dtype=np.float64) / n * 360.0 - 180.0
+        lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(ys, dtype=np.float64) / n))))
+        return lats, lons
+    
+    @staticmethod
+    def tile_bounds_array(zoom: Union[int, np.ndarray], xs: ArrayLike, ys: ArrayLike) -> np.ndarray:
+        """Bounds of many tiles as an (n, 4) matrix of [minLon, minLat, maxLon, maxLat] rows"""
+        xs = np.asarray(xs, dtype=np.int64)
+        ys = np.asarray(ys, dtype=np.int64)
+        lat_max, lon_min = TileCalculator.num2deg_array(zoom, xs, ys)
+        lat_min, lon_max = TileCalculator.num2deg_array(zoom, xs + 1, ys + 1)
+        return np.column_stack((lon_min, lat_min, lon_max, lat_max))
+    
+    @staticmethod
+    def quadkeys_array(zoom: int, xs: ArrayLike, ys: ArrayLike) -> List[str]:
+        """Quadkeys of many tiles of one zoom level (same digits as tile_quadkey)"""
+        xs = np.asarray(xs, dtype=np.int64)
+        ys = np.asarray(ys, dtype=np.int64)
+        if zoom == 0:
+            return [''] * len(xs)
+        shifts = np.arange(zoom - 1, -1, -1, dtype=np.int64)
+        digits = ((xs[:, None] >> shifts) & 1) + 2 * ((ys[:, None] >> shifts) & 1) + ord('0')
+        return digits.astype(np.uint8).view(f'S{zoom}').ravel().astype(str).tolist()
+    
+    @staticmethod
+    def quadkeys_to_tiles(quadkeys: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Decode quadkeys into zoom, x and y arrays"""
+        count = len(quadkeys)
+        zooms = np.fromiter((len(key) for key in quadkeys), dtype=np.int64, count=count)
+        xs = np.zeros(count, dtype=np.int64)
+        ys = np.zeros(count, dtype=np.int64)
+        for zoom in np.unique(zooms).tolist():
+            if zoom == 0:
+                continue
+            rows = np.nonzero(zooms == zoom)[0]
+            raw = ''.join(quadkeys[i] for i in rows.tolist()).encode('ascii')
+            digits = np.frombuffer(raw, dtype=np.uint8).reshape(len(rows), zoom).astype(np.int64) - ord('0')
+            if digits.min() < 0 or digits.max() > 3:
+                raise ValueError("Quadkeys may only contain the digits 0-3")
+            weights = np.left_shift(1, np.arange(zoom - 1, -1, -1, dtype=np.int64))
+            xs[rows] = (digits & 1) @ weights
+            ys[rows] = (digits >> 1) @ weights
+        return zooms, xs, ys
+    
+    @staticmethod
+    def get_tile_range(bbox: List[float], zoom: int) -> Tuple[int, int, int, int]:
+        """Get inclusive (min_x, min_y, max_x, max_y) tile range of bbox at zoom"""
         min_lon, min_lat, max_lon, max_lat = bbox
-        
+        min_x, max_y = TileCalculator.deg2num(min_lat, min_lon, zoom)
+        max_x, min_y = TileCalculator.deg2num(max_lat, max_lon, zoom)
+        return min_x, min_y, max_x, max_y
+    
+    @staticmethod
+    def iter_tiles_for_bbox(bbox: List[float], min_zoom: int, max_zoom: int) -> Iterator[Tuple[int, int, int]]:
+        """Lazily yield tile coordinates for given bbox and zoom range (zoom, x, y order)"""
         for zoom in range(min_zoom, max_zoom + 1):
-            min_x, max_y = TileCalculator.deg2num(min_lat, min_lon, zoom)
-            max_x, min_y = TileCalculator.deg2num(max_lat, max_lon, zoom)
+            min_x, min_y, max_x, max_y = TileCalculator.get_tile_range(bbox, zoom)
             
             for x in range(min_x, max_x + 1):
                 for y in range(min_y, max_y + 1):
-                    tiles.append((zoom, x, y))
-        
-        return tiles
+                    yield (zoom, x, y)
+    
+    @staticmethod
+    def get_tiles_for_bbox(bbox: List[float], min_zoom: int, max_zoom: int) -> List[Tuple[int, int, int]]:
+        """Get all tile coordinates for given bbox and zoom range"""
+        return list(TileCalculator.iter_tiles_for_bbox(bbox, min_zoom, max_zoom))
 
     @staticmethod
     def tile_bounds(zoom: int, x: int, y: int) -> List[float]:
@@ -38,43 +110,100 @@ class TileCalculator:
         n = 2 ** zoom
         lon_min = x / n * 360.0 - 180.0
         lon_max = (x + 1) / n * 360.0 - 180.0
-
-        def y_to_lat(y_val: int) -> float:
-            import math
-            return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y_val / n))))
-
-        lat_max = y_to_lat(y)
-        lat_min = y_to_lat(y + 1)
+        lat_max = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+        lat_min = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
         return [lon_min, lat_min, lon_max, lat_max]
 
     @staticmethod
-    def get_tiles_for_polygon(polygon_geojson: dict, min_zoom: int, max_zoom: int, bbox_hint: Optional[List[float]] = None) -> List[Tuple[int, int, int]]:
-        """Generate tiles intersecting a polygon (GeoJSON geometry dict). Uses bbox hint if provided to limit candidates."""
-        # Build shapely geometry
-        poly = shape(polygon_geojson)
-        poly = poly.buffer(0) if not poly.is_valid else poly
-        prepared = prep(poly)
+    def _polygon_geometry(polygon_geojson: dict, bbox_hint: Optional[List[float]] = None):
+        """Prepared shapely geometry of a GeoJSON polygon (clipped to the bbox hint)"""
+        geometry = shape(polygon_geojson)
+        geometry = geometry.buffer(0) if not geometry.is_valid else geometry
+        if bbox_hint is not None:
+            geometry = geometry.intersection(box(*bbox_hint))
+        shapely.prepare(geometry)
+        return geometry
 
-        # If no bbox hint, compute from polygon bounds
-        if bbox_hint is None:
-            min_lon, min_lat, max_lon, max_lat = poly.bounds
-            bbox_hint = [min_lon, min_lat, max_lon, max_lat]
+    @staticmethod
+    def _iter_polygon_cover(geometry, min_zoom: int, max_zoom: int) -> Iterator[tuple]:
+        """Quadtree cover of a geometry, per zoom level from min_zoom to max_zoom.
 
-        # Candidate tiles by bbox
-        candidate_tiles = TileCalculator.get_tiles_for_bbox(bbox_hint, min_zoom, max_zoom)
+        Yields (zoom, inside, edge_xs, edge_ys). `inside` lists (zoom, xs, ys) arrays of
+        tiles found to lie completely inside the polygon at that (lower or equal) zoom:
+        all their descendants are covered without further tests. Edge tiles intersect
+        the outline and are the only ones subdivided; tiles outside are dropped with
+        their whole subtree.
+        """
+        inside = []
+        xs = ys = np.zeros(1, dtype=np.int64)
+        for zoom in range(max_zoom + 1):
+            if zoom > 0:
+                xs = np.repeat(xs * 2, 4) + np.tile(np.array([0, 1, 0, 1]), len(xs))
+                ys = np.repeat(ys * 2, 4) + np.tile(np.array([0, 0, 1, 1]), len(ys))
+            if len(xs):
+                boxes = shapely.box(*TileCalculator.tile_bounds_array(zoom, xs, ys).T)
+                within = shapely.contains(geometry, boxes)
+                edge = shapely.intersects(geometry, boxes) & ~within
+                if within.any():
+                    inside.append((zoom, xs[within], ys[within]))
+                xs, ys = xs[edge], ys[edge]
+            if zoom >= min_zoom:
+                yield zoom, inside, xs, ys
 
-        # Filter by polygon intersection
-        filtered: List[Tuple[int, int, int]] = []
-        for z, x, y in candidate_tiles:
-            tb = TileCalculator.tile_bounds(z, x, y)
-            tile_poly = box(tb[0], tb[1], tb[2], tb[3])
-            if prepared.intersects(tile_poly):
-                filtered.append((z, x, y))
+    @staticmethod
+    def iter_tiles_for_polygon(polygon_geojson: dict, min_zoom: int, max_zoom: int,
+                               bbox_hint: Optional[List[float]] = None) -> Iterator[Tuple[int, int, int]]:
+        """Lazily yield the tiles intersecting a polygon (GeoJSON geometry dict), zoom by zoom"""
+        geometry = TileCalculator._polygon_geometry(polygon_geojson, bbox_hint)
+        for zoom, inside, edge_xs, edge_ys in TileCalculator._iter_polygon_cover(geometry, min_zoom, max_zoom):
+            for inside_zoom, xs, ys in inside:
+                shift = zoom - inside_zoom
+                for ax, ay in zip(xs.tolist(), ys.tolist()):
+                    for x in range(ax << shift, (ax + 1) << shift):
+                        for y in range(ay << shift, (ay + 1) << shift):
+                            yield (zoom, x, y)
+            for x, y in zip(edge_xs.tolist(), edge_ys.tolist()):
+                yield (zoom, x, y)
 
-        return filtered
+    @staticmethod
+    def iter_polygon_cover_ranges(polygon_geojson: dict, min_zoom: int, max_zoom: int,
+                                  bbox_hint: Optional[List[float]] = None) -> Iterator[Tuple[int, int, int, int, int]]:
+        """Disjoint tile rectangles (zoom, min_x, max_x, min_y, max_y) covering a polygon, per zoom.
+        An inner quadtree node is one rectangle, so the count grows with the outline, not the area."""
+        geometry = TileCalculator._polygon_geometry(polygon_geojson, bbox_hint)
+        for zoom, inside, edge_xs, edge_ys in TileCalculator._iter_polygon_cover(geometry, min_zoom, max_zoom):
+            for inside_zoom, xs, ys in inside:
+                shift = zoom - inside_zoom
+                for ax, ay in zip(xs.tolist(), ys.tolist()):
+                    yield (zoom, ax << shift, ((ax + 1) << shift) - 1, ay << shift, ((ay + 1) << shift) - 1)
+            for x, y in zip(edge_xs.tolist(), edge_ys.tolist()):
+                yield (zoom, x, x, y, y)
+
+    @staticmethod
+    def calculate_polygon_tile_counts(polygon_geojson: dict, min_zoom: int, max_zoom: int) -> Dict[int, int]:
+        """Number of tiles per zoom level intersecting a polygon (without enumerating inner tiles)"""
+        geometry = TileCalculator._polygon_geometry(polygon_geojson)
+        counts = {}
+        for zoom, inside, edge_xs, _ in TileCalculator._iter_polygon_cover(geometry, min_zoom, max_zoom):
+            counts[zoom] = len(edge_xs) + sum(len(xs) << 2 * (zoom - inside_zoom) for inside_zoom, xs, _ in inside)
+        return counts
+
+    @staticmethod
+    def get_tiles_for_polygon(polygon_geojson: dict, min_zoom: int, max_zoom: int, bbox_hint: Optional[List[float]] = None) -> List[Tuple[int, int, int]]:
+        """Generate tiles intersecting a polygon (GeoJSON geometry dict), in (zoom, x, y) order.
+        A bbox hint clips the polygon to that box."""
+        return sorted(TileCalculator.iter_tiles_for_polygon(polygon_geojson, min_zoom, max_zoom, bbox_hint))
+    
+    @staticmethod
+    def calculate_tile_counts(bbox: List[float], min_zoom: int, max_zoom: int) -> Dict[int, int]:
+        """Number of tiles per zoom level for given bbox (arithmetic, without enumerating them)"""
+        counts = {}
+        for zoom in range(min_zoom, max_zoom + 1):
+            min_x, min_y, max_x, max_y = TileCalculator.get_tile_range(bbox, zoom)
+            counts[zoom] = max(0, max_x - min_x + 1) * max(0, max_y - min_y + 1)
+        return counts
     
     @staticmethod
     def calculate_tile_count(bbox: List[float], min_zoom: int, max_zoom: int) -> int:
-        """Calculate total number of tiles for given bbox and zoom range"""
-        tiles = TileCalculator.get_tiles_for_bbox(bbox, min_zoom, max_zoom)
-        return len(tiles) 
\ No newline at end of file
+        """Calculate total number of tiles for given bbox and zoom range (without enumerating them)"""
+        return sum(TileCalculator.calculate_tile_counts(bbox, min_zoom, max_zoom).values()) 
\ No newline at end of file
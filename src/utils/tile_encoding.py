@@ -0,0 +1,104 @@
+import gzip
+import sqlite3
+import zlib
+from typing import Iterable, List, Optional
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def detect_encoding(data: bytes) -> str:
+    """Transport encoding of vector tile bytes: 'gzip', 'zlib' or 'raw' (plain PBF)"""
+    if data[:2] == GZIP_MAGIC:
+        return 'gzip'
+    if len(data) >= 2 and data[0] == 0x78 and data[1] in (0x01, 0x5E, 0x9C, 0xDA):
+        return 'zlib'
+    return 'raw'
+
+
+def to_gzip(data: bytes) -> bytes:
+    """Vector tile bytes as gzip; gzip input is returned unchanged.
+
+    mtime=0 keeps the output deterministic, so identical tiles stay identical
+    (and deduplicate) after compression.
+    """
+    encoding = detect_encoding(data)
+    if encoding == 'gzip':
+        return data
+    if encoding == 'zlib':
+        try:
+            data = zlib.decompress(data)
+        except zlib.error:
+            # Plain PBF that happens to start like a zlib header
+            pass
+    return gzip.compress(data, mtime=0)
+
+
+def detect_image_format(data: bytes) -> Optional[str]:
+    """Image format of raster tile bytes ('png', 'jpg', 'webp'), whatever the file extension says"""
+    if data.startswith(b'\x89PNG'):
+        return 'png'
+    if data.startswith(b'\xff\xd8'):
+        return 'jpg'
+    if data.startswith(b'RIFF') and data[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def combine_encodings(encodings: Iterable[str]) -> Optional[str]:
+    """One encoding (or image format) for a layer from sampled tiles: the shared one, 'mixed', or None without samples"""
+    found = set(encodings)
+    if not found:
+        return None
+    return found.pop() if len(found) == 1 else 'mixed'
+
+
+def sample_file_encoding(paths: Iterable[str]) -> Optional[str]:
+    """Encoding of a layer from the first bytes of a few of its tile files"""
+    encodings = []
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                encodings.append(detect_encoding(f.read(2)))
+        except OSError:
+            continue
+    return combine_encodings(encodings)
+
+
+def sample_file_format(paths: Iterable[str]) -> Optional[str]:
+    """Image format of a raster layer from the first bytes of a few of its tile files"""
+    formats = []
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                image_format = detect_image_format(f.read(12))
+        except OSError:
+            continue
+        if image_format:
+            formats.append(image_format)
+    return combine_encodings(formats)
+
+
+def _sample_mbtiles_prefixes(path: str) -> List[bytes]:
+    """First bytes of one tile per zoom level of an MBTiles file (indexed lookups only)"""
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            rows = [conn.execute("SELECT substr(tile_data, 1, 12) FROM tiles WHERE zoom_level = ? LIMIT 1",
+                                 (zoom,)).fetchone() for zoom in range(31)]
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return []
+    return [bytes(row[0]) for row in rows if row and row[0]]
+
+
+def sample_mbtiles_encoding(path: str) -> Optional[str]:
+    """Encoding of a vector MBTiles layer from one tile per zoom level"""
+    return combine_encodings(detect_encoding(prefix) for prefix in _sample_mbtiles_prefixes(path))
+
+
+def sample_mbtiles_format(path: str) -> Optional[str]:
+    """Image format of a raster MBTiles layer from one tile per zoom level"""
+    formats = [detect_image_format(prefix) for prefix in _sample_mbtiles_prefixes(path)]
+    return combine_encodings(image_format for image_format in formats if image_format)
@@ -0,0 +1,140 @@
+import os
+import threading
+from typing import Dict, Iterable, Iterator, Set, Tuple
+
+
+class _ColumnBitmap:
+    """Set of tile rows of one column as a bitmap starting at `base`"""
+
+    __slots__ = ('base', 'bits')
+
+    def __init__(self, rows: Iterable[int] = ()):
+        rows = list(rows)
+        self.base = min(rows) & ~7 if rows else 0
+        self.bits = bytearray(((max(rows) - self.base) >> 3) + 1 if rows else 0)
+        for row in rows:
+            index = row - self.base
+            self.bits[index >> 3] |= 1 << (index & 7)
+
+    def __contains__(self, row: int) -> bool:
+        index = row - self.base
+        return 0 <= index < len(self.bits) << 3 and bool(self.bits[index >> 3] >> (index & 7) & 1)
+
+    def __iter__(self) -> Iterator[int]:
+        for byte_index, byte in enumerate(self.bits):
+            if byte:
+                for bit in range(8):
+                    if byte >> bit & 1:
+                        yield self.base + (byte_index << 3) + bit
+
+    def add(self, row: int) -> None:
+        if not self.bits:
+            self.base = row & ~7
+        index = row - self.base
+        if index < 0:
+            grow = (7 - index) >> 3
+            self.bits[0:0] = bytes(grow)
+            self.base -= grow << 3
+            index = row - self.base
+        if index >> 3 >= len(self.bits):
+            self.bits.extend(bytes((index >> 3) + 1 - len(self.bits)))
+        self.bits[index >> 3] |= 1 << (index & 7)
+
+
+class TileExistenceIndex:
+    """Existing non-empty tile files of one output layer (`<layer_dir>/<z>/<x>/<y>.<ext>`).
+
+    Each zoom level is read with one os.scandir pass over its `x` directories
+    the first time it is needed, into a bitmap per column. Lookups are then
+    answered from memory instead of an exists/getsize pair per tile, and
+    tile_path() creates each `x` directory once instead of calling makedirs
+    for every tile. Tiles written through the index are added to it.
+    """
+
+    def __init__(self, layer_dir: str, extension: str):
+        self.layer_dir = layer_dir
+        self.extension = extension
+        self.files_scanned = 0
+        self._columns: Dict[int, Dict[int, _ColumnBitmap]] = {}
+        self._dirs: Dict[int, Set[int]] = {}
+        self._lock = threading.Lock()
+
+    def is_scanned(self, zoom: int) -> bool:
+        return zoom in self._columns
+
+    def scan_zoom(self, zoom: int) -> None:
+        """Read the existing tiles of a zoom level (once)"""
+        with self._lock:
+            self._scan_zoom_locked(zoom)
+
+    def _scan_zoom_locked(self, zoom: int) -> None:
+        if zoom in self._columns:
+            return
+        columns: Dict[int, _ColumnBitmap] = {}
+        dirs: Set[int] = set()
+        suffix = '.' + self.extension
+        try:
+            zoom_entries = os.scandir(os.path.join(self.layer_dir, str(zoom)))
+        except FileNotFoundError:
+            zoom_entries = None
+        if zoom_entries is not None:
+            with zoom_entries:
+                for column in zoom_entries:
+                    if not column.name.isdigit() or not column.is_dir():
+                        continue
+                    x = int(column.name)
+                    dirs.add(x)
+                    rows = []
+                    with os.scandir(column.path) as files:
+                        for entry in files:
+                            name = entry.name
+                            if not name.endswith(suffix) or not name[:-len(suffix)].isdigit():
+                                continue
+                            self.files_scanned += 1
+                            try:
+                                # Zero-byte leftovers of interrupted writes count as missing
+                                if entry.stat().st_size > 0:
+                                    rows.append(int(name[:-len(suffix)]))
+                            except OSError:
+                                continue
+                    if rows:
+                        columns[x] = _ColumnBitmap(rows)
+        self._columns[zoom] = columns
+        self._dirs[zoom] = dirs
+
+    def contains(self, zoom: int, x: int, y: int) -> bool:
+        with self._lock:
+            self._scan_zoom_locked(zoom)
+            column = self._columns[zoom].get(x)
+            return column is not None and y in column
+
+    def iter_tiles(self, zoom: int) -> Iterator[Tuple[int, int]]:
+        """(x, y) of the existing tiles of a zoom level, column by column"""
+        with self._lock:
+            self._scan_zoom_locked(zoom)
+            columns = {x: list(column) for x, column in self._columns[zoom].items()}
+        for x in sorted(columns):
+            for y in columns[x]:
+                yield x, y
+
+    def add(self, zoom: int, x: int, y: int) -> None:
+        """Record a tile that was just written"""
+        with self._lock:
+            self._scan_zoom_locked(zoom)
+            column = self._columns[zoom].get(x)
+            if column is None:
+                column = self._columns[zoom][x] = _ColumnBitmap()
+            column.add(y)
+
+    def tile_path(self, zoom: int, x: int, y: int, create_dir: bool = True) -> str:
+        """Path of a tile; its `x` directory is created on first use unless create_dir is False"""
+        column_dir = os.path.join(self.layer_dir, str(zoom), str(x))
+        if not create_dir:
+            return os.path.join(column_dir, f"{y}.{self.extension}")
+        with self._lock:
+            self._scan_zoom_locked(zoom)
+            dirs = self._dirs[zoom]
+            if x not in dirs:
+                os.makedirs(column_dir, exist_ok=True)
+                dirs.add(x)
+        return os.path.join(column_dir, f"{y}.{self.extension}")
@@ -0,0 +1,106 @@
+import zlib
+from typing import List, Tuple, Iterator
+
+import numpy as np
+
+from models.tile_server import tile_quadkey
+from utils.tile_calculator import TileCalculator
+
+
+class TileSharding:
+    """Deterministic partitioning of a bbox/zoom job into shards.
+
+    Tiles are assigned by the quadkey of their ancestor at the partition zoom:
+    a whole subtree always belongs to one shard, so every node downloads
+    neighbouring tiles and the assignment only depends on the job parameters.
+    Tiles above the partition zoom are assigned by their own quadkey.
+    """
+
+    # Aim for this many partition cells per shard so cell sizes even out
+    CELLS_PER_SHARD = 16
+
+    @staticmethod
+    def choose_partition_zoom(bbox: List[float], min_zoom: int, max_zoom: int, shard_count: int) -> int:
+        """Smallest zoom of the job with enough cells to spread over shard_count shards"""
+        wanted = TileSharding.CELLS_PER_SHARD * shard_count
+        for zoom in range(min_zoom, max_zoom + 1):
+            if TileCalculator.calculate_tile_count(bbox, zoom, zoom) >= wanted:
+                return zoom
+        return max_zoom
+
+    @staticmethod
+    def shard_of(tile: Tuple[int, int, int], partition_zoom: int, shard_count: int) -> int:
+        """Shard index (0-based) owning a tile"""
+        zoom, x, y = tile
+        if zoom > partition_zoom:
+            shift = zoom - partition_zoom
+            zoom, x, y = partition_zoom, x >> shift, y >> shift
+        return zlib.crc32(f"{zoom}/{tile_quadkey(zoom, x, y)}".encode()) % shard_count
+
+    @staticmethod
+    def shard_of_array(zoom: int, xs: np.ndarray, ys: np.ndarray, partition_zoom: int,
+                       shard_count: int) -> np.ndarray:
+        """Shard indexes of many tiles of one zoom level (same result as shard_of)"""
+        if zoom > partition_zoom:
+            shift = zoom - partition_zoom
+            zoom, xs, ys = partition_zoom, np.asarray(xs) >> shift, np.asarray(ys) >> shift
+        prefix = f"{zoom}/"
+        return np.fromiter((zlib.crc32((prefix + key).encode()) % shard_count
+                            for key in TileCalculator.quadkeys_array(zoom, xs, ys)),
+                           dtype=np.int64, count=len(xs))
+
+    @staticmethod
+    def _owned_tiles_above_partition(bbox: List[float], zoom: int, partition_zoom: int, shard_index: int,
+                                     shard_count: int) -> Tuple[np.ndarray, np.ndarray]:
+        """x and y arrays of the owned bbox tiles of a zoom below the partition zoom"""
+        min_x, min_y, max_x, max_y = TileCalculator.get_tile_range(bbox, zoom)
+        xs, ys = np.meshgrid(np.arange(min_x, max_x + 1), np.arange(min_y, max_y + 1), indexing='ij')
+        xs, ys = xs.ravel(), ys.ravel()
+        owned = TileSharding.shard_of_array(zoom, xs, ys, partition_zoom, shard_count) == shard_index
+        return xs[owned], ys[owned]
+
+    @staticmethod
+    def _iter_owned_cells(bbox: List[float], zoom: int, partition_zoom: int, shard_index: int,
+                          shard_count: int) -> Iterator[Tuple[int, int, int, int]]:
+        """Owned partition cells at `zoom`, clipped to the bbox tile range (min_x, min_y, max_x, max_y)"""
+        min_x, min_y, max_x, max_y = TileCalculator.get_tile_range(bbox, zoom)
+        shift = zoom - partition_zoom
+        cxs, cys = np.meshgrid(np.arange(min_x >> shift, (max_x >> shift) + 1),
+                               np.arange(min_y >> shift, (max_y >> shift) + 1), indexing='ij')
+        cxs, cys = cxs.ravel(), cys.ravel()
+        owned = TileSharding.shard_of_array(partition_zoom, cxs, cys, partition_zoom, shard_count) == shard_index
+        for cx, cy in zip(cxs[owned].tolist(), cys[owned].tolist()):
+            yield (max(min_x, cx << shift), max(min_y, cy << shift),
+                   min(max_x, ((cx + 1) << shift) - 1), min(max_y, ((cy + 1) << shift) - 1))
+
+    @staticmethod
+    def iter_shard_tiles(bbox: List[float], min_zoom: int, max_zoom: int, partition_zoom: int,
+                         shard_index: int, shard_count: int) -> Iterator[Tuple[int, int, int]]:
+        """Lazily yield the tiles of one shard, zoom by zoom and cell by cell"""
+        for zoom in range(min_zoom, max_zoom + 1):
+            if zoom < partition_zoom:
+                xs, ys = TileSharding._owned_tiles_above_partition(bbox, zoom, partition_zoom,
+                                                                   shard_index, shard_count)
+                for x, y in zip(xs.tolist(), ys.tolist()):
+                    yield (zoom, x, y)
+                continue
+            for x0, y0, x1, y1 in TileSharding._iter_owned_cells(bbox, zoom, partition_zoom,
+                                                                 shard_index, shard_count):
+                for x in range(x0, x1 + 1):
+                    for y in range(y0, y1 + 1):
+                        yield (zoom, x, y)
+
+    @staticmethod
+    def count_shard_tiles(bbox: List[float], min_zoom: int, max_zoom: int, partition_zoom: int,
+                          shard_index: int, shard_count: int) -> int:
+        """Number of tiles in one shard (per cell arithmetic, no enumeration below the partition zoom)"""
+        total = 0
+        for zoom in range(min_zoom, max_zoom + 1):
+            if zoom < partition_zoom:
+                total += len(TileSharding._owned_tiles_above_partition(bbox, zoom, partition_zoom,
+                                                                       shard_index, shard_count)[0])
+                continue
+            for x0, y0, x1, y1 in TileSharding._iter_owned_cells(bbox, zoom, partition_zoom,
+                                                                 shard_index, shard_count):
+                total += (x1 - x0 + 1) * (y1 - y0 + 1)
+        return total
@@ -0,0 +1,50 @@
+import threading
+from collections import Counter
+from typing import Dict, Optional
+
+
+class StubResponse:
+    """Stand-in for requests.Response"""
+
+    def __init__(self, status_code: int = 200, content: bytes = b"", headers: Optional[Dict[str, str]] = None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise Exception(f"HTTP {self.status_code}")
+
+
+class StubSession:
+    """Stand-in for requests.Session that answers from memory and records every GET.
+
+    With `payloads` ({url: bytes}) other URLs get a 404; without, every URL gets
+    `content`. Variants override respond(). urls, headers and hosts (a Counter
+    of hostnames, which sessions of one test may share) are updated thread-safely.
+    """
+
+    def __init__(self, content: bytes = b"tile", payloads: Optional[Dict[str, bytes]] = None,
+                 hosts: Optional[Counter] = None):
+        self.content = content
+        self.payloads = payloads
+        self.urls = []
+        self.headers = []
+        self.hosts = hosts if hosts is not None else Counter()
+        self._lock = threading.Lock()
+
+    def get(self, url, headers=None, timeout=None):
+        with self._lock:
+            self.urls.append(url)
+            self.headers.append(dict(headers or {}))
+            self.hosts[url.split('/')[2]] += 1
+        return self.respond(url, headers or {})
+
+    def respond(self, url: str, headers: Dict[str, str]) -> StubResponse:
+        if self.payloads is not None:
+            payload = self.payloads.get(url)
+            return StubResponse(404, b"") if payload is None else StubResponse(200, payload)
+        return StubResponse(200, self.content)
+
+    def close(self):
+        pass
@@ -0,0 +1,90 @@
+import os
+import sys
+import threading
+import http.server
+import socketserver
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+pytest.importorskip("aiohttp")
+
+from models.tile_server import TileServer
+from services.async_tile_download_service import AsyncTileDownloadService
+
+
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + b"async"
+
+
+class _StubTileHandler(http.server.BaseHTTPRequestHandler):
+    """Vector endpoint returns empty bodies, raster endpoint returns a PNG"""
+
+    def do_GET(self):
+        if self.path.startswith('/vector/'):
+            body = b""
+        elif self.path.startswith('/raster/'):
+            body = PNG_BYTES
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_upstream():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _StubTileHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_async_engine_vector_then_raster_fallback(tmp_path, stub_upstream):
+    vector = TileServer(name="VectorA", url=stub_upstream + "/vector/{z}/{x}/{y}.pbf", headers={}, tile_type="vector")
+    raster = TileServer(name="RasterB", url=stub_upstream + "/raster/{z}/{x}/{y}.png", headers={}, tile_type="raster")
+    tiles = [(6, x, y) for x in range(4) for y in range(4)]
+
+    service = AsyncTileDownloadService(retry_attempts=1, timeout=5, concurrency=8, per_server_limit=4)
+    result = service.download_tiles_batch(tiles, tmp_path.as_posix(), "asyncRegion", [vector, raster])
+
+    assert result["total"] == len(tiles)
+    assert result["downloaded"] == len(tiles)
+    assert result["failed"] == 0
+    for z, x, y in tiles:
+        tile_path = tmp_path / "asyncRegion" / "raster" / raster.name / str(z) / str(x) / f"{y}.png"
+        assert tile_path.read_bytes() == PNG_BYTES
+
+
+def test_async_engine_reports_failures(tmp_path, stub_upstream):
+    missing = TileServer(name="Missing", url=stub_upstream + "/none/{z}/{x}/{y}.png", headers={}, tile_type="raster")
+
+    service = AsyncTileDownloadService(retry_attempts=2, timeout=5, concurrency=4)
+    result = service.download_tiles_batch([(3, 1, 1), (3, 1, 2)], tmp_path.as_posix(), "asyncRegion", [missing])
+
+    assert result["downloaded"] == 0
+    assert result["failed"] == 2
+
+
+def test_async_download_tile_writes_the_given_path(tmp_path, stub_upstream):
+    raster = TileServer(name="RasterB", url=stub_upstream + "/raster/{z}/{x}/{y}.png", headers={}, tile_type="raster")
+    output_path = tmp_path / "single" / "tile.png"
+
+    service = AsyncTileDownloadService(retry_attempts=1, timeout=5)
+    assert service.download_tile(5, 3, 4, output_path.as_posix(), raster)
+    assert output_path.read_bytes() == PNG_BYTES
+
+    # An existing tile is kept without a request
+    missing = TileServer(name="Missing", url=stub_upstream + "/none/{z}/{x}/{y}.png", headers={}, tile_type="raster")
+    assert service.download_tile(5, 3, 4, output_path.as_posix(), missing)
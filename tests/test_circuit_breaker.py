@@ -0,0 +1,119 @@
+import asyncio
+import os
+import sys
+import time
+from collections import Counter
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from models.tile_server import TileServer
+from services.async_tile_download_service import AsyncTileDownloadService
+from services.circuit_breaker import CircuitBreaker, STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN
+from services.tile_download_service import TileDownloadService
+from utils.tile_calculator import TileCalculator
+from exceptions.tile_downloader_exceptions import DownloadError
+from conftest import StubResponse, StubSession
+
+
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + b"breaker"
+
+
+class _Session(StubSession):
+    """Hosts named dead* answer 503, slow* answer late"""
+
+    def respond(self, url, headers):
+        host = url.split('/')[2]
+        if host.startswith('dead'):
+            return StubResponse(503, b"")
+        if host.startswith('slow'):
+            time.sleep(0.02)
+        return StubResponse(200, PNG_BYTES)
+
+
+def test_breaker_opens_probes_and_closes():
+    breaker = CircuitBreaker("S", error_threshold=0.5, window_size=4, min_requests=4, open_seconds=0.05)
+    for status in (200, 503, 503, 500):
+        assert breaker.allow_request()
+        breaker.record(status, 0.01)
+    assert breaker.state == STATE_OPEN and not breaker.allow_request()
+
+    time.sleep(0.06)
+    assert breaker.allow_request() and breaker.state == STATE_HALF_OPEN
+    # Only one probe at a time while half-open
+    assert not breaker.allow_request()
+    breaker.record(503, 0.01)
+    assert breaker.state == STATE_OPEN
+
+    time.sleep(0.11)
+    assert breaker.allow_request()
+    breaker.record(404, 0.01)
+    assert breaker.state == STATE_CLOSED and breaker.get_stats()['opened'] == 2
+
+
+def _half_open(breaker: CircuitBreaker) -> None:
+    """Open the breaker with its open period already over, and take the probe"""
+    breaker.state = STATE_OPEN
+    breaker._open_until = 0.0
+    assert breaker.allow_request() and breaker.state == STATE_HALF_OPEN
+
+
+def test_probe_that_never_got_an_outcome_is_given_back():
+    server = TileServer(name="S", url="https://s.example.com/{z}/{x}/{y}.png", headers={}, tile_type="raster")
+
+    # Threads: a worker whose limiter wait is aborted by the drain deadline
+    service = TileDownloadService(max_workers=1, drain_timeout=0)
+    breaker = service.server_health.get_breaker("S")
+    _half_open(breaker)
+    service.cancel()
+    with pytest.raises(DownloadError):
+        service._request_tile(server.get_tile_url(1, 0, 0), server, {})
+    assert breaker.allow_request()
+
+    # asyncio: a request cancelled while it waits for the server's semaphore
+    async_service = AsyncTileDownloadService()
+    breaker = async_service.server_health.get_breaker("S")
+    _half_open(breaker)
+
+    async def cancel_waiting_request():
+        semaphore = asyncio.Semaphore(0)
+        task = asyncio.ensure_future(async_service._request(None, semaphore, server,
+                                                            server.get_tile_url(1, 0, 0), {}))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_waiting_request())
+    assert breaker.allow_request()
+
+
+def test_dead_server_is_skipped_once_its_breaker_opens(tmp_path):
+    dead = TileServer(name="Dead", url="https://dead.example.com/{z}/{x}/{y}.png", headers={}, tile_type="raster")
+    alive = TileServer(name="Alive", url="https://alive.example.com/{z}/{x}/{y}.png", headers={}, tile_type="raster")
+    tiles = TileCalculator.get_tiles_for_bbox([28.0, 40.0, 30.0, 42.0], 8, 10)
+    hosts: Counter = Counter()
+
+    service = TileDownloadService(max_workers=2, retry_attempts=1, timeout=5,
+                                  circuit_breaker={'min_requests': 5, 'window_size': 5, 'open_seconds': 60})
+    service.create_session = lambda: _Session(hosts=hosts)  # type: ignore
+    result = service.download_tiles_batch(tiles, tmp_path.as_posix(), "r", [dead, alive])
+
+    assert result["downloaded"] == len(tiles)
+    assert hosts["dead.example.com"] < 10 < len(tiles)
+    assert service.get_health_stats()["Dead"]["state"] == STATE_OPEN
+
+
+def test_health_ordering_prefers_faster_server(tmp_path):
+    slow = TileServer(name="Slow", url="https://slow.example.com/{z}/{x}/{y}.png", headers={}, tile_type="raster")
+    fast = TileServer(name="Fast", url="https://fast.example.com/{z}/{x}/{y}.png", headers={}, tile_type="raster")
+    tiles = TileCalculator.get_tiles_for_bbox([28.0, 40.0, 30.0, 42.0], 8, 10)
+    hosts: Counter = Counter()
+
+    service = TileDownloadService(max_workers=1, retry_attempts=1, timeout=5, health_ordering=True)
+    service.create_session = lambda: _Session(hosts=hosts)  # type: ignore
+    service.download_tiles_batch(tiles, tmp_path.as_posix(), "r", [slow, fast])
+
+    # The unmeasured fast server is tried once, then preferred
+    assert hosts["fast.example.com"] > hosts["slow.example.com"]
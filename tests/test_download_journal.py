@@ -0,0 +1,84 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from models.tile_server import TileServer
+from services.download_journal import DownloadJournal
+from services.tile_download_service import TileDownloadService
+from exceptions.tile_downloader_exceptions import DownloadError
+from conftest import StubResponse, StubSession
+
+
+def test_resume_skips_done_tiles_and_retry_failed_returns_failures(tmp_path):
+    journal = DownloadJournal(str(tmp_path / "journal.sqlite"), checkpoint_size=2)
+    job_id = journal.create_job({'region_name': 'test', 'bbox': [0, 0, 1, 1], 'min_zoom': 1, 'max_zoom': 2})
+    tiles = [(1, 0, 0), (1, 0, 1), (2, 1, 1), (2, 1, 2)]
+
+    journal.record_tile(job_id, tiles[0], True)
+    journal.record_tile(job_id, tiles[2], False, "HTTP 500")
+    journal.close()
+
+    # Reopen as after a crash: checkpointed outcomes survive
+    journal = DownloadJournal(str(tmp_path / "journal.sqlite"))
+    assert journal.get_latest_job_id() == job_id
+    assert journal.get_counts(job_id) == {'done': 1, 'failed': 1}
+    assert list(journal.iter_unfinished(job_id, tiles)) == tiles[1:]
+    # Tiles may come in any order, zoom levels mixed
+    assert list(journal.iter_unfinished(job_id, [tiles[3], tiles[0], tiles[1]], chunk_size=2)) == [tiles[3], tiles[1]]
+    assert list(journal.iter_failed(job_id)) == [tiles[2]]
+
+    # A successful retry moves the tile to done and counts the attempt
+    journal.record_tile(job_id, tiles[2], True)
+    journal.flush()
+    assert list(journal.iter_failed(job_id)) == []
+    assert journal.list_jobs()[0]['counts'] == {'done': 2, 'failed': 0}
+    journal.close()
+
+
+def test_cancel_drops_queued_tiles_and_reports_finished_ones(tmp_path):
+    raster = TileServer(name="RasterB", url="https://r.example.com/{z}/{x}/{y}.png", headers={}, tile_type="raster")
+    service = TileDownloadService(max_workers=2, retry_attempts=1, timeout=5, drain_timeout=5)
+    started = threading.Event()
+    release = threading.Event()
+
+    class SlowSession(StubSession):
+        def respond(self, url, headers):
+            started.set()
+            release.wait(5)
+            return super().respond(url, headers)
+
+    service.create_session = lambda: SlowSession()  # type: ignore
+
+    def cancel_when_busy():
+        started.wait(5)
+        time.sleep(0.2)  # let the submission window fill up
+        service.cancel()
+        release.set()
+
+    threading.Thread(target=cancel_when_busy, daemon=True).start()
+    recorded = []
+    tiles = [(8, x, 0) for x in range(50)]
+    result = service.download_tiles_batch(tiles, tmp_path.as_posix(), "cancelRegion", [raster],
+                                          tile_callback=lambda tile, ok, error: recorded.append((tile, ok)))
+
+    assert result['cancelled'] > 0
+    # Tiles beyond the bounded submission window are never produced
+    assert result['total'] < len(tiles)
+    assert result['downloaded'] + result['failed'] + result['cancelled'] == result['total']
+    assert len(recorded) == result['downloaded'] + result['failed']
+
+
+def test_requests_after_cancel_are_bounded_by_the_drain_deadline():
+    service = TileDownloadService(timeout=30, drain_timeout=0.2)
+    assert service._request_timeout() == 30
+
+    service.cancel()
+    assert 0 < service._request_timeout() <= 0.2
+    time.sleep(0.25)
+    with pytest.raises(DownloadError):
+        service._request_timeout()
@@ -0,0 +1,73 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from models.tile_server import TileServer
+from services.download_metrics import DownloadMetrics, MetricsReporter
+from services.tile_download_service import TileDownloadService
+from utils.tile_calculator import TileCalculator
+from conftest import StubResponse, StubSession
+
+
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + b"metrics"
+
+
+class _Session(StubSession):
+    def respond(self, url, headers):
+        if url.startswith('https://dead'):
+            return StubResponse(503, b"")
+        return StubResponse(200, PNG_BYTES)
+
+
+def test_batch_records_requests_statuses_and_fallbacks(tmp_path):
+    dead = TileServer(name="Dead", url="https://dead.example.com/{z}/{x}/{y}.png", headers={}, tile_type="raster")
+    live = TileServer(name="Live", url="https://live.example.com/{z}/{x}/{y}.png", headers={}, tile_type="raster")
+    tiles = TileCalculator.get_tiles_for_bbox([28.9, 41.0, 29.1, 41.1], 10, 11)
+    service = TileDownloadService(max_workers=4, retry_attempts=1, timeout=5)
+    service.create_session = lambda: _Session()  # type: ignore
+    service.metrics.start(len(tiles))
+
+    result = service.download_tiles_batch(tiles, tmp_path.as_posix(), "r", [dead, live])
+    snapshot = service.metrics.snapshot()
+
+    assert snapshot['tiles']['downloaded'] == result['downloaded'] == len(tiles)
+    assert snapshot['tiles']['processed'] == snapshot['expected_tiles'] == len(tiles)
+    servers = snapshot['servers']
+    assert servers['Live']['status_codes'] == {'200': len(tiles)}
+    assert servers['Live']['bytes'] == len(tiles) * len(PNG_BYTES)
+    assert servers['Dead']['status_codes'].get('503', 0) > 0
+    assert servers['Dead']['fallbacks'] == len(tiles)
+    latency = servers['Live']['latency']
+    assert latency['p50'] <= latency['p95'] <= latency['p99'] and sum(latency['buckets']) == len(tiles)
+
+
+def test_reporter_writes_json_and_prometheus_snapshots(tmp_path):
+    metrics = DownloadMetrics()
+    metrics.start(10)
+    metrics.set_gauge('queue_depth', lambda: 3)
+    for latency in (0.01, 0.2, 3.0):
+        metrics.record_request('Osm "main"', 200, latency, size=100)
+    metrics.record_request('Osm "main"', None, 0.5)
+    metrics.record_retry('Osm "main"')
+    for _ in range(3):
+        metrics.record_tile('downloaded')
+    metrics.record_tile('failed')
+
+    reporter = MetricsReporter(metrics, interval=0, json_path=str(tmp_path / "m.json"),
+                               prometheus_path=str(tmp_path / "m.prom"))
+    reporter.start()
+    snapshot = reporter.stop()
+
+    assert json.loads((tmp_path / "m.json").read_text())['tiles'] == snapshot['tiles']
+    assert snapshot['tiles']['processed'] == 4 and snapshot['bytes'] == 300
+    text = (tmp_path / "m.prom").read_text()
+    assert 'tile_downloader_requests_total{server="Osm \\"main\\"",status="200"} 3' in text
+    assert 'tile_downloader_requests_total{server="Osm \\"main\\"",status="error"} 1' in text
+    assert 'tile_downloader_request_duration_seconds_bucket{server="Osm \\"main\\"",le="0.25"} 2' in text
+    assert 'tile_downloader_request_duration_seconds_bucket{server="Osm \\"main\\"",le="+Inf"} 4' in text
+    assert 'tile_downloader_retries_total{server="Osm \\"main\\""} 1' in text
+    assert 'tile_downloader_queue_depth 3' in text
+    assert 'tile_downloader_tiles_total{result="failed"} 1' in text
+    assert 'Progress: 4/10 tiles (40.0%), 1 failed' in DownloadMetrics.format_progress(snapshot)
@@ -0,0 +1,59 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from models.tile_server import TileServer
+from services.job_estimator import JobEstimator
+from utils.tile_calculator import TileCalculator
+from conftest import StubResponse, StubSession
+
+
+BBOX = [28.9, 41.0, 29.1, 41.1]
+
+
+class _Session(StubSession):
+    def respond(self, url, headers):
+        zoom = int(url.split('/')[-3])
+        # Zoom 12 has no data upstream; other tiles grow with the zoom
+        if zoom == 12:
+            return StubResponse(404, b"")
+        return StubResponse(200, b"x" * (1000 * zoom))
+
+
+def test_stratified_samples_are_distinct_and_inside_the_range():
+    for zoom in (10, 14, 16):
+        min_x, min_y, max_x, max_y = TileCalculator.get_tile_range(BBOX, zoom)
+        samples = JobEstimator.sample_tiles(BBOX, zoom, 5)
+        assert len(samples) == min(5, (max_x - min_x + 1) * (max_y - min_y + 1))
+        assert len(set(samples)) == len(samples)
+        assert all(min_x <= x <= max_x and min_y <= y <= max_y for _, x, y in samples)
+
+
+def test_estimate_uses_present_tiles_and_upstream_samples(tmp_path):
+    server = TileServer(name="A", url="https://a.example.com/{z}/{x}/{y}.png", headers={}, tile_type="raster")
+    estimator = JobEstimator(tmp_path.as_posix(), samples_per_zoom=4, concurrency=10)
+    session = _Session()
+    estimator.create_session = lambda: session  # type: ignore
+
+    # Every sampled tile of zoom 10 is already downloaded
+    for zoom, x, y in JobEstimator.sample_tiles(BBOX, 10, 4):
+        path = tmp_path / "r" / "raster" / "A" / str(zoom) / str(x) / f"{y}.png"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"y" * 500)
+
+    estimate = estimator.estimate("r", BBOX, 10, 12, [server])
+    counts = TileCalculator.calculate_tile_counts(BBOX, 10, 12)
+    zooms = {zoom['zoom']: zoom['sources']['A'] for zoom in estimate['zooms']}
+
+    assert zooms[10]['present'] == zooms[10]['samples'] and zooms[10]['remaining_tiles'] == 0
+    assert zooms[11]['avg_bytes'] == 11000 and zooms[11]['remaining_tiles'] == counts[11]
+    assert zooms[11]['bytes'] == counts[11] * 11000
+    assert zooms[11]['disk_bytes'] % estimate['block_size'] == 0 and zooms[11]['disk_bytes'] >= zooms[11]['bytes']
+    assert zooms[12]['missing'] == zooms[12]['samples'] and zooms[12]['remaining_tiles'] == 0
+    assert not any('/10/' in url for url in session.urls)
+
+    totals = estimate['totals']
+    assert totals['tiles'] == sum(counts.values()) and totals['remaining_tiles'] == counts[11]
+    assert estimate['servers']['A']['tiles_per_second'] > 0 and totals['seconds'] > 0
+    assert estimate['fits'] and any(line.startswith("Total:") for line in JobEstimator.format_report(estimate))
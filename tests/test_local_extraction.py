@@ -0,0 +1,135 @@
+import os
+import sqlite3
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from adapters.mbtiles_adapter import MBTilesAdapter
+from services.local_tile_service import LocalTileService
+from utils.mbtiles_utils import MBTilesUtils
+
+
+BBOX = [28.9, 41.0, 29.1, 41.1]
+
+
+def _make_mbtiles(path: str, zooms) -> dict:
+    """TMS-scheme MBTiles with one tile per cell of BBOX at each zoom; returns {(z, x, xyz_y): data}"""
+    expected = {}
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+    conn.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)")
+    conn.executemany("INSERT INTO metadata VALUES (?, ?)",
+                     [('scheme', 'tms'), ('bounds', '28,40,30,42'), ('format', 'png')])
+    for zoom in zooms:
+        min_x, max_x, min_y, max_y = MBTilesUtils.bbox_to_tile_range(BBOX, zoom)
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                data = b"\x89PNG" + f"{zoom}/{x}/{y}".encode()
+                conn.execute("INSERT INTO tiles VALUES (?, ?, ?, ?)", (zoom, x, (1 << zoom) - 1 - y, data))
+                expected[(zoom, x, y)] = data
+    conn.commit()
+    conn.close()
+    return expected
+
+
+def test_extract_zooms_streams_batches_into_the_writer_pool(tmp_path):
+    source_path = str(tmp_path / "local.mbtiles")
+    expected = _make_mbtiles(source_path, (12, 13))
+    service = LocalTileService(workers=2, writer_threads=2, batch_size=3)
+    assert service.register_source({'name': 'Local', 'path': source_path, 'source_type': 'mbtiles',
+                                    'tile_type': 'raster'})
+
+    batches = list(service.get_extractor('Local').iter_tiles(BBOX, 13, batch_size=3))
+    assert all(len(batch) <= 3 for batch in batches)
+    assert sum(len(batch) for batch in batches) == sum(1 for tile in expected if tile[0] == 13)
+
+    out_dir = str(tmp_path / "out")
+    results = service.extract_zooms(['Local'], [12, 13], out_dir, "r", bbox=BBOX)
+
+    assert all(result['success'] for result in results.values())
+    assert sum(result['tiles_extracted'] for result in results.values()) == len(expected)
+    for (zoom, x, y), data in expected.items():
+        # TMS rows are written under XYZ paths
+        with open(os.path.join(out_dir, "r", "raster", "Local", str(zoom), str(x), f"{y}.png"), 'rb') as f:
+            assert f.read() == data
+
+    missing = service.extract_tiles('Local', BBOX, 15, out_dir, "r")
+    assert not missing['success'] and missing['errors'] == ["No tiles found for given bbox and zoom"]
+
+
+def test_write_errors_fail_only_the_affected_zoom(tmp_path):
+    source_path = str(tmp_path / "local.mbtiles")
+    expected = _make_mbtiles(source_path, (12, 13))
+    service = LocalTileService(workers=2, writer_threads=2, batch_size=3)
+    assert service.register_source({'name': 'Local', 'path': source_path, 'source_type': 'mbtiles',
+                                    'tile_type': 'raster'})
+    out_dir = str(tmp_path / "out")
+    # A file where the zoom 13 directory should be makes every zoom 13 write fail
+    blocked = os.path.join(out_dir, "r", "raster", "Local", "13")
+    os.makedirs(os.path.dirname(blocked))
+    open(blocked, 'wb').close()
+
+    try:
+        results = service.extract_zooms(['Local'], [12, 13], out_dir, "r", bbox=BBOX)
+        assert results[('Local', 12)]['success']
+        assert results[('Local', 12)]['tiles_extracted'] == sum(1 for tile in expected if tile[0] == 12)
+        failed = results[('Local', 13)]
+        assert not failed['success'] and failed['tiles_extracted'] == 0
+        assert failed['errors'] == [f"{sum(1 for tile in expected if tile[0] == 13)} tiles could not be written"]
+
+        # The writer pool outlives a single extraction
+        writers = service._writers
+        assert service.extract_tiles('Local', BBOX, 12, str(tmp_path / "again"), "r")['success']
+        assert service._writers is writers
+    finally:
+        service.close()
+    assert service._writers == [] and service.get_source('Local')._connections == {}
+
+
+def test_adapter_reuses_per_thread_connections_and_batches_lookups(tmp_path):
+    source_path = str(tmp_path / "local.mbtiles")
+    expected = _make_mbtiles(source_path, (12,))
+    adapter = MBTilesAdapter({'name': 'Local', 'path': source_path})
+    assert adapter.initialize() and adapter.schema == 'tiles'
+
+    # Lookups use the stored (TMS) row, like get_tile
+    coords = [(z, x, (1 << z) - 1 - y) for z, x, y in expected] + [(12, 0, 0)]
+    tiles = adapter.get_tiles(coords)
+    assert len(tiles) == len(expected) and (12, 0, 0) not in tiles
+    assert sorted(tiles.values()) == sorted(expected.values())
+    assert adapter.get_tile_count(BBOX, 12) == len(expected)
+    # A failing lookup raises instead of returning the tiles read before it
+    with pytest.raises(sqlite3.Error):
+        adapter.get_tiles(coords[:2] + [(12, 0)])
+
+    conn = adapter._connection()
+    assert adapter._connection() is conn
+    other = []
+    thread = threading.Thread(target=lambda: other.append(adapter._connection()))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+    adapter.close()
+    assert adapter._connections == {}
+
+
+def test_adapter_reads_images_map_layout(tmp_path):
+    source_path = str(tmp_path / "dedup.mbtiles")
+    conn = sqlite3.connect(source_path)
+    conn.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+    conn.execute("CREATE TABLE images (tile_id TEXT, tile_data BLOB)")
+    conn.execute("CREATE TABLE map (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_id TEXT)")
+    conn.execute("INSERT INTO metadata VALUES ('bounds', '28,40,30,42')")
+    conn.execute("INSERT INTO images VALUES ('sea', ?)", (b"\x89PNGsea",))
+    min_x, _, min_y, _ = MBTilesUtils.bbox_to_tile_range(BBOX, 12)
+    conn.executemany("INSERT INTO map VALUES (12, ?, ?, 'sea')", [(min_x, min_y), (min_x + 1, min_y)])
+    conn.commit()
+    conn.close()
+
+    adapter = MBTilesAdapter({'name': 'Dedup', 'path': source_path})
+    assert adapter.initialize() and adapter.schema == 'images_map'
+    assert adapter.get_tile(12, min_x, min_y) == b"\x89PNGsea"
+    assert sorted(tile[:2] for tile in adapter.extract_tiles(BBOX, 12)) == [(min_x, min_y), (min_x + 1, min_y)]
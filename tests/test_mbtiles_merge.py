@@ -0,0 +1,74 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from adapters.mbtiles_adapter import MBTilesAdapter
+from services.mbtiles_merge_service import MBTilesMergeService
+from services.mbtiles_writer import MBTilesWriter
+from utils.mbtiles_utils import MBTilesUtils
+from exceptions.tile_downloader_exceptions import DownloadError
+
+
+SEA = b"\x89PNGsea"
+
+
+def _make_archive(path: str, columns, payload: bytes, dedup: bool = False) -> None:
+    """Zoom 5 tiles in `columns` x rows 10-11; even rows are open sea"""
+    writer = MBTilesWriter(path, dedup=dedup)
+    for x in columns:
+        for y in (10, 11):
+            writer.put(5, x, y, SEA if y == 10 else payload + bytes([x]))
+    writer.close()
+
+
+def _make_tree(root: str) -> None:
+    for x, y, data in ((20, 10, SEA), (20, 11, b"\x89PNGtree"), (10, 11, b"\x89PNG-biggest-payload")):
+        os.makedirs(os.path.join(root, "5", str(x)), exist_ok=True)
+        with open(os.path.join(root, "5", str(x), f"{y}.png"), 'wb') as f:
+            f.write(data)
+
+
+def _lookup(path: str):
+    adapter = MBTilesAdapter({'name': 'Merged', 'path': path})
+    assert adapter.initialize()
+    return adapter
+
+
+def test_merge_resolves_conflicts_and_deduplicates_payloads(tmp_path):
+    turkey, africa, tree = (str(tmp_path / "turkey.mbtiles"), str(tmp_path / "africa.mbtiles"),
+                            str(tmp_path / "istanbul" / "raster" / "Layer"))
+    _make_archive(turkey, range(8, 12), b"\x89PNGtr")
+    _make_archive(africa, range(10, 14), b"\x89PNGafrica", dedup=True)
+    _make_tree(tree)
+
+    first = str(tmp_path / "first.mbtiles")
+    result = MBTilesMergeService('first', workers=3, batch_size=2).merge([turkey, africa, tree], first)
+
+    # Columns 8-13 and 20, two rows each; columns 10-11 overlap in both archives, (10, 11) in the tree too
+    assert result['tiles'] == 14 and result['conflicts'] == 5
+    assert [merged['tiles'] for merged in result['inputs']] == [8, 4, 2]
+    # All seven sea tiles share one payload
+    assert result['images'] == 14 - 6
+    adapter = _lookup(first)
+    assert adapter.get_tile(5, 10, 31 - 11) == b"\x89PNGtr" + bytes([10])
+    assert adapter.get_tile(5, 12, 31 - 11) == b"\x89PNGafrica" + bytes([12])
+    assert adapter.get_tile(5, 20, 31 - 10) == SEA
+
+    metadata = MBTilesUtils.get_mbtiles_metadata(first)
+    assert (metadata['minzoom'], metadata['maxzoom'], metadata['scheme']) == ('5', '5', 'tms')
+    bounds = [float(value) for value in metadata['bounds'].split(',')]
+    turkey_bounds = MBTilesUtils.get_mbtiles_bounds(turkey)
+    assert bounds[0] == pytest.approx(turkey_bounds[0], abs=1e-6) and bounds[2] > turkey_bounds[2]
+
+    largest = str(tmp_path / "largest.mbtiles")
+    MBTilesMergeService('largest').merge([turkey, africa, tree], largest)
+    adapter = _lookup(largest)
+    assert adapter.get_tile(5, 11, 31 - 11) == b"\x89PNGafrica" + bytes([11])
+    assert adapter.get_tile(5, 10, 31 - 11) == b"\x89PNG-biggest-payload"
+
+    with pytest.raises(DownloadError):
+        MBTilesMergeService('first').merge([turkey], largest)
+    assert not os.path.exists(largest + '.tmp')
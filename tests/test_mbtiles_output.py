@@ -0,0 +1,69 @@
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from adapters.mbtiles_adapter import MBTilesAdapter
+from models.tile_server import TileServer
+from services.tile_download_service import TileDownloadService
+from utils.mbtiles_utils import MBTilesUtils
+from utils.tile_calculator import TileCalculator
+from conftest import StubResponse, StubSession
+
+
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + b"mbtiles"
+
+
+def test_download_into_mbtiles_is_readable_by_adapter(tmp_path):
+    raster = TileServer(name="RasterB", url="https://r.example.com/{z}/{x}/{y}.png", headers={}, tile_type="raster")
+    bbox = [28.9, 41.0, 29.1, 41.1]
+    tiles = TileCalculator.get_tiles_for_bbox(bbox, 10, 12)
+
+    service = TileDownloadService(max_workers=4, retry_attempts=1, timeout=5, output_format='mbtiles')
+    service.create_session = lambda: StubSession(payloads={raster.get_tile_url(*t): PNG_BYTES for t in tiles})  # type: ignore
+    result = service.download_tiles_batch(iter(tiles), tmp_path.as_posix(), "mbRegion", [raster])
+
+    assert result["downloaded"] == len(tiles)
+    mbtiles_path = tmp_path / "mbRegion" / "raster" / "RasterB.mbtiles"
+    assert mbtiles_path.is_file()
+    # No per-tile files or directories are created
+    assert not (tmp_path / "mbRegion" / "raster" / "RasterB").exists()
+
+    metadata = MBTilesUtils.get_mbtiles_metadata(str(mbtiles_path))
+    assert metadata["format"] == "png"
+    assert (metadata["minzoom"], metadata["maxzoom"]) == ("10", "12")
+    assert MBTilesUtils.get_mbtiles_tile_stats(str(mbtiles_path))["tile_count"] == len(tiles)
+
+    adapter = MBTilesAdapter({'name': 'RasterB', 'path': str(mbtiles_path)})
+    assert adapter.initialize()
+    extracted = adapter.extract_tiles(bbox, 12)
+    expected = sorted((x, y) for z, x, y in tiles if z == 12)
+    assert sorted((x, y) for x, y, _ in extracted) == expected
+    assert all(data == PNG_BYTES for _, _, data in extracted)
+
+    # A second run finds every tile already stored and fetches nothing
+    service.create_session = lambda: StubSession(payloads={})  # type: ignore
+    rerun = service.download_tiles_batch(tiles, tmp_path.as_posix(), "mbRegion", [raster])
+    assert rerun["downloaded"] == len(tiles)
+
+
+def test_failed_mbtiles_batch_marks_its_tiles_failed(tmp_path):
+    raster = TileServer(name="RasterB", url="https://r.example.com/{z}/{x}/{y}.png", headers={}, tile_type="raster")
+    tiles = TileCalculator.get_tiles_for_bbox([28.9, 41.0, 29.1, 41.1], 10, 11)
+    # A layer file whose tiles table rejects every row: the writer's commit fails
+    store_path = tmp_path / "mbRegion" / "raster" / "RasterB.mbtiles"
+    store_path.parent.mkdir(parents=True)
+    conn = sqlite3.connect(str(store_path))
+    conn.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, "
+                 "tile_data BLOB CHECK (length(tile_data) < 4))")
+    conn.close()
+
+    service = TileDownloadService(max_workers=2, retry_attempts=1, timeout=5, output_format='mbtiles')
+    service.create_session = lambda: StubSession(payloads={raster.get_tile_url(*t): PNG_BYTES for t in tiles})  # type: ignore
+    reported = {}
+    result = service.download_tiles_batch(tiles, tmp_path.as_posix(), "mbRegion", [raster],
+                                          tile_callback=lambda tile, ok, error: reported.__setitem__(tile, ok))
+
+    assert result["downloaded"] == 0 and result["failed"] == len(tiles)
+    assert reported == {tile: False for tile in tiles}
@@ -0,0 +1,90 @@
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from services.local_tile_service import LocalTileService
+from services.mbtiles_subset_export import MBTilesSubsetExporter
+from services.mbtiles_writer import MBTilesWriter
+from utils.mbtiles_utils import MBTilesUtils
+from utils.tile_calculator import TileCalculator
+
+
+SOURCE_BBOX = [28.0, 40.0, 30.0, 42.0]
+EXPORT_BBOX = [28.9, 41.0, 29.1, 41.1]
+
+
+def _make_source(path: str, dedup: bool) -> None:
+    """MBTiles over SOURCE_BBOX at zooms 9-11; open sea (x even) tiles share one payload"""
+    writer = MBTilesWriter(path, name="source", dedup=dedup)
+    for zoom, x, y in TileCalculator.iter_tiles_for_bbox(SOURCE_BBOX, 9, 11):
+        writer.put(zoom, x, y, b"\x89PNGsea" if x % 2 == 0 else b"\x89PNG" + f"{zoom}/{x}/{y}".encode())
+    writer.close()
+
+
+def _register(tmp_path, dedup: bool) -> LocalTileService:
+    source_path = str(tmp_path / "source.mbtiles")
+    _make_source(source_path, dedup)
+    service = LocalTileService()
+    assert service.register_source({'name': 'Src', 'path': source_path, 'source_type': 'mbtiles'})
+    return service
+
+
+def _rows(path: str):
+    conn = sqlite3.connect(path)
+    try:
+        return {(z, x, (1 << z) - 1 - row): bytes(data)
+                for z, x, row, data in conn.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles")}
+    finally:
+        conn.close()
+
+
+def test_export_bbox_subset_of_plain_source(tmp_path):
+    service = _register(tmp_path, dedup=False)
+    target = str(tmp_path / "bundle" / "subset.mbtiles")
+
+    result = service.export_subset('Src', target, 10, 11, bbox=EXPORT_BBOX)
+
+    assert result['success'] and not result['dedup']
+    expected = set(TileCalculator.iter_tiles_for_bbox(EXPORT_BBOX, 10, 11))
+    assert set(_rows(target)) == expected and result['tiles_exported'] == len(expected)
+    metadata = MBTilesUtils.get_mbtiles_metadata(target)
+    assert (metadata['minzoom'], metadata['maxzoom']) == ('10', '11')
+    assert [float(v) for v in metadata['bounds'].split(',')] == EXPORT_BBOX
+    assert not os.path.exists(target + '.tmp')
+    assert not service.export_subset('Src', target, 10, 11, bbox=EXPORT_BBOX)['success']
+
+
+def test_export_polygon_cover_keeps_dedup_layout(tmp_path):
+    service = _register(tmp_path, dedup=True)
+    target = str(tmp_path / "subset.mbtiles")
+    polygon = {'type': 'Polygon', 'coordinates': [[[28.5, 40.5], [29.5, 40.5], [28.5, 41.5], [28.5, 40.5]]]}
+
+    result = service.export_subset('Src', target, 9, 11, polygon=polygon)
+
+    assert result['success'] and result['dedup']
+    expected = set(TileCalculator.iter_tiles_for_polygon(polygon, 9, 11))
+    rows = _rows(target)
+    assert set(rows) == expected
+    assert all(data == (b"\x89PNGsea" if x % 2 == 0 else b"\x89PNG" + f"{z}/{x}/{y}".encode())
+               for (z, x, y), data in rows.items())
+    # Only referenced payloads are copied, each once
+    assert result['images'] == len(set(rows.values()))
+
+
+def test_export_of_an_area_outside_the_source_fails_without_stale_metadata(tmp_path):
+    service = _register(tmp_path, dedup=False)
+    target = str(tmp_path / "empty.mbtiles")
+
+    result = service.export_subset('Src', target, 10, 11, bbox=[10.0, 10.0, 11.0, 11.0])
+    assert not result['success'] and result['tiles_exported'] == 0
+    assert result['errors'] == ["No tiles found for given area and zoom range"]
+    assert not os.path.exists(target)
+
+    # Inside the source but past its zoom range: the file keeps only metadata that still holds
+    exporter = MBTilesSubsetExporter(str(tmp_path / "source.mbtiles"))
+    stats = exporter.export(target, 14, 15, bbox=EXPORT_BBOX)
+    metadata = MBTilesUtils.get_mbtiles_metadata(target)
+    assert stats['tiles'] == 0 and stats['zooms'] is None
+    assert 'bounds' in metadata and not {'minzoom', 'maxzoom', 'center'} & set(metadata)
@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from models.tile_server import TileServer
+from services.tile_download_service import TileDownloadService
+from utils.tile_calculator import TileCalculator
+from conftest import StubResponse, StubSession
+
+
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + b"mirror"
+
+
+class _Session(StubSession):
+    """Mirror 'slow' takes longer than the hedge delay; every other host answers at once"""
+
+    def respond(self, url, headers):
+        if url.split('/')[2].startswith('slow'):
+            time.sleep(0.5)
+        return super().respond(url, headers)
+
+
+def test_subdomains_expand_and_spread_by_quadkey():
+    server = TileServer(name="S", url="https://t{s}.example.com/{z}/{x}/{y}.png", headers={},
+                        tile_type="raster", subdomains=["1", "2", "3"])
+    assert len(server.get_url_templates()) == 3
+
+    tiles = TileCalculator.get_tiles_for_bbox([28.0, 40.0, 30.0, 42.0], 8, 10)
+    hosts = Counter(server.get_tile_url(*t).split('/')[2] for t in tiles)
+    assert set(hosts) == {"t1.example.com", "t2.example.com", "t3.example.com"}
+    # Quadkey hashing is stable: a tile always goes to the same mirror
+    assert server.get_tile_url(10, 600, 380) == server.get_tile_url(10, 600, 380)
+    # Every mirror is listed once, starting with the chosen one
+    urls = server.get_tile_urls(10, 600, 380)
+    assert urls[0] == server.get_tile_url(10, 600, 380) and len(set(urls)) == 3
+
+    rr = TileServer(name="R", url="https://a.example.com/{z}/{x}/{y}.png", headers={}, tile_type="raster",
+                    mirrors=["https://b.example.com/{z}/{x}/{y}.png"], mirror_strategy="round_robin")
+    assert [rr.get_tile_url(1, 0, 0).split('/')[2] for _ in range(4)] == ["a.example.com", "b.example.com"] * 2
+
+
+def test_slow_mirror_is_hedged_to_the_next_one(tmp_path):
+    server = TileServer(name="Hedged", url="https://slow.example.com/{z}/{x}/{y}.png", headers={},
+                        tile_type="raster", mirrors=["https://fast.example.com/{z}/{x}/{y}.png"],
+                        mirror_strategy="round_robin", hedge_after=0.05)
+    tiles = TileCalculator.get_tiles_for_bbox([28.9, 41.0, 29.1, 41.1], 10, 11)
+    hosts: Counter = Counter()
+    service = TileDownloadService(max_workers=4, retry_attempts=1, timeout=5)
+    service.create_session = lambda: _Session(PNG_BYTES, hosts=hosts)  # type: ignore
+
+    started = time.monotonic()
+    result = service.download_tiles_batch(tiles, tmp_path.as_posix(), "r", [server])
+    elapsed = time.monotonic() - started
+
+    assert result["downloaded"] == len(tiles)
+    stats = service.get_hedge_stats()["Hedged"]
+    # Tiles routed to the slow mirror first were answered by the hedge
+    assert stats["hedged"] >= 1 and stats["won"] == stats["hedged"]
+    assert hosts["fast.example.com"] > hosts["slow.example.com"]
+    assert elapsed < 0.5 * hosts["slow.example.com"]
@@ -0,0 +1,55 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+Image = pytest.importorskip("PIL.Image")
+
+from services.pyramid_builder import PyramidBuilder
+
+
+def _write_tile(layer_dir, zoom, x, y, color):
+    path = layer_dir / str(zoom) / str(x) / f"{y}.png"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.new('RGBA', (256, 256), color).save(path, format='PNG')
+
+
+def test_parents_are_downsampled_mosaics_of_their_children(tmp_path):
+    layer_dir = tmp_path / "r" / "raster" / "A"
+    colors = {(0, 0): (255, 0, 0, 255), (1, 0): (0, 255, 0, 255), (0, 1): (0, 0, 255, 255)}
+    for (x, y), color in colors.items():
+        _write_tile(layer_dir, 2, x, y, color)
+    _write_tile(layer_dir, 2, 3, 3, (9, 9, 9, 255))
+    # An existing parent is kept as it is
+    _write_tile(layer_dir, 1, 1, 1, (1, 2, 3, 255))
+
+    stats = PyramidBuilder(str(layer_dir), workers=1).build()
+
+    assert stats['zooms'][1] == {'built': 1, 'skipped': 1, 'failed': 0}
+    assert stats['zooms'][0] == {'built': 1, 'skipped': 0, 'failed': 0}
+    parent = Image.open(layer_dir / "1" / "0" / "0.png")
+    assert parent.size == (256, 256)
+    assert parent.getpixel((64, 64)) == (255, 0, 0, 255)
+    assert parent.getpixel((192, 64)) == (0, 255, 0, 255)
+    assert parent.getpixel((64, 192)) == (0, 0, 255, 255)
+    assert parent.getpixel((192, 192))[3] == 0
+    assert Image.open(layer_dir / "1" / "1" / "1.png").getpixel((10, 10)) == (1, 2, 3, 255)
+    assert Image.open(layer_dir / "0" / "0" / "0.png").getpixel((200, 200)) == (1, 2, 3, 255)
+
+    again = PyramidBuilder(str(layer_dir), workers=2, complete_only=True).build()
+    assert again['built'] == 0 and again['failed'] == 0
+
+
+def test_pool_build_streams_levels_in_small_chunks(tmp_path):
+    layer_dir = tmp_path / "r" / "raster" / "B"
+    for x in range(8):
+        for y in range(8):
+            _write_tile(layer_dir, 3, x, y, (x * 30, y * 30, 0, 255))
+
+    stats = PyramidBuilder(str(layer_dir), workers=2, chunk_size=1).build()
+
+    assert {zoom: level['built'] for zoom, level in stats['zooms'].items()} == {2: 16, 1: 4, 0: 1}
+    assert stats['failed'] == 0
+    assert Image.open(layer_dir / "2" / "3" / "1.png").getpixel((200, 64)) == (7 * 30, 2 * 30, 0, 255)
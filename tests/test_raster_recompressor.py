@@ -0,0 +1,63 @@
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+Image = pytest.importorskip("PIL.Image")
+
+from services.raster_recompressor import RasterRecompressor
+from utils.tile_encoding import detect_image_format
+
+
+def _write_tile(layer_dir, x, y, color, **options):
+    path = layer_dir / "5" / str(x) / f"{y}.png"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.new('RGBA', (256, 256), color).save(path, format='PNG', **options)
+    return path
+
+
+def test_png_optimisation_keeps_only_smaller_lossless_results(tmp_path):
+    layer_dir = tmp_path / "r" / "raster" / "A"
+    path = _write_tile(layer_dir, 1, 1, (10, 20, 30, 255), compress_level=0)
+    before = path.read_bytes()
+
+    result = RasterRecompressor(str(tmp_path), target='png', workers=2).recompress_layers([str(layer_dir)])
+
+    assert result['recompressed'] == 1 and result['failed'] == 0
+    assert len(path.read_bytes()) < len(before)
+    assert Image.open(path).convert('RGBA').tobytes() == Image.open(io.BytesIO(before)).convert('RGBA').tobytes()
+
+
+def test_lossy_targets_convert_once_and_keep_transparent_tiles_out_of_jpeg(tmp_path):
+    layer_dir = tmp_path / "r" / "raster" / "A"
+    opaque = _write_tile(layer_dir, 1, 1, (10, 20, 30, 255))
+    transparent = _write_tile(layer_dir, 1, 2, (10, 20, 30, 0))
+
+    jpeg = RasterRecompressor(str(tmp_path), target='jpeg', quality=70, workers=1).recompress_layers([str(layer_dir)])
+    assert (jpeg['recompressed'], jpeg['unchanged']) == (1, 1)
+    assert detect_image_format(opaque.read_bytes()) == 'jpg'
+    assert detect_image_format(transparent.read_bytes()) == 'png'
+
+    webp = RasterRecompressor(str(tmp_path), target='webp', workers=1).recompress_layers([str(layer_dir)])
+    assert webp['recompressed'] == 2
+    assert detect_image_format(transparent.read_bytes()) == 'webp'
+    again = RasterRecompressor(str(tmp_path), target='webp', workers=1).recompress_layers([str(layer_dir)])
+    assert again['recompressed'] == 0 and again['unchanged'] == 2
+
+
+def test_only_the_given_tiles_are_recompressed_whatever_their_mtime(tmp_path):
+    layer_dir = tmp_path / "r" / "raster" / "A"
+    job_tile = _write_tile(layer_dir, 1, 1, (10, 20, 30, 255))
+    other_tile = _write_tile(layer_dir, 1, 2, (10, 20, 30, 255))
+    # Like a dedup hardlink to an old blob: the job's tile looks older than the job
+    os.utime(job_tile, (0, 0))
+
+    result = RasterRecompressor(str(tmp_path), target='webp', workers=1).recompress_layers(
+        [str(layer_dir)], tiles=iter([(5, 1, 1), (5, 1, 3)]))
+
+    assert (result['tiles'], result['recompressed']) == (1, 1)
+    assert detect_image_format(job_tile.read_bytes()) == 'webp'
+    assert detect_image_format(other_tile.read_bytes()) == 'png'
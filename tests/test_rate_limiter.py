@@ -0,0 +1,78 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from services.rate_limiter import AdaptiveHostLimiter, HostRateLimiter, parse_retry_after
+
+
+def test_limit_grows_on_healthy_responses_and_halves_on_429():
+    limiter = AdaptiveHostLimiter("tiles.example.com", initial_concurrency=4, max_concurrency=64)
+
+    for _ in range(40):
+        limiter.acquire()
+        limiter.release(200, 0.05)
+    grown = limiter.limit
+    assert grown > 4
+
+    limiter.acquire()
+    limiter.release(429, 0.05)
+    assert limiter.limit == max(1.0, grown / 2.0)
+
+    # A burst of 429s from the same congestion event only backs off once
+    for _ in range(5):
+        limiter.acquire()
+        limiter.release(429, 0.05)
+    assert limiter.decreases == 1
+
+
+def test_retry_after_pauses_host():
+    limiter = AdaptiveHostLimiter("tiles.example.com", initial_concurrency=2, max_concurrency=8)
+    limiter.acquire()
+    limiter.release(503, 0.01, retry_after=30)
+    assert limiter.paused_until > 0
+    assert limiter.throttled == 1
+
+
+def test_client_errors_neither_grow_the_limit_nor_pause_the_host():
+    limiter = AdaptiveHostLimiter("tiles.example.com", initial_concurrency=4, max_concurrency=64)
+    for _ in range(40):
+        limiter.acquire()
+        limiter.release(404, 0.05, retry_after=30)
+
+    assert limiter.limit == 4 and limiter.paused_until == 0
+    assert (limiter.throttled, limiter.errors, limiter.decreases) == (0, 0, 0)
+
+
+def test_servers_on_same_host_share_one_limiter():
+    registry = HostRateLimiter(initial_concurrency=5)
+    light = registry.get_limiter("https://cartodb-basemaps-b.global.ssl.fastly.net/light_all/1/0/0.png")
+    dark = registry.get_limiter("https://cartodb-basemaps-b.global.ssl.fastly.net/dark_all/1/0/0.png")
+    other = registry.get_limiter("https://api.maptiler.com/tiles/v3/1/0/0.pbf")
+
+    assert light is dark
+    assert light is not other
+    assert light.max_concurrency == 20
+
+
+def test_host_overrides_and_retry_after_parsing():
+    registry = HostRateLimiter(initial_concurrency=5, host_limits={
+        "api.maptiler.com": {"max_concurrency": 10, "requests_per_second": 20}
+    })
+    limiter = registry.get_limiter("https://api.maptiler.com/tiles/v3/1/0/0.pbf")
+    assert limiter.max_concurrency == 10
+    assert limiter.bucket is not None
+
+    assert parse_retry_after("12") == 12.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+def test_acquire_gives_up_on_a_paused_host_when_aborted():
+    limiter = AdaptiveHostLimiter("tiles.example.com", initial_concurrency=2, max_concurrency=8)
+    limiter.acquire()
+    limiter.release(503, 0.01, retry_after=30)
+    aborted = []
+
+    assert not limiter.acquire(abort=lambda: aborted.append(1) or len(aborted) > 1)
+    assert limiter.in_flight == 0
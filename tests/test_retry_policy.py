@@ -0,0 +1,80 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from models.tile_server import TileServer
+from services.retry_policy import RetryPolicy, RetryPolicyRegistry, DelayedQueue
+from services.source_factory import SourceFactory
+from services.tile_download_service import TileDownloadService
+from exceptions.tile_downloader_exceptions import DownloadError, ServerError, TileRequestError
+from conftest import StubResponse, StubSession
+
+
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + b"retry"
+
+
+class _FlakySession(StubSession):
+    """Answers 503 to the first request for `flaky_url`, 200 to everything else"""
+
+    def __init__(self, flaky_url: str):
+        super().__init__(PNG_BYTES)
+        self.flaky_url = flaky_url
+
+    def respond(self, url, headers):
+        with self._lock:
+            first_try = self.urls.count(url) == 1
+        if url == self.flaky_url and first_try:
+            return StubResponse(503, b"")
+        return super().respond(url, headers)
+
+
+def test_policy_backoff_jitter_retry_after_and_non_retryable_errors():
+    policy = RetryPolicy(attempts=4, base_delay=1.0, max_delay=3.0, jitter=0.0)
+    error = TileRequestError("HTTP 503", status=503)
+    assert [policy.retry_delay(n, error) for n in (1, 2, 3, 4)] == [1.0, 2.0, 3.0, None]
+    assert policy.retry_delay(1, TileRequestError("HTTP 503", status=503, retry_after=2.5)) == 2.5
+    assert policy.retry_delay(1, TileRequestError("HTTP 429", status=429, retry_after=60)) == 3.0
+    assert policy.retry_delay(1, TileRequestError("HTTP 404", status=404)) is None
+    assert policy.retry_delay(1, ServerError("Circuit open")) is None
+    assert policy.retry_delay(1, DownloadError("Empty content")) == 1.0
+
+    jittered = RetryPolicy(attempts=3, base_delay=1.0, jitter=0.5)
+    assert all(0.5 <= jittered.retry_delay(1, error) <= 1.0 for _ in range(50))
+
+    server = TileServer(name="S", url="https://s.example.com/{z}/{x}/{y}.png", headers={}, tile_type="raster",
+                        retry={'attempts': 5})
+    policy = RetryPolicyRegistry({'base_delay': 2.0}, attempts=3).get(server)
+    assert policy.attempts == 5 and policy.base_delay == 2.0
+
+    # Servers built by the source factory keep their overrides too; unknown settings are rejected
+    config = {'name': 'S', 'url': "https://s.example.com/{z}/{x}/{y}.png", 'retry': {'attempts': 5}}
+    assert SourceFactory.create_source(config).retry == {'attempts': 5}
+    assert SourceFactory.create_source({**config, 'retry': {'tries': 5}}) is None
+
+
+def test_delayed_queue_releases_items_in_due_order():
+    queue = DelayedQueue()
+    queue.push('later', 60)
+    queue.push('b', 0)
+    queue.push('a', -1)
+    assert queue.pop_ready() == ['a', 'b']
+    assert len(queue) == 1 and queue.next_ready_in() > 50
+    assert queue.clear() == 1 and queue.next_ready_in() is None
+
+
+def test_batch_retries_from_delay_queue_without_blocking_the_worker(tmp_path):
+    server = TileServer(name="Flaky", url="https://flaky.example.com/{z}/{x}/{y}.png", headers={},
+                        tile_type="raster", retry={'attempts': 2, 'base_delay': 0.3, 'jitter': 0})
+    tiles = [(10, x, 0) for x in range(6)]
+    session = _FlakySession(server.get_tile_url(*tiles[0]))
+    service = TileDownloadService(max_workers=1, max_concurrency_per_host=1, retry_attempts=1, timeout=5)
+    service.create_session = lambda: session  # type: ignore
+
+    result = service.download_tiles_batch(tiles, tmp_path.as_posix(), "r", [server])
+
+    assert result['downloaded'] == len(tiles) and result['failed'] == 0
+    # The only worker served every other tile while the failed one waited for its retry
+    assert session.urls[-1] == session.flaky_url
+    assert len(session.urls) == len(tiles) + 1
+    assert service.metrics.snapshot()['servers']['Flaky']['retries'] == 1
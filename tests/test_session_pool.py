@@ -0,0 +1,52 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from services.session_pool import SessionPool
+from services.tile_download_service import TileDownloadService
+from models.tile_server import TileServer
+from conftest import StubResponse, StubSession
+
+
+def test_pool_reuses_session_per_host():
+    created = []
+
+    def factory():
+        session = StubSession()
+        created.append(session)
+        return session
+
+    pool = SessionPool(factory)
+    a = pool.get_session("https://a.example.com/1/2/3.png")
+    b = pool.get_session("https://a.example.com/4/5/6.png")
+    c = pool.get_session("https://b.example.com/1/2/3.png")
+
+    assert a is b
+    assert a is not c
+    assert len(created) == 2
+
+    stats = pool.get_stats()
+    assert stats["https://a.example.com"]["requests"] == 2
+    assert stats["https://b.example.com"]["requests"] == 1
+
+
+def test_batch_creates_one_session_per_host(tmp_path):
+    created = []
+
+    def factory():
+        session = StubSession()
+        created.append(session)
+        return session
+
+    service = TileDownloadService(max_workers=4, retry_attempts=1, timeout=5)
+    service.create_session = factory  # type: ignore
+
+    raster = TileServer(name="RasterA", url="https://r.example.com/{z}/{x}/{y}.png", headers={}, tile_type="raster")
+    tiles = [(4, x, y) for x in range(3) for y in range(3)]
+
+    result = service.download_tiles_batch(tiles, tmp_path.as_posix(), "poolRegion", [raster])
+
+    assert result["downloaded"] == len(tiles)
+    assert len(created) == 1
+    assert len(created[0].urls) == len(tiles)
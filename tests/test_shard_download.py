@@ -0,0 +1,106 @@
+import http.server
+import json
+import os
+import socketserver
+import subprocess
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from services.shard_merge_service import ShardMergeService
+from utils.tile_calculator import TileCalculator
+from utils.tile_sharding import TileSharding
+
+
+DOWNLOADER = os.path.join(os.path.dirname(__file__), '..', 'src', 'tile_downloader.py')
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + b"shard"
+BBOX = [28.5, 40.8, 29.5, 41.2]
+
+
+class _StubTileHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(PNG_BYTES)))
+        self.end_headers()
+        self.wfile.write(PNG_BYTES)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_upstream():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _StubTileHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _write_config(tmp_path, upstream: str) -> None:
+    config = {
+        "regions": {"demo": {"bbox": BBOX, "min_zoom": 8, "max_zoom": 11, "description": "Demo"}},
+        "servers": [{"name": "Stub", "type": "http", "url": upstream + "/{z}/{x}/{y}.png",
+                     "headers": {}, "tile_type": "raster"}],
+        "output_dir": "out", "max_workers_per_server": 4, "retry_attempts": 1, "timeout": 10
+    }
+    (tmp_path / "config.json").write_text(json.dumps(config), encoding="utf-8")
+
+
+def _run(tmp_path, *args) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, os.path.abspath(DOWNLOADER), *args], cwd=tmp_path,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+
+
+def test_shards_partition_the_tile_space_exactly():
+    min_zoom, max_zoom, count = 6, 11, 3
+    partition_zoom = TileSharding.choose_partition_zoom(BBOX, min_zoom, max_zoom, count)
+    seen = []
+    for index in range(count):
+        tiles = list(TileSharding.iter_shard_tiles(BBOX, min_zoom, max_zoom, partition_zoom, index, count))
+        assert len(tiles) == TileSharding.count_shard_tiles(BBOX, min_zoom, max_zoom, partition_zoom, index, count)
+        assert tiles, "every shard gets work"
+        seen.extend(tiles)
+    assert sorted(seen) == sorted(TileCalculator.iter_tiles_for_bbox(BBOX, min_zoom, max_zoom))
+
+
+def test_sharded_processes_merge_into_one_region(tmp_path, stub_upstream):
+    _write_config(tmp_path, stub_upstream)
+    common = ["--region", "demo", "--min-zoom", "8", "--max-zoom", "11", "--servers", "Stub", "--shard-count", "3"]
+
+    # Two shards running side by side; the merge must refuse and name the missing one
+    shards = [_run(tmp_path, *common, "--shard-index", str(index)) for index in (0, 1)]
+    assert [shard.wait(timeout=120) for shard in shards] == [0, 0]
+    merge = _run(tmp_path, "--merge-shards", "demo")
+    output = merge.communicate(timeout=60)[0]
+    assert "Shard 2 of 3 is missing" in output
+    assert not (tmp_path / "out" / "demo").exists()
+
+    assert _run(tmp_path, *common, "--shard-index", "2").wait(timeout=120) == 0
+    output = _run(tmp_path, "--merge-shards", "demo").communicate(timeout=60)[0]
+    assert "Shards merged successfully" in output
+
+    merged = tmp_path / "out" / "demo" / "raster" / "Stub"
+    files = sorted(p.relative_to(merged).as_posix() for p in merged.rglob("*.png"))
+    expected = sorted(f"{z}/{x}/{y}.png" for z, x, y in TileCalculator.iter_tiles_for_bbox(BBOX, 8, 11))
+    assert files == expected
+
+
+def test_verify_reports_undone_tiles_and_mismatched_jobs(tmp_path):
+    base = {"bbox": BBOX, "min_zoom": 8, "max_zoom": 11, "shard_count": 2, "partition_zoom": 9,
+            "online_sources": ["Stub"], "output_format": "files", "status": "completed", "failed_tiles": 0}
+    manifests = [
+        dict(base, shard_index=0, job_id="a", expected_tiles=10, done_tiles=10),
+        dict(base, shard_index=1, job_id="b", expected_tiles=12, done_tiles=9, failed_tiles=3,
+             max_zoom=12, status="failed"),
+    ]
+    problems = ShardMergeService(tmp_path.as_posix()).verify(manifests)
+    assert any("different max_zoom" in p for p in problems)
+    assert any("Shard 1 left 3 of 12" in p and "--retry-failed" in p for p in problems)
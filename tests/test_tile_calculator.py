@@ -56,6 +56,63 @@ class TestTileCalculator:
         assert isinstance(count, int)
         assert count > 0
     
+    def test_streaming_tiles_match_list(self):
+        """Lazy tile iteration and arithmetic count agree with the full list"""
+        bbox = [28.5, 40.8, 29.5, 41.2]
+        tiles = TileCalculator.get_tiles_for_bbox(bbox, 8, 12)
+        
+        assert list(TileCalculator.iter_tiles_for_bbox(bbox, 8, 12)) == tiles
+        assert TileCalculator.calculate_tile_count(bbox, 8, 12) == len(tiles)
+    
+    def test_tile_counts_per_zoom(self):
+        """Per-zoom arithmetic counts match the enumerated tiles of each zoom"""
+        bbox = [28.5, 40.8, 29.5, 41.2]
+        counts = TileCalculator.calculate_tile_counts(bbox, 8, 12)
+        
+        assert list(counts) == [8, 9, 10, 11, 12]
+        for zoom, count in counts.items():
+            assert count == len(TileCalculator.get_tiles_for_bbox(bbox, zoom, zoom))
+    
+    def test_polygon_cover_matches_per_tile_test(self):
+        """Quadtree cover equals testing every bbox tile against the polygon (holes and parts included)"""
+        from shapely.geometry import Point, box, mapping, shape
+        geometry = (Point(29.0, 41.0).buffer(0.4, quad_segs=4).union(box(28.0, 40.0, 28.6, 41.3))
+                    .difference(Point(28.3, 40.5).buffer(0.1)).union(box(30.5, 40.0, 30.6, 40.1)))
+        polygon = mapping(geometry)
+        
+        expected = []
+        for z, x, y in TileCalculator.get_tiles_for_bbox(list(geometry.bounds), 6, 13):
+            if shape(polygon).intersects(box(*TileCalculator.tile_bounds(z, x, y))):
+                expected.append((z, x, y))
+        
+        assert polygon['type'] == 'MultiPolygon'
+        assert TileCalculator.get_tiles_for_polygon(polygon, 6, 13) == expected
+        counts = TileCalculator.calculate_polygon_tile_counts(polygon, 6, 13)
+        assert counts == {z: sum(1 for tile in expected if tile[0] == z) for z in range(6, 14)}
+        # Tiles inside the hole are left out
+        hole_x, hole_y = TileCalculator.deg2num(40.5, 28.3, 13)
+        assert (13, hole_x, hole_y) not in set(TileCalculator.iter_tiles_for_polygon(polygon, 13, 13))
+    
+    def test_array_kernels_match_scalar_functions(self):
+        """Vectorised lon/lat -> tile, tile -> bounds and quadkey kernels agree with the scalar path"""
+        import numpy as np
+        from models.tile_server import tile_quadkey
+        lats = np.linspace(-85.0, 85.0, 97)
+        lons = np.linspace(-180.0, 179.99, 97)
+        
+        for zoom in (0, 7, 16):
+            xs, ys = TileCalculator.deg2num_array(lats, lons, zoom)
+            assert list(zip(xs.tolist(), ys.tolist())) == [TileCalculator.deg2num(lat, lon, zoom) for lat, lon in zip(lats, lons)]
+            bounds = TileCalculator.tile_bounds_array(zoom, xs, ys)
+            assert np.allclose(bounds, [TileCalculator.tile_bounds(zoom, x, y) for x, y in zip(xs.tolist(), ys.tolist())])
+            quadkeys = TileCalculator.quadkeys_array(zoom, xs, ys)
+            assert quadkeys == [tile_quadkey(zoom, x, y) for x, y in zip(xs.tolist(), ys.tolist())]
+            zooms, qx, qy = TileCalculator.quadkeys_to_tiles(quadkeys)
+            assert (zooms == zoom).all() and (qx == xs).all() and (qy == ys).all()
+        
+        zooms, xs, ys = TileCalculator.quadkeys_to_tiles(['', '3', '120'])
+        assert zooms.tolist() == [0, 1, 3] and xs.tolist() == [0, 1, 4] and ys.tolist() == [0, 1, 2]
+    
     def test_edge_cases(self):
         """Test edge cases"""
         # Zero zoom
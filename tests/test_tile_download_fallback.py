@@ -7,34 +7,14 @@ import pytest
 
 from src.models.tile_server import TileServer
 from src.services.tile_download_service import TileDownloadService
-
-
-class DummyResponse:
-    def __init__(self, status_code: int, content: bytes):
-        self.status_code = status_code
-        self.content = content
-
-    def raise_for_status(self):
-        if not (200 <= self.status_code < 300):
-            raise Exception(f"HTTP {self.status_code}")
-
-
-class DummySession:
-    def __init__(self, url_to_payload: Dict[str, bytes]):
-        self.url_to_payload = url_to_payload
-
-    def get(self, url, headers=None, timeout=None):
-        payload = self.url_to_payload.get(url)
-        if payload is None:
-            return DummyResponse(404, b"")
-        return DummyResponse(200, payload)
+from conftest import StubSession
 
 
 def make_service_with_mocked_session(url_to_payload: Dict[str, bytes]) -> TileDownloadService:
     service = TileDownloadService(max_workers=2, retry_attempts=1, timeout=5)
 
     def create_session_override():
-        return DummySession(url_to_payload)
+        return StubSession(payloads=url_to_payload)
 
     # Monkeypatch instance method
     service.create_session = create_session_override  # type: ignore
@@ -86,3 +66,30 @@ def test_skip_existing_non_empty_but_not_zero_byte(tmp_path: Path):
     assert tile_path.read_bytes() == b"oldcontent"
 
 
+def test_batch_consumes_tile_generator_lazily(tmp_path: Path):
+    raster = TileServer(name="RasterB", url="https://r.example.com/{z}/{x}/{y}.png", headers={}, tile_type="raster")
+    tiles = [(10, x, y) for x in range(40) for y in range(25)]
+    service = make_service_with_mocked_session({raster.get_tile_url(*t): b"png" for t in tiles})
+
+    produced = []
+    produced_at_first_request = []
+    original_fetch = service._fetch_tile
+
+    def fetch_and_observe(zoom, x, y, server):
+        if not produced_at_first_request:
+            produced_at_first_request.append(len(produced))
+        return original_fetch(zoom, x, y, server)
+
+    service._fetch_tile = fetch_and_observe  # type: ignore
+
+    def producer():
+        for tile in tiles:
+            produced.append(tile)
+            yield tile
+
+    result = service.download_tiles_batch(producer(), tmp_path.as_posix(), "testRegion", [raster])
+
+    assert result["total"] == len(tiles)
+    assert result["downloaded"] == len(tiles)
+    # Work starts after a bounded window of tiles, not after the whole job is enumerated
+    assert produced_at_first_request[0] < len(tiles)
@@ -0,0 +1,53 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from models.tile_server import TileServer
+from services.tile_download_service import TileDownloadService
+from utils.tile_calculator import TileCalculator
+from utils.tile_existence import TileExistenceIndex
+from conftest import StubSession
+
+
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + b"exists"
+
+
+def test_index_scans_once_and_ignores_empty_files(tmp_path):
+    layer = tmp_path / "r" / "raster" / "A"
+    (layer / "5" / "10").mkdir(parents=True)
+    (layer / "5" / "10" / "7.png").write_bytes(PNG_BYTES)
+    (layer / "5" / "10" / "8.png").write_bytes(b"")
+    (layer / "5" / "10" / "9.png.1234.tmp").write_bytes(PNG_BYTES)
+
+    index = TileExistenceIndex(str(layer), "png")
+    assert index.contains(5, 10, 7)
+    assert not index.contains(5, 10, 8) and not index.contains(5, 10, 9) and not index.contains(5, 11, 7)
+    assert index.files_scanned == 2
+
+    path = index.tile_path(5, 12, 300)
+    assert os.path.isdir(os.path.dirname(path)) and path.endswith(os.path.join("5", "12", "300.png"))
+    index.add(5, 12, 300)
+    assert index.contains(5, 12, 300) and index.files_scanned == 2
+
+
+def test_rerun_skips_present_tiles_before_the_worker_queue(tmp_path):
+    server = TileServer(name="A", url="https://a.example.com/{z}/{x}/{y}.png", headers={}, tile_type="raster")
+    tiles = TileCalculator.get_tiles_for_bbox([28.9, 41.0, 29.1, 41.1], 10, 12)
+    session = StubSession(PNG_BYTES)
+    service = TileDownloadService(max_workers=4, retry_attempts=1, timeout=5)
+    service.create_session = lambda: session  # type: ignore
+
+    first = service.download_tiles_batch(tiles, tmp_path.as_posix(), "r", [server])
+    assert first["downloaded"] == len(tiles) and first["skipped"] == 0
+
+    # Drop one tile and truncate another: only those two are fetched again
+    layer = tmp_path / "r" / "raster" / "A"
+    (layer / "{}/{}/{}.png".format(*tiles[0])).unlink()
+    (layer / "{}/{}/{}.png".format(*tiles[-1])).write_bytes(b"")
+    session.urls.clear()
+    done = []
+    second = service.download_tiles_batch(tiles, tmp_path.as_posix(), "r", [server],
+                                          tile_callback=lambda tile, ok, error: done.append(ok))
+    assert second["downloaded"] == len(tiles) and second["skipped"] == len(tiles) - 2
+    assert len(session.urls) == 2 and len(done) == len(tiles) and all(done)
@@ -0,0 +1,42 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from services.tile_file_writer import TileFileWriter
+
+
+def test_callbacks_run_after_earlier_writes_are_on_disk(tmp_path):
+    writer = TileFileWriter(queue_size=4, batch_size=3, fsync=True)
+    seen = []
+
+    def check(tile, path):
+        seen.append((tile, os.path.exists(path) and open(path, 'rb').read() == b"tile"))
+
+    for y in range(10):
+        path = str(tmp_path / "r" / "raster" / "A" / "5" / str(y % 3) / f"{y}.png")
+        writer.put(path, b"tile", (5, y % 3, y))
+        writer.call_after_writes(check, (5, y % 3, y), path)
+    writer.close()
+
+    assert len(seen) == 10 and all(ok for _, ok in seen)
+    assert not list(tmp_path.rglob("*.tmp"))
+    stats = writer.get_stats()
+    assert stats['files'] == 10 and stats['bytes'] == 40 and stats['errors'] == 0
+    assert stats['queue_depth'] == 0 and 0 < stats['max_queue_depth'] <= 4
+
+
+def test_failed_write_is_reported_for_its_tile(tmp_path):
+    blocker = tmp_path / "blocker"
+    blocker.write_bytes(b"not a directory")
+    writer = TileFileWriter()
+    written = []
+    writer.put(str(blocker / "5" / "1.png"), b"tile", (5, 0, 1), on_written=lambda: written.append(1))
+    writer.put(str(tmp_path / "ok" / "2.png"), b"tile", (5, 0, 2), on_written=lambda: written.append(2))
+    writer.close()
+
+    # Only the tile that reached the disk is reported as written (e.g. to the existence index)
+    assert written == [2]
+    assert writer.write_errors == 1
+    assert writer.pop_error((5, 0, 1)) is not None and writer.pop_error((5, 0, 2)) is None
+    assert (tmp_path / "ok" / "2.png").read_bytes() == b"tile"
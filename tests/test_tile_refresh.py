@@ -0,0 +1,128 @@
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from core.tile_download_manager import TileDownloadManager
+from models.tile_server import TileServer
+from services.tile_download_service import TileDownloadService
+from services.tile_validators import TileValidatorIndex, layer_key
+from utils.tile_calculator import TileCalculator
+from conftest import StubResponse, StubSession
+
+
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + b"refresh"
+
+
+class _ConditionalSession(StubSession):
+    """Serves every tile with one ETag and answers 304 when it is sent back"""
+
+    def respond(self, url, headers):
+        if headers.get('If-None-Match') == '"v1"':
+            return StubResponse(304, b"", {'ETag': '"v1"'})
+        return StubResponse(200, PNG_BYTES, {'ETag': '"v1"', 'Last-Modified': 'Wed, 01 Jan 2025 00:00:00 GMT'})
+
+
+def test_refresh_revalidates_with_etag_and_respects_max_age(tmp_path):
+    server = TileServer(name="RasterB", url="https://r.example.com/{z}/{x}/{y}.png", headers={}, tile_type="raster")
+    tiles = TileCalculator.get_tiles_for_bbox([28.9, 41.0, 29.1, 41.1], 10, 11)
+    validators = TileValidatorIndex(str(tmp_path / "validators.sqlite"))
+    session = _ConditionalSession()
+    service = TileDownloadService(max_workers=4, retry_attempts=1, timeout=5)
+    service.create_session = lambda: session  # type: ignore
+
+    first = service.download_tiles_batch(tiles, tmp_path.as_posix(), "r", [server], validators=validators)
+    assert first["downloaded"] == len(tiles) and first["not_modified"] == 0
+    layer = layer_key("r", "raster", "RasterB")
+    assert validators.get(layer, *tiles[0])["etag"] == '"v1"'
+
+    # Plain reruns skip existing tiles without any request
+    session.headers.clear()
+    service.download_tiles_batch(tiles, tmp_path.as_posix(), "r", [server], validators=validators)
+    assert session.headers == []
+
+    # Refresh sends the stored validators; 304 keeps the file as it is
+    tile_path = tmp_path / "r" / "raster" / "RasterB" / str(tiles[0][0]) / str(tiles[0][1]) / f"{tiles[0][2]}.png"
+    mtime = os.stat(tile_path).st_mtime_ns
+    refreshed = service.download_tiles_batch(tiles, tmp_path.as_posix(), "r", [server],
+                                             validators=validators, refresh=True)
+    assert refreshed["downloaded"] == refreshed["not_modified"] == len(tiles)
+    assert all(h.get('If-None-Match') == '"v1"' for h in session.headers)
+    assert os.stat(tile_path).st_mtime_ns == mtime
+
+    # Everything was just revalidated: a max-age refresh has nothing to fetch
+    session.headers.clear()
+    service.download_tiles_batch(tiles, tmp_path.as_posix(), "r", [server],
+                                 validators=validators, refresh=True, max_age=3600)
+    assert session.headers == []
+    validators.close()
+
+
+def test_iter_stale_is_oldest_first_within_area(tmp_path):
+    index = TileValidatorIndex(str(tmp_path / "validators.sqlite"))
+    layer = layer_key("r", "raster", "A")
+    for tile in [(5, 10, 10), (5, 11, 10), (5, 12, 10), (5, 30, 30)]:
+        index.record(layer, *tile, None, None)
+    index.flush()
+    now = int(time.time())
+    ages = {(5, 10, 10): 100, (5, 11, 10): 5000, (5, 12, 10): 9000, (5, 30, 30): 9999}
+    with index._conn:
+        for (z, x, y), age in ages.items():
+            index._conn.execute(
+                "UPDATE validators SET fetched_at = ? WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (now - age, z, x, y)
+            )
+
+    # Area of tiles x 10..12, y 10 at zoom 5; (5, 30, 30) lies outside
+    west, _, _, north = TileCalculator.tile_bounds(5, 10, 10)
+    _, south, east, _ = TileCalculator.tile_bounds(5, 12, 10)
+    bbox = [west + 0.01, south + 0.01, east - 0.01, north - 0.01]
+    older_than = now - 1000
+    assert list(index.iter_stale([layer], bbox, 5, 5, older_than)) == [(5, 12, 10), (5, 11, 10)]
+    assert index.count_stale([layer], bbox, 5, 5, older_than) == 2
+    index.close()
+
+
+def test_resumed_max_age_refresh_fetches_the_tiles_still_stale(tmp_path):
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({
+        'regions': {}, 'output_dir': (tmp_path / "out").as_posix(), 'max_workers_per_server': 4,
+        'retry_attempts': 1, 'timeout': 5, 'progress_interval': 0,
+        'servers': [{'name': 'RasterB', 'type': 'http', 'url': "https://r.example.com/{z}/{x}/{y}.png",
+                     'tile_type': 'raster'}]
+    }))
+    manager = TileDownloadManager(str(config_path))
+    session = _ConditionalSession()
+    manager.download_service.create_session = lambda: session  # type: ignore
+    server = manager.config['server_defs']['RasterB']
+    bbox = [28.9, 41.0, 29.1, 41.1]
+    tiles = TileCalculator.get_tiles_for_bbox(bbox, 10, 11)
+    validators = manager.get_validator_index()
+    manager.download_service.download_tiles_batch(tiles, manager.config['output_dir'], "r", [server],
+                                                  validators=validators)
+
+    # An interrupted refresh: most tiles were revalidated (and journaled) before it stopped
+    refreshed = tiles[:-1]
+    journal = manager.get_journal()
+    job_id = journal.create_job({'region_name': 'r'})
+    now = int(time.time())
+    with validators._conn:
+        validators._conn.execute("UPDATE validators SET fetched_at = ?", (now - 7200,))
+        validators._conn.executemany(
+            "UPDATE validators SET fetched_at = ? WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            [(now, *tile) for tile in refreshed]
+        )
+    for tile in refreshed:
+        journal.record_tile(job_id, tile, True)
+    journal.flush()
+
+    session.headers.clear()
+    manager.refresh_options = {'max_age': 3600}
+    try:
+        assert manager._download_from_online_sources("r", bbox, 10, 11, [server], job_id=job_id) == (True, False)
+        assert len(session.headers) == 1
+        assert all(h.get('If-None-Match') == '"v1"' for h in session.headers)
+    finally:
+        manager.close()
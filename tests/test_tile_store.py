@@ -0,0 +1,87 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from adapters.mbtiles_adapter import MBTilesAdapter
+from models.tile_server import TileServer
+from services.mbtiles_writer import MBTilesWriter
+from services.tile_download_service import TileDownloadService
+from services.tile_store import ContentAddressedTileStore
+from utils.mbtiles_utils import MBTilesUtils
+from utils.tile_calculator import TileCalculator
+from conftest import StubResponse, StubSession
+
+
+SEA = b"\x89PNG\r\n\x1a\n" + b"sea" * 100
+LAND = b"\x89PNG\r\n\x1a\n" + b"land"
+
+
+class _Session(StubSession):
+    def respond(self, url, headers):
+        # Every tile is open sea except the ones in column 0
+        x = int(url.rsplit('/', 2)[-2])
+        return StubResponse(200, LAND if x == 0 else SEA)
+
+
+def test_store_links_identical_tiles_to_one_payload(tmp_path):
+    store = ContentAddressedTileStore(str(tmp_path / ".tile_store"))
+    paths = [tmp_path / "r" / "raster" / "S" / "3" / str(x) / "1.png" for x in range(4)]
+    for path in paths:
+        store.write_tile(str(path), SEA)
+    # Rewriting a tile replaces its link instead of writing through it
+    store.write_tile(str(paths[0]), LAND)
+
+    assert paths[0].read_bytes() == LAND
+    assert all(p.read_bytes() == SEA for p in paths[1:])
+    assert len({os.stat(p).st_ino for p in paths[1:]}) == 1
+
+    stats = store.get_stats()
+    assert (stats['tiles'], stats['unique_payloads']) == (5, 2)
+    assert stats['dedup_ratio'] > 1
+
+
+def test_concurrent_writers_of_one_payload_count_it_once(tmp_path):
+    store = ContentAddressedTileStore(str(tmp_path / ".tile_store"))
+    barrier = threading.Barrier(8)
+
+    def write(x):
+        barrier.wait()
+        store.write_tile(str(tmp_path / "r" / "3" / str(x) / "1.png"), SEA)
+
+    threads = [threading.Thread(target=write, args=(x,)) for x in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = store.get_stats()
+    assert (stats['tiles'], stats['unique_payloads'], stats['physical_bytes']) == (8, 1, len(SEA))
+    assert [name for name in os.listdir(tmp_path / ".tile_store" / os.listdir(tmp_path / ".tile_store")[0])
+            if name.endswith('.tmp')] == []
+
+
+def test_dedup_batch_into_mbtiles_is_readable(tmp_path):
+    server = TileServer(name="Sea", url="https://s.example.com/{z}/{x}/{y}.png", headers={}, tile_type="raster")
+    tiles = TileCalculator.get_tiles_for_bbox([-180, -85, 180, 85], 0, 3)
+
+    service = TileDownloadService(max_workers=4, retry_attempts=1, timeout=5, output_format='mbtiles', dedup=True)
+    service.create_session = lambda: _Session()  # type: ignore
+    result = service.download_tiles_batch(tiles, tmp_path.as_posix(), "world", [server])
+
+    assert result["downloaded"] == len(tiles)
+    assert (result["dedup"]["tiles"], result["dedup"]["unique_payloads"]) == (len(tiles), 2)
+
+    path = str(tmp_path / "world" / "raster" / "Sea.mbtiles")
+    assert MBTilesUtils.get_mbtiles_tile_stats(path)["tile_count"] == len(tiles)
+    adapter = MBTilesAdapter({'name': 'Sea', 'path': path})
+    assert adapter.initialize()
+    extracted = adapter.extract_tiles([-180, -85, 180, 85], 2)
+    assert sorted((x, y) for x, y, _ in extracted) == sorted((x, y) for z, x, y in tiles if z == 2)
+    assert all(data == (LAND if x == 0 else SEA) for x, _, data in extracted)
+
+    # Reopening keeps the images/map layout even without dedup requested
+    writer = MBTilesWriter(path)
+    assert writer.dedup and writer.has_tile(3, 5, 2)
+    writer.close()
@@ -0,0 +1,46 @@
+import gzip
+import os
+import sqlite3
+import sys
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from services.vector_tile_migration import VectorTileGzipMigration
+from utils.tile_encoding import detect_encoding, to_gzip
+
+PBF = b"\x1a\x05layer" * 20
+
+
+def test_to_gzip_normalises_every_encoding_once():
+    gzipped = to_gzip(PBF)
+    assert detect_encoding(gzipped) == 'gzip' and gzip.decompress(gzipped) == PBF
+    assert to_gzip(zlib.compress(PBF)) == gzipped
+    assert to_gzip(gzipped) is gzipped
+    assert detect_encoding(PBF) == 'raw' and detect_encoding(zlib.compress(PBF)) == 'zlib'
+
+
+def test_migration_converts_files_and_mbtiles_in_place(tmp_path):
+    layer_dir = tmp_path / "r" / "vector" / "V"
+    payloads = {(5, 1, 1): PBF, (5, 1, 2): zlib.compress(PBF), (6, 2, 2): gzip.compress(PBF)}
+    for (z, x, y), data in payloads.items():
+        path = layer_dir / str(z) / str(x) / f"{y}.pbf"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    conn = sqlite3.connect(tmp_path / "r" / "vector" / "M.mbtiles")
+    conn.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)")
+    conn.executemany("INSERT INTO tiles VALUES (5, ?, 0, ?)", [(x, PBF) for x in range(7)])
+    conn.commit()
+    conn.close()
+
+    result = VectorTileGzipMigration(str(tmp_path), workers=2, batch_size=3).migrate()
+
+    converted = {layer['layer']: (layer['converted'], layer['tiles']) for layer in result['layers']}
+    assert converted == {'V': (2, 3), 'M': (7, 7)}
+    for path in layer_dir.rglob("*.pbf"):
+        assert gzip.decompress(path.read_bytes()) == PBF
+    conn = sqlite3.connect(tmp_path / "r" / "vector" / "M.mbtiles")
+    assert all(gzip.decompress(row[0]) == PBF for row in conn.execute("SELECT tile_data FROM tiles"))
+    conn.close()
+    again = VectorTileGzipMigration(str(tmp_path)).migrate('r')
+    assert sum(layer['converted'] for layer in again['layers']) == 0